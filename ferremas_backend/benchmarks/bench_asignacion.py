@@ -0,0 +1,120 @@
+"""
+Benchmark de los asignadores de stock del checkout.
+
+Uso (desde ferremas_backend/):
+    python -m benchmarks.bench_asignacion --lineas 200 --tiendas 50 --carritos 50
+
+Genera carritos sintéticos y el stock de sus productos en cada tienda (cada
+producto está en alrededor del 40% de las tiendas, con cantidades que a veces
+no alcanzan) y mide, para cada asignador, el tiempo por carrito, las tiendas
+que despachan y las líneas que quedan partidas. Luego mide `descontar_pedido`
+completo (lectura, asignación y escritura) contra una base de pruebas.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings_bench')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.db import connection, reset_queries  # noqa: E402
+from django.test.utils import CaptureQueriesContext, setup_test_environment  # noqa: E402
+
+from productos.asignacion import MinimasTiendasAsignador, PrimeraTiendaAsignador  # noqa: E402
+from productos.models import Producto, StockTienda, Tienda  # noqa: E402
+from productos.stock_service import descontar_pedido  # noqa: E402
+
+ASIGNADORES = [PrimeraTiendaAsignador, MinimasTiendasAsignador]
+
+
+def generar(rnd, lineas, tiendas, carritos, productos):
+    """(stock {producto: {tienda: cantidad}}, carritos [{producto: cantidad}])."""
+    stock = {
+        producto_id: {tienda_id: rnd.randrange(0, 8) for tienda_id in range(1, tiendas + 1) if rnd.random() < 0.4}
+        for producto_id in range(1, productos + 1)
+    }
+    pedidos = [
+        {producto_id: rnd.randrange(1, 6) for producto_id in rnd.sample(range(1, productos + 1), lineas)}
+        for _ in range(carritos)
+    ]
+    return stock, pedidos
+
+
+def medir_asignadores(stock, pedidos):
+    for asignador_class in ASIGNADORES:
+        asignador = asignador_class()
+        tiempos, tiendas, partidas, faltantes = [], [], 0, 0
+        for pedido in pedidos:
+            disponibles = {producto_id: stock[producto_id] for producto_id in pedido}
+            inicio = time.perf_counter()
+            asignacion = asignador.asignar(pedido, disponibles)
+            tiempos.append(time.perf_counter() - inicio)
+            tiendas.append(len(asignacion.tiendas))
+            partidas += sum(1 for partes in asignacion.partes.values() if len(partes) > 1)
+            faltantes += sum(asignacion.faltantes.values())
+        print(f'{asignador_class.__name__}')
+        print(f'  {statistics.median(tiempos) * 1000:8.2f} ms por carrito (p50), máx {max(tiempos) * 1000:.2f} ms')
+        print(f'  tiendas por orden: media {statistics.fmean(tiendas):.1f}, máx {max(tiendas)}')
+        print(f'  líneas partidas: {partidas}, unidades faltantes: {faltantes}')
+
+
+def medir_descuento(stock, pedidos, tiendas):
+    """descontar_pedido contra la base, con el stock generado multiplicado para que no se agote."""
+    Tienda.objects.bulk_create([Tienda(nombre=f'Tienda {i}', direccion='D', telefono='1') for i in range(tiendas)])
+    ids_tienda = list(Tienda.objects.order_by('id').values_list('id', flat=True))
+    Producto.objects.bulk_create([
+        Producto(sku=f'ASG-{producto_id:06d}', nombre=f'Producto {producto_id}', precio=1000, categoria='C')
+        for producto_id in stock
+    ], batch_size=1000)
+    ids_producto = dict(zip(stock, Producto.objects.order_by('id').values_list('id', flat=True)))
+    StockTienda.objects.bulk_create([
+        StockTienda(producto_id=ids_producto[producto_id], tienda_id=ids_tienda[tienda_id - 1], cantidad=cantidad * 100)
+        for producto_id, por_tienda in stock.items() for tienda_id, cantidad in por_tienda.items()
+    ], batch_size=1000)
+
+    tiempos, consultas = [], []
+    for pedido in pedidos:
+        pedido = {ids_producto[producto_id]: cantidad for producto_id, cantidad in pedido.items()}
+        reset_queries()
+        with CaptureQueriesContext(connection) as capturadas:
+            inicio = time.perf_counter()
+            descontar_pedido(pedido)
+            tiempos.append(time.perf_counter() - inicio)
+        consultas.append(len(capturadas.captured_queries))
+    print(f'descontar_pedido ({connection.vendor})')
+    print(f'  {statistics.median(tiempos) * 1000:8.2f} ms por orden (p50), consultas por orden {statistics.fmean(consultas):.1f}')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--lineas', type=int, default=200, help='Líneas por carrito')
+    parser.add_argument('--tiendas', type=int, default=50)
+    parser.add_argument('--carritos', type=int, default=50)
+    parser.add_argument('--productos', type=int, default=2000, help='Catálogo del que se sacan las líneas')
+    parser.add_argument('--semilla', type=int, default=42)
+    args = parser.parse_args(argv)
+
+    stock, pedidos = generar(
+        random.Random(args.semilla), args.lineas, args.tiendas, args.carritos, max(args.productos, args.lineas)
+    )
+    print(f'{args.carritos} carritos de {args.lineas} líneas, {args.tiendas} tiendas')
+    medir_asignadores(stock, pedidos)
+
+    setup_test_environment()
+    nombre_original = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0)
+    try:
+        medir_descuento(stock, pedidos, args.tiendas)
+    finally:
+        connection.creation.destroy_test_db(nombre_original, verbosity=0)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
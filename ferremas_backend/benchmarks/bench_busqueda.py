@@ -0,0 +1,109 @@
+"""
+Benchmark del índice de búsqueda en memoria sobre un catálogo sintético.
+
+Uso (desde ferremas_backend/):
+    python -m benchmarks.bench_busqueda --productos 100000 --consultas 2000
+
+Informa el tiempo de construcción y los percentiles de latencia por consulta;
+termina con código 1 si el p95 supera el objetivo (20 ms por defecto).
+"""
+import argparse
+import random
+import statistics
+import sys
+import time
+
+from productos.search import IndiceBusqueda
+
+TIPOS = [
+    'Taladro', 'Martillo', 'Destornillador', 'Sierra', 'Llave', 'Alicate', 'Broca',
+    'Lijadora', 'Esmeril', 'Atornillador', 'Pintura', 'Brocha', 'Rodillo', 'Tornillo',
+    'Clavo', 'Cinta', 'Nivel', 'Escalera', 'Carretilla', 'Manguera', 'Candado', 'Bisagra',
+]
+MODIFICADORES = [
+    'Percutor', 'Inalámbrico', 'Profesional', 'Eléctrico', 'Manual', 'Ajustable',
+    'Circular', 'Caladora', 'Angular', 'Orbital', 'Reforzado', 'Galvanizado',
+    'Térmico', 'Extensible', 'Magnético', 'Industrial', 'Compacto', 'Doble',
+]
+MEDIDAS = ['12V', '18V', '20V', '1/2"', '3/8"', '10mm', '25mm', '1L', '4L', '2m', '5m', '500W', '800W']
+MARCAS = [
+    'Bosch', 'Makita', 'DeWalt', 'Stanley', 'Black+Decker', 'Truper', 'Irwin',
+    'Bauker', 'Sherwin', 'Tricolor', 'Einhell', 'Skil', 'Milwaukee', 'Ubermann',
+]
+MATERIALES = ['acero', 'aluminio', 'fibra de vidrio', 'madera', 'plástico', 'cobre', 'hierro fundido']
+USOS = ['carpintería', 'construcción', 'gasfitería', 'jardinería', 'electricidad', 'pintura', 'mecánica']
+
+
+def generar_catalogo(cantidad, semilla=42):
+    rnd = random.Random(semilla)
+    for producto_id in range(1, cantidad + 1):
+        tipo = rnd.choice(TIPOS)
+        nombre = f"{tipo} {rnd.choice(MODIFICADORES)} {rnd.choice(MEDIDAS)}"
+        descripcion = (
+            f"{tipo} de {rnd.choice(MATERIALES)} para {rnd.choice(USOS)}, "
+            f"ideal para uso {rnd.choice(['doméstico', 'profesional', 'intensivo'])}."
+        )
+        sku = f"{tipo[:3].upper()}-{producto_id:06d}"
+        yield producto_id, nombre, descripcion, rnd.choice(MARCAS), sku
+
+
+def generar_consultas(cantidad, semilla=7):
+    rnd = random.Random(semilla)
+    consultas = []
+    for _ in range(cantidad):
+        forma = rnd.random()
+        if forma < 0.4:
+            consulta = f"{rnd.choice(TIPOS)} {rnd.choice(MARCAS)}"
+        elif forma < 0.7:
+            consulta = f"{rnd.choice(TIPOS)} {rnd.choice(MARCAS)} {rnd.choice(MEDIDAS)}"
+        elif forma < 0.85:
+            # Prefijo a medio escribir, como en un buscador con autocompletado
+            palabra = rnd.choice(TIPOS + MODIFICADORES)
+            consulta = palabra[:rnd.randint(3, len(palabra))]
+        else:
+            consulta = f"{rnd.choice(MODIFICADORES).lower()} {rnd.choice(MATERIALES)}"
+        consultas.append(consulta)
+    return consultas
+
+
+def percentil(valores, p):
+    ordenados = sorted(valores)
+    indice = min(len(ordenados) - 1, max(0, round(p / 100 * len(ordenados)) - 1))
+    return ordenados[indice]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--productos', type=int, default=100000)
+    parser.add_argument('--consultas', type=int, default=2000)
+    parser.add_argument('--limite', type=int, default=20)
+    parser.add_argument('--objetivo-p95-ms', type=float, default=20.0)
+    args = parser.parse_args(argv)
+
+    inicio = time.perf_counter()
+    indice = IndiceBusqueda(generar_catalogo(args.productos))
+    construccion = time.perf_counter() - inicio
+    # La primera consulta ordena el vocabulario; no se mide como latencia
+    indice.buscar('taladro')
+
+    latencias = []
+    for consulta in generar_consultas(args.consultas):
+        inicio = time.perf_counter()
+        indice.buscar(consulta, limite=args.limite)
+        latencias.append((time.perf_counter() - inicio) * 1000)
+
+    p95 = percentil(latencias, 95)
+    print(f"productos: {len(indice)}  construcción: {construccion:.2f} s")
+    print(
+        f"consultas: {len(latencias)}  p50: {percentil(latencias, 50):.2f} ms  "
+        f"p95: {p95:.2f} ms  p99: {percentil(latencias, 99):.2f} ms  "
+        f"media: {statistics.mean(latencias):.2f} ms"
+    )
+    if p95 > args.objetivo_p95_ms:
+        print(f"p95 sobre el objetivo de {args.objetivo_p95_ms} ms")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,190 @@
+"""
+Benchmark de agregar al carrito: el camino anterior (get_or_create + get +
+get_or_create + save, y el frontend recargando el carrito) frente a los
+upserts de carrito/carrito_service.py con los totales en la respuesta.
+
+Uso (desde ferremas_backend/):
+    python -m benchmarks.bench_carrito --clics 500 --rtt-ms 1 --hilos 8
+
+Cada sentencia SQL espera `rtt-ms` antes de ejecutarse, para simular el viaje
+de ida y vuelta a un pooler remoto. Informa sentencias por clic y latencia
+p50/p95 de cada camino, y luego lanza `hilos` hilos que agregan a la vez el
+mismo producto al mismo carrito para contar incrementos perdidos. Al final
+simula `invitados` carritos de invitado (casi todos abandonados) con cada
+almacén de carrito/almacenamiento.py: sentencias, escrituras y filas creadas.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings_bench')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.db import OperationalError, connection, reset_queries  # noqa: E402
+from django.core.cache import caches  # noqa: E402
+from django.test.utils import CaptureQueriesContext, override_settings, setup_test_environment  # noqa: E402
+
+from benchmarks.run import percentil  # noqa: E402
+from carrito.almacenamiento import almacen_invitados, volcar_pendientes  # noqa: E402
+from carrito.carrito_service import carrito_para_escribir, sumar_item  # noqa: E402
+from carrito.mappers import datos_carrito, datos_item_con_totales  # noqa: E402
+from carrito.models import Carrito, ItemCarrito  # noqa: E402
+from carrito.serializers import ItemCarritoSerializer  # noqa: E402
+from productos.models import Producto  # noqa: E402
+from usuarios.models import CustomerUser  # noqa: E402
+
+
+def agregar_antes(usuario, producto_id, cantidad, recargar=True):
+    """Lo que hacían add_item y CarritoContext.jsx antes de los upserts."""
+    carrito, _ = Carrito.objects.get_or_create(usuario=usuario)
+    producto = Producto.objects.get(id=producto_id)
+    item, creado = ItemCarrito.objects.get_or_create(carrito=carrito, producto=producto, defaults={'cantidad': cantidad})
+    if not creado:
+        item.cantidad += cantidad
+        item.save()
+    datos = ItemCarritoSerializer(item).data
+    if recargar:
+        # El frontend pedía get_cart después de cada clic
+        datos_carrito(Carrito.objects.filter(usuario=usuario))
+    return datos
+
+
+def agregar_ahora(usuario, producto_id, cantidad, recargar=True):
+    item_id = sumar_item(carrito_para_escribir(usuario), producto_id, cantidad)
+    # La respuesta ya trae los totales: no hay recarga, pero sí esta lectura
+    return datos_item_con_totales(item_id) if recargar else item_id
+
+
+def con_latencia(rtt):
+    def envolver(execute, sql, params, many, context):
+        time.sleep(rtt)
+        return execute(sql, params, many, context)
+    return envolver
+
+
+def medir(nombre, agregar, usuario, productos, clics, rtt):
+    rnd = random.Random(7)
+    Carrito.objects.filter(usuario=usuario).delete()
+    latencias, sentencias = [], []
+    with connection.execute_wrapper(con_latencia(rtt)):
+        for _ in range(clics):
+            reset_queries()
+            with CaptureQueriesContext(connection) as consultas:
+                inicio = time.perf_counter()
+                agregar(usuario, rnd.choice(productos), 1)
+                latencias.append((time.perf_counter() - inicio) * 1000)
+            sentencias.append(len(consultas.captured_queries))
+    print(
+        f'  {nombre:<8} sentencias/clic {statistics.fmean(sentencias):5.2f}  '
+        f'p50 {percentil(latencias, 50):7.2f} ms  p95 {percentil(latencias, 95):7.2f} ms'
+    )
+
+
+def concurrencia(nombre, agregar, usuario, producto_id, hilos, clics):
+    Carrito.objects.filter(usuario=usuario).delete()
+    agregar(usuario, producto_id, 1, False)
+    barrera = threading.Barrier(hilos)
+
+    def trabajar():
+        try:
+            barrera.wait()
+            for _ in range(clics):
+                while True:
+                    try:
+                        agregar(usuario, producto_id, 1, False)
+                        break
+                    except OperationalError:
+                        # SQLite serializa las escrituras: la base estaba ocupada
+                        time.sleep(0.001)
+        finally:
+            connection.close()
+
+    trabajadores = [threading.Thread(target=trabajar) for _ in range(hilos)]
+    for hilo in trabajadores:
+        hilo.start()
+    for hilo in trabajadores:
+        hilo.join()
+    cantidad = ItemCarrito.objects.get(carrito__usuario=usuario, producto_id=producto_id).cantidad
+    esperada = 1 + hilos * clics
+    print(f'  {nombre:<8} {cantidad} de {esperada} unidades ({esperada - cantidad} incrementos perdidos)')
+
+
+def invitados(almacen, productos, cantidad, clics, rtt):
+    """Cada invitado agrega `clics` productos y mira su carrito; uno de cada 10 paga."""
+    rnd = random.Random(11)
+    caches['carritos'].clear()
+    Carrito.objects.filter(usuario__isnull=True).delete()
+    sentencias, escrituras, latencias = 0, 0, []
+    with override_settings(ALMACEN_CARRITO_INVITADO=f'carrito.almacenamiento.{almacen}'), \
+            connection.execute_wrapper(con_latencia(rtt)):
+        for numero in range(cantidad):
+            reset_queries()
+            with CaptureQueriesContext(connection) as consultas:
+                inicio = time.perf_counter()
+                tienda = almacen_invitados()
+                carrito_id = None
+                for _ in range(clics):
+                    _, carrito_id = tienda.agregar(carrito_id, rnd.choice(productos), 1)
+                tienda.obtener(carrito_id)
+                if numero % 10 == 0:
+                    tienda.persistir(carrito_id)
+                latencias.append((time.perf_counter() - inicio) * 1000 / (clics + 1))
+            sentencias += len(consultas.captured_queries)
+            escrituras += sum(not c['sql'].lstrip().upper().startswith('SELECT') for c in consultas.captured_queries)
+        en_la_base = Carrito.objects.filter(usuario__isnull=True).count()
+        reset_queries()
+        with CaptureQueriesContext(connection) as consultas:
+            volcar_pendientes()
+        escrituras_volcado = sum(not c['sql'].lstrip().upper().startswith('SELECT') for c in consultas.captured_queries)
+    print(
+        f'  {almacen:<16} sentencias/op {sentencias / (cantidad * (clics + 1)):5.2f}  '
+        f'escrituras {escrituras:6d} (+{escrituras_volcado} al volcar)  p50/op {percentil(latencias, 50):6.2f} ms  '
+        f'carritos en la base {en_la_base} (tras volcar {Carrito.objects.filter(usuario__isnull=True).count()})'
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--productos', type=int, default=200)
+    parser.add_argument('--clics', type=int, default=500)
+    parser.add_argument('--rtt-ms', type=float, default=1.0, help='Espera por sentencia SQL')
+    parser.add_argument('--hilos', type=int, default=8)
+    parser.add_argument('--clics-por-hilo', type=int, default=25)
+    parser.add_argument('--invitados', type=int, default=200)
+    args = parser.parse_args(argv)
+
+    setup_test_environment()
+    nombre_original = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0)
+    try:
+        Producto.objects.bulk_create([
+            Producto(sku=f'CAR-{i:05d}', nombre=f'Producto {i}', precio=990 + i, categoria='C') for i in range(args.productos)
+        ])
+        productos = list(Producto.objects.values_list('id', flat=True))
+        usuario = CustomerUser.objects.create_user(username='bench_carrito', email='carrito@ferremas.test', password='x')
+
+        print(f'{args.clics} clics sobre {args.productos} productos, {args.rtt_ms} ms por sentencia')
+        medir('antes', agregar_antes, usuario, productos, args.clics, args.rtt_ms / 1000)
+        medir('ahora', agregar_ahora, usuario, productos, args.clics, args.rtt_ms / 1000)
+
+        print(f'{args.hilos} hilos x {args.clics_por_hilo} clics sobre la misma línea')
+        concurrencia('antes', agregar_antes, usuario, productos[0], args.hilos, args.clics_por_hilo)
+        concurrencia('ahora', agregar_ahora, usuario, productos[0], args.hilos, args.clics_por_hilo)
+
+        print(f'{args.invitados} invitados x 5 clics y una lectura, 1 de cada 10 paga (persistir)')
+        invitados('AlmacenBaseDatos', productos, args.invitados, 5, args.rtt_ms / 1000)
+        invitados('AlmacenCache', productos, args.invitados, 5, args.rtt_ms / 1000)
+    finally:
+        connection.creation.destroy_test_db(nombre_original, verbosity=0)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,142 @@
+"""
+Benchmark de la búsqueda de tiendas cercanas con stock (productos/cercania.py).
+
+Uso (desde ferremas_backend/):
+    python -m benchmarks.bench_cercania --tiendas 5000 --productos 200 --ocupacion 0.3
+
+Llena una base de pruebas con `tiendas` tiendas repartidas por Chile y stock
+de cada producto en una fracción `ocupacion` de ellas, y mide por consulta
+(mediana de `consultas` puntos al azar):
+
+- el k-d tree solo, frente a calcular la distancia a todas las tiendas;
+- tiendas_cercanas con un pedido de 3 productos (consulta de stock + árbol),
+  frente a leer todas las tiendas y ordenarlas en Python;
+- construir el índice y mover una tienda (lo que hace la señal).
+"""
+import argparse
+import math
+import os
+import random
+import statistics
+import sys
+import time
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings_bench')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.db import connection  # noqa: E402
+from django.test.utils import setup_test_environment  # noqa: E402
+
+from productos.cercania import (  # noqa: E402
+    IndiceTiendas, obtener_indice, reiniciar_indice, tiendas_con_stock, tiendas_cercanas,
+)
+from productos.models import Producto, StockTienda, Tienda  # noqa: E402
+
+LIMITE = 5
+
+
+def poblar(rnd, tiendas, productos, ocupacion):
+    Tienda.objects.bulk_create([
+        Tienda(
+            nombre=f'Tienda {i}', direccion='Dirección', telefono='1',
+            latitud=rnd.uniform(-53.2, -18.5), longitud=rnd.uniform(-73.5, -69.5),
+        )
+        for i in range(tiendas)
+    ], batch_size=1000)
+    Producto.objects.bulk_create([
+        Producto(sku=f'GEO-{i:06d}', nombre=f'Producto {i}', precio=1000, categoria='C') for i in range(productos)
+    ], batch_size=1000)
+    ids_tienda = list(Tienda.objects.values_list('id', flat=True))
+    StockTienda.objects.bulk_create([
+        StockTienda(producto_id=producto_id, tienda_id=tienda_id, cantidad=rnd.randrange(1, 20))
+        for producto_id in Producto.objects.values_list('id', flat=True)
+        for tienda_id in ids_tienda if rnd.random() < ocupacion
+    ], batch_size=5000)
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * 6371.0088 * math.asin(math.sqrt(h))
+
+
+def fuerza_bruta(latitud, longitud, pedido=None):
+    """Lo que haría la vista sin índice: todas las tiendas y su stock, ordenadas en Python."""
+    candidatas = tiendas_con_stock(pedido) if pedido else None
+    tiendas = Tienda.objects.filter(activa=True, latitud__isnull=False).values_list('id', 'latitud', 'longitud')
+    return sorted(
+        (haversine_km(latitud, longitud, lat, lon), tienda_id)
+        for tienda_id, lat, lon in tiendas if candidatas is None or tienda_id in candidatas
+    )[:LIMITE]
+
+
+def medir(funcion, argumentos):
+    tiempos, resultados = [], []
+    for args in argumentos:
+        inicio = time.perf_counter()
+        resultados.append(funcion(*args))
+        tiempos.append(time.perf_counter() - inicio)
+    return statistics.median(tiempos), resultados
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tiendas', type=int, default=5000)
+    parser.add_argument('--productos', type=int, default=200)
+    parser.add_argument('--ocupacion', type=float, default=0.3, help='Fracción de tiendas con stock de cada producto')
+    parser.add_argument('--consultas', type=int, default=200)
+    parser.add_argument('--semilla', type=int, default=42)
+    args = parser.parse_args(argv)
+    rnd = random.Random(args.semilla)
+
+    setup_test_environment()
+    nombre_original = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0)
+    try:
+        poblar(rnd, args.tiendas, args.productos, args.ocupacion)
+        productos = list(Producto.objects.values_list('id', flat=True))
+        puntos = [(rnd.uniform(-53.2, -18.5), rnd.uniform(-73.5, -69.5)) for _ in range(args.consultas)]
+        pedidos = [{producto_id: 1 for producto_id in rnd.sample(productos, 3)} for _ in puntos]
+        print(f'{args.tiendas} tiendas, {StockTienda.objects.count()} filas de stock, {args.consultas} consultas')
+
+        reiniciar_indice()
+        inicio = time.perf_counter()
+        indice = obtener_indice()
+        print(f'  construir índice     {(time.perf_counter() - inicio) * 1000:8.1f} ms')
+
+        filas = list(Tienda.objects.values_list('id', 'latitud', 'longitud'))
+        t_bruta, bruta = medir(
+            lambda lat, lon: sorted((haversine_km(lat, lon, a, b), i) for i, a, b in filas)[:LIMITE], puntos
+        )
+        t_arbol, arbol = medir(lambda lat, lon: indice.cercanas(lat, lon, LIMITE), puntos)
+        assert [[i for _, i in r] for r in bruta] == [[i for i, _ in r] for r in arbol]
+        print(f'  solo distancia: todas {t_bruta * 1e6:8.0f} µs   k-d tree {t_arbol * 1e6:8.0f} µs  (x{t_bruta / t_arbol:.0f})')
+
+        con_pedido = [(lat, lon, pedido) for (lat, lon), pedido in zip(puntos, pedidos)]
+        t_bruta, bruta = medir(fuerza_bruta, con_pedido)
+        t_arbol, arbol = medir(lambda lat, lon, pedido: tiendas_cercanas(lat, lon, pedido, LIMITE), con_pedido)
+        assert [[i for _, i in r] for r in bruta] == [[i for i, _ in r] for r in arbol]
+        print(f'  con pedido de 3:      todas {t_bruta * 1000:8.2f} ms   índice {t_arbol * 1000:8.2f} ms  (x{t_bruta / t_arbol:.1f})')
+
+        inicio = time.perf_counter()
+        for tienda_id, latitud, longitud in filas[:1000]:
+            indice.indexar(tienda_id, latitud + 0.01, longitud)
+        por_cambio = (time.perf_counter() - inicio) / min(1000, len(filas))
+        inicio = time.perf_counter()
+        IndiceTiendas(filas)
+        print(
+            f'  mover una tienda     {por_cambio * 1e6:8.1f} µs  (rehacer todo: '
+            f'{(time.perf_counter() - inicio) * 1000:.1f} ms)'
+        )
+        print(f'  distancia media a la más cercana con el pedido: {statistics.mean(r[0][1] for r in arbol if r):.1f} km')
+    finally:
+        reiniciar_indice()
+        connection.creation.destroy_test_db(nombre_original, verbosity=0)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
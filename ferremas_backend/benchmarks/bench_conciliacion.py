@@ -0,0 +1,128 @@
+"""
+Benchmark de la conciliación de stock (productos/conciliacion_service.py).
+
+Uso (desde ferremas_backend/):
+    python -m benchmarks.bench_conciliacion --filas 10000 100000 1000000
+
+Para cada tamaño crea una base de pruebas con esa cantidad de filas de
+StockTienda (y un snapshot, un movimiento y una venta cada 10 filas) y un
+archivo de conteo desordenado con el 1% de diferencias, y corre la
+conciliación completa (conteo + esperado, sin aplicar). Informa filas leídas
+por segundo y el pico de memoria de Python (tracemalloc, en una segunda
+corrida), que debe quedar plano al crecer la tabla.
+"""
+import argparse
+import io
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import timedelta
+from decimal import Decimal
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings_bench')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.db import connection  # noqa: E402
+from django.test.utils import setup_test_environment  # noqa: E402
+from django.utils import timezone  # noqa: E402
+
+from carrito.models import ItemOrden, Orden  # noqa: E402
+from productos.carga_masiva_service import leer_filas  # noqa: E402
+from productos.conciliacion_service import conciliar  # noqa: E402
+from productos.models import Producto, StockMovimiento, StockSnapshot, StockTienda, Tienda  # noqa: E402
+
+TIENDAS = 10
+LOTE = 5000
+
+
+def poblar(rnd, filas, carpeta):
+    """Crea las filas y devuelve la ruta del archivo de conteo."""
+    Tienda.objects.bulk_create([Tienda(nombre=f'Tienda {i}', direccion='D', telefono='1') for i in range(TIENDAS)])
+    tiendas = list(Tienda.objects.values_list('id', flat=True))
+    productos = -(-filas // TIENDAS)
+    for inicio in range(0, productos, LOTE):
+        Producto.objects.bulk_create([
+            Producto(sku=f'CON-{rnd.getrandbits(40):010x}-{i}', nombre=f'Producto {i}', precio=1000, categoria='C')
+            for i in range(inicio, min(inicio + LOTE, productos))
+        ])
+    orden = Orden.objects.create(
+        total=Decimal('0'), nombre='Bench', email='b@test.com', telefono='1',
+        direccion='D', ciudad='C', codigo_postal='1', metodo_pago='mp',
+    )
+    antes = timezone.now() - timedelta(days=1)
+    conteo = os.path.join(carpeta, 'conteo.csv')
+    lineas = []
+    ids = Producto.objects.order_by('id').values_list('id', 'sku')
+    creadas = 0
+    for inicio in range(0, productos, LOTE):
+        stock, snapshots, movimientos, ventas = [], [], [], []
+        for producto_id, sku in ids[inicio:inicio + LOTE]:
+            for tienda_id in tiendas:
+                if creadas == filas:
+                    break
+                creadas += 1
+                cantidad = rnd.randrange(0, 500)
+                stock.append(StockTienda(producto_id=producto_id, tienda_id=tienda_id, cantidad=cantidad))
+                if creadas % 10 == 0:
+                    snapshots.append(StockSnapshot(producto_id=producto_id, tienda_id=tienda_id, cantidad=cantidad + 3, fecha=antes))
+                    movimientos.append(StockMovimiento(producto_id=producto_id, tienda_id=tienda_id, tipo='ajuste', cantidad=-1))
+                    ventas.append(ItemOrden(orden=orden, producto_id=producto_id, tienda_id=tienda_id, cantidad=2, precio_unitario=1))
+                contado = cantidad + 1 if rnd.random() < 0.01 else cantidad
+                lineas.append(f'{sku},{tienda_id},{contado}\n')
+        StockTienda.objects.bulk_create(stock)
+        StockSnapshot.objects.bulk_create(snapshots)
+        StockMovimiento.objects.bulk_create(movimientos)
+        ItemOrden.objects.bulk_create(ventas)
+    rnd.shuffle(lineas)
+    with open(conteo, 'w') as archivo:
+        archivo.write('sku,tienda,cantidad\n')
+        archivo.writelines(lineas)
+    return conteo
+
+
+def correr(conteo):
+    with open(conteo, 'rb') as archivo:
+        return conciliar(leer_filas(archivo, 'csv'), esperado=True, reporte=io.StringIO())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--filas', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--semilla', type=int, default=42)
+    args = parser.parse_args(argv)
+
+    setup_test_environment()
+    nombre_original = connection.settings_dict['NAME']
+    for filas in args.filas:
+        connection.creation.create_test_db(verbosity=0)
+        try:
+            with tempfile.TemporaryDirectory() as carpeta:
+                inicio = time.perf_counter()
+                conteo = poblar(random.Random(args.semilla), filas, carpeta)
+                print(f'{filas} filas de stock ({time.perf_counter() - inicio:.1f} s en poblar)')
+                resultado = correr(conteo)
+                tracemalloc.start()
+                correr(conteo)
+                _, pico = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+            print(
+                f"  {resultado['filas']} filas leídas en {resultado['segundos']:.2f} s: "
+                f"{resultado['filas_por_segundo']} filas/s, pico de memoria {pico / 2**20:.1f} MiB"
+            )
+            print(
+                f"  diferencias con el conteo {resultado['diferencias_conteo']}, "
+                f"con lo esperado {resultado['diferencias_esperado']}"
+            )
+        finally:
+            connection.creation.destroy_test_db(nombre_original, verbosity=0)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,112 @@
+"""
+Benchmark de la matriz columnar de stock frente al JSON anidado actual.
+
+Uso (desde ferremas_backend/):
+    python -m benchmarks.bench_matriz --productos 1000 --tiendas 20 --ocupacion 0.6
+
+Llena una base de pruebas con el stock de `productos` x `tiendas` (cada celda
+existe con probabilidad `ocupacion`) y mide tiempo de armado + render y bytes
+(planos y con gzip) de toda la grilla como hoy la obtiene GestionStock.jsx
+(StockTiendaSerializer, una entrada por celda con nombres y fechas) y como
+matriz densa y por coordenadas. Además mide el delta `since` tras cambiar
+el 1% de las celdas.
+"""
+import argparse
+import gzip
+import os
+import random
+import statistics
+import sys
+import time
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings_bench')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.db import connection  # noqa: E402
+from django.test.utils import setup_test_environment  # noqa: E402
+from django.utils import timezone  # noqa: E402
+from rest_framework.renderers import JSONRenderer  # noqa: E402
+
+from config.serializacion_rapida import JSONRapidoRenderer  # noqa: E402
+from productos.matriz_service import COORDENADAS, DENSA, matriz_stock  # noqa: E402
+from productos.models import Producto, StockTienda, Tienda  # noqa: E402
+from productos.serializers import StockTiendaSerializer  # noqa: E402
+from productos.stock_service import _escribir_cantidades  # noqa: E402
+
+
+def poblar(rnd, productos, tiendas, ocupacion):
+    Tienda.objects.bulk_create([Tienda(nombre=f'Tienda {i}', direccion='Dirección', telefono='1') for i in range(tiendas)])
+    Producto.objects.bulk_create([
+        Producto(sku=f'MTZ-{i:06d}', nombre=f'Producto {i}', precio=1000, categoria=f'Categoría {i % 20}')
+        for i in range(productos)
+    ], batch_size=1000)
+    ids_tienda = list(Tienda.objects.values_list('id', flat=True))
+    StockTienda.objects.bulk_create([
+        StockTienda(producto_id=producto_id, tienda_id=tienda_id, cantidad=rnd.randrange(0, 200))
+        for producto_id in Producto.objects.values_list('id', flat=True)
+        for tienda_id in ids_tienda if rnd.random() < ocupacion
+    ], batch_size=1000)
+
+
+def medir(funcion, repeticiones):
+    tiempos, resultado = [], None
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        resultado = funcion()
+        tiempos.append(time.perf_counter() - inicio)
+    return statistics.median(tiempos), resultado
+
+
+def reportar(nombre, segundos, cuerpo, base=None):
+    comprimido = len(gzip.compress(cuerpo))
+    extra = f'  (x{base[0] / segundos:.1f} más rápido, {base[1] / len(cuerpo):.1f}x menos bytes)' if base else ''
+    print(f'  {nombre:<13} {segundos * 1000:8.1f} ms  {len(cuerpo) / 1024:9.1f} KiB  gzip {comprimido / 1024:8.1f} KiB{extra}')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--productos', type=int, default=1000)
+    parser.add_argument('--tiendas', type=int, default=20)
+    parser.add_argument('--ocupacion', type=float, default=0.6, help='Fracción de celdas con fila de stock')
+    parser.add_argument('--repeticiones', type=int, default=5)
+    parser.add_argument('--semilla', type=int, default=42)
+    args = parser.parse_args(argv)
+    rnd = random.Random(args.semilla)
+
+    setup_test_environment()
+    nombre_original = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0)
+    try:
+        poblar(rnd, args.productos, args.tiendas, args.ocupacion)
+        celdas = StockTienda.objects.count()
+        ejes = {'productos': args.productos, 'tiendas': args.tiendas}
+        print(f'{args.productos} productos x {args.tiendas} tiendas, {celdas} celdas con stock')
+
+        t_anidado, anidado = medir(lambda: JSONRenderer().render(StockTiendaSerializer(
+            StockTienda.objects.select_related('producto', 'tienda').order_by('producto_id', 'tienda_id'), many=True
+        ).data), args.repeticiones)
+        reportar('anidado', t_anidado, anidado)
+        for formato in [DENSA, COORDENADAS]:
+            segundos, cuerpo = medir(
+                lambda: JSONRapidoRenderer().render(matriz_stock(formato=formato, **ejes)), args.repeticiones
+            )
+            reportar(formato, segundos, cuerpo, (t_anidado, len(anidado)))
+
+        desde = timezone.now()
+        filas = list(StockTienda.objects.values_list('producto_id', 'tienda_id', 'cantidad'))
+        _escribir_cantidades({
+            (producto_id, tienda_id): cantidad + 1
+            for producto_id, tienda_id, cantidad in rnd.sample(filas, max(1, len(filas) // 100))
+        })
+        segundos, cuerpo = medir(lambda: JSONRapidoRenderer().render(matriz_stock(desde=desde, **ejes)), args.repeticiones)
+        reportar('delta 1%', segundos, cuerpo, (t_anidado, len(anidado)))
+    finally:
+        connection.creation.destroy_test_db(nombre_original, verbosity=0)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,129 @@
+"""
+Benchmark de la purga de carritos de invitado (carrito/purga_service.py).
+
+Uso (desde ferremas_backend/):
+    python -m benchmarks.bench_purga --carritos 100000 --abandonados 0.8 --lote 200 --pausa 0.01
+
+Llena una base de pruebas con `carritos` carritos de invitado de 2 items,
+una fracción `abandonados` de ellos sin tocar hace 60 días, y corre la purga.
+Informa carritos por segundo y la duración del lote más largo, que es lo que
+más tiempo quedan bloqueadas las filas, mientras un hilo sigue agregando a
+carritos recientes y mide su latencia.
+"""
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from datetime import timedelta
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings_bench')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.db import OperationalError, connection  # noqa: E402
+from django.test.utils import setup_test_environment  # noqa: E402
+from django.utils import timezone  # noqa: E402
+
+from benchmarks.run import percentil  # noqa: E402
+from carrito import purga_service  # noqa: E402
+from carrito.carrito_service import carrito_para_escribir, sumar_item  # noqa: E402
+from carrito.models import Carrito, ItemCarrito  # noqa: E402
+from productos.models import Producto  # noqa: E402
+
+LOTE_CARGA = 5000
+
+
+def poblar(rnd, carritos, abandonados):
+    Producto.objects.bulk_create([
+        Producto(sku=f'PUR-{i:04d}', nombre=f'Producto {i}', precio=1000, categoria='C') for i in range(100)
+    ])
+    productos = list(Producto.objects.values_list('id', flat=True))
+    viejo = timezone.now() - timedelta(days=60)
+    recientes = []
+    for inicio in range(0, carritos, LOTE_CARGA):
+        nuevos = [Carrito(id=uuid.uuid4()) for _ in range(min(LOTE_CARGA, carritos - inicio))]
+        Carrito.objects.bulk_create(nuevos)
+        ItemCarrito.objects.bulk_create([
+            ItemCarrito(carrito=carrito, producto_id=producto_id, cantidad=1)
+            for carrito in nuevos for producto_id in rnd.sample(productos, 2)
+        ])
+        viejos = [carrito.id for carrito in nuevos if rnd.random() < abandonados]
+        Carrito.objects.filter(id__in=viejos).update(fecha_actualizacion=viejo)
+        recientes.extend(carrito.id for carrito in nuevos if carrito.id not in set(viejos))
+    return productos, recientes
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--carritos', type=int, default=100000)
+    parser.add_argument('--abandonados', type=float, default=0.8)
+    parser.add_argument('--lote', type=int, default=purga_service.LOTE_PURGA)
+    parser.add_argument('--pausa', type=float, default=purga_service.PAUSA_PURGA, help='Segundos entre lotes')
+    parser.add_argument('--semilla', type=int, default=42)
+    args = parser.parse_args(argv)
+    rnd = random.Random(args.semilla)
+
+    setup_test_environment()
+    nombre_original = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0)
+    try:
+        inicio = time.perf_counter()
+        productos, recientes = poblar(rnd, args.carritos, args.abandonados)
+        print(f'{args.carritos} carritos de invitado ({time.perf_counter() - inicio:.1f} s en poblar)')
+
+        latencias, terminado = [], threading.Event()
+
+        def trafico():
+            rnd_hilo = random.Random(1)
+            try:
+                while not terminado.is_set():
+                    inicio = time.perf_counter()
+                    while True:
+                        try:
+                            sumar_item(carrito_para_escribir(None, rnd_hilo.choice(recientes)), rnd_hilo.choice(productos), 1)
+                            break
+                        except OperationalError:
+                            time.sleep(0.001)
+                    latencias.append((time.perf_counter() - inicio) * 1000)
+                    time.sleep(0.002)
+            finally:
+                connection.close()
+
+        hilo = threading.Thread(target=trafico)
+        hilo.start()
+        # Un lote por llamada, para medir cuánto dura cada transacción
+        lotes, resultado = [], {'carritos': 0, 'items': 0, 'lotes': 0, 'segundos': 0.0}
+        antes_de = purga_service.inactivos_desde(30)
+        try:
+            while True:
+                parcial = purga_service.purgar_carritos_invitado(antes_de, lote=args.lote, max_lotes=1)
+                if not parcial['carritos']:
+                    break
+                if args.pausa:
+                    time.sleep(args.pausa)
+                lotes.append(parcial['segundos'] * 1000)
+                for clave in resultado:
+                    resultado[clave] += parcial[clave]
+        finally:
+            terminado.set()
+            hilo.join()
+        print(
+            f"  {resultado['carritos']} carritos y {resultado['items']} items en {resultado['segundos']:.2f} s "
+            f"({resultado['carritos'] / max(resultado['segundos'], 1e-9):.0f} carritos/s, {resultado['lotes']} lotes)"
+        )
+        print(f'  lote p50 {percentil(lotes, 50):.1f} ms, máximo {max(lotes):.1f} ms')
+        if latencias:
+            print(f'  agregar al carrito durante la purga: p50 {percentil(latencias, 50):.1f} ms, p95 {percentil(latencias, 95):.1f} ms')
+        print(f'  quedan {Carrito.objects.count()} carritos')
+    finally:
+        connection.creation.destroy_test_db(nombre_original, verbosity=0)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,113 @@
+"""
+Microbenchmark del camino rápido de serialización frente a los serializers de DRF.
+
+Uso (desde ferremas_backend/):
+    python -m benchmarks.bench_serializacion --productos 5000 --tiendas 4 --items 200
+
+Crea una base SQLite de prueba en memoria, la llena con datos sintéticos y
+mide filas por segundo de consulta + serialización + render JSON para el
+listado de productos y para un carrito, con cada camino. Verifica además que
+ambos produzcan los mismos bytes.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from decimal import Decimal
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings_test')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.db import connection  # noqa: E402
+from django.db.models import Prefetch  # noqa: E402
+from rest_framework.renderers import JSONRenderer  # noqa: E402
+
+from carrito.mappers import datos_carrito  # noqa: E402
+from carrito.models import Carrito, ItemCarrito  # noqa: E402
+from carrito.serializers import CarritoSerializer  # noqa: E402
+from config.serializacion_rapida import JSONRapidoRenderer  # noqa: E402
+from productos.mappers import filas_productos, serializar_productos  # noqa: E402
+from productos.models import Producto, StockTienda, Tienda  # noqa: E402
+from productos.serializers import ProductoSerializer  # noqa: E402
+
+
+def poblar(productos, tiendas, items):
+    tiendas = Tienda.objects.bulk_create([
+        Tienda(nombre=f'Tienda {i}', direccion='Dirección', telefono='1') for i in range(tiendas)
+    ])
+    Producto.objects.bulk_create([
+        Producto(
+            sku=f'BEN-{i:06d}', nombre=f'Producto {i}', descripcion='Descripción ' * 10,
+            precio=Decimal(1000 + i % 50000) / 10, categoria=f'Categoría {i % 20}', marca=f'Marca {i % 30}',
+            imagen_url=f'https://example.com/{i}.jpg' if i % 3 else None,
+        )
+        for i in range(productos)
+    ], batch_size=1000)
+    ids = list(Producto.objects.values_list('id', flat=True))
+    StockTienda.objects.bulk_create([
+        StockTienda(producto_id=producto_id, tienda=tienda, cantidad=producto_id % 17)
+        for producto_id in ids for tienda in tiendas
+    ], batch_size=1000)
+    carrito = Carrito.objects.create()
+    ItemCarrito.objects.bulk_create([
+        ItemCarrito(carrito=carrito, producto_id=producto_id, cantidad=1 + producto_id % 5)
+        for producto_id in ids[:items]
+    ])
+    return carrito
+
+
+def medir(funcion, repeticiones):
+    tiempos, resultado = [], None
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        resultado = funcion()
+        tiempos.append(time.perf_counter() - inicio)
+    return statistics.median(tiempos), resultado
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--productos', type=int, default=5000)
+    parser.add_argument('--tiendas', type=int, default=4)
+    parser.add_argument('--items', type=int, default=200, help='Líneas del carrito')
+    parser.add_argument('--repeticiones', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    nombre_original = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0)
+    try:
+        carrito = poblar(args.productos, args.tiendas, args.items)
+        productos = Producto.objects.order_by('id')
+        campos = set(ProductoSerializer.Meta.fields) - {'imagen'}
+        carritos = Carrito.objects.filter(pk=carrito.pk)
+
+        casos = [
+            ('listado de productos', args.productos,
+             lambda: JSONRenderer().render(ProductoSerializer(productos.prefetch_related(
+                 Prefetch('stocktienda_set', queryset=StockTienda.objects.select_related('tienda').order_by('id'))
+             ), many=True).data),
+             lambda: JSONRapidoRenderer().render(serializar_productos(filas_productos(productos, campos), campos))),
+            ('carrito', args.items,
+             lambda: JSONRenderer().render(CarritoSerializer(carritos.first()).data),
+             lambda: JSONRapidoRenderer().render(datos_carrito(carritos))),
+        ]
+        iguales = True
+        for nombre, filas, lento, rapido in casos:
+            t_lento, bytes_lento = medir(lento, args.repeticiones)
+            t_rapido, bytes_rapido = medir(rapido, args.repeticiones)
+            iguales &= bytes_lento == bytes_rapido
+            print(f"{nombre} ({filas} filas)")
+            print(f"  DRF:    {t_lento * 1000:8.1f} ms  {filas / t_lento:10.0f} filas/s")
+            print(f"  rápido: {t_rapido * 1000:8.1f} ms  {filas / t_rapido:10.0f} filas/s  (x{t_lento / t_rapido:.1f})")
+            print(f"  misma salida: {'sí' if bytes_lento == bytes_rapido else 'NO'}")
+    finally:
+        connection.creation.destroy_test_db(nombre_original, verbosity=0)
+    return 0 if iguales else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
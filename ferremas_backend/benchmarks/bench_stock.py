@@ -0,0 +1,159 @@
+"""
+Benchmarks de escritura de stock.
+
+Uso (desde ferremas_backend/):
+    python -m benchmarks.bench_stock --hilos 8 --descuentos 200 --stock 1000
+    python -m benchmarks.bench_stock --ajustes 10000
+    BENCH_DB_ENGINE=django.db.backends.postgresql BENCH_DB_NAME=ferremas \\
+        python -m benchmarks.bench_stock --hilos 32
+
+Crea una base de pruebas con un producto en una tienda y lanza N hilos que
+descuentan una unidad cada vez con `descontar_pedido`, como el checkout.
+Informa descuentos por segundo, reintentos por bloqueo de la base y verifica
+que no se vendan más unidades de las que había.
+
+Con --ajustes mide además una llamada a /api/stock-tienda/ajuste_masivo/ con esa
+cantidad de entradas (tiempo, consultas SQL y memoria máxima).
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings_bench')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.db import OperationalError, connection, reset_queries  # noqa: E402
+from django.test import Client  # noqa: E402
+from django.test.utils import CaptureQueriesContext, setup_test_environment  # noqa: E402
+from rest_framework_simplejwt.tokens import AccessToken  # noqa: E402
+
+from productos.models import Producto, StockTienda, Tienda  # noqa: E402
+from productos.stock_service import descontar_pedido  # noqa: E402
+from usuarios.models import CustomerUser  # noqa: E402
+
+
+def correr(producto_id, hilos, descuentos):
+    """Devuelve (segundos, descuentos exitosos, agotados, reintentos)."""
+    barrera = threading.Barrier(hilos + 1)
+    candado = threading.Lock()
+    totales = {'exitos': 0, 'agotados': 0, 'reintentos': 0}
+
+    def trabajar():
+        exitos = agotados = reintentos = 0
+        try:
+            barrera.wait()
+            for _ in range(descuentos):
+                while True:
+                    try:
+                        if descontar_pedido({producto_id: 1}).partes:
+                            exitos += 1
+                        else:
+                            agotados += 1
+                        break
+                    except OperationalError:
+                        # SQLite serializa las escrituras: la base estaba ocupada
+                        reintentos += 1
+                        time.sleep(0.001)
+        finally:
+            connection.close()
+            with candado:
+                totales['exitos'] += exitos
+                totales['agotados'] += agotados
+                totales['reintentos'] += reintentos
+
+    trabajadores = [threading.Thread(target=trabajar) for _ in range(hilos)]
+    for hilo in trabajadores:
+        hilo.start()
+    barrera.wait()
+    inicio = time.perf_counter()
+    for hilo in trabajadores:
+        hilo.join()
+    return time.perf_counter() - inicio, totales['exitos'], totales['agotados'], totales['reintentos']
+
+
+def ajuste_masivo(tienda, cantidad):
+    """Una llamada a ajuste_masivo con `cantidad` entradas: la mitad deltas y la mitad conteos."""
+    Producto.objects.bulk_create([
+        Producto(sku=f'AJ-{i:06d}', nombre=f'Producto {i}', precio=1000, categoria='Conteo') for i in range(cantidad)
+    ], batch_size=1000)
+    ids = list(Producto.objects.filter(sku__startswith='AJ-').order_by('id').values_list('id', flat=True))
+    StockTienda.objects.bulk_create([
+        StockTienda(producto_id=producto_id, tienda=tienda, cantidad=20) for producto_id in ids[: cantidad // 2]
+    ], batch_size=1000)
+    ajustes = [
+        {'producto': producto_id, 'tienda': tienda.id, 'delta': -(i % 30)} if i < cantidad // 2
+        else {'producto': producto_id, 'tienda': tienda.id, 'cantidad': i % 50}
+        for i, producto_id in enumerate(ids)
+    ]
+    trabajador = CustomerUser.objects.create_user(username='bench_bodega', email='bodega@ferremas.test', password='x', role='trabajador')
+    cabeceras = {'HTTP_AUTHORIZATION': f'Bearer {AccessToken.for_user(trabajador)}'}
+
+    def llamar():
+        return Client().post('/api/stock-tienda/ajuste_masivo/', {'ajustes': ajustes}, content_type='application/json', **cabeceras)
+
+    # Con DEBUG el registro de consultas está lleno por la carga de datos
+    reset_queries()
+    with CaptureQueriesContext(connection) as consultas:
+        inicio = time.perf_counter()
+        respuesta = llamar()
+        segundos = time.perf_counter() - inicio
+    sentencias = len(consultas.captured_queries)
+    # Segunda llamada, aparte, para medir memoria sin distorsionar el tiempo
+    tracemalloc.start()
+    try:
+        llamar()
+        pico = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    datos = respuesta.json()
+    print(f'ajuste masivo de {cantidad} entradas: HTTP {respuesta.status_code}')
+    print(f'  {segundos * 1000:10.1f} ms  consultas {sentencias}  memoria máxima {pico / 1024 / 1024:.1f} MiB')
+    print(f"  aplicados {datos['aplicados']}  rechazados {datos['rechazados']}")
+    return respuesta.status_code in (200, 207)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--hilos', type=int, default=8)
+    parser.add_argument('--descuentos', type=int, default=100, help='Descuentos por hilo')
+    parser.add_argument('--stock', type=int, default=500, help='Unidades iniciales del producto')
+    parser.add_argument('--ajustes', type=int, default=0, help='Entradas de una llamada a ajuste_masivo (0 para omitir)')
+    args = parser.parse_args(argv)
+
+    setup_test_environment()
+    nombre_original = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0)
+    try:
+        tienda = Tienda.objects.create(nombre='Ferremas Centro', direccion='Av. Principal 100', telefono='1')
+        producto = Producto.objects.create(sku='HOT-0001', nombre='Cemento 25 kg', precio=5990, categoria='Construcción')
+        stock = StockTienda.objects.create(producto=producto, tienda=tienda, cantidad=args.stock)
+
+        segundos, exitos, agotados, reintentos = correr(producto.id, args.hilos, args.descuentos)
+        stock.refresh_from_db()
+        producto.refresh_from_db()
+        consistente = (
+            exitos == min(args.stock, args.hilos * args.descuentos)
+            and stock.cantidad == args.stock - exitos
+            and producto.stock_total == stock.cantidad
+        )
+        intentos = exitos + agotados
+        print(f'{args.hilos} hilos x {args.descuentos} descuentos sobre {args.stock} unidades ({connection.vendor})')
+        print(f'  {intentos / segundos:10.0f} descuentos/s  ({segundos * 1000:.1f} ms en total)')
+        print(f'  exitosos {exitos}  agotados {agotados}  reintentos {reintentos}')
+        print(f'  stock final {stock.cantidad}  total del producto {producto.stock_total}')
+        print(f"  consistente: {'sí' if consistente else 'NO'}")
+        if args.ajustes:
+            consistente &= ajuste_masivo(tienda, args.ajustes)
+    finally:
+        connection.creation.destroy_test_db(nombre_original, verbosity=0)
+    return 0 if consistente else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,202 @@
+"""
+Prueba de carga del stream SSE de cambios de stock.
+
+Uso (desde ferremas_backend/):
+    python -m benchmarks.bench_stream --suscriptores 5000 --eventos 50
+    python -m benchmarks.bench_stream --suscriptores 5000 --rele
+
+Abre `suscriptores` conexiones a /api/stock-tienda/stream/ contra la
+aplicación ASGI del proyecto (config.asgi) en un solo event loop, como lo
+haría uvicorn, con el JWT de un trabajador (la apertura incluye validarlo
+contra la base de pruebas), la mitad filtrando por una tienda. Desde otro hilo (como una request
+que confirma un cambio) publica `eventos` lotes y mide la latencia de fan-out
+hasta que el chunk SSE sale por cada conexión interesada: p50/p99/máximo por
+entrega y tiempo hasta la última conexión de cada evento. Informa también
+hilos y memoria con todas las conexiones inactivas. Con --rele los lotes
+pasan por el relé entre workers (`manage.py rele_stock`).
+"""
+import argparse
+import asyncio
+import functools
+import json
+import os
+import resource
+import socket
+import statistics
+import sys
+import threading
+import time
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings_bench')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.test.utils import setup_test_environment  # noqa: E402
+from rest_framework_simplejwt.tokens import AccessToken  # noqa: E402
+
+from config.asgi import application  # noqa: E402
+from productos import eventos_service  # noqa: E402
+from usuarios.models import CustomerUser  # noqa: E402
+
+TIENDA_FILTRADA = 1
+
+
+@functools.lru_cache(maxsize=256)
+def secuencias(cuerpo):
+    """Los chunks de un mismo lote son el mismo objeto: se decodifican una vez, no por conexión."""
+    return [delta['cantidad'] for delta in json.loads(cuerpo.split(b'data: ', 1)[1])]
+
+
+class Conexion:
+    """Cliente ASGI mínimo: una request GET que queda abierta hasta `cerrar`."""
+
+    def __init__(self, aplicacion, consulta, token, entregas):
+        self.consulta = consulta
+        self.token = token
+        self.entregas = entregas
+        self.desconectar = asyncio.Event()
+        self.pedido_enviado = False
+        self.tarea = asyncio.ensure_future(aplicacion(self.scope(), self.recibir, self.enviar))
+
+    def scope(self):
+        return {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+            'path': '/api/stock-tienda/stream/', 'raw_path': b'/api/stock-tienda/stream/',
+            'query_string': self.consulta.encode(), 'root_path': '',
+            'headers': [(b'host', b'localhost'), (b'authorization', f'Bearer {self.token}'.encode())],
+            'client': ('127.0.0.1', 1), 'server': ('localhost', 80),
+        }
+
+    async def recibir(self):
+        if not self.pedido_enviado:
+            self.pedido_enviado = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        await self.desconectar.wait()
+        return {'type': 'http.disconnect'}
+
+    async def enviar(self, mensaje):
+        cuerpo = mensaje.get('body', b'')
+        if cuerpo.startswith(b'event: stock'):
+            # El número de evento viaja en `cantidad`; si la conexión se
+            # atrasó, varios eventos salen juntos en un chunk
+            momento = time.perf_counter()
+            for secuencia in secuencias(cuerpo):
+                self.entregas.append((secuencia, momento))
+        elif cuerpo.startswith(b'retry'):
+            self.entregas.append((None, time.perf_counter()))
+
+    async def cerrar(self):
+        self.desconectar.set()
+        await asyncio.wait([self.tarea], timeout=5)
+
+
+def puerto_libre():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def iniciar_rele():
+    puerto = puerto_libre()
+    loop = asyncio.new_event_loop()
+    listo = threading.Event()
+
+    async def servir():
+        evento = asyncio.Event()
+        tarea = asyncio.ensure_future(eventos_service.servir_rele('127.0.0.1', puerto, evento))
+        await evento.wait()
+        listo.set()
+        await tarea
+
+    threading.Thread(target=loop.run_until_complete, args=(servir(),), daemon=True).start()
+    listo.wait()
+    settings.STOCK_EVENTOS_RELE = f'127.0.0.1:{puerto}'
+    broker = eventos_service.broker()
+    while broker._conexion is None:
+        time.sleep(0.01)
+
+
+def percentil(valores, p):
+    valores = sorted(valores)
+    return valores[min(len(valores) - 1, int(len(valores) * p))]
+
+
+async def medir(args, token):
+    aplicacion = application
+    entregas = []
+    conexiones = []
+    inicio = time.perf_counter()
+    for i in range(args.suscriptores):
+        consulta = f'tiendas={TIENDA_FILTRADA}' if i % 2 else ''
+        conexiones.append(Conexion(aplicacion, consulta, token, entregas))
+        if i % 500 == 499:
+            await asyncio.sleep(0)
+    while sum(1 for secuencia, _ in entregas if secuencia is None) < args.suscriptores:
+        await asyncio.sleep(0.05)
+    apertura = time.perf_counter() - inicio
+    entregas.clear()
+    print(f'{args.suscriptores} conexiones abiertas en {apertura:.2f} s')
+    print(f'  suscriptores en el broker: {eventos_service.broker().suscriptores}, hilos: {threading.active_count()}')
+    print(f'  memoria máxima del proceso: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MiB')
+
+    # La mitad de los eventos es de la tienda filtrada (llega a todos) y la otra de otra tienda (a la mitad)
+    esperadas = {
+        secuencia: args.suscriptores if secuencia % 2 else args.suscriptores - args.suscriptores // 2
+        for secuencia in range(args.eventos)
+    }
+    publicados = {}
+
+    def publicar():
+        for secuencia in range(args.eventos):
+            tienda = TIENDA_FILTRADA if secuencia % 2 else TIENDA_FILTRADA + 1
+            publicados[secuencia] = time.perf_counter()
+            eventos_service.broker().publicar([{'producto': 1, 'tienda': tienda, 'cantidad': secuencia}])
+            time.sleep(args.intervalo / 1000)
+
+    hilo = threading.Thread(target=publicar)
+    hilo.start()
+    limite = time.perf_counter() + 30 + args.eventos * args.intervalo / 1000
+    while len(entregas) < sum(esperadas.values()) and time.perf_counter() < limite:
+        await asyncio.sleep(0.01)
+    hilo.join()
+
+    latencias, ultimas = [], {}
+    for secuencia, momento in entregas:
+        latencias.append(momento - publicados[secuencia])
+        ultimas[secuencia] = max(ultimas.get(secuencia, 0), momento - publicados[secuencia])
+    print(f"{args.eventos} eventos{' por el relé' if args.rele else ''}, {len(entregas)} de {sum(esperadas.values())} entregas")
+    print(f'  latencia por entrega: p50 {percentil(latencias, 0.5) * 1000:.1f} ms, '
+          f'p99 {percentil(latencias, 0.99) * 1000:.1f} ms, máx {max(latencias) * 1000:.1f} ms')
+    print(f'  hasta la última conexión: p50 {statistics.median(ultimas.values()) * 1000:.1f} ms, '
+          f'máx {max(ultimas.values()) * 1000:.1f} ms')
+
+    await asyncio.gather(*(conexion.cerrar() for conexion in conexiones))
+    print(f'  suscriptores tras cerrar: {eventos_service.broker().suscriptores}')
+    return len(entregas) == sum(esperadas.values())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--suscriptores', type=int, default=5000)
+    parser.add_argument('--eventos', type=int, default=50)
+    parser.add_argument('--intervalo', type=float, default=20, help='Milisegundos entre eventos')
+    parser.add_argument('--rele', action='store_true', help='Publicar a través del relé entre workers')
+    args = parser.parse_args(argv)
+    setup_test_environment()
+    nombre_original = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0)
+    try:
+        trabajador = CustomerUser.objects.create_user(username='bench_stream', password='x', role='trabajador')
+        if args.rele:
+            iniciar_rele()
+        return 0 if asyncio.run(medir(args, str(AccessToken.for_user(trabajador)))) else 1
+    finally:
+        connection.creation.destroy_test_db(nombre_original, verbosity=0)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,52 @@
+"""
+Compara dos archivos de resultados de benchmarks.run.
+
+Uso (desde ferremas_backend/):
+    python -m benchmarks.comparar base.json nuevo.json
+
+Muestra por escenario el p50, el p95, las consultas por request y la memoria
+de ambas corridas, con la variación relativa.
+"""
+import argparse
+import json
+import sys
+
+
+def variacion(antes, despues):
+    if antes in (None, 0) or despues is None:
+        return '     -'
+    return f'{(despues - antes) / antes * 100:+6.1f}%'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('base')
+    parser.add_argument('nuevo')
+    args = parser.parse_args(argv)
+
+    with open(args.base, encoding='utf-8') as archivo:
+        base = json.load(archivo)
+    with open(args.nuevo, encoding='utf-8') as archivo:
+        nuevo = json.load(archivo)
+    print(f"base:  {base['meta'].get('commit')} ({base['meta'].get('base_de_datos')})")
+    print(f"nuevo: {nuevo['meta'].get('commit')} ({nuevo['meta'].get('base_de_datos')})")
+
+    metricas = [
+        ('p50 ms', lambda r: r['latencia_ms']['p50']),
+        ('p95 ms', lambda r: r['latencia_ms']['p95']),
+        ('consultas', lambda r: r['consultas_por_request']['media']),
+        ('memoria KiB', lambda r: r['memoria_pico_kib']),
+    ]
+    for nombre in sorted(set(base['escenarios']) | set(nuevo['escenarios'])):
+        antes, despues = base['escenarios'].get(nombre), nuevo['escenarios'].get(nombre)
+        print(nombre)
+        if antes is None or despues is None:
+            print('  solo en ' + ('nuevo' if antes is None else 'base'))
+            continue
+        for etiqueta, obtener in metricas:
+            print(f'  {etiqueta:<12} {obtener(antes):>10} -> {obtener(despues):>10}  {variacion(obtener(antes), obtener(despues))}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,263 @@
+"""
+Suite de benchmarks de punta a punta de la API.
+
+Uso (desde ferremas_backend/):
+    python -m benchmarks.run --productos 5000 --iteraciones 100 --salida resultados.json
+    BENCH_DB_ENGINE=django.db.backends.postgresql BENCH_DB_NAME=ferremas \\
+        python -m benchmarks.run --keepdb --salida pg.json
+
+Crea una base de pruebas (SQLite en memoria, o test_<BENCH_DB_NAME> en
+Postgres), la llena con benchmarks.seed y ejecuta cada escenario a través del
+cliente de pruebas de Django, con middlewares, autenticación JWT y render.
+Por escenario informa percentiles de latencia, consultas SQL por request y
+memoria máxima asignada por request (tracemalloc, en una pasada aparte para
+no distorsionar las latencias). El resultado se escribe en JSON y se puede
+comparar entre corridas con `python -m benchmarks.comparar`.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings_bench')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.db import connection, reset_queries  # noqa: E402
+from django.test import Client  # noqa: E402
+from django.test.utils import CaptureQueriesContext, setup_test_environment  # noqa: E402
+from rest_framework_simplejwt.tokens import AccessToken  # noqa: E402
+
+from benchmarks.bench_busqueda import generar_consultas  # noqa: E402
+from benchmarks.seed import PASSWORD, Parametros, datos_existentes, sembrar  # noqa: E402
+from carrito.models import Carrito, ItemCarrito  # noqa: E402
+from productos.cache import invalidar_catalogo  # noqa: E402
+from productos.models import Producto  # noqa: E402
+from usuarios.models import CustomerUser  # noqa: E402
+
+
+class Escenario:
+    """
+    Un endpoint a medir. `request(i)` devuelve (método, url, datos, usuario_id)
+    para la iteración i; `antes(i)`, si existe, prepara el estado sin medirse.
+    """
+
+    def __init__(self, nombre, request, antes=None):
+        self.nombre = nombre
+        self.request = request
+        self.antes = antes
+
+
+def escenarios(datos, rnd):
+    productos, clientes = datos.productos, datos.clientes
+    con_carrito = datos.clientes_con_carrito or clientes
+    con_ordenes = datos.clientes_con_ordenes or clientes
+    consultas = generar_consultas(1000, rnd.randrange(1000))
+    correos = dict(CustomerUser.objects.filter(id__in=clientes).values_list('id', 'email'))
+
+    def elegir(lista):
+        return lista[rnd.randrange(len(lista))]
+
+    def preparar_pago(i):
+        # Cada pago vacía el carrito: se vuelve a llenar antes de medir
+        usuario_id = con_carrito[i % len(con_carrito)]
+        carrito, _ = Carrito.objects.get_or_create(usuario_id=usuario_id)
+        ItemCarrito.objects.bulk_create([
+            ItemCarrito(carrito=carrito, producto_id=producto_id, cantidad=1)
+            for producto_id in rnd.sample(productos, min(3, len(productos)))
+        ], ignore_conflicts=True)
+        return usuario_id
+
+    pagos = {}
+    return [
+        Escenario('catalogo_list', lambda i: ('get', '/api/productos/', None, None)),
+        Escenario(
+            'catalogo_list_sin_cache', lambda i: ('get', '/api/productos/', None, None),
+            antes=lambda i: invalidar_catalogo(),
+        ),
+        Escenario('catalogo_list_pagina', lambda i: ('get', '/api/productos/', {'page_size': 50}, None)),
+        Escenario('catalogo_retrieve', lambda i: ('get', f'/api/productos/{elegir(productos)}/', None, None)),
+        Escenario('catalogo_categories', lambda i: ('get', '/api/productos/categories/', None, None)),
+        Escenario('catalogo_search', lambda i: ('get', '/api/productos/search/', {'q': consultas[i % len(consultas)]}, None)),
+        Escenario('carrito_add', lambda i: (
+            'post', '/api/carritos/add_item/', {'producto_id': elegir(productos), 'cantidad': 1}, elegir(clientes),
+        )),
+        Escenario('carrito_get', lambda i: ('get', '/api/carritos/get_cart/', None, elegir(con_carrito))),
+        Escenario(
+            'simulate_payment', lambda i: ('post', '/api/carritos/simulate_payment/', {}, pagos[i]),
+            antes=lambda i: pagos.__setitem__(i, preparar_pago(i)),
+        ),
+        Escenario('user_orders', lambda i: ('get', '/api/carritos/user_orders/', None, elegir(con_ordenes))),
+        Escenario('contacto_list', lambda i: ('get', '/api/contacto/mensajes/', None, datos.admin)),
+        Escenario('login', lambda i: (
+            'post', '/api/usuarios/login/', {'email': correos[elegir(clientes)], 'password': PASSWORD}, None,
+        )),
+    ]
+
+
+def percentil(valores, p):
+    ordenados = sorted(valores)
+    indice = (len(ordenados) - 1) * p / 100
+    bajo = int(indice)
+    alto = min(bajo + 1, len(ordenados) - 1)
+    return ordenados[bajo] + (ordenados[alto] - ordenados[bajo]) * (indice - bajo)
+
+
+class Ejecutor:
+    def __init__(self):
+        self.client = Client()
+        self.tokens = {}
+
+    def cabeceras(self, usuario_id):
+        if usuario_id is None:
+            return {}
+        if usuario_id not in self.tokens:
+            self.tokens[usuario_id] = str(AccessToken.for_user(CustomerUser.objects.get(id=usuario_id)))
+        return {'HTTP_AUTHORIZATION': f'Bearer {self.tokens[usuario_id]}'}
+
+    def ejecutar(self, escenario, i):
+        if escenario.antes:
+            escenario.antes(i)
+        metodo, url, datos, usuario_id = escenario.request(i)
+        cabeceras = self.cabeceras(usuario_id)
+        if metodo == 'get':
+            llamar = lambda: self.client.get(url, datos, **cabeceras)  # noqa: E731
+        else:
+            llamar = lambda: self.client.post(url, datos or {}, content_type='application/json', **cabeceras)  # noqa: E731
+        return llamar
+
+    def medir(self, escenario, iteraciones, calentamiento, iteraciones_memoria):
+        for i in range(calentamiento):
+            self.ejecutar(escenario, i)()
+
+        latencias, consultas, errores = [], [], 0
+        for i in range(calentamiento, calentamiento + iteraciones):
+            llamar = self.ejecutar(escenario, i)
+            with CaptureQueriesContext(connection) as capturadas:
+                inicio = time.perf_counter()
+                respuesta = llamar()
+                latencias.append((time.perf_counter() - inicio) * 1000)
+            consultas.append(len(capturadas.captured_queries))
+            if respuesta.status_code >= 400:
+                errores += 1
+
+        picos = []
+        tracemalloc.start()
+        try:
+            for i in range(iteraciones_memoria):
+                llamar = self.ejecutar(escenario, calentamiento + iteraciones + i)
+                tracemalloc.reset_peak()
+                base = tracemalloc.get_traced_memory()[0]
+                llamar()
+                picos.append(tracemalloc.get_traced_memory()[1] - base)
+        finally:
+            tracemalloc.stop()
+        reset_queries()
+
+        return {
+            'iteraciones': iteraciones,
+            'errores': errores,
+            'latencia_ms': {
+                'p50': round(percentil(latencias, 50), 3),
+                'p90': round(percentil(latencias, 90), 3),
+                'p95': round(percentil(latencias, 95), 3),
+                'p99': round(percentil(latencias, 99), 3),
+                'max': round(max(latencias), 3),
+                'media': round(statistics.fmean(latencias), 3),
+            },
+            'consultas_por_request': {
+                'media': round(statistics.fmean(consultas), 2),
+                'max': max(consultas),
+            },
+            'memoria_pico_kib': round(max(picos) / 1024, 1) if picos else None,
+        }
+
+
+def commit_actual():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--productos', type=int, default=2000)
+    parser.add_argument('--tiendas', type=int, default=10)
+    parser.add_argument('--usuarios', type=int, default=100)
+    parser.add_argument('--carritos', type=int, default=50)
+    parser.add_argument('--ordenes', type=int, default=200)
+    parser.add_argument('--mensajes', type=int, default=200)
+    parser.add_argument('--semilla', type=int, default=42)
+    parser.add_argument('--iteraciones', type=int, default=50, help='Requests medidos por escenario')
+    parser.add_argument('--calentamiento', type=int, default=3, help='Requests previos no medidos')
+    parser.add_argument('--iteraciones-memoria', type=int, default=5, help='Requests medidos con tracemalloc')
+    parser.add_argument('--escenarios', help='Lista separada por comas (por defecto todos)')
+    parser.add_argument('--keepdb', action='store_true', help='Reutiliza la base de pruebas y sus datos si ya existen')
+    parser.add_argument('--salida', default='benchmarks/resultados.json', help='Archivo JSON de resultados')
+    args = parser.parse_args(argv)
+
+    parametros = Parametros(
+        productos=args.productos, tiendas=args.tiendas, usuarios=args.usuarios, carritos=args.carritos,
+        ordenes=args.ordenes, mensajes=args.mensajes, semilla=args.semilla,
+    )
+    setup_test_environment()
+    nombre_original = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, keepdb=args.keepdb)
+    try:
+        inicio = time.perf_counter()
+        if args.keepdb and Producto.objects.exists():
+            datos = datos_existentes()
+            print('Usando los datos existentes de la base de pruebas')
+        else:
+            datos = sembrar(parametros)
+        print(f'Datos listos en {time.perf_counter() - inicio:.1f} s')
+
+        rnd = random.Random(args.semilla)
+        seleccion = set(args.escenarios.split(',')) if args.escenarios else None
+        ejecutor = Ejecutor()
+        resultados = {}
+        for escenario in escenarios(datos, rnd):
+            if seleccion is not None and escenario.nombre not in seleccion:
+                continue
+            resultado = ejecutor.medir(escenario, args.iteraciones, args.calentamiento, args.iteraciones_memoria)
+            resultados[escenario.nombre] = resultado
+            latencia = resultado['latencia_ms']
+            print(
+                f"{escenario.nombre:<26} p50 {latencia['p50']:8.2f} ms  p95 {latencia['p95']:8.2f} ms  "
+                f"consultas {resultado['consultas_por_request']['media']:6.1f}  "
+                f"memoria {resultado['memoria_pico_kib']:9.1f} KiB  errores {resultado['errores']}"
+            )
+    finally:
+        connection.creation.destroy_test_db(nombre_original, verbosity=0, keepdb=args.keepdb)
+
+    informe = {
+        'meta': {
+            'fecha': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'commit': commit_actual(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'base_de_datos': connection.vendor,
+            'parametros': vars(parametros),
+            'iteraciones': args.iteraciones,
+        },
+        'escenarios': resultados,
+    }
+    with open(args.salida, 'w', encoding='utf-8') as salida:
+        json.dump(informe, salida, ensure_ascii=False, indent=2)
+    print(f'Resultados en {args.salida}')
+    return 1 if any(resultado['errores'] for resultado in resultados.values()) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,163 @@
+"""
+Generador de datos sintéticos para los benchmarks.
+
+Crea tiendas, productos con stock por tienda, usuarios, carritos con items,
+órdenes pagadas y mensajes de contacto, siempre con la misma semilla para que
+dos corridas con los mismos parámetros midan exactamente los mismos datos.
+Escribe con bulk_create, así que recalcula al final los totales de stock,
+reinicia el índice de búsqueda e invalida la caché del catálogo.
+"""
+import random
+from dataclasses import dataclass, field
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from django.utils import timezone
+
+from benchmarks.bench_busqueda import generar_catalogo
+from carrito.models import Carrito, ItemCarrito, ItemOrden, Orden
+from contacto.models import MensajeContacto
+from productos.cache import invalidar_catalogo
+from productos.models import Producto, StockTienda, Tienda
+from productos.search import reiniciar_indice
+from productos.stock_service import actualizar_totales
+from usuarios.models import CustomerUser
+
+PASSWORD = 'bench-password'
+CATEGORIAS = [
+    'Herramientas manuales', 'Herramientas eléctricas', 'Construcción', 'Pinturas',
+    'Gasfitería', 'Electricidad', 'Jardinería', 'Seguridad', 'Fijaciones', 'Adhesivos',
+]
+LOTE = 2000
+
+
+@dataclass
+class Parametros:
+    productos: int = 2000
+    tiendas: int = 10
+    usuarios: int = 100
+    carritos: int = 50
+    ordenes: int = 200
+    mensajes: int = 200
+    semilla: int = 42
+
+
+@dataclass
+class DatosSembrados:
+    """Ids que los escenarios necesitan para armar sus requests."""
+    productos: list = field(default_factory=list)
+    tiendas: list = field(default_factory=list)
+    clientes: list = field(default_factory=list)
+    clientes_con_carrito: list = field(default_factory=list)
+    clientes_con_ordenes: list = field(default_factory=list)
+    admin: int = None
+
+
+def _en_lotes(modelo, objetos):
+    return modelo.objects.bulk_create(objetos, batch_size=LOTE)
+
+
+@transaction.atomic
+def sembrar(parametros):
+    rnd = random.Random(parametros.semilla)
+    datos = DatosSembrados()
+
+    tiendas = _en_lotes(Tienda, [
+        Tienda(nombre=f'Ferremas {i + 1}', direccion=f'Av. Principal {100 + i}', telefono=f'+5622{i:07d}')
+        for i in range(parametros.tiendas)
+    ])
+    datos.tiendas = [tienda.id for tienda in tiendas]
+
+    _en_lotes(Producto, [
+        Producto(
+            sku=sku, nombre=nombre, descripcion=descripcion, marca=marca,
+            categoria=rnd.choice(CATEGORIAS),
+            precio=Decimal(rnd.randrange(990, 250000, 10)),
+            imagen_url=f'https://example.com/productos/{producto_id}.jpg' if producto_id % 4 else None,
+        )
+        for producto_id, nombre, descripcion, marca, sku in generar_catalogo(parametros.productos, parametros.semilla)
+    ])
+    datos.productos = list(Producto.objects.order_by('id').values_list('id', flat=True))
+
+    # Cada producto tiene stock en alrededor del 60% de las tiendas
+    _en_lotes(StockTienda, [
+        StockTienda(
+            producto_id=producto_id, tienda_id=tienda_id,
+            cantidad=rnd.randrange(0, 200), stock_minimo=rnd.randrange(0, 20),
+        )
+        for producto_id in datos.productos
+        for tienda_id in datos.tiendas if rnd.random() < 0.6
+    ])
+    for desde in range(0, len(datos.productos), LOTE):
+        actualizar_totales(Producto.objects.filter(id__in=datos.productos[desde:desde + LOTE]))
+
+    password = make_password(PASSWORD)
+    roles = ['admin', 'trabajador'] + ['cliente'] * max(parametros.usuarios - 2, 0)
+    _en_lotes(CustomerUser, [
+        CustomerUser(
+            username=f'bench{i}', email=f'bench{i}@ferremas.test', password=password, role=rol,
+            first_name='Usuario', last_name=f'{i}',
+        )
+        for i, rol in enumerate(roles[:parametros.usuarios])
+    ])
+    usuarios = list(CustomerUser.objects.filter(username__startswith='bench').order_by('id').values_list('id', 'role'))
+    datos.admin = next((usuario_id for usuario_id, rol in usuarios if rol == 'admin'), None)
+    datos.clientes = [usuario_id for usuario_id, rol in usuarios if rol == 'cliente']
+
+    datos.clientes_con_carrito = datos.clientes[:parametros.carritos]
+    carritos = _en_lotes(Carrito, [Carrito(usuario_id=usuario_id) for usuario_id in datos.clientes_con_carrito])
+    _en_lotes(ItemCarrito, [
+        ItemCarrito(carrito=carrito, producto_id=producto_id, cantidad=rnd.randrange(1, 5))
+        for carrito in carritos
+        for producto_id in rnd.sample(datos.productos, min(rnd.randrange(1, 11), len(datos.productos)))
+    ])
+
+    precios = dict(Producto.objects.values_list('id', 'precio'))
+    ahora = timezone.now()
+    ordenes, items = [], []
+    for _ in range(parametros.ordenes if datos.clientes else 0):
+        orden = Orden(
+            usuario_id=rnd.choice(datos.clientes), estado=rnd.choice(['pagado', 'enviado', 'entregado']),
+            total=Decimal(0), nombre='Cliente Bench', email='cliente@ferremas.test', telefono='+56900000000',
+            direccion='Calle Falsa 123', ciudad='Santiago', codigo_postal='8320000', metodo_pago='pago_simulado',
+        )
+        for producto_id in rnd.sample(datos.productos, min(rnd.randrange(1, 9), len(datos.productos))):
+            item = ItemOrden(orden=orden, producto_id=producto_id, cantidad=rnd.randrange(1, 4), precio_unitario=precios[producto_id])
+            orden.total += item.subtotal
+            items.append(item)
+        ordenes.append(orden)
+    _en_lotes(Orden, ordenes)
+    _en_lotes(ItemOrden, items)
+    datos.clientes_con_ordenes = sorted({orden.usuario_id for orden in ordenes})
+
+    mensajes = _en_lotes(MensajeContacto, [
+        MensajeContacto(
+            nombre=f'Cliente {i}', email=f'contacto{i}@ferremas.test', asunto=rnd.choice(['Cotización', 'Reclamo', 'Consulta', None]),
+            mensaje='Quisiera saber si tienen stock disponible. ' * rnd.randrange(1, 6),
+        )
+        for i in range(parametros.mensajes)
+    ])
+    # fecha_envio es auto_now_add: se reparte en los últimos 60 días después de crear
+    for mensaje in mensajes:
+        mensaje.fecha_envio = ahora - timedelta(minutes=rnd.randrange(0, 60 * 24 * 60))
+    MensajeContacto.objects.bulk_update(mensajes, ['fecha_envio'], batch_size=LOTE)
+
+    reiniciar_indice()
+    invalidar_catalogo()
+    return datos
+
+
+def datos_existentes():
+    """DatosSembrados a partir de una base ya poblada (para reutilizarla con --keepdb)."""
+    usuarios = list(CustomerUser.objects.filter(username__startswith='bench').order_by('id').values_list('id', 'role'))
+    clientes = [usuario_id for usuario_id, rol in usuarios if rol == 'cliente']
+    return DatosSembrados(
+        productos=list(Producto.objects.order_by('id').values_list('id', flat=True)),
+        tiendas=list(Tienda.objects.order_by('id').values_list('id', flat=True)),
+        clientes=clientes,
+        clientes_con_carrito=list(Carrito.objects.filter(usuario__in=clientes).order_by('usuario').values_list('usuario', flat=True)),
+        clientes_con_ordenes=sorted(set(Orden.objects.filter(usuario__in=clientes).values_list('usuario', flat=True))),
+        admin=next((usuario_id for usuario_id, rol in usuarios if rol == 'admin'), None),
+    )
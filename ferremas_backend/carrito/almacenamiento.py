@@ -0,0 +1,405 @@
+"""
+Dónde viven los carritos de invitado.
+
+settings.ALMACEN_CARRITO_INVITADO elige la clase (ruta de importación):
+
+- AlmacenBaseDatos: cada operación lee y escribe Carrito/ItemCarrito, como
+  con los usuarios autenticados. Es el valor por defecto.
+- AlmacenCache: el carrito vive en la caché 'carritos' (con su TIMEOUT y
+  MAX_ENTRIES) y solo llega a la base al pagar, al iniciar sesión (fusionar)
+  o cuando `manage.py volcar_carritos` vuelca los modificados. Un carrito
+  abandonado nunca crea filas. Lo que la caché expulse antes del volcado se
+  pierde, y el volcado solo ve los carritos si la caché es compartida entre
+  procesos (Redis, Memcached o FileBasedCache en un solo servidor).
+
+Los usuarios autenticados usan siempre la base. Las vistas hablan con el
+almacén que devuelve almacen_para(usuario), con la misma salida en los dos.
+"""
+import time
+import uuid
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from config.serializacion_rapida import serializacion_rapida_activa
+from productos.models import Producto
+
+from .carrito_service import (
+    CarritoAjeno, ProductoNoEncontrado, aplicar_operaciones, cargar_carrito, carrito_para_escribir,
+    escribir_lineas, guardar_carrito, sumar_item, validar_productos,
+)
+from .mappers import armar_carrito, armar_item_con_totales, columnas_carrito, datos_carrito, datos_item_con_totales
+from .models import Carrito, ItemCarrito
+from .serializers import CarritoSerializer
+
+ESPERA_BLOQUEO = 5  # segundos que vive el bloqueo de un carrito si su dueño muere
+ESPERA_HUECO = 60  # segundos que el volcado espera una entrada del diario antes de darla por perdida
+
+
+class AlmacenBaseDatos:
+    """
+    Carrito en Carrito/ItemCarrito. Con usuario, el suyo (se ignora
+    carrito_id); sin él, el carrito de invitado carrito_id.
+    """
+
+    def __init__(self, usuario=None):
+        self.usuario = usuario if usuario is not None and usuario.is_authenticated else None
+
+    def _carritos(self, carrito_id):
+        if self.usuario is not None:
+            return Carrito.objects.filter(usuario=self.usuario)
+        if carrito_id is None:
+            return Carrito.objects.none()
+        return Carrito.objects.filter(id=carrito_id, usuario__isnull=True)
+
+    def _items(self, carrito_id, item_id):
+        if self.usuario is not None:
+            return ItemCarrito.objects.filter(id=item_id, carrito__usuario=self.usuario)
+        return ItemCarrito.objects.filter(id=item_id, carrito_id=carrito_id, carrito__usuario__isnull=True)
+
+    def obtener(self, carrito_id):
+        """Salida de CarritoSerializer, o None si el carrito no existe."""
+        if serializacion_rapida_activa():
+            return datos_carrito(self._carritos(carrito_id))
+        carrito = cargar_carrito(self._carritos(carrito_id))
+        return CarritoSerializer(carrito).data if carrito else None
+
+    def agregar(self, carrito_id, producto_id, cantidad):
+        """
+        Suma unidades y devuelve (línea con los totales del carrito, id del
+        carrito). Lanza ProductoNoEncontrado y CarritoAjeno.
+        """
+        carrito_id = carrito_para_escribir(self.usuario, carrito_id)
+        return datos_item_con_totales(sumar_item(carrito_id, producto_id, cantidad)), carrito_id
+
+    def quitar(self, carrito_id, item_id):
+        """Borra la línea del carrito. False si no está en él."""
+        borradas, _ = self._items(carrito_id, item_id).delete()
+        return borradas > 0
+
+    def cambiar_cantidad(self, carrito_id, item_id, cantidad):
+        """Fija la cantidad de la línea y la devuelve con los totales, o None si no está en el carrito."""
+        if not self._items(carrito_id, item_id).update(cantidad=cantidad):
+            return None
+        return datos_item_con_totales(item_id)
+
+    def aplicar_lote(self, carrito_id, operaciones):
+        """
+        Aplica las operaciones de leer_operaciones en una transacción y
+        devuelve (el carrito resultante, su id). El upsert del carrito
+        comprueba que es de quien lo pide y lo bloquea hasta el final; las
+        líneas se leen una vez y se escriben con escribir_lineas. Lanza
+        OperacionInvalida, ProductoNoEncontrado y CarritoAjeno.
+        """
+        with transaction.atomic():
+            carrito_id = carrito_para_escribir(self.usuario, carrito_id)
+            filas = list(ItemCarrito.objects.filter(carrito_id=carrito_id).values_list('id', 'producto_id', 'cantidad'))
+            antes = {producto_id: cantidad for _, producto_id, cantidad in filas}
+            despues = aplicar_operaciones(dict(antes), {item_id: producto_id for item_id, producto_id, _ in filas}, operaciones)
+            validar_productos(set(despues) - set(antes))
+            escribir_lineas(carrito_id, antes, despues)
+        return self.obtener(carrito_id), carrito_id
+
+    def persistir(self, carrito_id):
+        """Deja el carrito al día en la base antes de leerlo desde ahí (checkout). Dice si escribió algo."""
+        return False
+
+    def vaciar(self, carrito_id):
+        """Olvida las líneas que el almacén guarde aparte de la base (tras pagar)."""
+
+    def descartar(self, carrito_id):
+        """Olvida el carrito (tras fusionarlo con el de un usuario)."""
+
+
+class AlmacenCache:
+    """
+    Carritos de invitado en la caché 'carritos', como
+    {'items': {producto_id: cantidad}, 'version', 'persistida', ...}.
+    El id de cada línea es el del producto. Los nombres y precios se leen
+    de la base en cada respuesta (una consulta), nunca se guardan.
+
+    Cada lectura-modificación-escritura toma un bloqueo por carrito
+    (cache.add) y sube la versión. Un carrito con versión distinta de la
+    persistida está sucio: al ensuciarse se anota en el diario (un contador
+    con cache.incr y una entrada por número) que recorre volcar_pendientes.
+    Si el volcado pasó de largo su entrada (la caché la expulsó), el próximo
+    cambio lo vuelve a anotar.
+    """
+
+    def __init__(self, usuario=None):
+        self.cache = caches['carritos']
+
+    @staticmethod
+    def _clave(carrito_id):
+        return f'carrito:{carrito_id}'
+
+    def _bloquear(self, carrito_id):
+        clave = f'carrito:{carrito_id}:bloqueo'
+        while not self.cache.add(clave, 1, ESPERA_BLOQUEO):
+            time.sleep(0.005)
+        return clave
+
+    def _leer(self, carrito_id):
+        """El carrito de la caché o, si no está, el de la base (sin guardarlo). None si no existe."""
+        carrito = self.cache.get(self._clave(carrito_id))
+        if carrito is not None:
+            return carrito
+        fila = Carrito.objects.filter(id=carrito_id).values('usuario_id', 'fecha_creacion').first()
+        if fila is None:
+            return None
+        if fila['usuario_id'] is not None:
+            raise CarritoAjeno(carrito_id)
+        items = ItemCarrito.objects.filter(carrito_id=carrito_id).order_by('id').values_list('producto_id', 'cantidad')
+        return {
+            'items': dict(items), 'version': 0, 'persistida': 0,
+            'fecha_creacion': fila['fecha_creacion'], 'fecha_actualizacion': timezone.now(),
+        }
+
+    def _modificar(self, carrito_id, cambio, crear=False):
+        """
+        Aplica cambio(items) al carrito bajo su bloqueo y lo guarda. Si
+        cambio devuelve False no se guarda nada. Devuelve (carrito, si
+        cambió), con carrito None si no existe y no se pidió crearlo.
+        """
+        bloqueo = self._bloquear(carrito_id)
+        try:
+            carrito = self._leer(carrito_id)
+            if carrito is None:
+                if not crear:
+                    return None, False
+                ahora = timezone.now()
+                carrito = {'items': {}, 'version': 0, 'persistida': 0, 'fecha_creacion': ahora, 'fecha_actualizacion': ahora}
+            if cambio(carrito['items']) is False:
+                return carrito, False
+            if carrito['version'] == carrito['persistida'] or carrito.get('diario', 0) <= self.cache.get(CLAVE_VOLCADO, 0):
+                carrito['diario'] = anotar_en_diario(self.cache, carrito_id)
+            carrito['version'] += 1
+            carrito['fecha_actualizacion'] = timezone.now()
+            self.cache.set(self._clave(carrito_id), carrito)
+            return carrito, True
+        finally:
+            self.cache.delete(bloqueo)
+
+    @staticmethod
+    def _filas_items(carrito, columnas_items, productos):
+        filas = []
+        for producto_id, cantidad in carrito['items'].items():
+            producto = productos.get(producto_id)
+            if producto is None:
+                continue  # Se borró el producto
+            fila = {
+                'id': producto_id, 'producto': producto_id, 'cantidad': cantidad,
+                'subtotal_calculado': producto['precio'] * cantidad,
+            }
+            for columna in columnas_items:
+                if columna.startswith('producto__'):
+                    fila[columna] = producto[columna[len('producto__'):]]
+            filas.append(fila)
+        return filas
+
+    @staticmethod
+    def _productos(ids, columnas_items):
+        campos = ['id', 'precio'] + [columna[len('producto__'):] for columna in columnas_items if columna.startswith('producto__')]
+        productos = Producto.objects.filter(pk__in=list(ids)).values(*dict.fromkeys(campos))
+        return {producto['id']: producto for producto in productos}
+
+    def _datos(self, carrito_id, carrito, productos=None):
+        columnas, columnas_items = columnas_carrito()
+        if productos is None:
+            productos = self._productos(carrito['items'], columnas_items)
+        filas_items = self._filas_items(carrito, columnas_items, productos)
+        fila = {
+            'id': uuid.UUID(str(carrito_id)), 'usuario': None,
+            'fecha_creacion': carrito['fecha_creacion'], 'fecha_actualizacion': carrito['fecha_actualizacion'],
+        }
+        fila = {columna: fila[columna] for columna in columnas}
+        fila['total_calculado'] = sum((item['subtotal_calculado'] for item in filas_items), Decimal(0))
+        return armar_carrito(fila, filas_items)
+
+    def obtener(self, carrito_id):
+        if carrito_id is None:
+            return None
+        carrito = self._leer(carrito_id)
+        return None if carrito is None else self._datos(carrito_id, carrito)
+
+    def _datos_item(self, carrito_id, carrito, producto_id, productos):
+        _, columnas_items = columnas_carrito()
+        filas_items = self._filas_items(carrito, columnas_items, productos)
+        fila = next(fila for fila in filas_items if fila['producto'] == producto_id)
+        return armar_item_con_totales(fila, carrito_id, filas_items)
+
+    def agregar(self, carrito_id, producto_id, cantidad):
+        carrito_id = carrito_id or uuid.uuid4()
+        _, columnas_items = columnas_carrito()
+        productos = {}
+
+        def sumar(items):
+            # Los productos del carrito validan el nuevo y dan los precios para los totales
+            productos.update(self._productos({producto_id, *items}, columnas_items))
+            if producto_id not in productos:
+                raise ProductoNoEncontrado(producto_id)
+            items[producto_id] = items.get(producto_id, 0) + cantidad
+
+        carrito, _ = self._modificar(carrito_id, sumar, crear=True)
+        return self._datos_item(carrito_id, carrito, producto_id, productos), carrito_id
+
+    def quitar(self, carrito_id, item_id):
+        def quitar(items):
+            return items.pop(item_id, None) is not None
+
+        return self._modificar(carrito_id, quitar)[1]
+
+    def cambiar_cantidad(self, carrito_id, item_id, cantidad):
+        _, columnas_items = columnas_carrito()
+        productos = {}
+
+        def fijar(items):
+            if item_id not in items:
+                return False
+            productos.update(self._productos(items, columnas_items))
+            items[item_id] = cantidad
+
+        carrito, cambiado = self._modificar(carrito_id, fijar)
+        if not cambiado or item_id not in productos:
+            return None
+        return self._datos_item(carrito_id, carrito, item_id, productos)
+
+    def aplicar_lote(self, carrito_id, operaciones):
+        carrito_id = carrito_id or uuid.uuid4()
+        _, columnas_items = columnas_carrito()
+        productos = {}
+
+        def aplicar(items):
+            despues = aplicar_operaciones(dict(items), {producto_id: producto_id for producto_id in items}, operaciones)
+            productos.update(self._productos(despues, columnas_items))
+            nuevos = set(despues) - set(items)
+            if nuevos - set(productos):
+                raise ProductoNoEncontrado(min(nuevos - set(productos)))
+            if despues == items:
+                return False
+            items.clear()
+            items.update(despues)
+
+        carrito, _ = self._modificar(carrito_id, aplicar, crear=True)
+        return self._datos(carrito_id, carrito, productos), carrito_id
+
+    def persistir(self, carrito_id):
+        """
+        Escribe el carrito en la base si está sucio y dice si lo escribió.
+        Queda marcado como persistido al confirmarse la transacción: si el
+        llamador (checkout, fusionar) la revierte, sigue sucio. Lanza CarritoAjeno.
+        """
+        bloqueo = self._bloquear(carrito_id)
+        try:
+            carrito = self.cache.get(self._clave(carrito_id))
+            if carrito is None or carrito['version'] == carrito['persistida']:
+                return False
+            guardar_carrito(carrito_id, carrito['items'])
+            version = carrito['version']
+        finally:
+            self.cache.delete(bloqueo)
+        transaction.on_commit(lambda: self._marcar_persistida(carrito_id, version))
+        return True
+
+    def _marcar_persistida(self, carrito_id, version):
+        bloqueo = self._bloquear(carrito_id)
+        try:
+            carrito = self.cache.get(self._clave(carrito_id))
+            # Otro persistir pudo confirmar una versión más nueva antes
+            if carrito is not None and carrito['persistida'] < version:
+                carrito['persistida'] = version
+                self.cache.set(self._clave(carrito_id), carrito)
+        finally:
+            self.cache.delete(bloqueo)
+
+    def vaciar(self, carrito_id):
+        # La base ya quedó vacía: la próxima lectura la trae de ahí. Si el pago
+        # se revierte, el carrito de la caché sigue siendo el bueno
+        transaction.on_commit(lambda: self.cache.delete(self._clave(carrito_id)))
+
+    def descartar(self, carrito_id):
+        transaction.on_commit(lambda: self.cache.delete(self._clave(carrito_id)))
+
+
+def almacen_invitados():
+    """Instancia del almacén de settings.ALMACEN_CARRITO_INVITADO (ruta de importación)."""
+    return import_string(getattr(settings, 'ALMACEN_CARRITO_INVITADO', 'carrito.almacenamiento.AlmacenBaseDatos'))()
+
+
+def almacen_para(usuario):
+    """La base para usuarios autenticados; el almacén configurado para invitados."""
+    if usuario is not None and usuario.is_authenticated:
+        return AlmacenBaseDatos(usuario)
+    return almacen_invitados()
+
+
+CLAVE_DIARIO = 'carritos:diario'
+CLAVE_VOLCADO = 'carritos:diario:volcado'
+CLAVE_HUECO = 'carritos:diario:hueco'
+
+
+def anotar_en_diario(cache, carrito_id):
+    """Agrega el carrito al diario y devuelve el número de su entrada."""
+    try:
+        numero = cache.incr(CLAVE_DIARIO)
+    except ValueError:
+        # Primer uso, o la caché expulsó el contador
+        cache.add(CLAVE_DIARIO, 0, None)
+        numero = cache.incr(CLAVE_DIARIO)
+    cache.set(f'{CLAVE_DIARIO}:{numero}', str(carrito_id))
+    return numero
+
+
+def _hueco_vencido(cache, numero):
+    """
+    Si la entrada `numero` falta hace más de ESPERA_HUECO. Entre el incr y el
+    set de anotar_en_diario la entrada todavía no existe, así que un hueco
+    recién visto se espera; si sigue ahí, la caché la expulsó.
+    """
+    visto = cache.get(CLAVE_HUECO)
+    if visto is None or visto[0] != numero:
+        cache.set(CLAVE_HUECO, (numero, time.time()), None)
+        return False
+    return time.time() - visto[1] > ESPERA_HUECO
+
+
+def volcar_pendientes(almacen=None):
+    """
+    Persiste los carritos anotados en el diario desde el último volcado y
+    devuelve cuántos escribió. Un solo volcado a la vez (otro devuelve 0).
+    El cursor se detiene en la primera entrada que falta, y la siguiente
+    corrida sigue desde ahí.
+    """
+    almacen = almacen or almacen_invitados()
+    if not isinstance(almacen, AlmacenCache):
+        return 0
+    cache = almacen.cache
+    if not cache.add('carritos:diario:volcando', 1, 300):
+        return 0
+    try:
+        desde = cache.get(CLAVE_VOLCADO, 0)
+        hasta = cache.get(CLAVE_DIARIO, 0)
+        if hasta < desde:
+            desde = 0  # El contador se reinició
+        escritos, vistos, volcado = 0, set(), desde
+        for numero in range(desde + 1, hasta + 1):
+            carrito_id = cache.get(f'{CLAVE_DIARIO}:{numero}')
+            if carrito_id is None and not _hueco_vencido(cache, numero):
+                break
+            if carrito_id is not None and carrito_id not in vistos:
+                vistos.add(carrito_id)
+                try:
+                    escritos += almacen.persistir(carrito_id)
+                except CarritoAjeno:
+                    # El id pasó a ser el carrito de un usuario: el de la caché sobra
+                    almacen.descartar(carrito_id)
+            cache.delete(f'{CLAVE_DIARIO}:{numero}')
+            volcado = numero
+        cache.set(CLAVE_VOLCADO, volcado, None)
+        return escritos
+    finally:
+        cache.delete('carritos:diario:volcando')
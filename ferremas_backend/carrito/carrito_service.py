@@ -0,0 +1,296 @@
+"""
+Lecturas y escrituras del carrito con un número fijo de sentencias.
+
+cargar_carrito trae un carrito con sus items y productos en dos consultas,
+con los subtotales y el total calculados en SQL. Agregar un producto son dos upserts (el carrito y la línea) y una lectura con
+la línea y los totales del carrito. El incremento lo hace la base
+(`cantidad = cantidad + n` en el ON CONFLICT), así dos clics simultáneos no
+pierden unidades, y ninguna sentencia necesita una transacción alrededor.
+La sintaxis (ON CONFLICT ... RETURNING) es la misma en PostgreSQL y SQLite.
+
+Un lote de operaciones (leer_operaciones, aplicar_operaciones) se reduce en
+Python a su efecto neto sobre las líneas y se escribe con escribir_lineas: un
+DELETE y un upsert, tenga las operaciones que tenga.
+"""
+import uuid
+
+from django.db import connection, transaction
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, OuterRef, Prefetch, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from productos.models import Producto
+
+from .models import Carrito, ItemCarrito
+
+
+class ProductoNoEncontrado(Exception):
+    """El producto que se quiere agregar no existe."""
+
+
+class CarritoAjeno(Exception):
+    """El id de carrito de invitado corresponde al carrito de un usuario."""
+
+
+class OperacionInvalida(Exception):
+    """Una operación de un lote no es válida o no aplica al carrito; `indice` es su posición."""
+
+    def __init__(self, indice, mensaje):
+        super().__init__(mensaje)
+        self.indice = indice
+
+
+OPERACIONES_LOTE = ('add', 'remove', 'set')
+MAX_OPERACIONES_LOTE = 200
+
+
+def _tabla(modelo):
+    return connection.ops.quote_name(modelo._meta.db_table)
+
+
+def _columna(modelo, campo):
+    return connection.ops.quote_name(modelo._meta.get_field(campo).column)
+
+
+def _valor(modelo, campo, valor):
+    return modelo._meta.get_field(campo).get_db_prep_value(valor, connection)
+
+
+def id_de_carrito(texto):
+    """UUID de un guest_cart_id recibido del cliente. Lanza ValueError si no es válido."""
+    return texto if isinstance(texto, uuid.UUID) else uuid.UUID(str(texto))
+
+
+def carrito_para_escribir(usuario, guest_cart_id=None):
+    """
+    Id del carrito donde escribir: el del usuario o el de invitado indicado,
+    creándolo si no existe (uno nuevo si el invitado no trae id). Marca su
+    fecha_actualizacion. Es una sola sentencia. Lanza CarritoAjeno.
+    """
+    ahora = timezone.now()
+    tabla, pk, dueno, creado, actualizado = (
+        _tabla(Carrito), _columna(Carrito, 'id'), _columna(Carrito, 'usuario'),
+        _columna(Carrito, 'fecha_creacion'), _columna(Carrito, 'fecha_actualizacion'),
+    )
+    if usuario is not None and usuario.is_authenticated:
+        conflicto, condicion = dueno, ''
+        carrito_id, usuario_id = uuid.uuid4(), usuario.pk
+    else:
+        # Un id de invitado que ya es el carrito de un usuario no se toca
+        conflicto, condicion = pk, f' WHERE {tabla}.{dueno} IS NULL'
+        carrito_id, usuario_id = id_de_carrito(guest_cart_id) if guest_cart_id else uuid.uuid4(), None
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {tabla} ({pk}, {dueno}, {creado}, {actualizado}) VALUES (%s, %s, %s, %s) '
+            f'ON CONFLICT ({conflicto}) DO UPDATE SET {actualizado} = excluded.{actualizado}{condicion} '
+            f'RETURNING {pk}',
+            [
+                _valor(Carrito, 'id', carrito_id), usuario_id,
+                _valor(Carrito, 'fecha_creacion', ahora), _valor(Carrito, 'fecha_actualizacion', ahora),
+            ],
+        )
+        fila = cursor.fetchone()
+    if fila is None:
+        raise CarritoAjeno(carrito_id)
+    return Carrito._meta.pk.to_python(fila[0])
+
+
+def sumar_item(carrito_id, producto_id, cantidad):
+    """
+    Suma `cantidad` unidades del producto al carrito, creando la línea si no
+    existe, en una sola sentencia. El producto se valida en la misma
+    sentencia (INSERT ... SELECT desde su tabla): las FK de Django son
+    diferidas y no fallarían hasta el commit. Devuelve el id de la línea.
+    Lanza ProductoNoEncontrado.
+    """
+    tabla = _tabla(ItemCarrito)
+    carrito, producto, columna_cantidad, anadido = (
+        _columna(ItemCarrito, 'carrito'), _columna(ItemCarrito, 'producto'),
+        _columna(ItemCarrito, 'cantidad'), _columna(ItemCarrito, 'fecha_añadido'),
+    )
+    id_producto = _columna(Producto, 'id')
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {tabla} ({carrito}, {producto}, {columna_cantidad}, {anadido}) '
+            f'SELECT %s, {id_producto}, %s, %s FROM {_tabla(Producto)} WHERE {id_producto} = %s '
+            f'ON CONFLICT ({carrito}, {producto}) DO UPDATE SET '
+            f'{columna_cantidad} = {tabla}.{columna_cantidad} + excluded.{columna_cantidad} '
+            f'RETURNING {_columna(ItemCarrito, "id")}',
+            [
+                _valor(ItemCarrito, 'carrito', carrito_id), cantidad,
+                _valor(ItemCarrito, 'fecha_añadido', timezone.now()), producto_id,
+            ],
+        )
+        fila = cursor.fetchone()
+    if fila is None:
+        raise ProductoNoEncontrado(producto_id)
+    return fila[0]
+
+
+def guardar_carrito(carrito_id, cantidades):
+    """
+    Deja en la base el carrito de invitado con exactamente las líneas de
+    `cantidades` ({producto_id: cantidad}), creándolo si no existe. Las
+    líneas de productos que ya no existen se descartan. Lanza CarritoAjeno.
+    """
+    existentes = set(Producto.objects.filter(pk__in=list(cantidades)).values_list('id', flat=True)) if cantidades else set()
+    with transaction.atomic():
+        carrito_id = carrito_para_escribir(None, carrito_id)
+        ItemCarrito.objects.filter(carrito_id=carrito_id).exclude(producto_id__in=existentes).delete()
+        ItemCarrito.objects.bulk_create(
+            [
+                ItemCarrito(carrito_id=carrito_id, producto_id=producto_id, cantidad=cantidad)
+                for producto_id, cantidad in cantidades.items() if producto_id in existentes
+            ],
+            update_conflicts=True, unique_fields=['carrito', 'producto'], update_fields=['cantidad'],
+        )
+    return carrito_id
+
+
+def leer_operaciones(operaciones):
+    """
+    Valida las operaciones de un lote ({'op': 'add' | 'remove' | 'set',
+    'producto_id' o 'item_id', 'cantidad'}) y las devuelve como tuplas
+    (op, item_id, producto_id, cantidad). add lleva producto_id; remove y
+    set, item_id o producto_id. Lanza OperacionInvalida.
+    """
+    if not isinstance(operaciones, list) or not operaciones:
+        raise OperacionInvalida(None, 'ops debe ser una lista de operaciones')
+    if len(operaciones) > MAX_OPERACIONES_LOTE:
+        raise OperacionInvalida(None, f'Un lote admite hasta {MAX_OPERACIONES_LOTE} operaciones')
+    leidas = []
+    for indice, operacion in enumerate(operaciones):
+        if not isinstance(operacion, dict) or operacion.get('op') not in OPERACIONES_LOTE:
+            raise OperacionInvalida(indice, f"op debe ser una de {', '.join(OPERACIONES_LOTE)}")
+        op = operacion['op']
+        try:
+            item_id = int(operacion['item_id']) if op != 'add' and operacion.get('item_id') is not None else None
+            producto_id = int(operacion['producto_id']) if operacion.get('producto_id') is not None else None
+            cantidad = int(operacion.get('cantidad', 1)) if op != 'remove' else None
+        except (TypeError, ValueError):
+            raise OperacionInvalida(indice, 'item_id, producto_id y cantidad deben ser números enteros')
+        if op == 'add' and producto_id is None:
+            raise OperacionInvalida(indice, 'add necesita producto_id')
+        if op != 'add' and item_id is None and producto_id is None:
+            raise OperacionInvalida(indice, f'{op} necesita item_id o producto_id')
+        if cantidad is not None and cantidad < 1:
+            raise OperacionInvalida(indice, 'La cantidad debe ser mayor a cero')
+        leidas.append((op, item_id, producto_id, cantidad))
+    return leidas
+
+
+def aplicar_operaciones(cantidades, lineas, operaciones):
+    """
+    Aplica en orden las operaciones de leer_operaciones sobre `cantidades`
+    ({producto_id: cantidad}, se modifica) y la devuelve. `lineas` da el
+    producto de cada item_id. Lanza OperacionInvalida si una operación
+    apunta a una línea que no está en el carrito.
+    """
+    for indice, (op, item_id, producto_id, cantidad) in enumerate(operaciones):
+        if op == 'add':
+            cantidades[producto_id] = cantidades.get(producto_id, 0) + cantidad
+            continue
+        if item_id is not None:
+            producto_id = lineas.get(item_id)
+        if producto_id not in cantidades:
+            raise OperacionInvalida(indice, 'El item no está en el carrito')
+        if op == 'remove':
+            del cantidades[producto_id]
+        else:
+            cantidades[producto_id] = cantidad
+    return cantidades
+
+
+def escribir_lineas(carrito_id, antes, despues):
+    """
+    Lleva las líneas del carrito de `antes` a `despues` ({producto_id:
+    cantidad}) con a lo más un DELETE y un upsert, sin importar cuántas
+    líneas cambien.
+    """
+    borrar = [producto_id for producto_id in antes if producto_id not in despues]
+    if borrar:
+        ItemCarrito.objects.filter(carrito_id=carrito_id, producto_id__in=borrar).delete()
+    cambios = [
+        ItemCarrito(carrito_id=carrito_id, producto_id=producto_id, cantidad=cantidad)
+        for producto_id, cantidad in despues.items() if antes.get(producto_id) != cantidad
+    ]
+    if cambios:
+        ItemCarrito.objects.bulk_create(
+            cambios, update_conflicts=True, unique_fields=['carrito', 'producto'], update_fields=['cantidad'],
+        )
+
+
+def validar_productos(producto_ids):
+    """Lanza ProductoNoEncontrado con el primero de los productos que no existe. Una consulta."""
+    producto_ids = set(producto_ids)
+    if not producto_ids:
+        return
+    faltan = producto_ids - set(Producto.objects.filter(pk__in=producto_ids).values_list('id', flat=True))
+    if faltan:
+        raise ProductoNoEncontrado(min(faltan))
+
+
+def fusionar_carritos(guest_cart_id, usuario):
+    """
+    Suma las líneas del carrito de invitado al carrito del usuario (creándolo
+    si no tiene) y borra el de invitado. Un id que no es de un carrito de
+    invitado no aporta nada. Devuelve el id del carrito del usuario.
+    """
+    tabla, carritos = _tabla(ItemCarrito), _tabla(Carrito)
+    carrito, producto, columna_cantidad, anadido = (
+        _columna(ItemCarrito, 'carrito'), _columna(ItemCarrito, 'producto'),
+        _columna(ItemCarrito, 'cantidad'), _columna(ItemCarrito, 'fecha_añadido'),
+    )
+    pk, dueno = _columna(Carrito, 'id'), _columna(Carrito, 'usuario')
+    origen = id_de_carrito(guest_cart_id)
+    with transaction.atomic():
+        destino = carrito_para_escribir(usuario)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {tabla} ({carrito}, {producto}, {columna_cantidad}, {anadido}) '
+                f'SELECT %s, i.{producto}, i.{columna_cantidad}, %s FROM {tabla} i '
+                f'JOIN {carritos} c ON c.{pk} = i.{carrito} WHERE c.{pk} = %s AND c.{dueno} IS NULL '
+                f'ON CONFLICT ({carrito}, {producto}) DO UPDATE SET '
+                f'{columna_cantidad} = {tabla}.{columna_cantidad} + excluded.{columna_cantidad}',
+                [_valor(ItemCarrito, 'carrito', destino), _valor(ItemCarrito, 'fecha_añadido', timezone.now()), _valor(Carrito, 'id', origen)],
+            )
+        Carrito.objects.filter(id=origen, usuario__isnull=True).delete()
+    return destino
+
+
+def _dinero():
+    return DecimalField(max_digits=20, decimal_places=2)
+
+
+def subtotal_en_sql():
+    """Subtotal de un ItemCarrito (cantidad por precio del producto), como expresión."""
+    return ExpressionWrapper(F('cantidad') * F('producto__precio'), output_field=_dinero())
+
+
+def total_en_sql(carrito='pk'):
+    """Total del carrito de la fila externa (su columna `carrito`) como subconsulta; 0 si no tiene items."""
+    del_carrito = ItemCarrito.objects.filter(carrito_id=OuterRef(carrito)).order_by().values('carrito_id')
+    return Coalesce(
+        Subquery(del_carrito.annotate(total=Sum(subtotal_en_sql())).values('total')), 0, output_field=_dinero(),
+    )
+
+
+def cargar_carrito(carritos):
+    """
+    El primer carrito del queryset con sus items y el producto de cada uno,
+    en dos consultas, o None. El subtotal de cada item y el total vienen
+    calculados en SQL (subtotal_calculado y total_calculado), y
+    ItemCarrito.subtotal y Carrito.total los devuelven sin recorrer nada.
+    """
+    items = ItemCarrito.objects.select_related('producto').annotate(subtotal_calculado=subtotal_en_sql()).order_by('id')
+    return carritos.annotate(total_calculado=total_en_sql()).prefetch_related(Prefetch('items', queryset=items)).first()
+
+
+def totales_carrito():
+    """Anotaciones con el total, las líneas y las unidades del carrito de cada ItemCarrito."""
+    del_carrito = ItemCarrito.objects.filter(carrito_id=OuterRef('carrito_id')).order_by().values('carrito_id')
+    return {
+        'carrito_total': total_en_sql('carrito_id'),
+        'carrito_items': Subquery(del_carrito.annotate(items=Count('id')).values('items')),
+        'carrito_unidades': Subquery(del_carrito.annotate(unidades=Sum('cantidad')).values('unidades')),
+    }
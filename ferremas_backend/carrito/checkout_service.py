@@ -0,0 +1,40 @@
+import logging
+
+from productos.movimientos_service import registrar
+from productos.stock_service import descontar_pedido, movimiento_de_venta
+
+from .models import ItemOrden
+
+logger = logging.getLogger(__name__)
+
+
+def crear_items_orden(orden, items_carrito):
+    """
+    Reparte los items del carrito entre tiendas, descuenta el stock y crea los
+    ItemOrden de la orden: uno por cada tienda que despacha un producto, más
+    uno sin tienda por lo que ninguna pudo cubrir. Las ventas quedan en el
+    libro de movimientos. Se llama dentro de la transacción del checkout.
+    """
+    items_carrito = list(items_carrito)
+    asignacion = descontar_pedido({item.producto_id: item.cantidad for item in items_carrito})
+
+    items_orden = []
+    for item in items_carrito:
+        producto = item.producto
+        for tienda_id, cantidad in asignacion.partes.get(item.producto_id, []):
+            items_orden.append(ItemOrden(
+                orden=orden, producto=producto, tienda_id=tienda_id, cantidad=cantidad, precio_unitario=producto.precio
+            ))
+            logger.info(f"{producto.nombre}: {cantidad} unidades desde la tienda {tienda_id}")
+        faltante = asignacion.faltantes.get(item.producto_id)
+        if faltante:
+            items_orden.append(ItemOrden(
+                orden=orden, producto=producto, tienda=None, cantidad=faltante, precio_unitario=producto.precio
+            ))
+            logger.error(f"Stock insuficiente para {producto.nombre} al procesar orden {orden.id}: faltan {faltante} unidades")
+
+    ItemOrden.objects.bulk_create(items_orden)
+    # Las ventas quedan en el libro de movimientos en un solo INSERT
+    registrar([movimiento_de_venta(item) for item in items_orden if item.tienda_id is not None])
+    logger.info(f"Orden {orden.id} despachada desde {len(asignacion.tiendas)} tienda(s)")
+    return items_orden
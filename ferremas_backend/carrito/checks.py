@@ -0,0 +1,24 @@
+from django.conf import settings
+from django.core.checks import Error, Tags, register
+from django.utils.module_loading import import_string
+
+from productos.checks import cache_local_al_proceso
+
+
+@register(Tags.caches)
+def cache_carritos_compartida(app_configs, **kwargs):
+    """
+    Con AlmacenCache la caché `carritos` es la fuente de verdad de los
+    carritos de invitado: sin DEBUG debe ser compartida entre los workers.
+    """
+    from .almacenamiento import AlmacenCache
+
+    almacen = import_string(getattr(settings, 'ALMACEN_CARRITO_INVITADO', 'carrito.almacenamiento.AlmacenBaseDatos'))
+    if settings.DEBUG or not issubclass(almacen, AlmacenCache) or not cache_local_al_proceso('carritos'):
+        return []
+    return [Error(
+        "ALMACEN_CARRITO_INVITADO usa la caché 'carritos', que es local al proceso (LocMemCache) con DEBUG=False.",
+        hint='Configure CARRITOS_CACHE_BACKEND y CARRITOS_CACHE_LOCATION con una caché compartida, '
+             'o use carrito.almacenamiento.AlmacenBaseDatos.',
+        id='carrito.E001',
+    )]
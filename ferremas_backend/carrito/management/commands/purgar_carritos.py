@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from carrito.purga_service import LOTE_PURGA, PAUSA_PURGA, inactivos_desde, purgar_carritos_invitado
+
+
+class Command(BaseCommand):
+    help = 'Borra los carritos de invitado sin cambios hace más de N días, en lotes cortos (ver CARRITO_INVITADO_DIAS_INACTIVO)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dias', type=int, help='Días de inactividad (por defecto, CARRITO_INVITADO_DIAS_INACTIVO)')
+        parser.add_argument('--lote', type=int, default=LOTE_PURGA, help='Carritos por transacción')
+        parser.add_argument('--pausa', type=float, default=PAUSA_PURGA, help='Segundos de espera entre lotes')
+        parser.add_argument('--max-lotes', type=int, help='Detenerse tras N lotes (el resto queda para la próxima corrida)')
+
+    def handle(self, *args, **options):
+        if options['dias'] is not None and options['dias'] < 0:
+            raise CommandError('--dias no puede ser negativo')
+        if options['lote'] < 1:
+            raise CommandError('--lote debe ser mayor a cero')
+        resultado = purgar_carritos_invitado(
+            inactivos_desde(options['dias']), lote=options['lote'], pausa=options['pausa'], max_lotes=options['max_lotes'],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Carritos borrados: {resultado['carritos']}, items: {resultado['items']} "
+            f"({resultado['lotes']} lotes en {resultado['segundos']:.2f} s)"
+        ))
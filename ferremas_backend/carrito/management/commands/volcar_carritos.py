@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from carrito.almacenamiento import AlmacenCache, almacen_invitados, volcar_pendientes
+
+
+class Command(BaseCommand):
+    help = 'Escribe en la base los carritos de invitado modificados en la caché desde el último volcado (ver ALMACEN_CARRITO_INVITADO)'
+
+    def handle(self, *args, **options):
+        almacen = almacen_invitados()
+        if not isinstance(almacen, AlmacenCache):
+            raise CommandError('ALMACEN_CARRITO_INVITADO no guarda los carritos en la caché: no hay nada que volcar')
+        escritos = volcar_pendientes(almacen)
+        self.stdout.write(self.style.SUCCESS(f"Carritos escritos: {escritos}"))
@@ -0,0 +1,134 @@
+"""
+Serialización rápida del carrito y del historial de órdenes a partir de filas
+de values(). La salida es la misma que la de CarritoSerializer y la del
+armado manual de `user_orders` (ver config.serializacion_rapida).
+"""
+from functools import lru_cache
+
+from django.conf import settings
+from django.utils import timezone
+
+from config.serializacion_rapida import campos_de_serializer, compilar_mapper, valor_json
+
+from .carrito_service import subtotal_en_sql, total_en_sql, totales_carrito
+from .models import Carrito, ItemCarrito, ItemOrden, Orden
+from .serializers import CarritoSerializer, ItemCarritoSerializer
+
+
+@lru_cache(maxsize=None)
+def _mappers_carrito(zona):
+    items, columnas_items = campos_de_serializer(ItemCarritoSerializer, calculados={
+        'subtotal': lambda fila: valor_json(fila['subtotal_calculado']),
+    })
+    carrito, columnas_carrito = campos_de_serializer(CarritoSerializer, zona=zona, calculados={
+        'items': lambda fila: fila['items'],
+        'total': lambda fila: valor_json(fila['total_calculado']),
+    })
+    return (compilar_mapper(carrito), columnas_carrito), (compilar_mapper(items), columnas_items)
+
+
+def _zona():
+    return timezone.get_current_timezone() if settings.USE_TZ else None
+
+
+def columnas_carrito():
+    """
+    Columnas de values() que necesita armar_carrito: (las del carrito, las de
+    cada item), además de total_calculado y subtotal_calculado.
+    """
+    (_, columnas), (_, columnas_items) = _mappers_carrito(_zona())
+    return columnas, list(dict.fromkeys(columnas_items))
+
+
+def armar_carrito(fila, filas_items):
+    """Salida de CarritoSerializer para una fila de carrito y las de sus items (ver columnas_carrito)."""
+    (mapper, _), (mapper_items, _) = _mappers_carrito(_zona())
+    fila['filas_items'] = filas_items
+    fila['items'] = [mapper_items(item) for item in filas_items]
+    return mapper(fila)
+
+
+def datos_carrito(carritos):
+    """Salida de CarritoSerializer para el primer carrito del queryset, o None si no hay."""
+    columnas, columnas_items = columnas_carrito()
+    fila = carritos.values(*columnas, total_calculado=total_en_sql()).first()
+    if fila is None:
+        return None
+    items = ItemCarrito.objects.filter(carrito_id=fila['id']).order_by('id')
+    return armar_carrito(fila, list(items.values(*columnas_items, subtotal_calculado=subtotal_en_sql())))
+
+
+def datos_item_con_totales(item_id):
+    """
+    Salida de ItemCarritoSerializer para la línea más `carrito` con el id, el
+    total, las líneas y las unidades de su carrito, en una consulta.
+    """
+    _, (mapper_items, columnas_items) = _mappers_carrito(None)
+    fila = ItemCarrito.objects.filter(pk=item_id).values(
+        *dict.fromkeys(columnas_items + ['carrito']), subtotal_calculado=subtotal_en_sql(), **totales_carrito()
+    ).first()
+    if fila is None:
+        return None
+    datos = mapper_items(fila)
+    datos['carrito'] = {
+        'id': str(fila['carrito']),
+        'total': valor_json(fila['carrito_total']),
+        'items': fila['carrito_items'],
+        'unidades': fila['carrito_unidades'],
+    }
+    return datos
+
+
+def armar_item_con_totales(fila, carrito_id, filas_items):
+    """Lo mismo que datos_item_con_totales, para una fila de item y las de todo su carrito (ver columnas_carrito)."""
+    _, (mapper_items, _) = _mappers_carrito(None)
+    datos = mapper_items(fila)
+    datos['carrito'] = {
+        'id': str(carrito_id),
+        'total': valor_json(sum(item['subtotal_calculado'] for item in filas_items)),
+        'items': len(filas_items),
+        'unidades': sum(item['cantidad'] for item in filas_items),
+    }
+    return datos
+
+
+def datos_ordenes_usuario(usuario):
+    """Historial de órdenes de `user_orders` con dos consultas en total."""
+    ordenes = list(Orden.objects.filter(usuario=usuario).order_by('-fecha_creacion').values(
+        'id', 'payment_id', 'estado', 'total', 'fecha_creacion', 'nombre', 'email', 'telefono',
+        'direccion', 'ciudad', 'codigo_postal',
+    ))
+    items_por_orden = {orden['id']: [] for orden in ordenes}
+    items = ItemOrden.objects.filter(orden_id__in=list(items_por_orden)).order_by('id').values(
+        'id', 'orden', 'producto__nombre', 'cantidad', 'precio_unitario', 'producto__imagen_url',
+    )
+    for item in items:
+        items_por_orden[item['orden']].append({
+            'id': item['id'],
+            'nombre': item['producto__nombre'],
+            'cantidad': item['cantidad'],
+            'precio': float(item['precio_unitario']),
+            'imagen': item['producto__imagen_url'] or 'https://via.placeholder.com/50'
+        })
+    return [
+        {
+            'orderId': str(orden['id']),
+            'paymentId': orden['payment_id'],
+            'status': orden['estado'],
+            'total': float(orden['total']),
+            'fechaCreacion': orden['fecha_creacion'].strftime('%d/%m/%Y'),
+            'fechaEstimadaEntrega': (orden['fecha_creacion'].replace(day=orden['fecha_creacion'].day + 7)).strftime('%d/%m/%Y'),
+            'items': items_por_orden[orden['id']],
+            'customerInfo': {
+                'nombre': orden['nombre'],
+                'email': orden['email'],
+                'telefono': orden['telefono']
+            },
+            'shippingInfo': {
+                'direccion': orden['direccion'],
+                'ciudad': orden['ciudad'],
+                'codigoPostal': orden['codigo_postal']
+            }
+        }
+        for orden in ordenes
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.1 on 2026-10-18 10:53
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('carrito', '0002_orden_itemorden'),
+        ('productos', '0005_libro_movimientos'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='itemorden',
+            name='tienda',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='items_orden', to='productos.tienda'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.1 on 2026-10-18 11:39
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('carrito', '0003_itemorden_tienda'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='carrito',
+            index=models.Index(condition=models.Q(('usuario__isnull', True)), fields=['fecha_actualizacion'], name='carrito_invitado_fecha_idx'),
+        ),
+    ]
@@ -1,5 +1,5 @@
 from django.db import models
-from productos.models import Producto
+from productos.models import Producto, Tienda
 from django.conf import settings
 import uuid # Importar uuid para usar en UUIDField
 
@@ -16,11 +16,24 @@ class Carrito(models.Model):
     fecha_creacion = models.DateTimeField(auto_now_add=True)
     fecha_actualizacion = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # Solo los carritos de invitado, en orden de inactividad: la purga
+            # de abandonados (purga_service.py) los recorre por aquí
+            models.Index(
+                fields=['fecha_actualizacion'], name='carrito_invitado_fecha_idx',
+                condition=models.Q(usuario__isnull=True),
+            ),
+        ]
+
     def __str__(self):
         return f"Carrito de {self.usuario.username if self.usuario else 'invitado'}"
     
     @property
     def total(self):
+        # cargar_carrito (carrito_service.py) lo trae calculado en SQL
+        if hasattr(self, 'total_calculado'):
+            return self.total_calculado
         return sum(item.subtotal for item in self.items.all())
 
 class ItemCarrito(models.Model):
@@ -44,6 +57,8 @@ class ItemCarrito(models.Model):
     #propiedad para calcular el subtotal del item (cantidad * precio del producto)
     @property
     def subtotal(self):
+        if hasattr(self, 'subtotal_calculado'):
+            return self.subtotal_calculado
         return self.producto.precio * self.cantidad
     
 
@@ -83,6 +98,8 @@ class Orden(models.Model):
 class ItemOrden(models.Model):
     orden = models.ForeignKey(Orden, on_delete=models.CASCADE, related_name='items')
     producto = models.ForeignKey(Producto, on_delete=models.PROTECT)
+    # Tienda que despacha estas unidades; vacía si ninguna tenía stock al pagar
+    tienda = models.ForeignKey(Tienda, on_delete=models.SET_NULL, null=True, blank=True, related_name='items_orden')
     cantidad = models.PositiveIntegerField()
     precio_unitario = models.DecimalField(max_digits=10, decimal_places=2)
     
@@ -0,0 +1,68 @@
+"""
+Purga de carritos de invitado abandonados.
+
+Los carritos sin usuario que no se tocan hace más de
+settings.CARRITO_INVITADO_DIAS_INACTIVO días se borran con sus items, en
+lotes de `lote` carritos, cada uno en su propia transacción corta: así ningún
+bloqueo dura más que un lote y el tráfico sigue entre uno y otro. Los
+carritos se eligen por el índice parcial carrito_invitado_fecha_idx.
+
+Es seguro correrla con tráfico: en PostgreSQL cada lote bloquea sus filas con
+FOR UPDATE SKIP LOCKED (un carrito que se está escribiendo queda para la
+próxima corrida) y el DELETE repite la condición de inactividad. Con
+AlmacenCache, un carrito que sigue vivo en la caché se vuelve a crear en la
+base la próxima vez que se persiste.
+"""
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Carrito, ItemCarrito
+
+LOTE_PURGA = 200
+PAUSA_PURGA = 0.01  # segundos entre lotes: deja pasar a las escrituras que esperaban
+
+
+def inactivos_desde(dias=None):
+    """Fecha antes de la cual un carrito de invitado se considera abandonado."""
+    if dias is None:
+        dias = getattr(settings, 'CARRITO_INVITADO_DIAS_INACTIVO', 30)
+    return timezone.now() - timedelta(days=dias)
+
+
+def purgar_carritos_invitado(antes_de, lote=LOTE_PURGA, pausa=PAUSA_PURGA, max_lotes=None):
+    """
+    Borra los carritos de invitado con fecha_actualizacion anterior a
+    `antes_de`, `lote` por transacción, esperando `pausa` segundos entre
+    lotes. Devuelve cuántos carritos e items borró, en cuántos lotes y
+    cuántos segundos tomó.
+    """
+    inicio = time.monotonic()
+    carritos = items = lotes = 0
+    abandonados = Carrito.objects.filter(usuario__isnull=True, fecha_actualizacion__lt=antes_de)
+    while max_lotes is None or lotes < max_lotes:
+        with transaction.atomic():
+            ids = list(
+                abandonados.select_for_update(skip_locked=True)
+                .order_by('fecha_actualizacion').values_list('id', flat=True)[:lote]
+            )
+            if not ids:
+                break
+            # La condición se repite: si alguno se tocó después de elegirlo, se queda
+            _, por_modelo = abandonados.filter(id__in=ids).delete()
+            carritos += por_modelo.get(Carrito._meta.label, 0)
+            items += por_modelo.get(ItemCarrito._meta.label, 0)
+        lotes += 1
+        if len(ids) < lote:
+            break
+        if pausa:
+            time.sleep(pausa)
+    return {
+        'carritos': carritos,
+        'items': items,
+        'lotes': lotes,
+        'segundos': round(time.monotonic() - inicio, 3),
+    }
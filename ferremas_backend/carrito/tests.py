@@ -1,3 +1,455 @@
-from django.test import TestCase
+from decimal import Decimal
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import transaction
+from django.test import override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APITestCase
+
+from productos.models import Producto
+from usuarios.models import CustomerUser
+from .models import Carrito, ItemCarrito, ItemOrden, Orden
+
+
+class SerializacionRapidaCarritoTest(APITestCase):
+    """El camino rápido de get_cart y user_orders produce los mismos bytes que el original"""
+
+    def setUp(self):
+        self.usuario = CustomerUser.objects.create_user(username='cliente_rapido', email='cliente_rapido@test.com', password='x')
+        self.productos = [
+            Producto.objects.create(sku='CR001', nombre='Martillo', precio=Decimal('29.99'), categoria='Herramientas'),
+            Producto.objects.create(
+                sku='CR002', nombre='Llave ñandú', precio=Decimal('1500.50'), categoria='Herramientas',
+                imagen_url='https://example.com/llave.jpg'
+            ),
+        ]
+        self.carrito = Carrito.objects.create(usuario=self.usuario)
+        self.invitado = Carrito.objects.create()
+        for cantidad, producto in enumerate(self.productos, start=1):
+            ItemCarrito.objects.create(carrito=self.carrito, producto=producto, cantidad=cantidad * 3)
+        for total in [Decimal('89.97'), Decimal('0.00')]:
+            orden = Orden.objects.create(
+                usuario=self.usuario, total=total, nombre='Cliente', email='c@test.com', telefono='1',
+                direccion='Calle 1', ciudad='Santiago', codigo_postal='1', metodo_pago='mercadopago'
+            )
+            for producto in self.productos:
+                ItemOrden.objects.create(orden=orden, producto=producto, cantidad=2, precio_unitario=producto.precio)
+
+    def comparar(self, url, params=None):
+        with self.settings(SERIALIZACION_RAPIDA=False):
+            lenta = self.client.get(url, params)
+        with self.settings(SERIALIZACION_RAPIDA=True):
+            rapida = self.client.get(url, params)
+        self.assertEqual(rapida.status_code, lenta.status_code)
+        self.assertEqual(rapida.content, lenta.content)
+        self.assertEqual(lenta.content, JSONRenderer().render(lenta.data))
+        return rapida
+
+    def test_get_cart(self):
+        """Carrito con items, carrito de invitado vacío y carrito inexistente"""
+        url = reverse('carrito-get-cart')
+        self.comparar(url, {'guest_cart_id': str(self.invitado.id)})
+        self.comparar(url)
+        self.client.force_authenticate(user=self.usuario)
+        respuesta = self.comparar(url)
+        self.assertEqual(len(respuesta.data['items']), 2)
+
+    def test_user_orders(self):
+        """Historial con varias órdenes y sus items"""
+        self.client.force_authenticate(user=self.usuario)
+        self.comparar(reverse('user_orders'))
+
+    def test_consultas_constantes(self):
+        """El historial se arma con dos consultas aunque haya varias órdenes"""
+        self.client.force_authenticate(user=self.usuario)
+        with self.settings(SERIALIZACION_RAPIDA=True), self.assertNumQueries(2):
+            self.client.get(reverse('user_orders'))
+
+
+class AgregarItemTest(APITestCase):
+    """add_item con upserts: incrementa en la base, valida el producto y responde los totales del carrito"""
+
+    def setUp(self):
+        self.usuario = CustomerUser.objects.create_user(username='cliente_upsert', email='upsert@test.com', password='x')
+        self.martillo = Producto.objects.create(sku='UP001', nombre='Martillo', precio=Decimal('1000'), categoria='C')
+        self.clavos = Producto.objects.create(sku='UP002', nombre='Clavos', precio=Decimal('250.50'), categoria='C')
+        self.url = reverse('carrito-add-item')
+
+    def agregar(self, producto, cantidad=1, **extra):
+        return self.client.post(self.url, {'producto_id': producto.id, 'cantidad': cantidad, **extra}, format='json')
+
+    def test_suma_y_responde_totales(self):
+        self.client.force_authenticate(user=self.usuario)
+        with self.assertNumQueries(3):
+            data = self.agregar(self.martillo, 2).data
+        self.agregar(self.clavos, 2)
+        with self.assertNumQueries(3):
+            data = self.agregar(self.martillo, 3).data
+        self.assertEqual((data['producto_nombre'], data['cantidad'], data['subtotal']), ('Martillo', 5, 5000.0))
+        self.assertEqual(data['carrito'], {
+            'id': str(Carrito.objects.get(usuario=self.usuario).id), 'total': 5501.0, 'items': 2, 'unidades': 7,
+        })
+        self.assertEqual(self.client.get(reverse('carrito-get-cart')).data['total'], data['carrito']['total'])
+
+    def test_invitado(self):
+        data = self.agregar(self.martillo).data
+        guest_cart_id = str(data['guest_cart_id'])
+        self.assertTrue(Carrito.objects.filter(id=guest_cart_id, usuario__isnull=True).exists())
+        data = self.agregar(self.martillo, guest_cart_id=guest_cart_id).data
+        self.assertEqual((data['cantidad'], data['carrito']['id']), (2, guest_cart_id))
+        # El id lo puede generar el cliente
+        nuevo = '6f1c2f0e-8a53-4b8a-9c43-3f2d3f1f6a10'
+        self.assertEqual(self.agregar(self.clavos, guest_cart_id=nuevo).data['carrito']['total'], 250.5)
+
+    def test_errores(self):
+        carrito_ajeno = Carrito.objects.create(usuario=self.usuario)
+        producto_inexistente = Producto(id=self.clavos.id + 100)
+        self.assertEqual(self.agregar(producto_inexistente).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.agregar(self.martillo, guest_cart_id=str(carrito_ajeno.id)).status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(self.agregar(self.martillo, guest_cart_id='x').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.agregar(self.martillo, 0).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(ItemCarrito.objects.exists())
+
+
+class CargaCarritoTest(APITestCase):
+    """Leer un carrito cuesta lo mismo con 1 que con 100 líneas, con los totales calculados en SQL"""
+
+    def setUp(self):
+        self.usuario = CustomerUser.objects.create_user(username='cliente_cien', email='cien@test.com', password='x')
+        productos = Producto.objects.bulk_create([
+            Producto(sku=f'CC{i:03d}', nombre=f'Producto {i}', precio=Decimal('10.25') + i, categoria='C') for i in range(100)
+        ])
+        carrito = Carrito.objects.create(usuario=self.usuario)
+        ItemCarrito.objects.bulk_create([
+            ItemCarrito(carrito=carrito, producto=producto, cantidad=i % 3 + 1) for i, producto in enumerate(productos)
+        ])
+        self.total = sum((producto.precio * (i % 3 + 1) for i, producto in enumerate(productos)), Decimal(0))
+        self.client.force_authenticate(user=self.usuario)
+
+    def test_get_cart_con_cien_lineas(self):
+        for rapida in [True, False]:
+            with self.subTest(rapida=rapida), self.settings(SERIALIZACION_RAPIDA=rapida), self.assertNumQueries(2):
+                data = self.client.get(reverse('carrito-get-cart')).data
+            self.assertEqual(len(data['items']), 100)
+            self.assertEqual(data['total'], self.total)
+            self.assertEqual(data['items'][4]['subtotal'], Decimal('14.25') * 2)
+
+    def test_preferencia_de_pago_con_cien_lineas(self):
+        with mock.patch('carrito.views.CarritoViewSet.mercadopago_service') as servicio, self.assertNumQueries(2):
+            servicio.create_preference.return_value = {'id': 'pref'}
+            response = self.client.post(reverse('carrito-create-mercadopago-preference'), {}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        items_mp = servicio.create_preference.call_args[0][0]
+        self.assertEqual(len(items_mp), 100)
+        self.assertEqual(sum(Decimal(str(item['unit_price'])) * item['quantity'] for item in items_mp), self.total)
+
+
+class LoteCarritoTest(APITestCase):
+    """batch aplica operaciones en orden, todas o ninguna, con las mismas consultas para 3 que para 60"""
+
+    def setUp(self):
+        caches['carritos'].clear()
+        self.usuario = CustomerUser.objects.create_user(username='cliente_lote', email='lote@test.com', password='x')
+        self.productos = Producto.objects.bulk_create([
+            Producto(sku=f'LT{i:03d}', nombre=f'Producto {i}', precio=Decimal('100') * (i + 1), categoria='C') for i in range(30)
+        ])
+        self.a, self.b, self.c = self.productos[:3]
+        self.url = reverse('carrito-batch')
+
+    def lote(self, ops, **extra):
+        return self.client.post(self.url, {'ops': ops, **extra}, format='json')
+
+    def cantidades(self, data):
+        return {item['producto']: item['cantidad'] for item in data['items']}
+
+    def test_aplica_en_orden(self):
+        carrito = Carrito.objects.create(usuario=self.usuario)
+        linea_a = ItemCarrito.objects.create(carrito=carrito, producto=self.a, cantidad=2)
+        linea_b = ItemCarrito.objects.create(carrito=carrito, producto=self.b, cantidad=1)
+        self.client.force_authenticate(user=self.usuario)
+        data = self.lote([
+            {'op': 'set', 'item_id': linea_a.id, 'cantidad': 5},
+            {'op': 'remove', 'item_id': linea_b.id},
+            {'op': 'add', 'producto_id': self.c.id, 'cantidad': 2},
+            {'op': 'add', 'producto_id': self.c.id},
+            {'op': 'set', 'producto_id': self.c.id, 'cantidad': 4},
+        ]).data
+        self.assertEqual(self.cantidades(data), {self.a.id: 5, self.c.id: 4})
+        self.assertEqual(data['total'], 500.0 + 1200.0)
+        self.assertEqual(dict(ItemCarrito.objects.values_list('producto_id', 'cantidad')), {self.a.id: 5, self.c.id: 4})
+
+    def test_consultas_fijas(self):
+        self.client.force_authenticate(user=self.usuario)
+        self.lote([{'op': 'add', 'producto_id': self.a.id}, {'op': 'add', 'producto_id': self.c.id}])
+        for ops in [
+            [
+                {'op': 'add', 'producto_id': self.b.id}, {'op': 'remove', 'producto_id': self.c.id},
+                {'op': 'set', 'producto_id': self.a.id, 'cantidad': 3},
+            ],
+            [{'op': 'add', 'producto_id': producto.id, 'cantidad': 2} for producto in self.productos[2:]]
+            + [{'op': 'remove', 'producto_id': self.b.id}]
+            + [{'op': 'set', 'producto_id': producto.id, 'cantidad': 4} for producto in self.productos[2:]],
+        ]:
+            # Upsert del carrito, líneas, productos nuevos, DELETE, upsert de
+            # líneas, el carrito de vuelta (2) y el savepoint (2)
+            with self.assertNumQueries(9):
+                self.assertEqual(self.lote(ops).status_code, status.HTTP_200_OK)
+        self.assertEqual(ItemCarrito.objects.count(), 29)
+
+    def test_todas_o_ninguna(self):
+        self.client.force_authenticate(user=self.usuario)
+        self.lote([{'op': 'add', 'producto_id': self.a.id}])
+        antes = list(ItemCarrito.objects.values_list('producto_id', 'cantidad'))
+        response = self.lote([{'op': 'add', 'producto_id': self.b.id}, {'op': 'remove', 'producto_id': self.c.id}])
+        self.assertEqual((response.status_code, response.data['op']), (status.HTTP_400_BAD_REQUEST, 1))
+        response = self.lote([{'op': 'set', 'producto_id': self.a.id, 'cantidad': 9}, {'op': 'add', 'producto_id': 10 ** 6}])
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.lote([{'op': 'set', 'producto_id': self.a.id, 'cantidad': 0}]).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.lote([{'op': 'vaciar'}]).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(list(ItemCarrito.objects.values_list('producto_id', 'cantidad')), antes)
+
+    def test_invitado_en_los_dos_almacenes(self):
+        ajeno = Carrito.objects.create(usuario=self.usuario)
+        ops = [
+            {'op': 'add', 'producto_id': self.a.id, 'cantidad': 3},
+            {'op': 'add', 'producto_id': self.b.id},
+            {'op': 'remove', 'producto_id': self.a.id},
+            {'op': 'add', 'producto_id': self.c.id, 'cantidad': 2},
+        ]
+        for almacen in AlmacenCarritoInvitadoTest.ALMACENES:
+            with self.subTest(almacen=almacen), override_settings(ALMACEN_CARRITO_INVITADO=almacen):
+                data = self.lote(ops).data
+                self.assertEqual(self.cantidades(data), {self.b.id: 1, self.c.id: 2})
+                guest_cart_id = str(data['guest_cart_id'])
+                data = self.lote([{'op': 'set', 'item_id': data['items'][1]['id'], 'cantidad': 1}], guest_cart_id=guest_cart_id).data
+                self.assertEqual((self.cantidades(data), data['total']), ({self.b.id: 1, self.c.id: 1}, 500.0))
+                self.assertEqual(self.lote(ops, guest_cart_id=str(ajeno.id)).status_code, status.HTTP_403_FORBIDDEN)
+
+
+class CheckoutStockTest(APITestCase):
+    """El checkout reparte el stock entre tiendas y registra las ventas en el libro de movimientos"""
+
+    def test_simulate_payment_registra_ventas(self):
+        from productos.models import StockMovimiento, StockTienda, Tienda
+        usuario = CustomerUser.objects.create_user(username='cliente_libro', email='cliente_libro@test.com', password='x')
+        tienda = Tienda.objects.create(nombre='A', direccion='D', telefono='1')
+        carrito = Carrito.objects.create(usuario=usuario)
+        for i, cantidad in enumerate([2, 3]):
+            producto = Producto.objects.create(sku=f'LC00{i}', nombre=f'P{i}', precio=Decimal('1000'), categoria='C')
+            StockTienda.objects.create(producto=producto, tienda=tienda, cantidad=10)
+            ItemCarrito.objects.create(carrito=carrito, producto=producto, cantidad=cantidad)
+        self.client.force_authenticate(user=usuario)
+
+        response = self.client.post(reverse('carrito-simulate-payment'), {}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        orden = Orden.objects.get()
+        ventas = StockMovimiento.objects.filter(tipo=StockMovimiento.VENTA).order_by('cantidad')
+        self.assertEqual(
+            [(venta.cantidad, venta.orden_id, venta.item_orden.cantidad) for venta in ventas],
+            [(-3, orden.id, 3), (-2, orden.id, 2)],
+        )
+
+    def test_checkout_reparte_entre_tiendas(self):
+        """Un item que ninguna tienda cubre sola se parte; lo que falta queda sin tienda"""
+        from productos.models import StockTienda, Tienda
+        usuario = CustomerUser.objects.create_user(username='cliente_reparto', email='cliente_reparto@test.com', password='x')
+        tienda_a = Tienda.objects.create(nombre='A', direccion='D', telefono='1')
+        tienda_b = Tienda.objects.create(nombre='B', direccion='D', telefono='1')
+        taladro = Producto.objects.create(sku='RP001', nombre='Taladro', precio=Decimal('1000'), categoria='C')
+        broca = Producto.objects.create(sku='RP002', nombre='Broca', precio=Decimal('100'), categoria='C')
+        StockTienda.objects.create(producto=taladro, tienda=tienda_a, cantidad=2)
+        StockTienda.objects.create(producto=taladro, tienda=tienda_b, cantidad=3)
+        StockTienda.objects.create(producto=broca, tienda=tienda_b, cantidad=1)
+        carrito = Carrito.objects.create(usuario=usuario)
+        ItemCarrito.objects.create(carrito=carrito, producto=taladro, cantidad=4)
+        ItemCarrito.objects.create(carrito=carrito, producto=broca, cantidad=2)
+        self.client.force_authenticate(user=usuario)
+
+        response = self.client.post(reverse('carrito-simulate-payment'), {}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            set(ItemOrden.objects.values_list('producto_id', 'tienda_id', 'cantidad')),
+            {(taladro.id, tienda_b.id, 3), (taladro.id, tienda_a.id, 1), (broca.id, tienda_b.id, 1), (broca.id, None, 1)},
+        )
+        self.assertEqual(
+            dict(StockTienda.objects.values_list('tienda_id', 'cantidad').filter(producto=taladro)),
+            {tienda_a.id: 1, tienda_b.id: 0},
+        )
+
+
+class AlmacenCarritoInvitadoTest(APITestCase):
+    """El carrito de invitado funciona igual en la base y en la caché; la caché solo escribe al volcar, pagar o fusionar"""
+
+    ALMACENES = ['carrito.almacenamiento.AlmacenBaseDatos', 'carrito.almacenamiento.AlmacenCache']
+
+    def setUp(self):
+        caches['carritos'].clear()
+        self.martillo = Producto.objects.create(sku='AC001', nombre='Martillo', precio=Decimal('1000'), categoria='C')
+        self.clavos = Producto.objects.create(sku='AC002', nombre='Clavos', precio=Decimal('250.50'), categoria='C')
+
+    def post(self, accion, datos):
+        return self.client.post(reverse(f'carrito-{accion}'), datos, format='json')
+
+    def recorrido(self):
+        """Agrega, cambia y quita líneas como invitado; devuelve el id del carrito y el carrito final"""
+        guest_cart_id = str(self.post('add-item', {'producto_id': self.martillo.id, 'cantidad': 2}).data['guest_cart_id'])
+        datos = self.post('add-item', {'producto_id': self.clavos.id, 'guest_cart_id': guest_cart_id}).data
+        self.assertEqual(datos['carrito'], {'id': guest_cart_id, 'total': 2250.5, 'items': 2, 'unidades': 3})
+        datos = self.post('update-quantity', {'item_id': datos['id'], 'new_quantity': 4, 'guest_cart_id': guest_cart_id}).data
+        self.assertEqual((datos['cantidad'], datos['subtotal'], datos['carrito']['total']), (4, 1002.0, 3002.0))
+        carrito = self.client.get(reverse('carrito-get-cart'), {'guest_cart_id': guest_cart_id}).data
+        martillo = next(item['id'] for item in carrito['items'] if item['producto'] == self.martillo.id)
+        self.assertEqual(self.post('remove-item', {'item_id': martillo, 'guest_cart_id': guest_cart_id}).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.post('remove-item', {'item_id': martillo, 'guest_cart_id': guest_cart_id}).status_code, status.HTTP_404_NOT_FOUND)
+        return guest_cart_id, self.client.get(reverse('carrito-get-cart'), {'guest_cart_id': guest_cart_id}).data
+
+    def test_misma_salida_en_los_dos_almacenes(self):
+        salidas = []
+        for almacen in self.ALMACENES:
+            with self.subTest(almacen=almacen), override_settings(ALMACEN_CARRITO_INVITADO=almacen):
+                guest_cart_id, carrito = self.recorrido()
+                self.assertEqual(Carrito.objects.filter(id=guest_cart_id).exists(), almacen.endswith('BaseDatos'))
+                salidas.append([(item['producto_nombre'], item['cantidad'], item['subtotal']) for item in carrito['items']])
+                self.assertEqual(carrito['total'], 1002.0)
+        self.assertEqual(salidas[0], salidas[1])
+
+    @override_settings(ALMACEN_CARRITO_INVITADO='carrito.almacenamiento.AlmacenCache')
+    def test_cache_escribe_al_volcar(self):
+        from .almacenamiento import volcar_pendientes
+        guest_cart_id, _ = self.recorrido()
+        with self.assertNumQueries(1):
+            self.post('add-item', {'producto_id': self.martillo.id, 'guest_cart_id': guest_cart_id})
+        self.assertFalse(Carrito.objects.exists())
+
+        self.assertEqual(volcar_pendientes(), 1)
+        self.assertEqual(volcar_pendientes(), 0)
+        self.assertEqual(
+            dict(ItemCarrito.objects.filter(carrito_id=guest_cart_id).values_list('producto_id', 'cantidad')),
+            {self.clavos.id: 4, self.martillo.id: 1},
+        )
+        # Sigue en la caché después del volcado, y un nuevo cambio se vuelve a anotar
+        self.post('remove-item', {'item_id': self.clavos.id, 'guest_cart_id': guest_cart_id})
+        self.assertEqual(volcar_pendientes(), 1)
+        self.assertEqual(list(ItemCarrito.objects.values_list('producto_id', flat=True)), [self.martillo.id])
+
+    @override_settings(ALMACEN_CARRITO_INVITADO='carrito.almacenamiento.AlmacenCache')
+    def test_volcado_no_salta_entradas_faltantes(self):
+        """Una entrada del diario que aún no se escribe detiene el volcado; si se perdió, el carrito se vuelve a anotar"""
+        from .almacenamiento import CLAVE_DIARIO, ESPERA_HUECO, volcar_pendientes
+        cache = caches['carritos']
+        primero = str(self.post('add-item', {'producto_id': self.martillo.id}).data['guest_cart_id'])
+        # Otro proceso tomó el número siguiente pero todavía no escribe su entrada
+        hueco = cache.incr(CLAVE_DIARIO)
+        segundo = str(self.post('add-item', {'producto_id': self.clavos.id}).data['guest_cart_id'])
+
+        self.assertEqual(volcar_pendientes(), 1)
+        self.assertTrue(Carrito.objects.filter(id=primero).exists())
+        self.assertFalse(Carrito.objects.filter(id=segundo).exists())
+        self.assertEqual(volcar_pendientes(), 0)
+
+        # La entrada nunca llega (la caché la expulsó): pasado el plazo se salta
+        despues = timezone.now().timestamp() + ESPERA_HUECO + 1
+        with mock.patch('carrito.almacenamiento.time.time', return_value=despues):
+            self.assertEqual(volcar_pendientes(), 1)
+        self.assertTrue(Carrito.objects.filter(id=segundo).exists())
+
+        # Un carrito cuya entrada se perdió se vuelve a anotar en su próximo cambio
+        tercero = str(self.post('add-item', {'producto_id': self.martillo.id}).data['guest_cart_id'])
+        cache.delete(f'{CLAVE_DIARIO}:{hueco + 2}')
+        with mock.patch('carrito.almacenamiento.time.time', return_value=despues):
+            self.assertEqual(volcar_pendientes(), 0)
+        with mock.patch('carrito.almacenamiento.time.time', return_value=despues + ESPERA_HUECO + 1):
+            self.assertEqual(volcar_pendientes(), 0)
+        self.assertFalse(Carrito.objects.filter(id=tercero).exists())
+        self.post('add-item', {'producto_id': self.clavos.id, 'guest_cart_id': tercero})
+        self.assertEqual(volcar_pendientes(), 1)
+        self.assertEqual(ItemCarrito.objects.filter(carrito_id=tercero).count(), 2)
+
+    @override_settings(ALMACEN_CARRITO_INVITADO='carrito.almacenamiento.AlmacenCache')
+    def test_persistir_revertido_sigue_sucio(self):
+        """Si la transacción que persistió el carrito se revierte, la caché no lo da por persistido"""
+        from .almacenamiento import AlmacenCache
+        guest_cart_id = self.post('add-item', {'producto_id': self.martillo.id}).data['guest_cart_id']
+        almacen = AlmacenCache()
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                self.assertTrue(almacen.persistir(guest_cart_id))
+                almacen.vaciar(guest_cart_id)
+                raise RuntimeError
+        self.assertFalse(Carrito.objects.exists())
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertTrue(almacen.persistir(guest_cart_id))
+        self.assertFalse(almacen.persistir(guest_cart_id))
+        self.assertEqual(ItemCarrito.objects.get(carrito_id=guest_cart_id).producto, self.martillo)
+
+    @override_settings(ALMACEN_CARRITO_INVITADO='carrito.almacenamiento.AlmacenCache')
+    def test_cache_pago_y_fusion(self):
+        guest_cart_id, _ = self.recorrido()
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.post('simulate-payment', {'guest_cart_id': guest_cart_id})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(list(Orden.objects.values_list('total', flat=True)), [Decimal('1002.00')])
+        self.assertEqual(self.client.get(reverse('carrito-get-cart'), {'guest_cart_id': guest_cart_id}).data['items'], [])
+
+        # Al iniciar sesión, el carrito de invitado se suma al del usuario
+        usuario = CustomerUser.objects.create_user(username='cliente_fusion', email='fusion@test.com', password='x')
+        ItemCarrito.objects.create(carrito=Carrito.objects.create(usuario=usuario), producto=self.clavos, cantidad=1)
+        self.post('add-item', {'producto_id': self.clavos.id, 'cantidad': 2, 'guest_cart_id': guest_cart_id})
+        self.post('add-item', {'producto_id': self.martillo.id, 'guest_cart_id': guest_cart_id})
+        self.client.force_authenticate(user=usuario)
+        with self.captureOnCommitCallbacks(execute=True):
+            carrito = self.post('fusionar', {'guest_cart_id': guest_cart_id}).data
+        self.assertEqual(
+            sorted((item['producto_nombre'], item['cantidad']) for item in carrito['items']), [('Clavos', 3), ('Martillo', 1)],
+        )
+        self.assertFalse(Carrito.objects.filter(id=guest_cart_id).exists())
+        self.client.force_authenticate(user=None)
+        self.assertEqual(self.client.get(reverse('carrito-get-cart'), {'guest_cart_id': guest_cart_id}).data['items'], [])
+
+
+class ChequeoCacheCarritosTest(APITestCase):
+    """AlmacenCache sin DEBUG exige una caché 'carritos' compartida"""
+
+    def test_almacen_cache_con_locmem(self):
+        from .checks import cache_carritos_compartida
+        with override_settings(DEBUG=False, ALMACEN_CARRITO_INVITADO='carrito.almacenamiento.AlmacenCache'):
+            self.assertEqual([error.id for error in cache_carritos_compartida(None)], ['carrito.E001'])
+        with override_settings(DEBUG=False, ALMACEN_CARRITO_INVITADO='carrito.almacenamiento.AlmacenBaseDatos'):
+            self.assertEqual(cache_carritos_compartida(None), [])
+
+
+class PurgaCarritosTest(APITestCase):
+    """La purga borra solo carritos de invitado inactivos, por lotes y con sus items"""
+
+    def setUp(self):
+        producto = Producto.objects.create(sku='PG001', nombre='Martillo', precio=Decimal('1000'), categoria='C')
+        usuario = CustomerUser.objects.create_user(username='cliente_purga', email='purga@test.com', password='x')
+        self.viejos = [Carrito.objects.create() for _ in range(5)]
+        self.reciente = Carrito.objects.create()
+        self.de_usuario = Carrito.objects.create(usuario=usuario)
+        for carrito in self.viejos + [self.reciente, self.de_usuario]:
+            ItemCarrito.objects.create(carrito=carrito, producto=producto, cantidad=1)
+        # auto_now no deja fijar la fecha en save()
+        hace_dos_meses = timezone.now() - timedelta(days=60)
+        Carrito.objects.exclude(id=self.reciente.id).update(fecha_actualizacion=hace_dos_meses)
+
+    def test_borra_por_lotes(self):
+        from .purga_service import inactivos_desde, purgar_carritos_invitado
+        resultado = purgar_carritos_invitado(inactivos_desde(30), lote=2)
+        self.assertEqual((resultado['carritos'], resultado['items'], resultado['lotes']), (5, 5, 3))
+        self.assertEqual(set(Carrito.objects.values_list('id', flat=True)), {self.reciente.id, self.de_usuario.id})
+        self.assertEqual(ItemCarrito.objects.count(), 2)
+
+    def test_comando(self):
+        salida = StringIO()
+        call_command('purgar_carritos', '--dias', '30', '--lote', '2', '--max-lotes', '1', stdout=salida)
+        self.assertIn('Carritos borrados: 2, items: 2 (1 lotes', salida.getvalue())
+        call_command('purgar_carritos', stdout=salida)
+        self.assertEqual(Carrito.objects.count(), 2)
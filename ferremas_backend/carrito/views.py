@@ -1,13 +1,20 @@
-from rest_framework import viewsets, status
+from rest_framework import viewsets, status, permissions
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from .models import Carrito, ItemCarrito, Orden, ItemOrden
-from productos.models import Producto, StockTienda
-from .serializers import ItemCarritoSerializer, CarritoSerializer
+from .models import Carrito, Orden, ItemOrden
+from .almacenamiento import almacen_invitados, almacen_para
+from .carrito_service import (
+    CarritoAjeno, OperacionInvalida, ProductoNoEncontrado, cargar_carrito, fusionar_carritos, id_de_carrito,
+    leer_operaciones,
+)
+from .checkout_service import crear_items_orden
+from .serializers import CarritoSerializer
 from .mercadopago_service import MercadoPagoService
+from .mappers import datos_ordenes_usuario
+from config.serializacion_rapida import JSONRapidoRenderer, serializacion_rapida_activa
+from rest_framework.renderers import BrowsableAPIRenderer
 import logging
 from django.db import transaction
-from django.shortcuts import get_object_or_404
 from usuarios.models import CustomerUser
 import time
 
@@ -16,105 +23,150 @@ logger = logging.getLogger(__name__)
 class CarritoViewSet(viewsets.GenericViewSet):
     # Inicializamos el servicio de MercadoPago
     mercadopago_service = MercadoPagoService()
+    renderer_classes = [JSONRapidoRenderer, BrowsableAPIRenderer]
     
     def _get_cart(self, user, guest_cart_id=None):
-        """Helper para obtener el carrito del usuario o invitado"""
+        """
+        Helper para obtener el carrito del usuario o invitado con sus items,
+        productos y total en dos consultas (cargar_carrito). El de invitado se
+        persiste antes si el almacén lo tiene en la caché.
+        """
         if user.is_authenticated:
-            return Carrito.objects.filter(usuario=user).first()
+            return cargar_carrito(Carrito.objects.filter(usuario=user))
         elif guest_cart_id:
-            return Carrito.objects.filter(id=guest_cart_id, usuario__isnull=True).first()
+            try:
+                guest_cart_id = id_de_carrito(guest_cart_id)
+                almacen_invitados().persistir(guest_cart_id)
+            except (ValueError, CarritoAjeno):
+                return None
+            return cargar_carrito(Carrito.objects.filter(id=guest_cart_id, usuario__isnull=True))
         return None
 
+    def _guest_cart_id(self, request, datos):
+        """guest_cart_id de un invitado como UUID, o None (usuario autenticado o sin id). Lanza ValueError."""
+        guest_cart_id = datos.get('guest_cart_id')
+        if request.user.is_authenticated or not guest_cart_id:
+            return None
+        return id_de_carrito(guest_cart_id)
+
     @action(detail=False, methods=['post'])
     def add_item(self, request):
-        producto_id = request.data.get('producto_id')
-        cantidad = int(request.data.get('cantidad', 1))
-        guest_cart_id = request.data.get('guest_cart_id')
+        """
+        Suma `cantidad` unidades de `producto_id` al carrito (en la base con
+        dos upserts, o en la caché para invitados según el almacén). Responde
+        la línea actualizada y, en `carrito`, los totales del carrito, para
+        no tener que recargarlo.
+        """
+        try:
+            producto_id = int(request.data.get('producto_id'))
+            cantidad = int(request.data.get('cantidad', 1))
+        except (TypeError, ValueError):
+            return Response({'error': 'producto_id y cantidad deben ser números enteros'}, status=status.HTTP_400_BAD_REQUEST)
+        if cantidad < 1:
+            return Response({'error': 'La cantidad debe ser mayor a cero'}, status=status.HTTP_400_BAD_REQUEST)
         user = request.user
 
-        if user.is_authenticated:
-            carrito, _ = Carrito.objects.get_or_create(usuario=user)
-        else:
-            if guest_cart_id:
-                carrito, _ = Carrito.objects.get_or_create(id=guest_cart_id, usuario=None)
-            else:
-                carrito = Carrito.objects.create(usuario=None)
-
         try:
-            producto = Producto.objects.get(id=producto_id)
-            item, created = ItemCarrito.objects.get_or_create(
-                carrito=carrito,
-                producto=producto,
-                defaults={'cantidad': cantidad}
-            )
-            if not created:
-                item.cantidad += cantidad
-                item.save()
-            data = ItemCarritoSerializer(item).data
-            if not user.is_authenticated and created:
-                data['guest_cart_id'] = carrito.id
-            return Response(data, status=status.HTTP_200_OK)
-        except Producto.DoesNotExist:
+            data, carrito_id = almacen_para(user).agregar(self._guest_cart_id(request, request.data), producto_id, cantidad)
+        except ValueError:
+            return Response({'error': 'guest_cart_id no es un id de carrito válido'}, status=status.HTTP_400_BAD_REQUEST)
+        except CarritoAjeno:
+            return Response({'error': 'No tienes permiso para modificar este carrito'}, status=status.HTTP_403_FORBIDDEN)
+        except ProductoNoEncontrado:
             return Response({'error': 'Producto no encontrado'}, status=status.HTTP_404_NOT_FOUND)
+        if not user.is_authenticated:
+            data['guest_cart_id'] = carrito_id
+        return Response(data, status=status.HTTP_200_OK)
 
     @action(detail=False, methods=['post'])
     def remove_item(self, request):
-        item_id = request.data.get('item_id')
-        guest_cart_id = request.data.get('guest_cart_id')
-        user = request.user
+        try:
+            item_id = int(request.data.get('item_id'))
+            carrito_id = self._guest_cart_id(request, request.data)
+        except (TypeError, ValueError):
+            return Response({'error': 'item_id o guest_cart_id no son válidos'}, status=status.HTTP_400_BAD_REQUEST)
 
-        logger.info(f"remove_item - item_id: {item_id}, guest_cart_id: {guest_cart_id}, user_authenticated: {user.is_authenticated}")
+        try:
+            eliminado = almacen_para(request.user).quitar(carrito_id, item_id)
+        except CarritoAjeno:
+            return Response({'error': 'No tienes permiso para eliminar este item'}, status=status.HTTP_403_FORBIDDEN)
+        if not eliminado:
+            return Response({'error': 'Item no encontrado en tu carrito'}, status=status.HTTP_404_NOT_FOUND)
+        logger.info(f"Item {item_id} eliminado exitosamente")
+        return Response({'message': 'Item eliminado exitosamente'}, status=status.HTTP_200_OK)
 
+    @action(detail=False, methods=['post'])
+    def batch(self, request):
+        """
+        Aplica en orden una lista de operaciones `ops` sobre el carrito, todas
+        o ninguna, y responde el carrito resultante (como get_cart):
+
+            {"guest_cart_id": "...", "ops": [
+                {"op": "add", "producto_id": 3, "cantidad": 2},
+                {"op": "set", "item_id": 8, "cantidad": 5},
+                {"op": "remove", "item_id": 9}
+            ]}
+
+        remove y set aceptan producto_id en lugar de item_id. El dueño del
+        carrito se comprueba una vez por lote y las líneas se escriben con un
+        número fijo de sentencias, sin importar cuántas operaciones traiga.
+        """
         try:
-            # Obtener el item del carrito
-            item = ItemCarrito.objects.get(id=item_id)
-            
-            logger.info(f"Item encontrado - carrito_id: {item.carrito.id}, carrito_usuario: {item.carrito.usuario}")
-            
-            # Verificar que el usuario tenga permiso para eliminar el item
-            if user.is_authenticated:
-                if item.carrito.usuario != user:
-                    logger.warning(f"Usuario autenticado no coincide - item.carrito.usuario: {item.carrito.usuario}, request.user: {user}")
-                    return Response({'error': 'No tienes permiso para eliminar este item'}, status=status.HTTP_403_FORBIDDEN)
-            else:
-                logger.info(f"Comparando carrito IDs - item.carrito.id: {item.carrito.id} (type: {type(item.carrito.id)}), guest_cart_id: {guest_cart_id} (type: {type(guest_cart_id)})")
-                if str(item.carrito.id) != guest_cart_id:
-                    logger.warning(f"Guest cart ID no coincide - item.carrito.id: {item.carrito.id}, guest_cart_id: {guest_cart_id}")
-                    return Response({'error': 'No tienes permiso para eliminar este item'}, status=status.HTTP_403_FORBIDDEN)
-
-            # Eliminar el item
-            item.delete()
-            logger.info(f"Item {item_id} eliminado exitosamente")
-            
-            return Response({'message': 'Item eliminado exitosamente'}, status=status.HTTP_200_OK)
-            
-        except ItemCarrito.DoesNotExist:
-            logger.error(f"Item {item_id} no encontrado")
-            return Response({'error': 'Item no encontrado'}, status=status.HTTP_404_NOT_FOUND)
-        except Exception as e:
-            logger.error(f"Error al eliminar item: {e}")
-            return Response({'error': 'Error al eliminar el item'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            operaciones = leer_operaciones(request.data.get('ops'))
+            carrito_id = self._guest_cart_id(request, request.data)
+            data, carrito_id = almacen_para(request.user).aplicar_lote(carrito_id, operaciones)
+        except OperacionInvalida as e:
+            return Response({'error': str(e), 'op': e.indice}, status=status.HTTP_400_BAD_REQUEST)
+        except ValueError:
+            return Response({'error': 'guest_cart_id no es un id de carrito válido'}, status=status.HTTP_400_BAD_REQUEST)
+        except CarritoAjeno:
+            return Response({'error': 'No tienes permiso para modificar este carrito'}, status=status.HTTP_403_FORBIDDEN)
+        except ProductoNoEncontrado as e:
+            return Response({'error': f'Producto {e} no encontrado'}, status=status.HTTP_404_NOT_FOUND)
+        if not request.user.is_authenticated:
+            data['guest_cart_id'] = carrito_id
+        return Response(data, status=status.HTTP_200_OK)
 
     @action(detail=False, methods=['get'])
     def get_cart(self, request):
-        guest_cart_id = request.query_params.get('guest_cart_id')
-        user = request.user
-        carrito = None
-        if user.is_authenticated:
-            carrito = Carrito.objects.filter(usuario=user).first()
-        elif guest_cart_id:
-            carrito = Carrito.objects.filter(id=guest_cart_id, usuario__isnull=True).first()
-        if carrito:
-            return Response(CarritoSerializer(carrito).data)
+        try:
+            carrito_id = self._guest_cart_id(request, request.query_params)
+            datos = almacen_para(request.user).obtener(carrito_id)
+        except (ValueError, CarritoAjeno):
+            datos = None
+        if datos is not None:
+            return Response(datos)
         return Response({'items': [], 'total': 0})
 
+    @action(detail=False, methods=['post'], permission_classes=[permissions.IsAuthenticated])
+    def fusionar(self, request):
+        """
+        Al iniciar sesión: suma el carrito de invitado `guest_cart_id` al del
+        usuario (persistiéndolo antes si vive en la caché) y responde el
+        carrito resultante. Sin carrito de invitado, solo responde el del usuario.
+        """
+        try:
+            carrito_id = id_de_carrito(request.data['guest_cart_id']) if request.data.get('guest_cart_id') else None
+        except ValueError:
+            return Response({'error': 'guest_cart_id no es un id de carrito válido'}, status=status.HTTP_400_BAD_REQUEST)
+        if carrito_id is not None:
+            invitados = almacen_invitados()
+            try:
+                invitados.persistir(carrito_id)
+            except CarritoAjeno:
+                return Response({'error': 'No tienes permiso para modificar este carrito'}, status=status.HTTP_403_FORBIDDEN)
+            fusionar_carritos(carrito_id, request.user)
+            invitados.descartar(carrito_id)
+        datos = almacen_para(request.user).obtener(None)
+        return Response(datos if datos is not None else {'items': [], 'total': 0})
+
     @action(detail=False, methods=['post'])
     def create_mercadopago_preference(self, request):
         guest_cart_id = request.data.get('guest_cart_id')
         user = request.user
         carrito = self._get_cart(user, guest_cart_id)
         
-        if not carrito or not carrito.items.exists():
+        if not carrito or not carrito.items.all():
             return Response({'error': 'El carrito está vacío'}, status=status.HTTP_400_BAD_REQUEST)
 
         # Crear metadata para asociar el pago con el carrito y el usuario
@@ -178,15 +230,18 @@ class CarritoViewSet(viewsets.GenericViewSet):
                     logger.error("Webhook no contiene 'cart_id' en metadata.")
                     return Response({"status": "error", "reason": "missing cart_id"}, status=status.HTTP_400_BAD_REQUEST)
 
-                carrito = get_object_or_404(Carrito, id=cart_id)
-                if not carrito.items.exists():
+                carrito = cargar_carrito(Carrito.objects.filter(id=cart_id))
+                if carrito is None:
+                    logger.error(f"El carrito {cart_id} del pago {payment_id} no existe.")
+                    return Response({"status": "error", "reason": "cart not found"}, status=status.HTTP_404_NOT_FOUND)
+                if not carrito.items.all():
                     logger.warning(f"El carrito {cart_id} ya estaba vacío al procesar el webhook.")
                     return Response({"status": "ok", "reason": "cart already empty"}, status=status.HTTP_200_OK)
 
                 # Crear la orden
                 orden = Orden.objects.create(
                     usuario_id=user_id,
-                    total=sum(item.subtotal for item in carrito.items.all()),
+                    total=carrito.total,
                     estado='pagado',
                     payment_id=payment_id,
                     # Asumiendo que la info del comprador viene en el pago
@@ -200,34 +255,14 @@ class CarritoViewSet(viewsets.GenericViewSet):
                     metodo_pago="mercadopago"
                 )
 
-                # Mover items del carrito a la orden y actualizar stock
-                for item_carrito in carrito.items.all():
-                    ItemOrden.objects.create(
-                        orden=orden,
-                        producto=item_carrito.producto,
-                        cantidad=item_carrito.cantidad,
-                        precio_unitario=item_carrito.producto.precio
-                    )
-                    
-                    # Actualizar stock del producto en todas las tiendas
-                    stocks_tienda = StockTienda.objects.filter(producto=item_carrito.producto)
-                    
-                    if stocks_tienda.exists():
-                        # Si hay stock en tiendas, reducir de la primera tienda disponible
-                        for stock in stocks_tienda:
-                            if stock.cantidad >= item_carrito.cantidad:
-                                stock.cantidad -= item_carrito.cantidad
-                                stock.save()
-                                logger.info(f"Stock actualizado en tienda {stock.tienda.nombre}: {stock.cantidad}")
-                                break
-                        else:
-                            # Si no hay suficiente stock en ninguna tienda, registrar el error
-                            logger.error(f"Stock insuficiente para {item_carrito.producto.nombre} al procesar orden {orden.id}")
-                    else:
-                        logger.warning(f"No hay stock registrado para {item_carrito.producto.nombre} en ninguna tienda")
-                
+                # Mover items del carrito a la orden, repartidos entre las tiendas que
+                # los despachan, y descontar el stock
+                crear_items_orden(orden, carrito.items.all())
+
                 # Vaciar el carrito
                 carrito.items.all().delete()
+                if carrito.usuario_id is None:
+                    almacen_invitados().vaciar(carrito.id)
                 logger.info(f"Orden {orden.id} creada y carrito {cart_id} vaciado.")
 
             return Response({"status": "ok"}, status=status.HTTP_200_OK)
@@ -247,7 +282,7 @@ class CarritoViewSet(viewsets.GenericViewSet):
         user = request.user
         carrito = self._get_cart(user, guest_cart_id)
         
-        if not carrito or not carrito.items.exists():
+        if not carrito or not carrito.items.all():
             return Response({'error': 'El carrito está vacío'}, status=status.HTTP_400_BAD_REQUEST)
 
         try:
@@ -264,7 +299,7 @@ class CarritoViewSet(viewsets.GenericViewSet):
             # Crear la orden
             orden = Orden.objects.create(
                 usuario_id=user.id if user.is_authenticated else None,
-                total=sum(item.subtotal for item in carrito.items.all()),
+                total=carrito.total,
                 estado='pagado',
                 payment_id=f"SIM-{carrito.id}-{int(time.time())}",
                 nombre=shipping_data['nombre'],
@@ -276,34 +311,13 @@ class CarritoViewSet(viewsets.GenericViewSet):
                 metodo_pago="pago_simulado"
             )
 
-            # Mover items del carrito a la orden y actualizar stock
-            for item_carrito in carrito.items.all():
-                ItemOrden.objects.create(
-                    orden=orden,
-                    producto=item_carrito.producto,
-                    cantidad=item_carrito.cantidad,
-                    precio_unitario=item_carrito.producto.precio
-                )
-                
-                # Actualizar stock del producto en todas las tiendas
-                stocks_tienda = StockTienda.objects.filter(producto=item_carrito.producto)
-                
-                if stocks_tienda.exists():
-                    # Si hay stock en tiendas, reducir de la primera tienda disponible
-                    for stock in stocks_tienda:
-                        if stock.cantidad >= item_carrito.cantidad:
-                            stock.cantidad -= item_carrito.cantidad
-                            stock.save()
-                            logger.info(f"Stock actualizado en tienda {stock.tienda.nombre}: {stock.cantidad}")
-                            break
-                    else:
-                        # Si no hay suficiente stock en ninguna tienda, registrar el error
-                        logger.error(f"Stock insuficiente para {item_carrito.producto.nombre} al procesar orden {orden.id}")
-                else:
-                    logger.warning(f"No hay stock registrado para {item_carrito.producto.nombre} en ninguna tienda")
-            
+            # Mover items del carrito a la orden, repartidos entre las tiendas que
+            # los despachan, y descontar el stock
+            crear_items_orden(orden, carrito.items.all())
+
             # Vaciar el carrito
             carrito.items.all().delete()
+            almacen_para(user).vaciar(carrito.id)
             logger.info(f"Orden simulada {orden.id} creada y carrito {carrito.id} vaciado.")
 
             return Response({
@@ -319,37 +333,23 @@ class CarritoViewSet(viewsets.GenericViewSet):
 
     @action(detail=False, methods=['post'])
     def update_quantity(self, request):
-        item_id = request.data.get('item_id')
-        new_quantity = int(request.data.get('new_quantity'))
-
-        if not item_id or new_quantity is None:
+        """Fija la cantidad de una línea del carrito y la responde con los totales, como add_item."""
+        try:
+            item_id = int(request.data.get('item_id'))
+            new_quantity = int(request.data.get('new_quantity'))
+            carrito_id = self._guest_cart_id(request, request.data)
+        except (TypeError, ValueError):
             return Response({'error': 'Item ID and new quantity are required'}, status=status.HTTP_400_BAD_REQUEST)
+        if new_quantity < 1:
+            return Response({'error': 'La cantidad debe ser mayor a cero'}, status=status.HTTP_400_BAD_REQUEST)
 
         try:
-            item = ItemCarrito.objects.get(id=item_id)
-            # Optional: Add checks if the current user/guest owns this cart/item
-            # if request.user.is_authenticated and item.carrito.usuario != request.user:
-            #     return Response({'error': 'Not authorized'}, status=status.HTTP_403_FORBIDDEN)
-            # elif not request.user.is_authenticated:
-            #     guest_cart_id = request.data.get('guest_cart_id') # Need to pass guest_cart_id from frontend
-            #     if str(item.carrito.id) != guest_cart_id:
-            #          return Response({'error': 'Not authorized or invalid cart'}, status=status.HTTP_403_FORBIDDEN)
-
-
-            item.cantidad = new_quantity
-            item.save()
-            # Re-fetch the cart to update totals in the frontend
-            # Alternatively, calculate new total here and return
-            # For simplicity, let's just return the updated item data
-            updated_item_data = ItemCarritoSerializer(item).data
-            return Response(updated_item_data, status=status.HTTP_200_OK)
-
-        except ItemCarrito.DoesNotExist:
+            data = almacen_para(request.user).cambiar_cantidad(carrito_id, item_id, new_quantity)
+        except CarritoAjeno:
+            return Response({'error': 'Not authorized or invalid cart'}, status=status.HTTP_403_FORBIDDEN)
+        if data is None:
             return Response({'error': 'Item not found'}, status=status.HTTP_404_NOT_FOUND)
-        except Exception as e:
-             # Log the error for debugging
-            print(f"Error updating item quantity: {e}")
-            return Response({'error': 'An error occurred while updating quantity'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        return Response(data, status=status.HTTP_200_OK)
 
     @action(detail=False, methods=['get'])
     def get_order_details(self, request):
@@ -426,6 +426,9 @@ class CarritoViewSet(viewsets.GenericViewSet):
             )
         
         try:
+            if serializacion_rapida_activa():
+                return Response(datos_ordenes_usuario(request.user), status=status.HTTP_200_OK)
+
             # Obtener todas las órdenes del usuario, ordenadas por fecha de creación (más recientes primero)
             ordenes = Orden.objects.filter(usuario=request.user).order_by('-fecha_creacion')
             
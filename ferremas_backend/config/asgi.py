@@ -13,4 +13,9 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# El stream de cambios de stock se atiende fuera del handler de Django
+from productos.stream import con_stream  # noqa: E402
+
+application = con_stream(django_application)
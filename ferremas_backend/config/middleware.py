@@ -5,8 +5,9 @@ class DisableBrowserCacheMiddleware:
     def __call__(self, request):
         response = self.get_response(request)
         
-        # Añadir encabezados para evitar caché en las respuestas
-        if request.method == 'GET':
+        # Añadir encabezados para evitar caché en las respuestas, salvo en las
+        # que traen su propio validador (ETag) para GET condicionales
+        if request.method == 'GET' and not response.has_header('ETag'):
             response['Cache-Control'] = 'no-cache, no-store, must-revalidate'
             response['Pragma'] = 'no-cache'
             response['Expires'] = '0'
@@ -0,0 +1,128 @@
+"""
+Camino rápido de serialización para endpoints de lectura muy consultados.
+
+En vez de instanciar modelos y recorrer los campos del serializer objeto por
+objeto, el endpoint lee filas con `values()` y las convierte con un mapper
+compilado una sola vez a partir del propio serializer, reutilizando el
+`to_representation` de cada campo para que la salida sea idéntica. Se puede
+desactivar con SERIALIZACION_RAPIDA = False en settings.
+"""
+import json
+from decimal import Decimal
+
+from django.conf import settings
+from rest_framework import ISO_8601
+from rest_framework.fields import DateTimeField, ReadOnlyField, SerializerMethodField
+from rest_framework.relations import PrimaryKeyRelatedField
+from rest_framework.renderers import JSONRenderer
+from rest_framework.settings import api_settings
+
+
+def serializacion_rapida_activa():
+    return getattr(settings, 'SERIALIZACION_RAPIDA', True)
+
+
+def valor_json(valor):
+    """Lo que el JSONEncoder de DRF escribiría para un valor sin campo que lo convierta."""
+    if isinstance(valor, Decimal):
+        return float(valor)
+    return valor
+
+
+def _conversor_fecha(campo, zona):
+    """
+    DateTimeField.to_representation con la zona horaria ya resuelta: evita
+    consultar la zona activa en cada valor, que es lo más caro de ese campo.
+    """
+    formato = getattr(campo, 'format', api_settings.DATETIME_FORMAT)
+    if zona is None or hasattr(campo, 'timezone') or formato is None or formato.lower() != ISO_8601:
+        return campo.to_representation
+
+    def convertir(valor):
+        if isinstance(valor, str) or valor.utcoffset() is None:
+            return campo.to_representation(valor)
+        texto = valor.astimezone(zona).isoformat()
+        return texto[:-6] + 'Z' if texto.endswith('+00:00') else texto
+    return convertir
+
+
+def compilar_mapper(campos):
+    """
+    Compila una función fila -> dict a partir de una lista de
+    (nombre de salida, clave en la fila, conversor). Si la clave es None, el
+    conversor recibe la fila completa; si no, recibe el valor (salvo None, que
+    se copia tal cual, como hace Serializer.to_representation).
+    """
+    entorno, partes = {}, []
+    for indice, (nombre, clave, conversor) in enumerate(campos):
+        if clave is None:
+            entorno[f'c{indice}'] = conversor
+            valor = f'c{indice}(f)'
+        elif conversor is None:
+            valor = f'f[{clave!r}]'
+        else:
+            entorno[f'c{indice}'] = conversor
+            valor = f'(None if (v{indice} := f[{clave!r}]) is None else c{indice}(v{indice}))'
+        partes.append(f'{nombre!r}: {valor}')
+    return eval('lambda f: {' + ', '.join(partes) + '}', entorno)
+
+
+def campos_de_serializer(serializer_class, nombres=None, calculados=None, zona=None):
+    """
+    Especificación para `compilar_mapper` que replica `serializer_class`.
+
+    Los campos se leen de la fila por su `source` (con `__` en lugar de `.`).
+    `calculados` asigna a un nombre de campo una función de la fila completa,
+    para los campos que no salen de una columna (métodos, propiedades, anidados).
+    `zona` es la zona horaria activa al serializar (la que usaría DRF).
+    Devuelve (especificación, columnas de values() necesarias).
+    """
+    calculados = calculados or {}
+    especificacion, columnas = [], []
+    for nombre, campo in serializer_class().fields.items():
+        if campo.write_only or (nombres is not None and nombre not in nombres):
+            continue
+        if nombre in calculados:
+            especificacion.append((nombre, None, calculados[nombre]))
+            continue
+        if isinstance(campo, SerializerMethodField):
+            raise ValueError(f"El campo '{nombre}' necesita un conversor en `calculados`")
+        clave = campo.source.replace('.', '__')
+        columnas.append(clave)
+        if isinstance(campo, PrimaryKeyRelatedField):
+            # values() ya entrega la clave primaria
+            especificacion.append((nombre, clave, None))
+        elif isinstance(campo, ReadOnlyField):
+            especificacion.append((nombre, clave, valor_json))
+        elif isinstance(campo, DateTimeField):
+            especificacion.append((nombre, clave, _conversor_fecha(campo, zona)))
+        else:
+            especificacion.append((nombre, clave, campo.to_representation))
+    return especificacion, columnas
+
+
+class JSONRapidoRenderer(JSONRenderer):
+    """
+    Igual que JSONRenderer, pero cuando los datos solo tienen tipos nativos
+    (como los del camino rápido) usa un encoder reutilizado sin `default`.
+    Ante cualquier otro tipo vuelve al render de DRF, con idéntico resultado.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None or self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = self._encoder().encode(data)
+        except TypeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        return ret.replace('\u2028', '\\u2028').replace('\u2029', '\\u2029').encode()
+
+    @classmethod
+    def _encoder(cls):
+        if '_encoder_nativo' not in cls.__dict__:
+            cls._encoder_nativo = json.JSONEncoder(
+                ensure_ascii=cls.ensure_ascii,
+                allow_nan=not cls.strict,
+                separators=(',', ':') if cls.compact else (', ', ': '),
+            )
+        return cls._encoder_nativo
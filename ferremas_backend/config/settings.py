@@ -138,6 +138,77 @@ STATIC_URL = 'static/'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Caché
+# `catalogo` guarda las respuestas públicas del catálogo (ver productos/cache.py).
+# Por defecto es local al proceso; con CATALOGO_CACHE_BACKEND/LOCATION se puede
+# usar p. ej. django.core.cache.backends.filebased.FileBasedCache y una carpeta.
+# Con varios workers debe ser compartida: la versión del catálogo y la fecha de
+# último cambio (Last-Modified) viven ahí y la invalidación debe verse en todos.
+# Con DEBUG=False, `manage.py check` (y runserver/migrate) falla si alguna de
+# las dos cachés sigue en LocMemCache (productos/checks.py, carrito/checks.py).
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'catalogo': {
+        'BACKEND': os.getenv('CATALOGO_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CATALOGO_CACHE_LOCATION', 'catalogo'),
+        'TIMEOUT': 300,
+        'OPTIONS': {
+            'MAX_ENTRIES': 5000,
+            'CULL_FREQUENCY': 4,
+        },
+    },
+    # Carritos de invitado con AlmacenCache: TIMEOUT es lo que vive un carrito
+    # sin tocarse. Debe ser compartida entre los workers (Redis, Memcached o
+    # FileBasedCache en un solo servidor) para ALMACEN_CARRITO_INVITADO y
+    # `manage.py volcar_carritos`.
+    'carritos': {
+        'BACKEND': os.getenv('CARRITOS_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CARRITOS_CACHE_LOCATION', 'carritos'),
+        'TIMEOUT': 7 * 24 * 3600,
+        'OPTIONS': {
+            'MAX_ENTRIES': 50000,
+            'CULL_FREQUENCY': 4,
+        },
+    },
+}
+
+# Segundos que vive cada respuesta cacheada del catálogo, por acción
+CATALOGO_CACHE_TTL = {
+    'productos_list': 60,
+    'productos_retrieve': 300,
+    'productos_categories': 3600,
+    'productos_stock_por_tienda': 60,
+    'productos_facetas': 3600,
+    'tiendas_list': 3600,
+    'stock_resumen_bajo_minimo': 60,
+}
+
+# Listado de productos, carrito y historial de órdenes se arman desde values()
+# con mappers compilados (config/serializacion_rapida.py). Misma salida que los
+# serializers; con SERIALIZACION_RAPIDA=0 se vuelve al camino de DRF.
+SERIALIZACION_RAPIDA = os.getenv('SERIALIZACION_RAPIDA', '1') == '1'
+
+# Estrategia con que el checkout reparte cada orden entre tiendas
+# (productos/asignacion.py): MinimasTiendasAsignador despacha desde la menor
+# cantidad de tiendas; PrimeraTiendaAsignador toma por orden de id.
+ASIGNADOR_STOCK = os.getenv('ASIGNADOR_STOCK', 'productos.asignacion.MinimasTiendasAsignador')
+
+# Dónde viven los carritos de invitado (carrito/almacenamiento.py): AlmacenBaseDatos
+# escribe cada cambio en la base; AlmacenCache los guarda en la caché 'carritos'
+# y los escribe al pagar, al iniciar sesión o con `manage.py volcar_carritos`.
+ALMACEN_CARRITO_INVITADO = os.getenv('ALMACEN_CARRITO_INVITADO', 'carrito.almacenamiento.AlmacenBaseDatos')
+
+# Días sin cambios tras los que `manage.py purgar_carritos` borra un carrito de invitado
+CARRITO_INVITADO_DIAS_INACTIVO = int(os.getenv('CARRITO_INVITADO_DIAS_INACTIVO', '30'))
+
+# Stream en vivo de cambios de stock (productos/stream.py). Solo existe
+# sirviendo config.asgi, p. ej. con `uvicorn config.asgi:application`.
+# Con varios workers, 'host:puerto' del relé (`manage.py rele_stock`) para que
+# cada worker reciba los cambios de todos; sin él, cada uno ve solo los suyos.
+STOCK_EVENTOS_RELE = os.getenv('STOCK_EVENTOS_RELE')
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -0,0 +1,40 @@
+from .settings_test import *
+
+# Configuración para benchmarks (python -m benchmarks.run). Por defecto SQLite;
+# con BENCH_DB_ENGINE=django.db.backends.postgresql se usa un Postgres local.
+# El runner trabaja siempre sobre la base de pruebas (prefijo test_) que crea.
+DATABASES = {
+    'default': {
+        'ENGINE': os.getenv('BENCH_DB_ENGINE', 'django.db.backends.sqlite3'),
+        'NAME': os.getenv('BENCH_DB_NAME', str(BASE_DIR / 'bench_db.sqlite3')),
+        'USER': os.getenv('BENCH_DB_USER', ''),
+        'PASSWORD': os.getenv('BENCH_DB_PASSWORD', ''),
+        'HOST': os.getenv('BENCH_DB_HOST', ''),
+        'PORT': os.getenv('BENCH_DB_PORT', ''),
+    }
+}
+
+# La caché del catálogo se mide como en producción (local al proceso)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'catalogo': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'catalogo-bench',
+        'TIMEOUT': 300,
+        'OPTIONS': {
+            'MAX_ENTRIES': 5000,
+            'CULL_FREQUENCY': 4,
+        },
+    },
+    'carritos': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'carritos-bench',
+        'TIMEOUT': 7 * 24 * 3600,
+        'OPTIONS': {
+            'MAX_ENTRIES': 50000,
+            'CULL_FREQUENCY': 4,
+        },
+    },
+}
@@ -30,7 +30,15 @@ LOGGING = {
 CACHES = {
     'default': {
         'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
-    }
+    },
+    'catalogo': {
+        'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
+    },
+    # AlmacenCache necesita una caché que guarde de verdad
+    'carritos': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'carritos-test',
+    },
 }
 
 # Configuración de archivos estáticos para pruebas
@@ -1,7 +1,32 @@
 from django.contrib import admin
-from .models import Producto, Tienda, StockTienda
+from .models import Producto, Tienda, StockTienda, StockMovimiento
+
+
+@admin.register(Producto)
+class ProductoAdmin(admin.ModelAdmin):
+    list_display = ('sku', 'nombre', 'categoria', 'marca', 'precio', 'stock_total', 'tiendas_con_stock')
+    list_filter = ('categoria',)
+    search_fields = ('sku', 'nombre', 'marca')
+    readonly_fields = ('stock_total', 'tiendas_con_stock')
+
 
-# Register your models here.
-admin.site.register(Producto)
 admin.site.register(Tienda)
 admin.site.register(StockTienda)
+
+
+@admin.register(StockMovimiento)
+class StockMovimientoAdmin(admin.ModelAdmin):
+    """El libro es de solo inserción: se consulta, no se edita."""
+    list_display = ('fecha', 'tipo', 'producto', 'tienda', 'cantidad', 'orden', 'usuario')
+    list_filter = ('tipo', 'tienda')
+    list_select_related = ('producto', 'tienda', 'orden', 'usuario')
+    raw_id_fields = ('producto', 'orden', 'item_orden')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
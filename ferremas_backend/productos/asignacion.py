@@ -0,0 +1,117 @@
+"""
+Asignación de stock entre tiendas para despachar una orden.
+
+Un asignador recibe el pedido ({producto_id: cantidad}) y el stock disponible
+({producto_id: {tienda_id: cantidad}}) y decide qué tienda despacha cuántas
+unidades de cada producto. No toca la base: productos.stock_service carga el
+stock, llama al asignador configurado en ASIGNADOR_STOCK y descuenta.
+"""
+from dataclasses import dataclass, field
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+@dataclass
+class Asignacion:
+    # producto_id -> [(tienda_id, cantidad), ...]
+    partes: dict = field(default_factory=dict)
+    # producto_id -> unidades que ninguna tienda puede cubrir
+    faltantes: dict = field(default_factory=dict)
+
+    def agregar(self, producto_id, tienda_id, cantidad):
+        self.partes.setdefault(producto_id, []).append((tienda_id, cantidad))
+
+    @property
+    def tiendas(self):
+        return {tienda_id for partes in self.partes.values() for tienda_id, _ in partes}
+
+
+class Asignador:
+    def asignar(self, pedido, disponibles):
+        raise NotImplementedError
+
+
+class PrimeraTiendaAsignador(Asignador):
+    """
+    Cada producto se toma de las tiendas en orden de id, partiendo la cantidad
+    si la primera no alcanza. Es lo que hacía el checkout, sin vender de más.
+    """
+
+    def asignar(self, pedido, disponibles):
+        asignacion = Asignacion()
+        for producto_id, cantidad in pedido.items():
+            for tienda_id, stock in sorted(disponibles.get(producto_id, {}).items()):
+                if not cantidad:
+                    break
+                tomar = min(cantidad, stock)
+                if tomar > 0:
+                    asignacion.agregar(producto_id, tienda_id, tomar)
+                    cantidad -= tomar
+            if cantidad:
+                asignacion.faltantes[producto_id] = cantidad
+        return asignacion
+
+
+class MinimasTiendasAsignador(Asignador):
+    """
+    Minimiza las tiendas que despachan la orden. Elegir el mínimo exacto es un
+    problema de cobertura de conjuntos, así que se usa la heurística voraz:
+    se elige la tienda que completa más líneas pendientes (y, a igualdad, más
+    unidades), se toma de ella todo lo que pueda y se repite. Al final, las
+    líneas partidas se reasignan a una sola de las tiendas elegidas si alguna
+    tiene la cantidad completa.
+    """
+
+    def asignar(self, pedido, disponibles):
+        pendiente = {producto_id: cantidad for producto_id, cantidad in pedido.items() if cantidad > 0}
+        por_tienda = {}
+        for producto_id in pendiente:
+            for tienda_id, stock in disponibles.get(producto_id, {}).items():
+                if stock > 0:
+                    por_tienda.setdefault(tienda_id, {})[producto_id] = stock
+
+        tomado = {}
+        while pendiente and por_tienda:
+            def puntaje(tienda_id):
+                completas = unidades = 0
+                for producto_id, stock in por_tienda[tienda_id].items():
+                    falta = pendiente.get(producto_id, 0)
+                    completas += stock >= falta > 0
+                    unidades += min(stock, falta)
+                return completas, unidades, -tienda_id
+
+            elegida = max(por_tienda, key=puntaje)
+            stock_elegida = por_tienda.pop(elegida)
+            for producto_id, stock in stock_elegida.items():
+                falta = pendiente.get(producto_id)
+                if not falta:
+                    continue
+                cantidad = min(stock, falta)
+                tomado.setdefault(producto_id, {})[elegida] = cantidad
+                if cantidad == falta:
+                    del pendiente[producto_id]
+                else:
+                    pendiente[producto_id] = falta - cantidad
+            if not any(producto_id in pendiente for stock in por_tienda.values() for producto_id in stock):
+                break
+
+        elegidas = {tienda_id for tiendas in tomado.values() for tienda_id in tiendas}
+        asignacion = Asignacion(faltantes=pendiente)
+        for producto_id, tiendas in tomado.items():
+            if len(tiendas) > 1 and producto_id not in pendiente:
+                total = sum(tiendas.values())
+                completa = min(
+                    (tienda_id for tienda_id in elegidas if disponibles[producto_id].get(tienda_id, 0) >= total),
+                    default=None,
+                )
+                if completa is not None:
+                    tiendas = {completa: total}
+            for tienda_id, cantidad in sorted(tiendas.items()):
+                asignacion.agregar(producto_id, tienda_id, cantidad)
+        return asignacion
+
+
+def asignador_configurado():
+    """Instancia del asignador de settings.ASIGNADOR_STOCK (ruta de importación)."""
+    return import_string(getattr(settings, 'ASIGNADOR_STOCK', 'productos.asignacion.MinimasTiendasAsignador'))()
@@ -0,0 +1,167 @@
+"""
+Caché de las respuestas públicas del catálogo.
+
+Las entradas se guardan en el alias de caché `catalogo` usando como versión
+de Django el número de versión del catálogo. Cualquier alta, cambio o baja de
+Producto, StockTienda o Tienda incrementa esa versión, con lo que todas las
+entradas anteriores dejan de leerse y el backend las descarta por TTL o por
+MAX_ENTRIES. El incremento se hace al confirmar la transacción: si se hiciera
+antes, un GET concurrente podría guardar las filas viejas bajo la versión nueva.
+
+Cada entrada guarda además su ETag (hash del contenido) y el momento del último
+cambio del catálogo, que se usan para responder GET condicionales con 304.
+"""
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.utils import encoders
+
+ALIAS = 'catalogo'
+CLAVE_VERSION = 'catalogo:version'
+CLAVE_MODIFICADO = 'catalogo:modificado'
+TTL_POR_DEFECTO = 300
+
+
+def cache_catalogo():
+    return caches[ALIAS]
+
+
+def _version_inicial():
+    # Si la clave de versión se pierde (reinicio o expulsión), se parte de un
+    # valor basado en la hora para no reutilizar versiones que sigan en caché
+    return int(time.time() * 1000)
+
+
+def version_catalogo():
+    return estado_catalogo()[0]
+
+
+def estado_catalogo():
+    """Versión actual del catálogo y momento (epoch) de su último cambio conocido."""
+    cache = cache_catalogo()
+    valores = cache.get_many([CLAVE_VERSION, CLAVE_MODIFICADO])
+    if CLAVE_VERSION not in valores or CLAVE_MODIFICADO not in valores:
+        cache.add(CLAVE_VERSION, _version_inicial(), None)
+        cache.add(CLAVE_MODIFICADO, time.time(), None)
+        valores = cache.get_many([CLAVE_VERSION, CLAVE_MODIFICADO])
+    return valores.get(CLAVE_VERSION, 0), valores.get(CLAVE_MODIFICADO, time.time())
+
+
+def invalidar_catalogo():
+    """Incrementa la versión del catálogo, invalidando todas las entradas cacheadas."""
+    cache = cache_catalogo()
+    cache.set(CLAVE_MODIFICADO, time.time(), None)
+    try:
+        return cache.incr(CLAVE_VERSION)
+    except ValueError:
+        version = _version_inicial()
+        cache.set(CLAVE_VERSION, version, None)
+        return version
+
+
+def invalidar_al_confirmar():
+    """Invalida el catálogo cuando se confirme la transacción actual (de inmediato si no hay una)."""
+    transaction.on_commit(invalidar_catalogo)
+
+
+def ttl(accion):
+    return getattr(settings, 'CATALOGO_CACHE_TTL', {}).get(accion, TTL_POR_DEFECTO)
+
+
+def _contar(accion, resultado):
+    cache = cache_catalogo()
+    clave = f'catalogo:stats:{accion}:{resultado}'
+    cache.add(clave, 0, None)
+    try:
+        cache.incr(clave)
+    except ValueError:
+        pass
+
+
+def estadisticas():
+    """Aciertos y fallos por acción, con la versión actual del catálogo."""
+    cache = cache_catalogo()
+    acciones = getattr(settings, 'CATALOGO_CACHE_TTL', {}).keys()
+    claves = [f'catalogo:stats:{accion}:{resultado}' for accion in acciones for resultado in ('hit', 'miss')]
+    valores = cache.get_many(claves)
+    por_accion = {}
+    for accion in acciones:
+        aciertos = valores.get(f'catalogo:stats:{accion}:hit', 0)
+        fallos = valores.get(f'catalogo:stats:{accion}:miss', 0)
+        total = aciertos + fallos
+        por_accion[accion] = {
+            'hits': aciertos,
+            'misses': fallos,
+            'hit_ratio': round(aciertos / total, 4) if total else None,
+        }
+    return {'version': version_catalogo(), 'acciones': por_accion}
+
+
+def obtener_o_calcular(clave, calcular, accion):
+    """Valor cacheado para `clave` en la versión actual del catálogo, calculándolo si falta."""
+    cache = cache_catalogo()
+    version = version_catalogo()
+    valor = cache.get(clave, version=version)
+    if valor is not None:
+        _contar(accion, 'hit')
+        return valor
+    _contar(accion, 'miss')
+    valor = calcular()
+    cache.set(clave, valor, ttl(accion), version=version)
+    return valor
+
+
+def etag_de(data):
+    """ETag fuerte a partir del contenido JSON de la respuesta."""
+    contenido = json.dumps(data, cls=encoders.JSONEncoder, ensure_ascii=False, separators=(',', ':'))
+    return '"%s"' % hashlib.md5(contenido.encode()).hexdigest()
+
+
+def clave_request(accion, request):
+    parametros = '&'.join(f'{k}={v}' for k, v in sorted(request.query_params.lists()))
+    firma = hashlib.md5(f'{request.path}?{parametros}'.encode()).hexdigest()
+    return f'catalogo:{accion}:{firma}'
+
+
+class CatalogoCacheMixin:
+    """
+    Cachea la respuesta de las acciones públicas de solo lectura del catálogo
+    y la valida con ETag (hash del contenido) y Last-Modified (último cambio
+    del catálogo), respondiendo 304 sin serializar cuando el cliente ya la tiene.
+    """
+
+    def respuesta_cacheada(self, accion, construir):
+        """
+        Devuelve la respuesta cacheada para esta acción y query string, o la
+        construye con `construir()` y la guarda si fue exitosa.
+        """
+        cache = cache_catalogo()
+        clave = clave_request(accion, self.request)
+        version, modificado = estado_catalogo()
+        entrada = cache.get(clave, version=version)
+        if entrada is not None:
+            _contar(accion, 'hit')
+        else:
+            _contar(accion, 'miss')
+            response = construir()
+            if response.status_code != status.HTTP_200_OK:
+                return response
+            entrada = {'data': response.data, 'etag': etag_de(response.data), 'modificado': int(modificado)}
+            cache.set(clave, entrada, ttl(accion), version=version)
+
+        response = get_conditional_response(
+            self.request, etag=entrada['etag'], last_modified=entrada['modificado']
+        ) or Response(entrada['data'])
+        response['ETag'] = entrada['etag']
+        response['Last-Modified'] = http_date(entrada['modificado'])
+        # El navegador puede guardarla, pero debe revalidarla en cada uso
+        response['Cache-Control'] = 'no-cache'
+        return response
@@ -0,0 +1,257 @@
+"""
+Importación y exportación masiva de productos y stock en CSV o NDJSON.
+
+La importación lee el archivo fila a fila y escribe por lotes: cada lote se
+valida, se cruza con lo existente en una consulta y se guarda con
+bulk_create/bulk_update dentro de su propia transacción, así la memoria queda
+acotada por el tamaño del lote y no por el del archivo. La exportación recorre
+la tabla con un cursor del servidor (`iterator()`) y va generando texto.
+
+Los cambios de cantidad de la importación de stock quedan en el libro de
+StockMovimiento como ajustes, en la misma transacción de su lote.
+"""
+import csv
+import io
+import json
+
+from django.db import transaction
+from django.utils import timezone
+
+from .cache import invalidar_al_confirmar
+from .eventos_service import publicar_cambios
+from .models import Producto, StockMovimiento, StockTienda, Tienda
+from .movimientos_service import movimiento, registrar
+from .search import reiniciar_indice
+from .serializers import ProductoImportacionSerializer, StockImportacionSerializer
+from .stock_service import bloquear_filas, sincronizar_totales
+
+FORMATOS = ('csv', 'ndjson')
+TAMANO_LOTE = 1000
+TAMANO_CURSOR = 2000
+# Errores detallados que se devuelven; el resto solo se cuenta
+MAX_ERRORES = 1000
+
+COLUMNAS_PRODUCTO = ['sku', 'nombre', 'descripcion', 'precio', 'categoria', 'marca', 'imagen_url']
+COLUMNAS_STOCK = ['sku', 'tienda', 'cantidad', 'stock_minimo']
+
+
+class FormatoInvalido(ValueError):
+    pass
+
+
+def formato_de(nombre_archivo, formato=None):
+    """Formato pedido explícitamente o deducido de la extensión del archivo."""
+    if not formato and nombre_archivo:
+        formato = nombre_archivo.rsplit('.', 1)[-1]
+    formato = (formato or '').lower()
+    if formato == 'jsonl':
+        formato = 'ndjson'
+    if formato not in FORMATOS:
+        raise FormatoInvalido(f"Formato no soportado: '{formato}'. Use csv o ndjson")
+    return formato
+
+
+def leer_filas(archivo, formato):
+    """
+    Recorre un archivo binario y produce (número de fila, fila, error), con la
+    fila como diccionario o None si no se pudo interpretar.
+    """
+    texto = io.TextIOWrapper(archivo, encoding='utf-8-sig', newline='')
+    try:
+        if formato == 'csv':
+            for numero, fila in enumerate(csv.DictReader(texto), start=1):
+                # Las columnas vacías cuentan como ausentes
+                yield numero, {k: v for k, v in fila.items() if k and v not in (None, '')}, None
+        else:
+            numero = 0
+            for linea in texto:
+                if not linea.strip():
+                    continue
+                numero += 1
+                try:
+                    fila = json.loads(linea)
+                except ValueError as e:
+                    yield numero, None, f'JSON inválido: {e}'
+                    continue
+                if not isinstance(fila, dict):
+                    yield numero, None, 'Cada línea debe ser un objeto JSON'
+                    continue
+                yield numero, fila, None
+    finally:
+        # No cerrar el archivo subyacente al descartar el envoltorio de texto
+        texto.detach()
+
+
+class ResultadoImportacion:
+    def __init__(self):
+        self.procesadas = 0
+        self.creados = 0
+        self.actualizados = 0
+        self.con_error = 0
+        self.errores = []
+
+    def error(self, numero, detalle):
+        self.con_error += 1
+        if len(self.errores) < MAX_ERRORES:
+            self.errores.append({'fila': numero, 'errores': detalle})
+
+    def como_dict(self):
+        return {
+            'procesadas': self.procesadas,
+            'creados': self.creados,
+            'actualizados': self.actualizados,
+            'con_error': self.con_error,
+            'errores': self.errores,
+        }
+
+
+def _por_lotes(filas, resultado, serializer_class, tamano):
+    """Valida las filas y las agrupa en lotes de (número, datos validados)."""
+    lote = []
+    for numero, fila, error in filas:
+        resultado.procesadas += 1
+        if error:
+            resultado.error(numero, {'fila': [error]})
+            continue
+        serializer = serializer_class(data=fila)
+        if not serializer.is_valid():
+            resultado.error(numero, serializer.errors)
+            continue
+        lote.append((numero, serializer.validated_data))
+        if len(lote) >= tamano:
+            yield lote
+            lote = []
+    if lote:
+        yield lote
+
+
+def importar_productos(filas, tamano_lote=TAMANO_LOTE):
+    """Crea o actualiza productos por sku. Devuelve el resumen con los errores por fila."""
+    resultado = ResultadoImportacion()
+    for lote in _por_lotes(filas, resultado, ProductoImportacionSerializer, tamano_lote):
+        # Si un sku se repite en el lote, gana la última fila
+        por_sku = {datos['sku']: datos for _, datos in lote}
+        ahora = timezone.now()
+        with transaction.atomic():
+            existentes = Producto.objects.in_bulk(list(por_sku), field_name='sku')
+            nuevos, modificados, campos = [], [], {'fecha_actualizacion'}
+            for sku, datos in por_sku.items():
+                producto = existentes.get(sku)
+                if producto is None:
+                    nuevos.append(Producto(**datos))
+                    continue
+                for campo, valor in datos.items():
+                    setattr(producto, campo, valor)
+                    campos.add(campo)
+                producto.fecha_actualizacion = ahora
+                modificados.append(producto)
+            Producto.objects.bulk_create(nuevos)
+            if modificados:
+                Producto.objects.bulk_update(modificados, sorted(campos))
+        resultado.creados += len(nuevos)
+        resultado.actualizados += len(modificados)
+
+    if resultado.creados or resultado.actualizados:
+        # bulk_create/bulk_update no emiten señales
+        reiniciar_indice()
+        invalidar_al_confirmar()
+    return resultado.como_dict()
+
+
+def importar_stock(filas, tamano_lote=TAMANO_LOTE, usuario=None):
+    """
+    Crea o actualiza el stock por (sku, tienda) y registra cada cambio de
+    cantidad como ajuste de `usuario`. Devuelve el resumen con los errores por fila.
+    """
+    resultado = ResultadoImportacion()
+    tiendas = set(Tienda.objects.values_list('id', flat=True))
+    for lote in _por_lotes(filas, resultado, StockImportacionSerializer, tamano_lote):
+        productos = dict(
+            Producto.objects.filter(sku__in={datos['sku'] for _, datos in lote}).values_list('sku', 'id')
+        )
+        por_clave = {}
+        for numero, datos in lote:
+            if datos['sku'] not in productos:
+                resultado.error(numero, {'sku': [f"No existe un producto con sku '{datos['sku']}'"]})
+            elif datos['tienda'] not in tiendas:
+                resultado.error(numero, {'tienda': [f"No existe la tienda {datos['tienda']}"]})
+            else:
+                por_clave[(productos[datos['sku']], datos['tienda'])] = datos
+        if not por_clave:
+            continue
+
+        producto_ids = {producto_id for producto_id, _ in por_clave}
+        ahora = timezone.now()
+        with transaction.atomic():
+            # Bloquea las filas hasta el commit: el ajuste del libro es contra su cantidad de ahora
+            anteriores = bloquear_filas(por_clave)
+            existentes = {
+                (stock.producto_id, stock.tienda_id): stock
+                for stock in StockTienda.objects.filter(producto_id__in=producto_ids)
+                if (stock.producto_id, stock.tienda_id) in por_clave
+            }
+            nuevos, modificados = [], []
+            for (producto_id, tienda_id), datos in por_clave.items():
+                stock = existentes.get((producto_id, tienda_id))
+                if stock is None:
+                    nuevos.append(StockTienda(
+                        producto_id=producto_id, tienda_id=tienda_id,
+                        cantidad=datos['cantidad'], stock_minimo=datos.get('stock_minimo', 0),
+                    ))
+                    continue
+                stock.cantidad = datos['cantidad']
+                stock.stock_minimo = datos.get('stock_minimo', stock.stock_minimo)
+                stock.fecha_actualizacion = ahora
+                modificados.append(stock)
+            StockTienda.objects.bulk_create(nuevos)
+            StockTienda.objects.bulk_update(modificados, ['cantidad', 'stock_minimo', 'fecha_actualizacion'])
+            movimientos = []
+            for stock in nuevos + modificados:
+                delta = stock.cantidad - anteriores.get((stock.producto_id, stock.tienda_id), 0)
+                if delta:
+                    movimientos.append(movimiento(stock, StockMovimiento.AJUSTE, delta, usuario=usuario, fecha=ahora))
+            registrar(movimientos)
+            sincronizar_totales(producto_ids)
+            publicar_cambios({
+                (stock.producto_id, stock.tienda_id): stock.cantidad for stock in nuevos + modificados
+            })
+        resultado.creados += len(nuevos)
+        resultado.actualizados += len(modificados)
+
+    if resultado.creados or resultado.actualizados:
+        invalidar_al_confirmar()
+    return resultado.como_dict()
+
+
+class _Eco:
+    """Pseudo-archivo para csv.writer: devuelve lo escrito en vez de guardarlo."""
+
+    def write(self, valor):
+        return valor
+
+
+def _serializar(columnas, filas, formato):
+    if formato == 'csv':
+        escritor = csv.writer(_Eco())
+        yield escritor.writerow(columnas)
+        for fila in filas:
+            yield escritor.writerow(['' if valor is None else valor for valor in fila])
+    else:
+        for fila in filas:
+            yield json.dumps(dict(zip(columnas, fila)), ensure_ascii=False, default=str) + '\n'
+
+
+def exportar_productos(formato, queryset=None):
+    """Genera el catálogo en el formato pedido, leyendo la tabla con un cursor del servidor."""
+    queryset = Producto.objects.all() if queryset is None else queryset
+    filas = queryset.order_by('id').values_list(*COLUMNAS_PRODUCTO).iterator(chunk_size=TAMANO_CURSOR)
+    return _serializar(COLUMNAS_PRODUCTO, filas, formato)
+
+
+def exportar_stock(formato, queryset=None):
+    """Genera el stock por tienda en el formato pedido, identificando el producto por sku."""
+    queryset = StockTienda.objects.all() if queryset is None else queryset
+    filas = queryset.order_by('id').values_list(
+        'producto__sku', 'tienda_id', 'cantidad', 'stock_minimo'
+    ).iterator(chunk_size=TAMANO_CURSOR)
+    return _serializar(COLUMNAS_STOCK, filas, formato)
@@ -0,0 +1,210 @@
+"""
+Tiendas más cercanas a un punto, con stock para un pedido.
+
+Las tiendas activas con coordenadas se guardan en un k-d tree en memoria del
+proceso sobre vectores unitarios 3D: la distancia euclídea entre vectores (la
+cuerda) crece igual que la distancia sobre la esfera, así que el árbol
+devuelve las tiendas en orden de distancia real, sin casos especiales en el
+antimeridiano ni cerca de los polos.
+
+Las señales de Tienda lo mantienen al día sin reconstruirlo en cada cambio:
+las altas y las tiendas movidas van a una lista de pendientes que se recorre
+aparte, las bajas se descartan al leer, y el árbol se rehace cuando los
+pendientes pasan de MAX_PENDIENTES_INDICE.
+"""
+import heapq
+import itertools
+import math
+import threading
+
+from django.db.models import Count, Q
+
+RADIO_TIERRA_KM = 6371.0088
+MAX_PENDIENTES_INDICE = 64
+
+
+def vector(latitud, longitud):
+    """Punto de la esfera unitaria para unas coordenadas en grados."""
+    lat, lon = math.radians(latitud), math.radians(longitud)
+    return (math.cos(lat) * math.cos(lon), math.cos(lat) * math.sin(lon), math.sin(lat))
+
+
+def distancia_km(cuerda2):
+    """Distancia sobre la superficie para el cuadrado de la cuerda entre dos vectores unitarios."""
+    return 2 * RADIO_TIERRA_KM * math.asin(min(1.0, math.sqrt(cuerda2) / 2))
+
+
+def _cuerda2(a, b):
+    return (a[0] - b[0]) ** 2 + (a[1] - b[1]) ** 2 + (a[2] - b[2]) ** 2
+
+
+class _Nodo:
+    __slots__ = ('punto', 'tienda_id', 'eje', 'menor', 'mayor')
+
+    def __init__(self, punto, tienda_id, eje, menor, mayor):
+        self.punto = punto
+        self.tienda_id = tienda_id
+        self.eje = eje
+        self.menor = menor
+        self.mayor = mayor
+
+
+def _construir(puntos, profundidad=0):
+    """k-d tree balanceado sobre [(punto, tienda_id)], partiendo por la mediana."""
+    if not puntos:
+        return None
+    eje = profundidad % 3
+    puntos.sort(key=lambda item: item[0][eje])
+    medio = len(puntos) // 2
+    punto, tienda_id = puntos[medio]
+    return _Nodo(
+        punto, tienda_id, eje,
+        _construir(puntos[:medio], profundidad + 1),
+        _construir(puntos[medio + 1:], profundidad + 1),
+    )
+
+
+class IndiceTiendas:
+    """
+    Índice espacial de tiendas. Se construye con tuplas (id, latitud,
+    longitud) y admite altas, movimientos y bajas individuales.
+    """
+
+    def __init__(self, filas=()):
+        self._lock = threading.RLock()
+        self._puntos = {}  # tienda_id -> vector actual
+        self._raiz = None
+        self._pendientes = {}  # tienda_id -> vector, aún fuera del árbol
+        for tienda_id, latitud, longitud in filas:
+            self._puntos[tienda_id] = vector(latitud, longitud)
+        self._reconstruir()
+
+    def __len__(self):
+        return len(self._puntos)
+
+    def _reconstruir(self):
+        self._raiz = _construir([(punto, tienda_id) for tienda_id, punto in self._puntos.items()])
+        self._pendientes = {}
+
+    def indexar(self, tienda_id, latitud, longitud):
+        punto = vector(latitud, longitud)
+        with self._lock:
+            if self._puntos.get(tienda_id) == punto:
+                return
+            self._puntos[tienda_id] = punto
+            self._pendientes[tienda_id] = punto
+            if len(self._pendientes) > MAX_PENDIENTES_INDICE:
+                self._reconstruir()
+
+    def eliminar(self, tienda_id):
+        with self._lock:
+            self._puntos.pop(tienda_id, None)
+            self._pendientes.pop(tienda_id, None)
+
+    def cercanas(self, latitud, longitud, cantidad, candidatas=None):
+        """
+        Hasta `cantidad` pares (tienda_id, distancia en km), de la más cercana
+        a la más lejana, entre las tiendas de `candidatas` (todas si es None).
+        """
+        if cantidad < 1:
+            return []
+        consulta = vector(latitud, longitud)
+        with self._lock:
+            puntos, pendientes, raiz = self._puntos, list(self._pendientes.items()), self._raiz
+            if candidatas is not None and len(candidatas) * 8 < len(puntos):
+                # Pocas candidatas: medirlas a todas es más barato que recorrer el árbol
+                medidas = [
+                    (_cuerda2(consulta, puntos[tienda_id]), tienda_id)
+                    for tienda_id in candidatas if tienda_id in puntos
+                ]
+                return [(tienda_id, distancia_km(d2)) for d2, tienda_id in heapq.nsmallest(cantidad, medidas)]
+
+            # Búsqueda best-first: el heap mezcla nodos (con una cota inferior de
+            # la distancia de todo su subárbol) y tiendas (con su distancia
+            # exacta); cuando sale una tienda, ninguna otra puede estar más cerca
+            orden = itertools.count()
+            heap = []
+            for tienda_id, punto in pendientes:
+                if candidatas is None or tienda_id in candidatas:
+                    heap.append((_cuerda2(consulta, punto), next(orden), tienda_id, None))
+            if raiz is not None:
+                heap.append((0.0, next(orden), None, raiz))
+            heapq.heapify(heap)
+            resultado = []
+            while heap and len(resultado) < cantidad:
+                cota, _, tienda_id, nodo = heapq.heappop(heap)
+                if nodo is None:
+                    resultado.append((tienda_id, distancia_km(cota)))
+                    continue
+                # Un nodo cuya tienda se movió o se borró sigue partiendo el espacio, pero no se devuelve
+                if puntos.get(nodo.tienda_id) is nodo.punto and (
+                    candidatas is None or nodo.tienda_id in candidatas
+                ):
+                    heapq.heappush(heap, (_cuerda2(consulta, nodo.punto), next(orden), nodo.tienda_id, None))
+                diferencia = consulta[nodo.eje] - nodo.punto[nodo.eje]
+                cerca, lejos = (nodo.menor, nodo.mayor) if diferencia < 0 else (nodo.mayor, nodo.menor)
+                if cerca is not None:
+                    heapq.heappush(heap, (cota, next(orden), None, cerca))
+                if lejos is not None:
+                    heapq.heappush(heap, (max(cota, diferencia * diferencia), next(orden), None, lejos))
+        return resultado
+
+
+_indice = None
+_indice_lock = threading.Lock()
+
+
+def obtener_indice():
+    """Índice de tiendas del proceso, construido la primera vez que se usa."""
+    global _indice
+    if _indice is None:
+        with _indice_lock:
+            if _indice is None:
+                from .models import Tienda
+                _indice = IndiceTiendas(
+                    Tienda.objects.filter(activa=True, latitud__isnull=False, longitud__isnull=False)
+                    .values_list('id', 'latitud', 'longitud').order_by().iterator(chunk_size=5000)
+                )
+    return _indice
+
+
+def actualizar_en_indice(tienda):
+    if _indice is None:
+        return
+    if tienda.activa and tienda.latitud is not None and tienda.longitud is not None:
+        _indice.indexar(tienda.id, tienda.latitud, tienda.longitud)
+    else:
+        _indice.eliminar(tienda.id)
+
+
+def eliminar_de_indice(tienda_id):
+    if _indice is not None:
+        _indice.eliminar(tienda_id)
+
+
+def reiniciar_indice():
+    global _indice
+    _indice = None
+
+
+def tiendas_con_stock(pedido):
+    """Ids de las tiendas que tienen todo el pedido ({producto_id: cantidad}), en una consulta."""
+    from .models import StockTienda
+    condicion = Q()
+    for producto_id, cantidad in pedido.items():
+        condicion |= Q(producto_id=producto_id, cantidad__gte=cantidad)
+    return set(
+        StockTienda.objects.filter(condicion).values('tienda_id').annotate(
+            lineas=Count('producto_id', distinct=True)
+        ).filter(lineas=len(pedido)).values_list('tienda_id', flat=True)
+    )
+
+
+def tiendas_cercanas(latitud, longitud, pedido=None, cantidad=5):
+    """
+    Las `cantidad` tiendas activas más cercanas al punto que pueden despachar
+    todo el `pedido` ({producto_id: cantidad}), como [(tienda_id, km)].
+    Sin pedido, las más cercanas sin mirar el stock.
+    """
+    candidatas = tiendas_con_stock(pedido) if pedido else None
+    return obtener_indice().cercanas(latitud, longitud, cantidad, candidatas=candidatas)
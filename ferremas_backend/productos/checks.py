@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.core.checks import Error, Tags, register
+
+CACHES_LOCALES = {'django.core.cache.backends.locmem.LocMemCache'}
+
+
+def cache_local_al_proceso(alias):
+    """Si el alias de caché vive en la memoria de cada proceso (cada worker tendría la suya)."""
+    return settings.CACHES.get(alias, {}).get('BACKEND') in CACHES_LOCALES
+
+
+@register(Tags.caches)
+def cache_catalogo_compartida(app_configs, **kwargs):
+    """
+    Sin DEBUG la caché `catalogo` debe ser compartida: la versión del catálogo
+    vive en ella, y con una por worker los demás seguirían sirviendo (y
+    validando con ETag) las respuestas anteriores a un cambio.
+    """
+    if settings.DEBUG or not cache_local_al_proceso('catalogo'):
+        return []
+    return [Error(
+        "La caché 'catalogo' es local al proceso (LocMemCache) con DEBUG=False.",
+        hint='Configure CATALOGO_CACHE_BACKEND y CATALOGO_CACHE_LOCATION con una caché compartida '
+             '(Redis, Memcached o FileBasedCache en un solo servidor).',
+        id='productos.E001',
+    )]
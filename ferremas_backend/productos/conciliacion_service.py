@@ -0,0 +1,263 @@
+"""
+Conciliación del stock contra un conteo físico y contra el stock esperado.
+
+Todas las fuentes se recorren ordenadas por (sku, tienda) y se cruzan con un
+merge-join, sin cargar ninguna en memoria:
+
+- sistema: StockTienda, con un cursor del servidor (`iterator()`).
+- contado: el archivo de conteo (CSV o NDJSON con sku, tienda y cantidad),
+  ordenado por partes en archivos temporales y mezclado con heapq.merge.
+- esperado: el último StockSnapshot de la fila más los movimientos del libro
+  posteriores, salvo las ventas, que se toman de ItemOrden (por fecha de la
+  orden). Sin snapshot se parte de cero, así que conviene correr antes
+  compactar_movimientos.
+
+La base ordena los sku con collation binaria ("C" en PostgreSQL), que es el
+mismo orden en que Python compara textos; sin eso el merge-join se desalinea.
+
+Las diferencias van a un reporte CSV a medida que aparecen. Con `aplicar`, el
+conteo se impone con productos.stock_service.ajustar_en_lote en lotes,
+después de recorrer todo: las correcciones esperan en un archivo temporal,
+así no se escribe sobre las tablas mientras sus cursores siguen abiertos.
+"""
+import csv
+import heapq
+import itertools
+import tempfile
+import time
+from operator import itemgetter
+
+from django.db import connection
+from django.db.models import F, Sum, Value
+from django.db.models.functions import Coalesce, Collate
+from django.utils import timezone
+
+from carrito.models import ItemOrden
+
+from .models import Producto, StockMovimiento, StockTienda
+from .movimientos_service import EPOCA, _ultimo_snapshot
+from .stock_service import LOTE_ESCRITURA, ajustar_en_lote
+
+TAMANO_CURSOR = 5000
+# Filas del conteo que se ordenan en memoria antes de volcarlas a un temporal
+TAMANO_ORDEN = 200000
+MAX_ERRORES = 1000
+COLUMNAS_REPORTE = ['sku', 'tienda', 'sistema', 'contado', 'esperado', 'diferencias']
+
+
+class ResultadoConciliacion:
+    def __init__(self):
+        self.filas = 0
+        self.claves = 0
+        self.diferencias_conteo = 0
+        self.no_contadas = 0
+        self.diferencias_esperado = 0
+        self.corregidas = 0
+        self.rechazadas = 0
+        self.con_error = 0
+        self.errores = []
+        self.segundos = 0
+
+    def error(self, numero, detalle):
+        self.con_error += 1
+        if len(self.errores) < MAX_ERRORES:
+            self.errores.append({'fila': numero, 'error': detalle})
+
+    def como_dict(self):
+        return {
+            'filas': self.filas,
+            'claves': self.claves,
+            'diferencias_conteo': self.diferencias_conteo,
+            'no_contadas': self.no_contadas,
+            'diferencias_esperado': self.diferencias_esperado,
+            'corregidas': self.corregidas,
+            'rechazadas': self.rechazadas,
+            'con_error': self.con_error,
+            'errores': self.errores,
+            'segundos': round(self.segundos, 3),
+            'filas_por_segundo': round(self.filas / self.segundos) if self.segundos else None,
+        }
+
+
+def _sku(campo):
+    """Expresión del sku para ordenar igual que Python: por bytes, no por el idioma de la base."""
+    if connection.vendor == 'postgresql':
+        return Collate(F(campo), 'C')
+    return F(campo)
+
+
+def _filas_sistema(ahora):
+    """((sku, tienda), (producto_id, cantidad, snapshot)) de cada StockTienda, en orden."""
+    filas = StockTienda.objects.annotate(
+        snapshot=_ultimo_snapshot(ahora, 'cantidad'),
+    ).order_by(_sku('producto__sku').asc(), 'tienda_id').values_list(
+        'producto__sku', 'tienda_id', 'producto_id', 'cantidad', 'snapshot',
+    )
+    for sku, tienda_id, producto_id, cantidad, snapshot in filas.iterator(chunk_size=TAMANO_CURSOR):
+        yield (sku, tienda_id), (producto_id, cantidad, snapshot)
+
+
+def _posteriores_al_snapshot(queryset, fecha, ahora):
+    """Suma de `cantidad` por (sku, tienda) de lo ocurrido después del último snapshot de cada fila."""
+    filas = queryset.annotate(
+        corte=Coalesce(_ultimo_snapshot(ahora, 'fecha'), Value(EPOCA)),
+    ).filter(**{f'{fecha}__gt': F('corte'), f'{fecha}__lte': ahora}).values(
+        'producto__sku', 'tienda_id',
+    ).annotate(total=Sum('cantidad')).order_by(_sku('producto__sku').asc(), 'tienda_id')
+    for fila in filas.values_list('producto__sku', 'tienda_id', 'total').iterator(chunk_size=TAMANO_CURSOR):
+        yield (fila[0], fila[1]), fila[2]
+
+
+def _movidas(ahora):
+    """Neto de movimientos del libro que no son ventas, después del snapshot."""
+    return _posteriores_al_snapshot(
+        StockMovimiento.objects.exclude(tipo=StockMovimiento.VENTA), 'fecha', ahora
+    )
+
+
+def _vendidas(ahora):
+    """Unidades vendidas según ItemOrden, después del snapshot."""
+    return _posteriores_al_snapshot(
+        ItemOrden.objects.filter(tienda__isnull=False).annotate(fecha=F('orden__fecha_creacion')), 'fecha', ahora
+    )
+
+
+def _leer_conteo(filas, resultado):
+    for numero, fila, error in filas:
+        if error:
+            resultado.error(numero, error)
+            continue
+        try:
+            sku = str(fila['sku'])
+            tienda_id = int(fila['tienda'])
+            cantidad = int(fila['cantidad'])
+        except (KeyError, TypeError, ValueError):
+            resultado.error(numero, 'Se esperan sku, tienda y cantidad enteros')
+            continue
+        if cantidad < 0:
+            resultado.error(numero, 'La cantidad no puede ser negativa')
+            continue
+        yield (sku, tienda_id), cantidad
+
+
+def _conteo_ordenado(filas, resultado, directorio):
+    """
+    Conteo ordenado por (sku, tienda): por partes de TAMANO_ORDEN filas que se
+    ordenan en memoria y se vuelcan a temporales, y luego se mezclan. Dentro
+    de una misma clave se conserva el orden del archivo (gana la última fila).
+    """
+    partes, lote = [], []
+    for clave, cantidad in _leer_conteo(filas, resultado):
+        lote.append((clave, cantidad))
+        if len(lote) >= TAMANO_ORDEN:
+            partes.append(_volcar(lote, directorio))
+            lote = []
+    lote.sort(key=itemgetter(0))
+    if not partes:
+        return iter(lote)
+    if lote:
+        partes.append(_volcar(lote, directorio))
+    return heapq.merge(*(_leer_parte(parte) for parte in partes), key=itemgetter(0))
+
+
+def _volcar(lote, directorio):
+    lote.sort(key=itemgetter(0))
+    parte = tempfile.TemporaryFile('w+', dir=directorio, newline='', encoding='utf-8')
+    csv.writer(parte).writerows((sku, tienda_id, cantidad) for (sku, tienda_id), cantidad in lote)
+    parte.seek(0)
+    return parte
+
+
+def _leer_parte(parte):
+    with parte:
+        for sku, tienda_id, cantidad in csv.reader(parte):
+            yield (sku, int(tienda_id)), int(cantidad)
+
+
+def _etiquetar(nombre, filas, resultado):
+    for clave, valor in filas:
+        resultado.filas += 1
+        yield clave, nombre, valor
+
+
+def conciliar(conteo=None, esperado=False, aplicar=False, reporte=None, no_contadas=False, usuario=None):
+    """
+    Cruza StockTienda con las filas del conteo (las de carga_masiva_service.
+    leer_filas) y/o con el stock esperado, y escribe cada clave con
+    diferencias en `reporte` (archivo de texto, CSV). Con `no_contadas` se
+    reportan también las filas que el conteo no incluye (nunca se corrigen).
+    Con `aplicar` lleva las filas contadas a la cantidad del conteo.
+    Devuelve el resumen, con filas leídas por segundo.
+    """
+    if conteo is None and not esperado:
+        raise ValueError('Se necesita un conteo o comparar con el stock esperado')
+    resultado = ResultadoConciliacion()
+    inicio = time.perf_counter()
+    ahora = timezone.now()
+    escritor = csv.writer(reporte) if reporte is not None else None
+    if escritor:
+        escritor.writerow(COLUMNAS_REPORTE)
+
+    with tempfile.TemporaryDirectory(prefix='conciliacion-') as directorio:
+        fuentes = [_etiquetar('sistema', _filas_sistema(ahora), resultado)]
+        if conteo is not None:
+            fuentes.append(_etiquetar('contado', _conteo_ordenado(conteo, resultado, directorio), resultado))
+        if esperado:
+            fuentes.append(_etiquetar('movido', _movidas(ahora), resultado))
+            fuentes.append(_etiquetar('vendido', _vendidas(ahora), resultado))
+
+        correcciones = tempfile.TemporaryFile('w+', dir=directorio, newline='', encoding='utf-8') if aplicar else None
+        por_corregir = csv.writer(correcciones) if aplicar else None
+        for clave, grupo in itertools.groupby(heapq.merge(*fuentes, key=itemgetter(0)), key=itemgetter(0)):
+            resultado.claves += 1
+            valores = {nombre: valor for _, nombre, valor in grupo}
+            producto_id, sistema, snapshot = valores.get('sistema', (None, None, None))
+            contado = valores.get('contado')
+            diferencias = []
+            if conteo is not None:
+                if contado is None:
+                    if sistema is not None:
+                        resultado.no_contadas += 1
+                        if no_contadas:
+                            diferencias.append('no_contada')
+                elif contado != (sistema or 0):
+                    resultado.diferencias_conteo += 1
+                    diferencias.append('conteo')
+                    if por_corregir:
+                        por_corregir.writerow((clave[0], clave[1], producto_id or '', contado))
+            calculado = None
+            if esperado:
+                calculado = (snapshot or 0) + valores.get('movido', 0) - valores.get('vendido', 0)
+                if calculado != (sistema or 0):
+                    resultado.diferencias_esperado += 1
+                    diferencias.append('esperado')
+            if diferencias and escritor:
+                escritor.writerow([clave[0], clave[1], sistema, contado, calculado, ';'.join(diferencias)])
+
+        if aplicar:
+            correcciones.seek(0)
+            _aplicar(csv.reader(correcciones), resultado, usuario)
+            correcciones.close()
+
+    resultado.segundos = time.perf_counter() - inicio
+    return resultado.como_dict()
+
+
+def _aplicar(correcciones, resultado, usuario):
+    """Impone las cantidades contadas con ajustar_en_lote, de a LOTE_ESCRITURA filas."""
+    while lote := list(itertools.islice(correcciones, LOTE_ESCRITURA)):
+        # Las filas contadas que no existían en StockTienda se crean: falta el id del producto
+        sin_id = {sku for sku, _, producto_id, _ in lote if not producto_id}
+        ids = dict(Producto.objects.filter(sku__in=sin_id).values_list('sku', 'id')) if sin_id else {}
+        ajustes = []
+        for sku, tienda_id, producto_id, cantidad in lote:
+            producto_id = int(producto_id) if producto_id else ids.get(sku)
+            if producto_id is None:
+                resultado.rechazadas += 1
+                continue
+            ajustes.append({'producto': producto_id, 'tienda': int(tienda_id), 'cantidad': int(cantidad)})
+        for ajuste in ajustar_en_lote(ajustes, usuario=usuario):
+            if ajuste['estado'] == 'aplicado':
+                resultado.corregidas += 1
+            else:
+                resultado.rechazadas += 1
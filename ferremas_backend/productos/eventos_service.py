@@ -0,0 +1,273 @@
+"""
+Cambios de stock en vivo para el stream SSE (productos/stream.py).
+
+Cada escritura de StockTienda publica, cuando su transacción se confirma, un
+lote de deltas {producto, tienda, cantidad} (cantidad None si la fila se
+borró). El broker del proceso los reparte a los suscriptores: cada uno es
+una cola asyncio atendida por su event loop, así miles de conexiones
+inactivas no ocupan un hilo cada una.
+
+Con varios workers, cada uno solo ve sus propias escrituras. Si
+STOCK_EVENTOS_RELE apunta a un relé (`manage.py rele_stock`, que reenvía cada
+línea a todos los workers conectados) los lotes se publican a través de él y
+todos los workers los reparten. Es un reemplazo local de un pub/sub externo
+como Redis, con la misma interfaz.
+"""
+import asyncio
+import json
+import logging
+import socket
+import threading
+import time
+
+from django.conf import settings
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+# Lotes pendientes por suscriptor antes de darlo por desfasado: se le avisa
+# que vuelva a leer la matriz en vez de acumular memoria sin límite
+MAX_PENDIENTES = 100
+ESPERA_RECONEXION = 1
+
+
+class Lote(list):
+    """
+    Deltas de un lote tal como los ve una suscripción. Las suscripciones con
+    el mismo filtro reciben el mismo Lote, así el stream lo codifica una vez
+    (`codificado`) para todas.
+    """
+    codificado = None
+
+
+class Suscripcion:
+    """
+    Lotes pendientes de un suscriptor. Se toca solo desde su event loop: el
+    broker le entrega con call_soon_threadsafe.
+    """
+
+    def __init__(self, loop, productos=None, tiendas=None):
+        self.loop = loop
+        self.productos = productos
+        self.tiendas = tiendas
+        self.filtro = (
+            frozenset(productos) if productos is not None else None,
+            frozenset(tiendas) if tiendas is not None else None,
+        )
+        self.pendientes = []
+        self.desfasada = False
+        self._espera = None
+        self._limite = None
+        self._temporizador = None
+
+    def filtrar(self, deltas):
+        if self.productos is None and self.tiendas is None:
+            return Lote(deltas)
+        return Lote(
+            delta for delta in deltas
+            if (self.productos is None or delta['producto'] in self.productos)
+            and (self.tiendas is None or delta['tienda'] in self.tiendas)
+        )
+
+    def entregar(self, lote):
+        if not lote or self.desfasada:
+            return
+        if len(self.pendientes) < MAX_PENDIENTES:
+            self.pendientes.append(lote)
+        else:
+            self.desfasada = True
+            self.pendientes = []
+        if self._espera is not None and not self._espera.done():
+            self._espera.set_result(None)
+
+    async def siguiente(self, espera=None):
+        """
+        Deltas llegados desde la llamada anterior, en una sola lista. None si
+        se desfasó: se perdieron lotes y el cliente debe releer el stock;
+        desde ahí la suscripción sigue normal. Lanza asyncio.TimeoutError si
+        no llega nada en `espera` segundos.
+        """
+        if not self.pendientes and not self.desfasada:
+            # Un future y un timer que solo se rearma al vencer, en vez de
+            # Queue + wait_for (una tarea y un timer por llamada): con miles de
+            # suscriptores eso se nota en el fan-out
+            self._espera = self.loop.create_future()
+            if espera is not None:
+                self._limite = self.loop.time() + espera
+                if self._temporizador is None:
+                    self._temporizador = self.loop.call_at(self._limite, self._vencer)
+            try:
+                await self._espera
+            finally:
+                self._espera = None
+        if self.desfasada:
+            self.desfasada = False
+            return None
+        lotes, self.pendientes = self.pendientes, []
+        return lotes[0] if len(lotes) == 1 else [delta for lote in lotes for delta in lote]
+
+    def _vencer(self):
+        self._temporizador = None
+        if self._espera is None or self._espera.done():
+            return
+        if self.loop.time() >= self._limite:
+            self._espera.set_exception(asyncio.TimeoutError())
+        else:
+            self._temporizador = self.loop.call_at(self._limite, self._vencer)
+
+
+class BrokerLocal:
+    """Reparte los lotes publicados a las suscripciones de este proceso."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._por_loop = {}
+
+    def suscribir(self, productos=None, tiendas=None):
+        """Se llama desde el event loop que va a leer la suscripción."""
+        suscripcion = Suscripcion(asyncio.get_running_loop(), productos, tiendas)
+        with self._lock:
+            self._por_loop.setdefault(suscripcion.loop, set()).add(suscripcion)
+        return suscripcion
+
+    def cancelar(self, suscripcion):
+        with self._lock:
+            suscripciones = self._por_loop.get(suscripcion.loop)
+            if suscripciones is not None:
+                suscripciones.discard(suscripcion)
+                if not suscripciones:
+                    del self._por_loop[suscripcion.loop]
+
+    @property
+    def suscriptores(self):
+        with self._lock:
+            return sum(len(suscripciones) for suscripciones in self._por_loop.values())
+
+    def publicar(self, deltas):
+        self.repartir(deltas)
+
+    def repartir(self, deltas):
+        """Una sola llamada por event loop, no por suscriptor: el reparto corre dentro del loop."""
+        with self._lock:
+            por_loop = [(loop, list(suscripciones)) for loop, suscripciones in self._por_loop.items()]
+        for loop, suscripciones in por_loop:
+            try:
+                loop.call_soon_threadsafe(_entregar_todas, suscripciones, deltas)
+            except RuntimeError:
+                # El loop se cerró sin cancelar sus suscripciones
+                with self._lock:
+                    self._por_loop.pop(loop, None)
+
+
+def _entregar_todas(suscripciones, deltas):
+    por_filtro = {}
+    for suscripcion in suscripciones:
+        lote = por_filtro.get(suscripcion.filtro)
+        if lote is None:
+            lote = por_filtro[suscripcion.filtro] = suscripcion.filtrar(deltas)
+        suscripcion.entregar(lote)
+
+
+class BrokerRele(BrokerLocal):
+    """
+    Publica a través del relé y reparte lo que el relé reenvía, incluidos los
+    lotes propios. Si el relé no responde, reparte solo en este proceso.
+    """
+
+    def __init__(self, host, puerto):
+        super().__init__()
+        self.direccion = (host, puerto)
+        self._conexion = None
+        self._lock_envio = threading.Lock()
+        threading.Thread(target=self._escuchar, name='rele-stock', daemon=True).start()
+
+    def publicar(self, deltas):
+        linea = (json.dumps(deltas, separators=(',', ':')) + '\n').encode()
+        with self._lock_envio:
+            conexion = self._conexion
+            if conexion is not None:
+                try:
+                    conexion.sendall(linea)
+                    return
+                except OSError:
+                    logger.warning('Relé de stock caído, se reparte solo en este proceso')
+        self.repartir(deltas)
+
+    def _escuchar(self):
+        while True:
+            try:
+                conexion = socket.create_connection(self.direccion)
+            except OSError:
+                time.sleep(ESPERA_RECONEXION)
+                continue
+            with self._lock_envio:
+                self._conexion = conexion
+            try:
+                for linea in conexion.makefile('rb'):
+                    self.repartir(json.loads(linea))
+            except (OSError, ValueError):
+                logger.exception('Error leyendo del relé de stock')
+            finally:
+                with self._lock_envio:
+                    self._conexion = None
+                conexion.close()
+            time.sleep(ESPERA_RECONEXION)
+
+
+async def servir_rele(host, puerto, listo=None):
+    """
+    Relé entre workers: cada línea que llega de una conexión se reenvía a
+    todas, también a la que la mandó. `listo` (asyncio.Event) se marca al
+    quedar escuchando.
+    """
+    conexiones = set()
+
+    async def atender(lector, escritor):
+        conexiones.add(escritor)
+        try:
+            while linea := await lector.readline():
+                for destino in list(conexiones):
+                    destino.write(linea)
+                await asyncio.gather(*(destino.drain() for destino in list(conexiones)), return_exceptions=True)
+        except ConnectionError:
+            pass
+        finally:
+            conexiones.discard(escritor)
+            escritor.close()
+
+    servidor = await asyncio.start_server(atender, host, puerto)
+    async with servidor:
+        if listo is not None:
+            listo.set()
+        await servidor.serve_forever()
+
+
+_broker = None
+_lock_broker = threading.Lock()
+
+
+def broker():
+    """Broker del proceso: BrokerRele si STOCK_EVENTOS_RELE ('host:puerto') está configurado."""
+    global _broker
+    with _lock_broker:
+        if _broker is None:
+            rele = getattr(settings, 'STOCK_EVENTOS_RELE', None)
+            if rele:
+                host, puerto = rele.rsplit(':', 1)
+                _broker = BrokerRele(host, int(puerto))
+            else:
+                _broker = BrokerLocal()
+    return _broker
+
+
+def publicar_cambios(cantidades):
+    """
+    Publica {(producto_id, tienda_id): cantidad o None} cuando la transacción
+    actual se confirme (de inmediato si no hay una).
+    """
+    deltas = [
+        {'producto': producto_id, 'tienda': tienda_id, 'cantidad': cantidad}
+        for (producto_id, tienda_id), cantidad in cantidades.items()
+    ]
+    if deltas:
+        transaction.on_commit(lambda: broker().publicar(deltas))
@@ -0,0 +1,93 @@
+from django.db.models import Case, Count, IntegerField, Value, When
+
+from .cache import obtener_o_calcular
+from .models import Producto, StockTienda
+
+# Rangos de precio en CLP: (desde, hasta), el último sin tope
+RANGOS_PRECIO = [
+    (0, 5000),
+    (5000, 10000),
+    (10000, 25000),
+    (25000, 50000),
+    (50000, 100000),
+    (100000, None),
+]
+
+CLAVE_RESUMEN = 'catalogo:facetas:resumen'
+
+# Máximo de ids por consulta cuando las facetas se calculan sobre resultados de búsqueda
+TAMANO_BLOQUE = 5000
+
+
+def _rango_precio():
+    return Case(
+        *[
+            When(precio__lt=hasta, then=Value(indice))
+            for indice, (_, hasta) in enumerate(RANGOS_PRECIO) if hasta is not None
+        ],
+        default=Value(len(RANGOS_PRECIO) - 1),
+        output_field=IntegerField(),
+    )
+
+
+def _contar(queryset, categorias, marcas, precios, tiendas):
+    # Una sola pasada agrupada por (categoria, marca, rango de precio)
+    filas = queryset.order_by().annotate(rango_precio=_rango_precio()).values(
+        'categoria', 'marca', 'rango_precio'
+    ).annotate(total=Count('id'))
+    for fila in filas:
+        categorias[fila['categoria']] = categorias.get(fila['categoria'], 0) + fila['total']
+        if fila['marca']:
+            marcas[fila['marca']] = marcas.get(fila['marca'], 0) + fila['total']
+        precios[fila['rango_precio']] += fila['total']
+
+    # Disponibilidad por tienda: productos distintos con stock en cada una
+    disponibles = StockTienda.objects.filter(
+        producto__in=queryset.order_by().values('id'), cantidad__gt=0
+    ).order_by().values('tienda', 'tienda__nombre').annotate(total=Count('producto', distinct=True))
+    for fila in disponibles:
+        clave = (fila['tienda'], fila['tienda__nombre'])
+        tiendas[clave] = tiendas.get(clave, 0) + fila['total']
+
+
+def calcular_facetas(queryset, ids=None):
+    """
+    Conteos por categoría, marca, rango de precio y tienda con stock para los
+    productos del queryset (o, si se indican, solo los de `ids`).
+    """
+    categorias, marcas, tiendas = {}, {}, {}
+    precios = [0] * len(RANGOS_PRECIO)
+    if ids is None:
+        _contar(queryset, categorias, marcas, precios, tiendas)
+    else:
+        # Los conteos son aditivos entre bloques disjuntos de productos
+        ids = list(ids)
+        for inicio in range(0, len(ids), TAMANO_BLOQUE):
+            bloque = queryset.filter(pk__in=ids[inicio:inicio + TAMANO_BLOQUE])
+            _contar(bloque, categorias, marcas, precios, tiendas)
+
+    def ordenar(conteos):
+        return [
+            {'valor': valor, 'total': total}
+            for valor, total in sorted(conteos.items(), key=lambda item: (-item[1], item[0]))
+        ]
+
+    return {
+        'categoria': ordenar(categorias),
+        'marca': ordenar(marcas),
+        'precio': [
+            {'desde': desde, 'hasta': hasta, 'total': precios[indice]}
+            for indice, (desde, hasta) in enumerate(RANGOS_PRECIO)
+        ],
+        'tienda': [
+            {'id': tienda_id, 'nombre': nombre, 'total': total}
+            for (tienda_id, nombre), total in sorted(tiendas.items(), key=lambda item: (-item[1], item[0][0]))
+        ],
+    }
+
+
+def resumen_facetas():
+    """Facetas de todo el catálogo, cacheadas hasta que cambie un producto, stock o tienda."""
+    return obtener_o_calcular(
+        CLAVE_RESUMEN, lambda: calcular_facetas(Producto.objects.all()), 'productos_facetas'
+    )
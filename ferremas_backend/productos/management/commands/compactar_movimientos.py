@@ -0,0 +1,37 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from productos.movimientos_service import compactar, purgar
+
+
+class Command(BaseCommand):
+    help = 'Guarda snapshots del stock a partir del libro de movimientos y, opcionalmente, purga los movimientos ya resumidos'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--hasta',
+            help='Fecha ISO 8601 del snapshot (por defecto, hace 5 minutos)',
+        )
+        parser.add_argument(
+            '--purgar-dias', type=int,
+            help='Borra los movimientos resumidos por un snapshot de hace más de N días',
+        )
+
+    def handle(self, *args, **options):
+        hasta = None
+        if options['hasta']:
+            hasta = parse_datetime(options['hasta'])
+            if hasta is None:
+                raise CommandError(f"Fecha inválida: {options['hasta']}")
+            if timezone.is_naive(hasta):
+                hasta = timezone.make_aware(hasta)
+
+        guardados = compactar(hasta)
+        self.stdout.write(self.style.SUCCESS(f"Snapshots guardados: {guardados}"))
+
+        if options['purgar_dias'] is not None:
+            borrados = purgar(timezone.now() - timedelta(days=options['purgar_dias']))
+            self.stdout.write(self.style.SUCCESS(f"Movimientos purgados: {borrados}"))
@@ -0,0 +1,64 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from productos.carga_masiva_service import FormatoInvalido, formato_de, leer_filas
+from productos.conciliacion_service import conciliar
+
+
+class Command(BaseCommand):
+    help = (
+        'Concilia StockTienda contra un conteo físico (CSV o NDJSON con sku, tienda y cantidad) '
+        'y/o contra el stock esperado según snapshots, libro de movimientos y ventas'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--conteo', help='Ruta del archivo de conteo .csv o .ndjson')
+        parser.add_argument('--formato', help='csv o ndjson (por defecto se deduce de la extensión)')
+        parser.add_argument('--esperado', action='store_true', help='Comparar también con el stock esperado')
+        parser.add_argument('--reporte', help='CSV de diferencias (por defecto, la salida estándar)')
+        parser.add_argument('--no-contadas', action='store_true', help='Reportar las filas que el conteo no incluye')
+        parser.add_argument('--aplicar', action='store_true', help='Llevar las filas contadas a la cantidad del conteo')
+
+    def handle(self, *args, **options):
+        if not options['conteo'] and not options['esperado']:
+            raise CommandError('Indique --conteo, --esperado o ambos')
+        if options['aplicar'] and not options['conteo']:
+            raise CommandError('--aplicar necesita --conteo')
+        archivo = reporte = None
+        try:
+            conteo = None
+            if options['conteo']:
+                try:
+                    formato = formato_de(options['conteo'], options['formato'])
+                except FormatoInvalido as e:
+                    raise CommandError(str(e))
+                archivo = open(options['conteo'], 'rb')
+                conteo = leer_filas(archivo, formato)
+            reporte = open(options['reporte'], 'w', newline='', encoding='utf-8') if options['reporte'] else sys.stdout
+            resultado = conciliar(
+                conteo, esperado=options['esperado'], aplicar=options['aplicar'],
+                reporte=reporte, no_contadas=options['no_contadas'],
+            )
+        finally:
+            if archivo is not None:
+                archivo.close()
+            if reporte is not None and reporte is not sys.stdout:
+                reporte.close()
+
+        # Con el reporte en la salida estándar, el resumen va a la de errores
+        salida = self.stderr if not options['reporte'] else self.stdout
+        for error in resultado['errores'][:50]:
+            salida.write(f"  Fila {error['fila']}: {error['error']}")
+        salida.write(
+            f"Filas leídas: {resultado['filas']} en {resultado['segundos']} s "
+            f"({resultado['filas_por_segundo']} filas/s), claves: {resultado['claves']}"
+        )
+        salida.write(
+            f"Diferencias con el conteo: {resultado['diferencias_conteo']}, no contadas: {resultado['no_contadas']}, "
+            f"diferencias con lo esperado: {resultado['diferencias_esperado']}, filas del conteo con error: {resultado['con_error']}"
+        )
+        if options['aplicar']:
+            salida.write(self.style.SUCCESS(
+                f"Corregidas: {resultado['corregidas']}, rechazadas: {resultado['rechazadas']}"
+            ))
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from productos.carga_masiva_service import (
+    FormatoInvalido, exportar_productos, exportar_stock, formato_de,
+)
+
+
+class Command(BaseCommand):
+    help = 'Exporta productos o stock por tienda a CSV o NDJSON sin cargar la tabla en memoria'
+
+    def add_arguments(self, parser):
+        parser.add_argument('tipo', choices=['productos', 'stock'])
+        parser.add_argument('archivo', nargs='?', default='-', help='Ruta de salida (por defecto la salida estándar)')
+        parser.add_argument('--formato', help='csv o ndjson (por defecto se deduce de la extensión, o csv)')
+
+    def handle(self, *args, **options):
+        destino = options['archivo']
+        try:
+            formato = formato_de(None if destino == '-' else destino, options['formato'] or ('csv' if destino == '-' else None))
+        except FormatoInvalido as e:
+            raise CommandError(str(e))
+        exportar = exportar_productos if options['tipo'] == 'productos' else exportar_stock
+
+        if destino == '-':
+            for linea in exportar(formato):
+                self.stdout.write(linea, ending='')
+            return
+        with open(destino, 'w', encoding='utf-8', newline='') as salida:
+            salida.writelines(exportar(formato))
+        self.stderr.write(self.style.SUCCESS(f'Exportado a {destino}'))
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from productos.carga_masiva_service import (
+    TAMANO_LOTE, FormatoInvalido, formato_de, importar_productos, importar_stock, leer_filas,
+)
+
+
+class Command(BaseCommand):
+    help = 'Importa productos (upsert por sku) o stock (upsert por producto y tienda) desde CSV o NDJSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('tipo', choices=['productos', 'stock'])
+        parser.add_argument('archivo', help='Ruta del archivo .csv o .ndjson')
+        parser.add_argument('--formato', help='csv o ndjson (por defecto se deduce de la extensión)')
+        parser.add_argument(
+            '--lote', type=int, default=TAMANO_LOTE,
+            help=f'Filas por transacción (por defecto {TAMANO_LOTE})',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            formato = formato_de(options['archivo'], options['formato'])
+        except FormatoInvalido as e:
+            raise CommandError(str(e))
+        importar = importar_productos if options['tipo'] == 'productos' else importar_stock
+
+        with open(options['archivo'], 'rb') as archivo:
+            resultado = importar(leer_filas(archivo, formato), tamano_lote=options['lote'])
+
+        for error in resultado['errores'][:50]:
+            self.stdout.write(f"  Fila {error['fila']}: {error['errores']}")
+        self.stdout.write(
+            f"Filas procesadas: {resultado['procesadas']}, creadas: {resultado['creados']}, "
+            f"actualizadas: {resultado['actualizados']}, con error: {resultado['con_error']}"
+        )
+        if resultado['con_error']:
+            self.stdout.write(self.style.WARNING('Importación terminada con errores'))
+        else:
+            self.stdout.write(self.style.SUCCESS('Importación terminada'))
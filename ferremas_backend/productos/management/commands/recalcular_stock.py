@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Max
+
+from productos.models import Producto
+from productos.stock_service import actualizar_totales, productos_descuadrados
+
+
+class Command(BaseCommand):
+    help = 'Verifica y reconstruye stock_total y tiendas_con_stock de los productos'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verificar', action='store_true',
+            help='Solo informa los productos descuadrados, sin corregirlos',
+        )
+        parser.add_argument(
+            '--lote', type=int, default=5000,
+            help='Cantidad de ids de producto por sentencia UPDATE (por defecto 5000)',
+        )
+
+    def handle(self, *args, **options):
+        descuadrados = productos_descuadrados()
+        cantidad = descuadrados.count()
+        for producto in descuadrados.only('id', 'sku', 'stock_total', 'tiendas_con_stock')[:20]:
+            self.stdout.write(
+                f"  {producto.sku}: stock_total {producto.stock_total} -> {producto.stock_total_real}, "
+                f"tiendas_con_stock {producto.tiendas_con_stock} -> {producto.tiendas_con_stock_real}"
+            )
+        self.stdout.write(f"Productos descuadrados: {cantidad}")
+
+        if options['verificar'] or not cantidad:
+            return
+
+        lote = options['lote']
+        max_id = Producto.objects.aggregate(max_id=Max('id'))['max_id'] or 0
+        actualizados = 0
+        for desde in range(0, max_id + 1, lote):
+            actualizados += actualizar_totales(
+                Producto.objects.filter(id__gte=desde, id__lt=desde + lote)
+            )
+        self.stdout.write(self.style.SUCCESS(f"Totales reconstruidos para {actualizados} productos"))
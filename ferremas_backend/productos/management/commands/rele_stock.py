@@ -0,0 +1,20 @@
+import asyncio
+
+from django.core.management.base import BaseCommand
+
+from productos.eventos_service import servir_rele
+
+
+class Command(BaseCommand):
+    help = 'Relé de cambios de stock entre workers (ver STOCK_EVENTOS_RELE)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--puerto', type=int, default=8765)
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"Relé de stock escuchando en {options['host']}:{options['puerto']}")
+        try:
+            asyncio.run(servir_rele(options['host'], options['puerto']))
+        except KeyboardInterrupt:
+            pass
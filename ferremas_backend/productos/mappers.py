@@ -0,0 +1,63 @@
+"""
+Serialización rápida del listado de productos a partir de filas de values().
+La salida es la misma que la de ProductoSerializer (ver config.serializacion_rapida).
+"""
+from functools import lru_cache
+
+from django.conf import settings
+from django.utils import timezone
+
+from config.serializacion_rapida import campos_de_serializer, compilar_mapper
+
+from .models import StockTienda
+from .serializers import ProductoSerializer, StockTiendaSerializer, url_imagen_versionada
+
+# Máximo de ids de producto por consulta de stock
+TAMANO_BLOQUE = 5000
+
+
+@lru_cache(maxsize=None)
+def _mapper_stock(zona):
+    especificacion, columnas = campos_de_serializer(StockTiendaSerializer, zona=zona)
+    return compilar_mapper(especificacion), columnas
+
+
+@lru_cache(maxsize=128)
+def _mapper_producto(campos, zona=None):
+    especificacion, columnas = campos_de_serializer(ProductoSerializer, nombres=campos, zona=zona, calculados={
+        'imagen_url': lambda fila: url_imagen_versionada(fila['imagen_url']),
+        'stock_por_tienda': lambda fila: fila['stock_por_tienda'],
+    })
+    if 'imagen_url' in campos:
+        columnas.append('imagen_url')
+    return compilar_mapper(especificacion), columnas
+
+
+def filas_productos(queryset, campos, ordering=None):
+    """Queryset de values() con las columnas que necesitan los campos pedidos (paginable)."""
+    _, columnas = _mapper_producto(frozenset(campos))
+    columnas = ['id', *columnas]
+    if ordering:
+        # La paginación por cursor lee la columna de orden de cada fila
+        columnas.append(ordering.lstrip('-'))
+    return queryset.prefetch_related(None).values(*dict.fromkeys(columnas))
+
+
+def serializar_productos(filas, campos):
+    """Convierte filas de `filas_productos` en la salida de ProductoSerializer(many=True)."""
+    zona = timezone.get_current_timezone() if settings.USE_TZ else None
+    mapper, _ = _mapper_producto(frozenset(campos), zona)
+    filas = list(filas)
+    if 'stock_por_tienda' in campos:
+        por_producto = {}
+        for fila in filas:
+            fila['stock_por_tienda'] = por_producto.setdefault(fila['id'], [])
+        mapper_stock, columnas = _mapper_stock(zona)
+        ids = list(por_producto)
+        for inicio in range(0, len(ids), TAMANO_BLOQUE):
+            stock = StockTienda.objects.filter(
+                producto_id__in=ids[inicio:inicio + TAMANO_BLOQUE]
+            ).order_by('id').values(*columnas)
+            for fila in stock:
+                por_producto[fila['producto']].append(mapper_stock(fila))
+    return [mapper(fila) for fila in filas]
@@ -0,0 +1,82 @@
+"""
+Matriz de stock productos x tiendas en formato columnar.
+
+En vez de repetir nombres y fechas en cada celda, la respuesta trae los ids
+de cada eje y las cantidades, densas (una fila por producto) o como
+coordenadas (fila, columna, cantidad) cuando la matriz es rala o se piden
+solo los cambios. Las celdas salen de una sola pasada por values_list.
+"""
+from django.utils import timezone
+
+from .models import Producto, StockTienda, Tienda
+
+MAX_PRODUCTOS_MATRIZ = 1000
+MAX_TIENDAS_MATRIZ = 200
+DENSA = 'densa'
+COORDENADAS = 'coordenadas'
+FORMATOS = [DENSA, COORDENADAS]
+
+
+def eje(modelo, desde=None, hasta=None, limite=None):
+    """
+    Ids del eje en [desde, hasta], ordenados, hasta `limite`. Devuelve también
+    el id con que empieza la página siguiente (o None): se pasa como `desde`.
+    """
+    ids = modelo.objects.order_by('id').values_list('id', flat=True)
+    if desde is not None:
+        ids = ids.filter(id__gte=desde)
+    if hasta is not None:
+        ids = ids.filter(id__lte=hasta)
+    ids = list(ids[:limite + 1])
+    return ids[:limite], (ids[limite] if len(ids) > limite else None)
+
+
+def matriz_stock(producto_desde=None, producto_hasta=None, productos=MAX_PRODUCTOS_MATRIZ,
+                 tienda_desde=None, tienda_hasta=None, tiendas=MAX_TIENDAS_MATRIZ,
+                 formato=DENSA, desde=None):
+    """
+    Página de la matriz. Con `desde` (fecha) solo van las celdas modificadas
+    desde entonces, siempre como coordenadas; `generado` sirve de `desde` en
+    la consulta siguiente. Las filas borradas no aparecen en el delta.
+    En la forma densa, None es que el producto no tiene fila en esa tienda.
+    """
+    generado = timezone.now()
+    ids_producto, siguiente_producto = eje(Producto, producto_desde, producto_hasta, productos)
+    ids_tienda, siguiente_tienda = eje(Tienda, tienda_desde, tienda_hasta, tiendas)
+    datos = {
+        'productos': ids_producto,
+        'tiendas': ids_tienda,
+        'siguiente_producto': siguiente_producto,
+        'siguiente_tienda': siguiente_tienda,
+        'formato': COORDENADAS if desde is not None else formato,
+        # Mismo formato que DRF; como texto, el render no sale del camino nativo
+        'generado': generado.isoformat().replace('+00:00', 'Z'),
+    }
+    if not ids_producto or not ids_tienda:
+        celdas = []
+    else:
+        # Los ejes son ids consecutivos de la tabla, así que el rango cubre
+        # exactamente las celdas de la página
+        celdas = StockTienda.objects.filter(
+            producto_id__gte=ids_producto[0], producto_id__lte=ids_producto[-1],
+            tienda_id__gte=ids_tienda[0], tienda_id__lte=ids_tienda[-1],
+        )
+        if desde is not None:
+            celdas = celdas.filter(fecha_actualizacion__gte=desde)
+        celdas = celdas.values_list('producto_id', 'tienda_id', 'cantidad').iterator(chunk_size=5000)
+
+    fila_de = {producto_id: i for i, producto_id in enumerate(ids_producto)}
+    columna_de = {tienda_id: j for j, tienda_id in enumerate(ids_tienda)}
+    if datos['formato'] == DENSA:
+        cantidades = [[None] * len(ids_tienda) for _ in ids_producto]
+        for producto_id, tienda_id, cantidad in celdas:
+            cantidades[fila_de[producto_id]][columna_de[tienda_id]] = cantidad
+        datos['cantidades'] = cantidades
+    else:
+        filas, columnas, cantidades = [], [], []
+        for producto_id, tienda_id, cantidad in celdas:
+            filas.append(fila_de[producto_id])
+            columnas.append(columna_de[tienda_id])
+            cantidades.append(cantidad)
+        datos['celdas'] = {'filas': filas, 'columnas': columnas, 'cantidades': cantidades}
+    return datos
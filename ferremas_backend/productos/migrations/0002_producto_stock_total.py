@@ -0,0 +1,42 @@
+# Generated by Django 5.1 on 2026-10-18 10:16
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def calcular_totales(apps, schema_editor):
+    Producto = apps.get_model('productos', 'Producto')
+    StockTienda = apps.get_model('productos', 'StockTienda')
+    stock = StockTienda.objects.filter(producto=OuterRef('pk')).order_by().values('producto')
+    Producto.objects.update(
+        stock_total=Coalesce(Subquery(stock.annotate(total=Sum('cantidad')).values('total')), 0),
+        tiendas_con_stock=Coalesce(
+            Subquery(stock.filter(cantidad__gt=0).annotate(tiendas=Count('id')).values('tiendas')), 0
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('productos', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='producto',
+            name='stock_total',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='producto',
+            name='tiendas_con_stock',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='producto',
+            index=models.Index(fields=['stock_total', 'id'], name='producto_stock_total_idx'),
+        ),
+        migrations.RunPython(calcular_totales, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,48 @@
+from django.db import migrations
+
+# Índice de texto completo solo para PostgreSQL; en otros motores la búsqueda
+# usa el índice en memoria de productos.search.
+CREAR_BUSQUEDA = """
+CREATE EXTENSION IF NOT EXISTS unaccent;
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_ts_config WHERE cfgname = 'es_unaccent') THEN
+        CREATE TEXT SEARCH CONFIGURATION es_unaccent (COPY = spanish);
+        ALTER TEXT SEARCH CONFIGURATION es_unaccent
+            ALTER MAPPING FOR hword, hword_part, word WITH unaccent, spanish_stem;
+    END IF;
+END
+$$;
+CREATE INDEX IF NOT EXISTS producto_busqueda_gin ON productos_producto USING gin ((
+    setweight(to_tsvector('es_unaccent', coalesce("productos_producto"."nombre", '')), 'A') ||
+    setweight(to_tsvector('simple', coalesce("productos_producto"."sku", '')), 'A') ||
+    setweight(to_tsvector('es_unaccent', coalesce("productos_producto"."marca", '')), 'B') ||
+    setweight(to_tsvector('es_unaccent', coalesce("productos_producto"."descripcion", '')), 'C')
+));
+"""
+
+ELIMINAR_BUSQUEDA = """
+DROP INDEX IF EXISTS producto_busqueda_gin;
+DROP TEXT SEARCH CONFIGURATION IF EXISTS es_unaccent;
+"""
+
+
+def crear_busqueda(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(CREAR_BUSQUEDA)
+
+
+def eliminar_busqueda(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(ELIMINAR_BUSQUEDA)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('productos', '0002_producto_stock_total'),
+    ]
+
+    operations = [
+        migrations.RunPython(crear_busqueda, eliminar_busqueda),
+    ]
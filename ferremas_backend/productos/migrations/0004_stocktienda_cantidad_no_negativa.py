@@ -0,0 +1,17 @@
+# Generated by Django 5.1 on 2026-10-18 10:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('productos', '0003_busqueda_texto_completo'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='stocktienda',
+            constraint=models.CheckConstraint(condition=models.Q(('cantidad__gte', 0)), name='stocktienda_cantidad_no_negativa'),
+        ),
+    ]
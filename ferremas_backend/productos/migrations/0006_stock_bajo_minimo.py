@@ -0,0 +1,17 @@
+# Generated by Django 5.1 on 2026-10-18 10:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('productos', '0005_libro_movimientos'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='stocktienda',
+            index=models.Index(condition=models.Q(('cantidad__lt', models.F('stock_minimo'))), fields=['tienda', 'id'], name='stock_bajo_minimo_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.1 on 2026-10-18 11:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('productos', '0007_tienda_coordenadas'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='producto',
+            index=models.Index(fields=['categoria'], name='producto_categoria_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='producto',
+            index=models.Index(fields=['marca'], name='producto_marca_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stocktienda',
+            index=models.Index(fields=['tienda', 'id'], name='stock_tienda_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stocktienda',
+            index=models.Index(fields=['tienda', 'cantidad', 'id'], name='stock_tienda_cantidad_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stocktienda',
+            index=models.Index(fields=['tienda', 'fecha_actualizacion', 'id'], name='stock_tienda_fecha_idx'),
+        ),
+    ]
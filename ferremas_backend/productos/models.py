@@ -1,4 +1,7 @@
+from django.conf import settings
+from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db import models
+from django.utils import timezone
 
 class Tienda(models.Model):
     nombre = models.CharField(max_length=255)
@@ -6,6 +9,9 @@ class Tienda(models.Model):
     telefono = models.CharField(max_length=20)
     email = models.EmailField(blank=True)
     activa = models.BooleanField(default=True)
+    # Coordenadas en grados (WGS 84); sin ellas la tienda no aparece en las búsquedas por cercanía
+    latitud = models.FloatField(null=True, blank=True, validators=[MinValueValidator(-90), MaxValueValidator(90)])
+    longitud = models.FloatField(null=True, blank=True, validators=[MinValueValidator(-180), MaxValueValidator(180)])
     fecha_creacion = models.DateTimeField(auto_now_add=True)
     fecha_actualizacion = models.DateTimeField(auto_now=True)
 
@@ -20,12 +26,34 @@ class Producto(models.Model):
     categoria = models.CharField(max_length=100)
     marca = models.CharField(max_length=100, blank=True)
     imagen_url = models.URLField(max_length=500, blank=True, null=True)
+    # Totales desnormalizados de StockTienda, mantenidos por productos.stock_service
+    stock_total = models.PositiveIntegerField(default=0, editable=False)
+    tiendas_con_stock = models.PositiveIntegerField(default=0, editable=False)
     fecha_creacion = models.DateTimeField(auto_now_add=True)
     fecha_actualizacion = models.DateTimeField(auto_now=True)
 
+    CAMPOS_DESNORMALIZADOS = ('stock_total', 'tiendas_con_stock')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['stock_total', 'id'], name='producto_stock_total_idx'),
+            models.Index(fields=['categoria'], name='producto_categoria_idx'),
+            models.Index(fields=['marca'], name='producto_marca_idx'),
+        ]
+
     def __str__(self):
         return f"{self.nombre} ({self.sku})"
 
+    def save(self, *args, **kwargs):
+        # Un save() completo de una instancia cargada hace tiempo no debe pisar
+        # los totales de stock que se actualizaron mientras tanto.
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.CAMPOS_DESNORMALIZADOS
+            ]
+        super().save(*args, **kwargs)
+
 class StockTienda(models.Model):
     producto = models.ForeignKey(Producto, on_delete=models.CASCADE)
     tienda = models.ForeignKey(Tienda, on_delete=models.CASCADE)
@@ -35,8 +63,89 @@ class StockTienda(models.Model):
 
     class Meta:
         unique_together = ('producto', 'tienda')
+        constraints = [
+            # Además del CHECK de PositiveIntegerField, explícito y con nombre:
+            # los descuentos de productos.stock_service cuentan con él
+            models.CheckConstraint(condition=models.Q(cantidad__gte=0), name='stocktienda_cantidad_no_negativa'),
+        ]
+        indexes = [
+            # Índice parcial con solo las filas bajo su mínimo: el listado de
+            # reposición y el resumen por tienda no recorren toda la tabla, y la
+            # base lo mantiene en cualquier escritura, también las masivas
+            models.Index(
+                fields=['tienda', 'id'], name='stock_bajo_minimo_idx',
+                condition=models.Q(cantidad__lt=models.F('stock_minimo')),
+            ),
+            # Páginas del stock de una tienda en cada orden de StockTiendaPagination
+            models.Index(fields=['tienda', 'id'], name='stock_tienda_id_idx'),
+            models.Index(fields=['tienda', 'cantidad', 'id'], name='stock_tienda_cantidad_idx'),
+            models.Index(fields=['tienda', 'fecha_actualizacion', 'id'], name='stock_tienda_fecha_idx'),
+        ]
         verbose_name = 'Stock por Tienda'
         verbose_name_plural = 'Stocks por Tienda'
 
     def __str__(self):
         return f"{self.producto.nombre} - {self.tienda.nombre}: {self.cantidad}"
+
+
+class StockMovimiento(models.Model):
+    """
+    Libro de movimientos de StockTienda.cantidad: solo se insertan filas, en la
+    misma transacción que el cambio de cantidad (ver productos.stock_service).
+    """
+    AJUSTE = 'ajuste'
+    TRANSFERENCIA = 'transferencia'
+    VENTA = 'venta'
+    DEVOLUCION = 'devolucion'
+    TIPO_CHOICES = [
+        (AJUSTE, 'Ajuste'),
+        (TRANSFERENCIA, 'Transferencia'),
+        (VENTA, 'Venta'),
+        (DEVOLUCION, 'Devolución'),
+    ]
+
+    producto = models.ForeignKey(Producto, on_delete=models.CASCADE, related_name='movimientos')
+    tienda = models.ForeignKey(Tienda, on_delete=models.CASCADE, related_name='movimientos')
+    tipo = models.CharField(max_length=20, choices=TIPO_CHOICES)
+    # Positiva si entran unidades a la tienda, negativa si salen
+    cantidad = models.IntegerField()
+    # En transferencias, la otra tienda
+    tienda_contraparte = models.ForeignKey(Tienda, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    orden = models.ForeignKey('carrito.Orden', on_delete=models.SET_NULL, null=True, blank=True, related_name='movimientos_stock')
+    item_orden = models.ForeignKey('carrito.ItemOrden', on_delete=models.SET_NULL, null=True, blank=True, related_name='movimientos_stock')
+    usuario = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    fecha = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['tienda', 'fecha'], name='movimiento_tienda_fecha_idx'),
+            models.Index(fields=['producto', 'tienda', 'fecha'], name='movimiento_stock_fecha_idx'),
+        ]
+        verbose_name = 'Movimiento de Stock'
+        verbose_name_plural = 'Movimientos de Stock'
+
+    def __str__(self):
+        return f"{self.get_tipo_display()} {self.cantidad:+d} - producto {self.producto_id} en tienda {self.tienda_id}"
+
+
+class StockSnapshot(models.Model):
+    """
+    Cantidad de un producto en una tienda en `fecha`. Los genera el comando
+    compactar_movimientos para que el stock histórico se calcule con el último
+    snapshot más los movimientos posteriores, sin recorrer todo el libro.
+    """
+    producto = models.ForeignKey(Producto, on_delete=models.CASCADE, related_name='+')
+    tienda = models.ForeignKey(Tienda, on_delete=models.CASCADE, related_name='+')
+    cantidad = models.IntegerField()
+    fecha = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['producto', 'tienda', 'fecha'], name='snapshot_stock_fecha_unico'),
+        ]
+        indexes = [
+            models.Index(fields=['tienda', 'fecha'], name='snapshot_tienda_fecha_idx'),
+        ]
+
+    def __str__(self):
+        return f"Producto {self.producto_id} en tienda {self.tienda_id} al {self.fecha:%Y-%m-%d %H:%M}: {self.cantidad}"
@@ -0,0 +1,187 @@
+"""
+Libro de movimientos de stock y snapshots.
+
+Cada cambio de cantidad hecho por productos.stock_service (ajustes,
+transferencias, ventas y devoluciones), por la importación de stock o por
+el alta y la edición de una fila desde la API deja un StockMovimiento. Para no
+recorrer todo el libro al preguntar por el stock en una fecha pasada, el
+comando compactar_movimientos guarda periódicamente un StockSnapshot de cada
+fila con movimientos nuevos: el stock en T es el último snapshot anterior a T
+más los movimientos entre ambos.
+
+Los snapshots se toman de StockTienda.cantidad (menos lo que se movió después
+de la fecha del snapshot), así que también recogen los cambios que no pasan
+por el libro, como un update() directo sobre la tabla.
+
+purgar deja la historia empezando en un snapshot de todas las filas; antes de
+esa fecha ya no hay con qué calcular y stock_en lanza HistoriaPurgada.
+"""
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.db import transaction
+from django.db.models import Case, Exists, F, IntegerField, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import StockMovimiento, StockSnapshot, StockTienda
+
+# Los snapshots se toman con este margen hacia atrás, para que no quede fuera
+# un movimiento de una transacción que aún no confirma
+MARGEN_COMPACTACION = timedelta(minutes=5)
+# Fecha de referencia para las filas que aún no tienen snapshot
+EPOCA = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+class HistoriaPurgada(Exception):
+    """La fecha es anterior al inicio del libro, que se purgó. Lleva la fecha de inicio."""
+
+
+def movimiento(stock, tipo, cantidad, **referencias):
+    """StockMovimiento sin guardar de `cantidad` unidades en la fila `stock`."""
+    return StockMovimiento(
+        producto_id=stock.producto_id, tienda_id=stock.tienda_id, tipo=tipo, cantidad=cantidad, **referencias
+    )
+
+
+def registrar(movimientos):
+    """Inserta los movimientos en una sola sentencia (o en lotes de 1000, si son muchos)."""
+    return StockMovimiento.objects.bulk_create(movimientos, batch_size=1000)
+
+
+def _movimientos_de_la_fila():
+    return StockMovimiento.objects.filter(producto=OuterRef('producto'), tienda=OuterRef('tienda')).order_by()
+
+
+def _suma(movimientos):
+    """Subconsulta con la suma de cantidades de los movimientos (0 si no hay)."""
+    total = movimientos.values('producto').annotate(total=Sum('cantidad')).values('total')
+    return Coalesce(Subquery(total), 0)
+
+
+def _ultimo_snapshot(fecha, campo):
+    snapshots = StockSnapshot.objects.filter(
+        producto=OuterRef('producto'), tienda=OuterRef('tienda'), fecha__lte=fecha
+    ).order_by('-fecha')
+    return Subquery(snapshots.values(campo)[:1])
+
+
+def inicio_historia():
+    """
+    Fecha desde la que se puede calcular el stock: None si el libro nunca se
+    purgó. Un snapshot solo se guarda si hay movimientos hasta su fecha, así
+    que si no queda ninguno hasta el primer snapshot es que se purgaron.
+    """
+    primero = StockSnapshot.objects.order_by('fecha').values_list('fecha', flat=True).first()
+    if primero is None or StockMovimiento.objects.filter(fecha__lte=primero).exists():
+        return None
+    return primero
+
+
+def stock_en(fecha, filas=None):
+    """
+    Cantidad de cada fila de StockTienda (por defecto todas) en `fecha`.
+    Devuelve {(producto_id, tienda_id): cantidad}. Lanza HistoriaPurgada si
+    `fecha` es anterior a inicio_historia().
+
+    Con snapshot anterior a `fecha` suma solo los movimientos posteriores a
+    él; sin snapshot, descuenta de la cantidad actual lo que se movió después.
+    """
+    inicio = inicio_historia()
+    if inicio is not None and fecha < inicio:
+        raise HistoriaPurgada(inicio)
+    filas = StockTienda.objects.all() if filas is None else filas
+    movimientos = _movimientos_de_la_fila()
+    filas = filas.annotate(
+        snapshot_fecha=_ultimo_snapshot(fecha, 'fecha'),
+        snapshot_cantidad=_ultimo_snapshot(fecha, 'cantidad'),
+    ).annotate(
+        historica=Case(
+            When(
+                snapshot_fecha__isnull=False,
+                then=F('snapshot_cantidad') + _suma(
+                    movimientos.filter(fecha__gt=OuterRef('snapshot_fecha'), fecha__lte=fecha)
+                ),
+            ),
+            default=F('cantidad') - _suma(movimientos.filter(fecha__gt=fecha)),
+            output_field=IntegerField(),
+        )
+    )
+    return {
+        (producto_id, tienda_id): historica
+        for producto_id, tienda_id, historica in filas.values_list('producto_id', 'tienda_id', 'historica')
+    }
+
+
+def compactar(hasta=None):
+    """
+    Guarda un snapshot en `hasta` (por defecto, hace MARGEN_COMPACTACION) de
+    cada fila con movimientos desde su último snapshot. Devuelve cuántos guardó.
+    """
+    hasta = hasta or timezone.now() - MARGEN_COMPACTACION
+    movimientos = _movimientos_de_la_fila()
+    pendientes = StockTienda.objects.annotate(
+        desde=Coalesce(_ultimo_snapshot(hasta, 'fecha'), Value(EPOCA)),
+    ).filter(
+        Exists(movimientos.filter(fecha__gt=OuterRef('desde'), fecha__lte=hasta))
+    ).annotate(
+        posteriores=_suma(movimientos.filter(fecha__gt=hasta)),
+    )
+    snapshots = [
+        StockSnapshot(producto_id=producto_id, tienda_id=tienda_id, fecha=hasta, cantidad=cantidad - posteriores)
+        for producto_id, tienda_id, cantidad, posteriores
+        in pendientes.values_list('producto_id', 'tienda_id', 'cantidad', 'posteriores').iterator()
+    ]
+    StockSnapshot.objects.bulk_create(snapshots, batch_size=1000, ignore_conflicts=True)
+    return len(snapshots)
+
+
+def purgar(antes_de):
+    """
+    Borra los movimientos hasta el último snapshot anterior a `antes_de` (el
+    límite). Antes guarda en el límite un snapshot de cada fila que no lo
+    tenga, y borra los más antiguos: la historia empieza ahí y desde el
+    límite sigue siendo exacta. Devuelve cuántos movimientos borró.
+    """
+    limite = StockSnapshot.objects.filter(fecha__lte=antes_de).order_by('-fecha').values_list('fecha', flat=True).first()
+    if limite is None:
+        return 0
+    with transaction.atomic():
+        con_snapshot = set(StockSnapshot.objects.filter(fecha=limite).values_list('producto_id', 'tienda_id'))
+        snapshots = [
+            StockSnapshot(producto_id=producto_id, tienda_id=tienda_id, fecha=limite, cantidad=cantidad)
+            for (producto_id, tienda_id), cantidad in stock_en(limite).items()
+            if (producto_id, tienda_id) not in con_snapshot
+        ]
+        StockSnapshot.objects.bulk_create(snapshots, batch_size=1000, ignore_conflicts=True)
+        StockSnapshot.objects.filter(fecha__lt=limite).delete()
+        borrados, _ = StockMovimiento.objects.filter(fecha__lte=limite).delete()
+    return borrados
+
+
+def reporte_tienda(tienda_id, desde, hasta):
+    """
+    Stock inicial, neto por tipo de movimiento y stock final de cada producto
+    de la tienda entre `desde` y `hasta`. Lanza HistoriaPurgada si `desde` es
+    anterior a inicio_historia().
+    """
+    filas = StockTienda.objects.filter(tienda_id=tienda_id)
+    inicial = stock_en(desde, filas)
+    final = stock_en(hasta, filas)
+    netos = {}
+    for producto_id, tipo, total in StockMovimiento.objects.filter(
+        tienda_id=tienda_id, fecha__gt=desde, fecha__lte=hasta
+    ).order_by().values_list('producto_id', 'tipo').annotate(total=Sum('cantidad')):
+        netos.setdefault(producto_id, {})[tipo] = total
+
+    reporte = []
+    for producto_id, sku, nombre in filas.order_by('producto_id').values_list('producto_id', 'producto__sku', 'producto__nombre'):
+        por_tipo = netos.get(producto_id, {})
+        reporte.append({
+            'producto': producto_id,
+            'sku': sku,
+            'nombre': nombre,
+            'stock_inicial': inicial[(producto_id, tienda_id)],
+            **{tipo: por_tipo.get(tipo, 0) for tipo, _ in StockMovimiento.TIPO_CHOICES},
+            'stock_final': final[(producto_id, tienda_id)],
+        })
+    return reporte
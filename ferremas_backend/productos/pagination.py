@@ -0,0 +1,53 @@
+from rest_framework.pagination import CursorPagination
+
+
+class ProductoCursorPagination(CursorPagination):
+    """
+    Paginación por cursor (keyset sobre id, o sobre `ordering`) para el listado de productos.
+    Solo se activa cuando el cliente envía `cursor` o `page_size`, así los
+    clientes que esperan la lista completa siguen funcionando igual.
+    """
+    ordering = 'id'
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+    ordenamientos_permitidos = ['stock_total', '-stock_total', 'precio', '-precio']
+
+    def paginate_queryset(self, queryset, request, view=None):
+        params = request.query_params
+        if self.cursor_query_param not in params and self.page_size_query_param not in params:
+            return None
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_ordering(self, request, queryset, view):
+        # `?ordering=` con desempate por id, que mantiene estable el cursor
+        ordering = request.query_params.get('ordering')
+        if ordering in self.ordenamientos_permitidos:
+            return (ordering, '-id' if ordering.startswith('-') else 'id')
+        return (self.ordering,)
+
+
+class StockBajoMinimoPagination(CursorPagination):
+    """Keyset sobre id para el listado de stock bajo mínimo, que usa el índice parcial (tienda, id)."""
+    ordering = 'id'
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+
+class StockTiendaPagination(CursorPagination):
+    """
+    Keyset para el stock de una tienda. Cada orden permitido tiene su índice
+    (tienda, campo, id) en StockTienda, así cada página es un rango del índice.
+    """
+    ordering = 'id'
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+    ordenamientos_permitidos = ['cantidad', '-cantidad', 'fecha_actualizacion', '-fecha_actualizacion']
+
+    def get_ordering(self, request, queryset, view):
+        ordering = request.query_params.get('ordering')
+        if ordering in self.ordenamientos_permitidos:
+            return (ordering, '-id' if ordering.startswith('-') else 'id')
+        return (self.ordering,)
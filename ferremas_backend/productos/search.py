@@ -0,0 +1,323 @@
+"""
+Búsqueda de productos por texto libre sobre nombre, descripción, marca y sku.
+
+En PostgreSQL se usa la búsqueda de texto completo nativa (configuración
+`es_unaccent`, creada en la migración 0003, con índice GIN sobre VECTOR_SQL).
+En otros motores (SQLite en settings_test) se usa un índice invertido en
+memoria del proceso, con el mismo plegado de acentos, stemming y prefijos.
+"""
+import heapq
+import math
+import re
+import threading
+import unicodedata
+from bisect import bisect_left
+from collections import Counter, defaultdict
+
+from django.db import connection
+from django.db.models import BooleanField, FloatField
+from django.db.models.expressions import RawSQL
+
+# Debe coincidir exactamente con la expresión del índice GIN de la migración 0003
+VECTOR_SQL = (
+    "setweight(to_tsvector('es_unaccent', coalesce(\"productos_producto\".\"nombre\", '')), 'A') || "
+    "setweight(to_tsvector('simple', coalesce(\"productos_producto\".\"sku\", '')), 'A') || "
+    "setweight(to_tsvector('es_unaccent', coalesce(\"productos_producto\".\"marca\", '')), 'B') || "
+    "setweight(to_tsvector('es_unaccent', coalesce(\"productos_producto\".\"descripcion\", '')), 'C')"
+)
+
+PESOS_CAMPOS = {'nombre': 3.0, 'sku': 3.0, 'marca': 2.0, 'descripcion': 1.0}
+
+PALABRAS_VACIAS = {
+    'a', 'al', 'con', 'de', 'del', 'el', 'en', 'la', 'las', 'los', 'o', 'para',
+    'por', 'sin', 'su', 'un', 'una', 'y',
+}
+
+# Sufijos flexivos y derivativos frecuentes, del más largo al más corto
+SUFIJOS = sorted([
+    'amientos', 'imientos', 'amiento', 'imiento', 'aciones', 'uciones', 'adoras',
+    'adores', 'idades', 'amente', 'acion', 'ucion', 'adora', 'ador', 'ancias',
+    'ancia', 'ibles', 'ables', 'mente', 'istas', 'idad', 'ible', 'able', 'ista',
+    'osos', 'osas', 'ivos', 'ivas', 'oso', 'osa', 'ivo', 'iva', 'es', 'os', 'as',
+    's', 'o', 'a', 'e',
+], key=len, reverse=True)
+
+_NO_ALFANUMERICO = re.compile(r'[^a-z0-9]+')
+
+# Factor aplicado a los términos que solo coinciden por prefijo
+FACTOR_PREFIJO = 0.7
+
+
+def normalizar(texto):
+    """Minúsculas y sin tildes ni diéresis ("Martíllo Pingüino" -> "martillo pinguino")."""
+    texto = unicodedata.normalize('NFKD', texto or '')
+    return ''.join(c for c in texto if not unicodedata.combining(c)).lower()
+
+
+def raiz(palabra):
+    """Stemming ligero para español: quita el sufijo más largo dejando al menos 3 letras."""
+    if len(palabra) <= 3 or any(c.isdigit() for c in palabra):
+        return palabra
+    for sufijo in SUFIJOS:
+        if palabra.endswith(sufijo) and len(palabra) - len(sufijo) >= 3:
+            return palabra[:-len(sufijo)]
+    return palabra
+
+
+def tokenizar(texto):
+    """Lista de raíces del texto, sin palabras vacías."""
+    return [
+        raiz(palabra)
+        for palabra in _NO_ALFANUMERICO.split(normalizar(texto))
+        if palabra and palabra not in PALABRAS_VACIAS
+    ]
+
+
+def terminos_sku(sku):
+    """Partes de un sku y el sku compacto ("TAL-18V" -> [tal, 18v], tal18v)."""
+    partes = [p for p in _NO_ALFANUMERICO.split(normalizar(sku)) if p]
+    return partes, ''.join(partes)
+
+
+class IndiceBusqueda:
+    """
+    Índice invertido en memoria con ranking tipo BM25 y coincidencia por prefijo.
+
+    Se construye a partir de tuplas (id, nombre, descripcion, marca, sku) y admite
+    altas, modificaciones y bajas individuales, de modo que las señales de
+    Producto lo mantienen al día sin reconstruirlo.
+    """
+
+    K1 = 1.2
+
+    def __init__(self, filas=()):
+        self._lock = threading.RLock()
+        # termino -> {producto_id: peso del campo ya saturado (tf de BM25)}
+        self._postings = defaultdict(dict)
+        # Los sku compactos son casi únicos por producto: van aparte y solo
+        # coinciden exactos, para no inflar las expansiones por prefijo
+        self._skus = defaultdict(dict)
+        self._terminos_doc = {}  # producto_id -> (términos indexados, sku compacto)
+        self._vocabulario = None  # lista ordenada, se rehace tras cambios
+        for fila in filas:
+            self.indexar(*fila)
+
+    def __len__(self):
+        return len(self._terminos_doc)
+
+    def indexar(self, producto_id, nombre, descripcion, marca, sku):
+        partes_sku, sku_compacto = terminos_sku(sku)
+        pesos = defaultdict(float)
+        for campo, terminos in (
+            ('nombre', tokenizar(nombre)),
+            ('sku', partes_sku),
+            ('marca', tokenizar(marca)),
+            ('descripcion', tokenizar(descripcion)),
+        ):
+            for termino in terminos:
+                pesos[termino] += PESOS_CAMPOS[campo]
+        k1 = self.K1
+        with self._lock:
+            self._quitar(producto_id)
+            for termino, peso in pesos.items():
+                self._postings[termino][producto_id] = peso * (k1 + 1) / (peso + k1)
+            peso = PESOS_CAMPOS['sku']
+            self._skus[sku_compacto][producto_id] = peso * (k1 + 1) / (peso + k1)
+            self._terminos_doc[producto_id] = (tuple(pesos), sku_compacto)
+            self._vocabulario = None
+
+    def eliminar(self, producto_id):
+        with self._lock:
+            self._quitar(producto_id)
+            self._vocabulario = None
+
+    def _quitar(self, producto_id):
+        if producto_id not in self._terminos_doc:
+            return
+        terminos, sku_compacto = self._terminos_doc.pop(producto_id)
+        for postings, clave in [(self._postings, termino) for termino in terminos] + [(self._skus, sku_compacto)]:
+            docs = postings[clave]
+            docs.pop(producto_id, None)
+            if not docs:
+                del postings[clave]
+
+    def _expandir(self, termino):
+        """Términos del vocabulario que empiezan con `termino` (incluido él mismo)."""
+        if self._vocabulario is None:
+            self._vocabulario = sorted(self._postings)
+        vocabulario = self._vocabulario
+        inicio = bisect_left(vocabulario, termino)
+        fin = bisect_left(vocabulario, termino + '\uffff', inicio)
+        return vocabulario[inicio:fin]
+
+    def _puntuar(self, candidatos, listas):
+        """Puntaje de cada candidato sumando las listas (docs, multiplicador) que lo contienen."""
+        puntajes = dict.fromkeys(candidatos, 0.0)
+        for docs, multiplicador in listas:
+            for producto_id in candidatos & docs.keys():
+                puntajes[producto_id] += docs[producto_id] * multiplicador
+        return puntajes
+
+    @staticmethod
+    def _ordenar(puntajes, cantidad):
+        clave = lambda producto_id: (puntajes[producto_id], -producto_id)
+        if cantidad is None:
+            return sorted(puntajes, key=clave, reverse=True)
+        return heapq.nlargest(cantidad, puntajes, key=clave)
+
+    def buscar(self, consulta, limite=20, offset=0):
+        """
+        Ids de producto ordenados por relevancia. Primero los que coinciden con
+        todos los términos de la consulta; dentro de cada grupo, por puntaje.
+        Con `limite=None` devuelve todas las coincidencias.
+        """
+        terminos = list(dict.fromkeys(tokenizar(consulta)))
+        if not terminos:
+            return []
+        necesarios = None if limite is None else offset + limite
+        with self._lock:
+            total_docs = len(self._terminos_doc) or 1
+            listas = []  # (docs, multiplicador) de cada término expandido
+            conjuntos = []  # productos que coinciden con cada término de la consulta
+            for termino in terminos:
+                # Los términos de una letra solo coinciden exactos
+                expansion = self._expandir(termino) if len(termino) > 1 else [termino]
+                coincidentes = set()
+                for candidato, docs in [(c, self._postings.get(c)) for c in expansion] + [(termino, self._skus.get(termino))]:
+                    if not docs:
+                        continue
+                    idf = math.log(1 + (total_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+                    factor = 1.0 if candidato == termino else FACTOR_PREFIJO
+                    listas.append((docs, idf * factor))
+                    coincidentes.update(docs.keys())
+                conjuntos.append(coincidentes)
+
+            if len(listas) == 1:
+                # Un solo término sin expansiones: el ranking es el de su lista
+                docs, _ = listas[0]
+                mejores = heapq.nlargest(
+                    len(docs) if necesarios is None else necesarios,
+                    docs.items(),
+                    key=lambda item: (item[1], -item[0]),
+                )
+                return [producto_id for producto_id, _ in mejores][offset:]
+
+            # Camino rápido: si basta con los que tienen todos los términos, solo
+            # se puntúa la intersección
+            todos = set.intersection(*sorted(conjuntos, key=len))
+            if necesarios is not None and len(todos) >= necesarios:
+                return self._ordenar(self._puntuar(todos, listas), necesarios)[offset:]
+
+            # Si no, se agrupa por cantidad de términos coincidentes, de más a menos
+            coincidencias = Counter()
+            for coincidentes in conjuntos:
+                coincidencias.update(coincidentes)
+            grupos = defaultdict(set)
+            for producto_id, cantidad in coincidencias.items():
+                grupos[cantidad].add(producto_id)
+            resultado = []
+            for cantidad in sorted(grupos, reverse=True):
+                faltan = None if necesarios is None else necesarios - len(resultado)
+                resultado.extend(self._ordenar(self._puntuar(grupos[cantidad], listas), faltan))
+                if necesarios is not None and len(resultado) >= necesarios:
+                    break
+        return resultado[offset:]
+
+
+_indice = None
+_indice_lock = threading.Lock()
+
+
+def obtener_indice():
+    """Índice en memoria del proceso, construido la primera vez que se usa."""
+    global _indice
+    if _indice is None:
+        with _indice_lock:
+            if _indice is None:
+                from .models import Producto
+                filas = Producto.objects.values_list(
+                    'id', 'nombre', 'descripcion', 'marca', 'sku'
+                ).order_by().iterator(chunk_size=5000)
+                _indice = IndiceBusqueda(filas)
+    return _indice
+
+
+def actualizar_en_indice(producto):
+    if _indice is not None:
+        _indice.indexar(producto.id, producto.nombre, producto.descripcion, producto.marca, producto.sku)
+
+
+def eliminar_de_indice(producto_id):
+    if _indice is not None:
+        _indice.eliminar(producto_id)
+
+
+def reiniciar_indice():
+    global _indice
+    _indice = None
+
+
+def consulta_tsquery(consulta, operador='&'):
+    """Convierte texto libre en una tsquery con prefijos ("taladro bosch" -> "taladro:* & bosch:*")."""
+    palabras = [
+        palabra for palabra in _NO_ALFANUMERICO.split(normalizar(consulta))
+        if palabra and palabra not in PALABRAS_VACIAS
+    ]
+    return f' {operador} '.join(f'{palabra}:*' for palabra in palabras)
+
+
+def _buscar_postgres(queryset, consulta, limite, offset):
+    fin = None if limite is None else offset + limite
+    for operador in ('&', '|'):
+        tsquery = consulta_tsquery(consulta, operador)
+        if not tsquery:
+            return []
+        ids = list(
+            queryset.filter(
+                RawSQL(f"{VECTOR_SQL} @@ to_tsquery('es_unaccent', %s)", [tsquery], output_field=BooleanField())
+            ).annotate(
+                rango=RawSQL(f"ts_rank_cd({VECTOR_SQL}, to_tsquery('es_unaccent', %s))", [tsquery], output_field=FloatField())
+            ).order_by('-rango', 'id').values_list('id', flat=True)[offset:fin]
+        )
+        # Si ningún producto tiene todos los términos, se relaja a cualquiera de ellos
+        if ids or offset:
+            return ids
+    return []
+
+
+def filtrar_productos(queryset, consulta):
+    """
+    Los productos del queryset que coinciden con la consulta, sin ordenar por
+    relevancia: para usarlo como subconsulta (`producto__in=`) en otros listados.
+    """
+    if connection.vendor == 'postgresql':
+        tsquery = consulta_tsquery(consulta)
+        if not tsquery:
+            return queryset.none()
+        return queryset.filter(
+            RawSQL(f"{VECTOR_SQL} @@ to_tsquery('es_unaccent', %s)", [tsquery], output_field=BooleanField())
+        )
+    return queryset.filter(pk__in=obtener_indice().buscar(consulta, limite=None))
+
+
+def buscar_productos(queryset, consulta, limite=20, offset=0):
+    """
+    Ids de los productos del queryset que coinciden con la consulta, por
+    relevancia. Con `limite=None` devuelve todas las coincidencias.
+    """
+    if connection.vendor == 'postgresql':
+        return _buscar_postgres(queryset, consulta, limite, offset)
+    indice = obtener_indice()
+    if not queryset.query.where:
+        return indice.buscar(consulta, limite=limite, offset=offset)
+    # Con filtros adicionales (p. ej. categoría) se recorren los candidatos por
+    # relevancia en bloques hasta completar la página pedida
+    candidatos = indice.buscar(consulta, limite=None)
+    ids = []
+    for inicio in range(0, len(candidatos), 500):
+        bloque = candidatos[inicio:inicio + 500]
+        permitidos = set(queryset.filter(pk__in=bloque).values_list('id', flat=True))
+        ids.extend(producto_id for producto_id in bloque if producto_id in permitidos)
+        if limite is not None and len(ids) >= offset + limite:
+            break
+    return ids[offset:] if limite is None else ids[offset:offset + limite]
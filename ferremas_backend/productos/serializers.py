@@ -1,12 +1,57 @@
 from rest_framework import serializers
 from productos.models import Producto, Tienda, StockTienda
 from config.supabase_config import upload_file, delete_file
-import time
+import hashlib
 
-class TiendaSerializer(serializers.ModelSerializer):
-    class Meta:
-        model = Tienda
-        fields = ['id', 'nombre', 'direccion', 'telefono', 'email', 'activa', 'fecha_creacion', 'fecha_actualizacion']
+def url_imagen_versionada(imagen_url):
+    # Cada subida genera un archivo con nombre único, así que la versión se
+    # deriva de la URL: cambia con la imagen y no con cada petición
+    if imagen_url:
+        return f"{imagen_url}?v={hashlib.md5(imagen_url.encode()).hexdigest()[:8]}"
+    return None
+
+class CamposDinamicosMixin:
+    """
+    Limita los campos de salida a los indicados en `context['campos']`.
+    Los campos de `expansiones` que no estén en `expansiones_por_defecto` solo
+    se incluyen cuando se piden explícitamente.
+    """
+    expansiones = {}
+    expansiones_por_defecto = ()
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        campos = self.context.get('campos')
+        if campos is None:
+            campos = self.campos_por_defecto(self.fields)
+        for nombre in list(self.fields):
+            if nombre not in campos:
+                self.fields.pop(nombre)
+
+    @classmethod
+    def campos_por_defecto(cls, todos):
+        ocultos = {campo for nombre, campo in cls.expansiones.items() if nombre not in cls.expansiones_por_defecto}
+        return [nombre for nombre in todos if nombre not in ocultos]
+
+    @classmethod
+    def resolver_campos(cls, campos, expandir):
+        """
+        Campos a serializar según `?fields=` (None = los de siempre) y `?expand=`.
+        Lanza ValidationError si se pide un campo o expansión desconocidos.
+        """
+        todos = list(cls.Meta.fields)
+        desconocidas = [nombre for nombre in expandir if nombre not in cls.expansiones]
+        if desconocidas:
+            raise serializers.ValidationError({'expand': [f"Expansión desconocida: {', '.join(desconocidas)}"]})
+        if campos is None:
+            seleccion = set(cls.campos_por_defecto(todos))
+        else:
+            desconocidos = [nombre for nombre in campos if nombre not in todos]
+            if desconocidos:
+                raise serializers.ValidationError({'fields': [f"Campo desconocido: {', '.join(desconocidos)}"]})
+            seleccion = set(campos)
+        seleccion.update(cls.expansiones[nombre] for nombre in expandir)
+        return seleccion
 
 class StockTiendaSerializer(serializers.ModelSerializer):
     producto_nombre = serializers.CharField(source='producto.nombre', read_only=True)
@@ -17,26 +62,69 @@ class StockTiendaSerializer(serializers.ModelSerializer):
         fields = ['id', 'producto', 'tienda', 'producto_nombre', 'tienda_nombre', 'cantidad', 'stock_minimo', 'fecha_actualizacion']
         read_only_fields = ['fecha_actualizacion']
 
-class ProductoSerializer(serializers.ModelSerializer):
+class StockBajoMinimoSerializer(StockTiendaSerializer):
+    """Fila de stock bajo su mínimo, con lo necesario para reponerla."""
+    producto_sku = serializers.CharField(source='producto.sku', read_only=True)
+    categoria = serializers.CharField(source='producto.categoria', read_only=True)
+    marca = serializers.CharField(source='producto.marca', read_only=True)
+    reponer = serializers.IntegerField(read_only=True)
+
+    class Meta(StockTiendaSerializer.Meta):
+        fields = StockTiendaSerializer.Meta.fields + ['producto_sku', 'categoria', 'marca', 'reponer']
+
+class TiendaSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
+    # Solo con ?expand=stock
+    stock = StockTiendaSerializer(source='stocktienda_set', many=True, read_only=True)
+
+    expansiones = {'stock': 'stock'}
+
+    class Meta:
+        model = Tienda
+        fields = [
+            'id', 'nombre', 'direccion', 'telefono', 'email', 'activa', 'latitud', 'longitud',
+            'fecha_creacion', 'fecha_actualizacion', 'stock',
+        ]
+
+    def validate(self, attrs):
+        latitud = attrs.get('latitud', getattr(self.instance, 'latitud', None))
+        longitud = attrs.get('longitud', getattr(self.instance, 'longitud', None))
+        if (latitud is None) != (longitud is None):
+            raise serializers.ValidationError('La latitud y la longitud van juntas')
+        return attrs
+
+class ProductoImportacionSerializer(serializers.ModelSerializer):
+    """Valida una fila de la importación masiva de productos (sin subir imágenes)."""
+
+    class Meta:
+        model = Producto
+        fields = ['sku', 'nombre', 'descripcion', 'precio', 'categoria', 'marca', 'imagen_url']
+        # La unicidad del sku se resuelve con upsert, no con una consulta por fila
+        extra_kwargs = {'sku': {'validators': []}}
+
+class StockImportacionSerializer(serializers.Serializer):
+    """Valida una fila de la importación masiva de stock, identificando el producto por sku."""
+    sku = serializers.CharField(max_length=50)
+    tienda = serializers.IntegerField()
+    cantidad = serializers.IntegerField(min_value=0)
+    stock_minimo = serializers.IntegerField(min_value=0, required=False)
+
+class ProductoSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
     precio = serializers.FloatField()
     imagen = serializers.ImageField(write_only=True, required=False)
     imagen_url = serializers.SerializerMethodField()
     stock_por_tienda = StockTiendaSerializer(source='stocktienda_set', many=True, read_only=True)
-    stock_total = serializers.SerializerMethodField()
 
     class Meta:
         model = Producto
-        fields = ['id', 'sku', 'nombre', 'descripcion', 'precio', 'categoria', 'marca', 'imagen', 'imagen_url', 'stock_por_tienda', 'stock_total', 'fecha_creacion', 'fecha_actualizacion']
+        fields = ['id', 'sku', 'nombre', 'descripcion', 'precio', 'categoria', 'marca', 'imagen', 'imagen_url', 'stock_por_tienda', 'stock_total', 'tiendas_con_stock', 'fecha_creacion', 'fecha_actualizacion']
+        read_only_fields = ['stock_total', 'tiendas_con_stock']
 
-    def get_stock_total(self, obj):
-        return sum(stock.cantidad for stock in obj.stocktienda_set.all())
+    expansiones = {'stock': 'stock_por_tienda'}
+    # El listado siempre incluyó el stock; se mantiene salvo que se use ?fields=
+    expansiones_por_defecto = ('stock',)
 
     def get_imagen_url(self, obj):
-        if obj.imagen_url:
-            # Añadir timestamp para evitar caché
-            timestamp = int(time.time())
-            return f"{obj.imagen_url}?v={timestamp}"
-        return None
+        return url_imagen_versionada(obj.imagen_url)
 
     def create(self, validated_data):
         imagen = validated_data.pop('imagen', None)
@@ -0,0 +1,59 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import cercania
+from .cache import invalidar_al_confirmar
+from .eventos_service import publicar_cambios
+from .models import Producto, StockTienda, Tienda
+from .search import actualizar_en_indice, eliminar_de_indice
+from .stock_service import sincronizar_totales
+
+
+@receiver(post_save, sender=StockTienda)
+@receiver(post_delete, sender=StockTienda)
+def actualizar_totales_producto(sender, instance, **kwargs):
+    """Mantiene los totales de stock del producto en cada escritura de StockTienda."""
+    sincronizar_totales([instance.producto_id])
+    # Refrescar la instancia en memoria para que quien la use vea el nuevo total
+    if StockTienda.producto.is_cached(instance):
+        instance.producto.refresh_from_db(fields=list(instance.producto.CAMPOS_DESNORMALIZADOS))
+
+
+@receiver(post_save, sender=StockTienda)
+def publicar_stock_guardado(sender, instance, **kwargs):
+    publicar_cambios({(instance.producto_id, instance.tienda_id): instance.cantidad})
+
+
+@receiver(post_delete, sender=StockTienda)
+def publicar_stock_borrado(sender, instance, **kwargs):
+    publicar_cambios({(instance.producto_id, instance.tienda_id): None})
+
+
+@receiver(post_save, sender=Producto)
+def indexar_producto(sender, instance, **kwargs):
+    actualizar_en_indice(instance)
+
+
+@receiver(post_delete, sender=Producto)
+def desindexar_producto(sender, instance, **kwargs):
+    eliminar_de_indice(instance.id)
+
+
+@receiver(post_save, sender=Tienda)
+def ubicar_tienda(sender, instance, **kwargs):
+    cercania.actualizar_en_indice(instance)
+
+
+@receiver(post_delete, sender=Tienda)
+def quitar_ubicacion_tienda(sender, instance, **kwargs):
+    cercania.eliminar_de_indice(instance.id)
+
+
+@receiver(post_save, sender=Producto)
+@receiver(post_delete, sender=Producto)
+@receiver(post_save, sender=StockTienda)
+@receiver(post_delete, sender=StockTienda)
+@receiver(post_save, sender=Tienda)
+@receiver(post_delete, sender=Tienda)
+def invalidar_cache_catalogo(sender, **kwargs):
+    invalidar_al_confirmar()
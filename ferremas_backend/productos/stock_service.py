@@ -0,0 +1,322 @@
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .asignacion import asignador_configurado
+from .cache import invalidar_al_confirmar
+from .eventos_service import publicar_cambios
+from .models import Producto, StockMovimiento, StockTienda, Tienda
+from .movimientos_service import movimiento, registrar
+
+
+class StockInsuficiente(Exception):
+    """La fila no tiene la cantidad que se quiere descontar."""
+
+
+def _subconsultas_totales():
+    """Subconsultas correlacionadas con el total y las tiendas con stock de cada producto."""
+    stock = StockTienda.objects.filter(producto=OuterRef('pk')).order_by().values('producto')
+    total = stock.annotate(total=Sum('cantidad')).values('total')
+    tiendas = stock.filter(cantidad__gt=0).annotate(tiendas=Count('id')).values('tiendas')
+    return Coalesce(Subquery(total), 0), Coalesce(Subquery(tiendas), 0)
+
+
+def actualizar_totales(queryset):
+    """
+    Recalcula stock_total y tiendas_con_stock de los productos del queryset
+    en una sola sentencia UPDATE. Devuelve la cantidad de filas actualizadas.
+    """
+    total, tiendas = _subconsultas_totales()
+    return queryset.update(stock_total=total, tiendas_con_stock=tiendas)
+
+
+def sincronizar_totales(producto_ids):
+    """Actualiza los totales desnormalizados de los productos indicados."""
+    producto_ids = set(producto_ids)
+    if not producto_ids:
+        return 0
+    return actualizar_totales(Producto.objects.filter(pk__in=producto_ids))
+
+
+def productos_descuadrados():
+    """Productos cuyos totales guardados no coinciden con StockTienda."""
+    total, tiendas = _subconsultas_totales()
+    return Producto.objects.annotate(
+        stock_total_real=total,
+        tiendas_con_stock_real=tiendas,
+    ).exclude(
+        stock_total=F('stock_total_real'),
+        tiendas_con_stock=F('tiendas_con_stock_real'),
+    )
+
+
+def bajo_minimo(queryset=None):
+    """
+    Filas con la cantidad bajo su stock mínimo. El filtro es el mismo
+    predicado del índice parcial stock_bajo_minimo_idx, así la base lo usa.
+    """
+    queryset = StockTienda.objects.all() if queryset is None else queryset
+    return queryset.filter(cantidad__lt=F('stock_minimo'))
+
+
+def resumen_bajo_minimo():
+    """Por tienda: filas bajo su mínimo y cuántas de ellas están agotadas."""
+    conteos = {
+        fila['tienda_id']: fila
+        for fila in bajo_minimo().order_by().values('tienda_id').annotate(
+            bajo_minimo=Count('id'), agotados=Count('id', filter=Q(cantidad=0)),
+        )
+    }
+    return [
+        {
+            'tienda': tienda_id,
+            'nombre': nombre,
+            'bajo_minimo': conteos.get(tienda_id, {}).get('bajo_minimo', 0),
+            'agotados': conteos.get(tienda_id, {}).get('agotados', 0),
+        }
+        for tienda_id, nombre in Tienda.objects.order_by('id').values_list('id', 'nombre')
+    ]
+
+
+# Cambios de cantidad. Cada uno es una sola sentencia UPDATE condicionada
+# (cantidad >= lo que se descuenta), así dos requests concurrentes no pueden
+# pisarse ni dejar stock negativo. Como update() no emite señales, al final se
+# sincronizan los totales del producto y se deja la caché del catálogo para
+# invalidar al confirmar (si la transacción se revierte, no se invalida).
+# Cada cambio queda en el libro de StockMovimiento dentro de la misma
+# transacción; las ventas del checkout las registra el llamador en un lote,
+# una vez creados los ItemOrden a los que apuntan.
+
+def _sumar(stock_filtro, delta):
+    """Suma `delta` a las filas del filtro si alcanza el stock. Devuelve las filas actualizadas."""
+    if delta < 0:
+        stock_filtro = stock_filtro.filter(cantidad__gte=-delta)
+    return stock_filtro.update(cantidad=F('cantidad') + delta, fecha_actualizacion=timezone.now())
+
+
+def _despues_de_cambiar(producto_ids, cantidades):
+    """Totales, caché y stream en vivo, con las cantidades nuevas {(producto_id, tienda_id): cantidad}."""
+    sincronizar_totales(producto_ids)
+    invalidar_al_confirmar()
+    publicar_cambios(cantidades)
+
+
+def ajustar_cantidad(stock_id, delta, tipo=StockMovimiento.AJUSTE, **referencias):
+    """
+    Suma `delta` (positivo o negativo) a la cantidad de un StockTienda y lo
+    registra como movimiento de `tipo` con `referencias` (usuario, orden...).
+    Lanza StockInsuficiente si quedaría negativa y StockTienda.DoesNotExist si no existe.
+    """
+    with transaction.atomic():
+        if not _sumar(StockTienda.objects.filter(pk=stock_id), delta):
+            StockTienda.objects.get(pk=stock_id)
+            raise StockInsuficiente(stock_id)
+        stock = StockTienda.objects.select_related('producto', 'tienda').get(pk=stock_id)
+        if delta:
+            registrar([movimiento(stock, tipo, delta, **referencias)])
+        _despues_de_cambiar([stock.producto_id], {(stock.producto_id, stock.tienda_id): stock.cantidad})
+    return stock
+
+
+def transferir(producto_id, tienda_origen_id, tienda_destino_id, cantidad, usuario=None):
+    """
+    Mueve `cantidad` unidades entre dos tiendas en una transacción. Las dos
+    filas se bloquean en orden de id, así dos transferencias cruzadas no se
+    bloquean mutuamente. Devuelve (origen, destino).
+    """
+    tienda_origen_id, tienda_destino_id = int(tienda_origen_id), int(tienda_destino_id)
+    with transaction.atomic():
+        StockTienda.objects.get_or_create(
+            producto_id=producto_id, tienda_id=tienda_destino_id,
+            defaults={'cantidad': 0, 'stock_minimo': 0},
+        )
+        filas = StockTienda.objects.filter(
+            producto_id=producto_id, tienda_id__in=[tienda_origen_id, tienda_destino_id]
+        )
+        list(filas.select_for_update().order_by('id').values_list('id', flat=True))
+        if not filas.filter(tienda_id=tienda_origen_id).exists():
+            raise StockTienda.DoesNotExist('No existe stock en la tienda de origen')
+        if not _sumar(filas.filter(tienda_id=tienda_origen_id), -cantidad):
+            raise StockInsuficiente(tienda_origen_id)
+        _sumar(filas.filter(tienda_id=tienda_destino_id), cantidad)
+        stocks = {stock.tienda_id: stock for stock in filas.select_related('producto', 'tienda')}
+        registrar([
+            movimiento(stocks[tienda_origen_id], StockMovimiento.TRANSFERENCIA, -cantidad,
+                       tienda_contraparte_id=tienda_destino_id, usuario=usuario),
+            movimiento(stocks[tienda_destino_id], StockMovimiento.TRANSFERENCIA, cantidad,
+                       tienda_contraparte_id=tienda_origen_id, usuario=usuario),
+        ])
+        _despues_de_cambiar([producto_id], {(producto_id, tienda_id): stock.cantidad for tienda_id, stock in stocks.items()})
+    return stocks[tienda_origen_id], stocks[tienda_destino_id]
+
+
+def descontar_pedido(pedido, asignador=None):
+    """
+    Reparte `pedido` ({producto_id: cantidad}) entre las tiendas activas con el
+    asignador configurado y descuenta lo asignado, en una transacción. Todo el
+    stock de los productos se lee (y bloquea) en una consulta y se escribe en
+    un INSERT ... ON CONFLICT, así el costo no depende de cuántas tiendas hay.
+    Devuelve la Asignacion; lo que no se pudo cubrir queda en `faltantes`.
+    """
+    asignador = asignador or asignador_configurado()
+    with transaction.atomic():
+        disponibles = {}
+        for producto_id, tienda_id, cantidad in StockTienda.objects.select_for_update(of=('self',)).filter(
+            producto_id__in=list(pedido), tienda__activa=True, cantidad__gt=0
+        ).values_list('producto_id', 'tienda_id', 'cantidad'):
+            disponibles.setdefault(producto_id, {})[tienda_id] = cantidad
+        asignacion = asignador.asignar(pedido, disponibles)
+        nuevas = {}
+        for producto_id, partes in asignacion.partes.items():
+            for tienda_id, cantidad in partes:
+                restante = disponibles[producto_id][tienda_id] - cantidad
+                if restante < 0:
+                    raise StockInsuficiente(producto_id)
+                nuevas[(producto_id, tienda_id)] = restante
+        if nuevas:
+            _escribir_cantidades(nuevas)
+            _despues_de_cambiar(asignacion.partes, nuevas)
+    return asignacion
+
+
+def movimiento_de_venta(item_orden):
+    """Movimiento sin guardar de la venta de `item_orden` desde su tienda."""
+    return movimiento(
+        item_orden, StockMovimiento.VENTA, -item_orden.cantidad, orden_id=item_orden.orden_id, item_orden=item_orden
+    )
+
+
+# Ajuste masivo (conteos cíclicos). Se leen y bloquean las filas con
+# SELECT ... FOR UPDATE, las cantidades nuevas se calculan en memoria y se
+# escriben con un INSERT ... ON CONFLICT DO UPDATE (que también crea las filas
+# que faltan) y un INSERT en el libro: la cantidad de sentencias no depende
+# del número de ajustes, salvo por los lotes de LOTE_BLOQUEO pares y de
+# LOTE_ESCRITURA filas.
+MAX_AJUSTES_LOTE = 10000
+LOTE_ESCRITURA = 1000
+# Pares (producto, tienda) por SELECT ... FOR UPDATE: cada producto es un
+# término del OR, y SQLite no acepta expresiones de más de 1000 niveles
+LOTE_BLOQUEO = 250
+
+
+def _escribir_cantidades(cantidades, ahora=None):
+    """
+    Escribe {(producto_id, tienda_id): cantidad} con INSERT ... ON CONFLICT DO
+    UPDATE, creando las filas que no existan. Las filas deben estar bloqueadas
+    (select_for_update) desde que se leyó la cantidad anterior.
+    """
+    ahora = ahora or timezone.now()
+    StockTienda.objects.bulk_create(
+        [
+            StockTienda(producto_id=producto_id, tienda_id=tienda_id, cantidad=cantidad, fecha_actualizacion=ahora)
+            for (producto_id, tienda_id), cantidad in cantidades.items()
+        ],
+        batch_size=LOTE_ESCRITURA,
+        update_conflicts=True, unique_fields=['producto', 'tienda'], update_fields=['cantidad', 'fecha_actualizacion'],
+    )
+
+
+def bloquear_filas(pares):
+    """
+    Bloquea las filas de los pares (producto_id, tienda_id) y devuelve
+    {(producto_id, tienda_id): cantidad} de las que existen. Va de a
+    LOTE_BLOQUEO pares en orden de (producto, tienda), así dos lotes
+    concurrentes toman los bloqueos en el mismo orden y no se bloquean mutuamente.
+    """
+    cantidades = {}
+    pares = sorted(pares)
+    for inicio in range(0, len(pares), LOTE_BLOQUEO):
+        tiendas_por_producto = {}
+        for producto_id, tienda_id in pares[inicio:inicio + LOTE_BLOQUEO]:
+            tiendas_por_producto.setdefault(producto_id, []).append(tienda_id)
+        condicion = Q(
+            *(Q(producto_id=producto_id, tienda_id__in=tiendas) for producto_id, tiendas in tiendas_por_producto.items()),
+            _connector=Q.OR,
+        )
+        filas = StockTienda.objects.select_for_update().filter(condicion).order_by('producto_id', 'tienda_id')
+        for producto_id, tienda_id, cantidad in filas.values_list('producto_id', 'tienda_id', 'cantidad'):
+            cantidades[(producto_id, tienda_id)] = cantidad
+    return cantidades
+
+
+def _entero(valor):
+    if isinstance(valor, bool) or valor is None:
+        raise ValueError(valor)
+    if isinstance(valor, str):
+        valor = valor.strip()
+    return int(valor)
+
+
+def _leer_ajuste(ajuste):
+    """(producto_id, tienda_id, delta, absoluta) de una entrada, o ValueError con el motivo."""
+    if not isinstance(ajuste, dict):
+        raise ValueError('Cada ajuste debe ser un objeto')
+    if ('delta' in ajuste) == ('cantidad' in ajuste):
+        raise ValueError("Indique solo uno de 'delta' o 'cantidad'")
+    try:
+        producto_id, tienda_id = _entero(ajuste.get('producto')), _entero(ajuste.get('tienda'))
+        delta = _entero(ajuste['delta']) if 'delta' in ajuste else None
+        absoluta = _entero(ajuste['cantidad']) if 'cantidad' in ajuste else None
+    except (TypeError, ValueError):
+        raise ValueError('producto, tienda y delta o cantidad deben ser números enteros')
+    if absoluta is not None and absoluta < 0:
+        raise ValueError('La cantidad no puede ser negativa')
+    return producto_id, tienda_id, delta, absoluta
+
+
+def ajustar_en_lote(ajustes, usuario=None):
+    """
+    Aplica en una transacción una lista de ajustes {producto, tienda, delta}
+    o {producto, tienda, cantidad} (cantidad absoluta), en orden. Los ajustes
+    que dejarían el stock negativo o que son inválidos se rechazan sin
+    afectar a los demás. Las filas que no existen se crean si el ajuste no es
+    negativo. Devuelve un resultado por ajuste, en el mismo orden.
+    """
+    resultados, leidos = [], []
+    for indice, ajuste in enumerate(ajustes):
+        try:
+            leidos.append((indice, *_leer_ajuste(ajuste)))
+            resultados.append(None)
+        except ValueError as e:
+            resultados.append({'indice': indice, 'estado': 'rechazado', 'error': str(e)})
+
+    producto_ids = {producto_id for _, producto_id, _, _, _ in leidos}
+    tienda_ids = {tienda_id for _, _, tienda_id, _, _ in leidos}
+    ahora = timezone.now()
+    with transaction.atomic():
+        productos = set(Producto.objects.filter(pk__in=producto_ids).values_list('pk', flat=True))
+        tiendas = set(Tienda.objects.filter(pk__in=tienda_ids).values_list('pk', flat=True))
+        # Se bloquean solo las filas de los pares pedidos, no el cruce de
+        # todos los productos con todas las tiendas
+        cantidades = bloquear_filas({
+            (producto_id, tienda_id) for _, producto_id, tienda_id, _, _ in leidos
+            if producto_id in productos and tienda_id in tiendas
+        })
+        originales, movimientos = dict(cantidades), []
+
+        for indice, producto_id, tienda_id, delta, absoluta in leidos:
+            resultado = resultados[indice] = {'indice': indice, 'producto': producto_id, 'tienda': tienda_id}
+            if producto_id not in productos or tienda_id not in tiendas:
+                resultado.update(estado='rechazado', error='Producto o tienda no encontrados')
+                continue
+            clave = (producto_id, tienda_id)
+            actual = cantidades.get(clave)
+            cantidad = absoluta if absoluta is not None else (actual or 0) + delta
+            if cantidad < 0:
+                resultado.update(estado='rechazado', error='No se puede tener stock negativo', cantidad=actual or 0)
+                continue
+            cantidades[clave] = cantidad
+            if cantidad != (actual or 0):
+                movimientos.append(StockMovimiento(
+                    producto_id=producto_id, tienda_id=tienda_id, tipo=StockMovimiento.AJUSTE,
+                    cantidad=cantidad - (actual or 0), usuario=usuario, fecha=ahora,
+                ))
+            resultado.update(estado='aplicado', cantidad=cantidad)
+
+        cambiadas = {clave: cantidad for clave, cantidad in cantidades.items() if originales.get(clave) != cantidad}
+        _escribir_cantidades(cambiadas, ahora)
+        registrar(movimientos)
+        if movimientos:
+            _despues_de_cambiar({mov.producto_id for mov in movimientos}, cambiadas)
+    return resultados
@@ -0,0 +1,175 @@
+"""
+Stream SSE de cambios de stock: GET /api/stock-tienda/stream/.
+
+Es una aplicación ASGI propia que config/asgi.py monta delante de Django. El
+handler ASGI de Django abre un hilo por request para sus señales y
+middleware síncronos y lo retiene mientras la respuesta siga abierta; acá
+cada conexión es solo una corrutina esperando su suscripción en el broker
+(productos/eventos_service.py), así miles de suscriptores inactivos no
+ocupan hilos. Bajo WSGI (runserver) la ruta no existe: hay que servir
+config.asgi, p. ej. con `uvicorn config.asgi:application`.
+
+Como la matriz y el stock bajo mínimo, es solo para administradores y
+trabajadores: el JWT de acceso va en `Authorization: Bearer` o, como
+EventSource no manda cabeceras, en `?token=` (401 sin token válido, 403 sin
+el rol). CORS solo se responde a los orígenes de CORS_ALLOWED_ORIGINS, nunca
+con `*`.
+
+Eventos: `stock` con [{producto, tienda, cantidad}] (cantidad null si la
+fila se borró) y `resync` si se perdieron cambios y conviene releer el stock
+(p. ej. la matriz con `since`). Se filtra con `?tiendas=1,2` y `?productos=`.
+"""
+import asyncio
+import json
+from types import SimpleNamespace
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+
+from usuarios.permissions import EsAdministradorOTrabajador
+
+from .eventos_service import Lote, broker
+
+RUTA_STREAM = '/api/stock-tienda/stream/'
+MAX_FILTRO_STREAM = 1000
+# Segundos sin eventos tras los que se manda un comentario SSE, para que
+# proxies y balanceadores no corten la conexión por inactiva
+LATIDO_STREAM = 15
+
+
+def ids_de(parametros, nombre):
+    """Ids separados por coma del parámetro `nombre`, o None si no viene. Lanza ValueError."""
+    valores = parametros.get(nombre)
+    if not valores or not valores[-1]:
+        return None
+    try:
+        ids = {int(valor) for valor in valores[-1].split(',')}
+    except ValueError:
+        raise ValueError(nombre)
+    if len(ids) > MAX_FILTRO_STREAM:
+        raise ValueError(nombre)
+    return ids
+
+
+def token_de(scope, parametros):
+    """JWT de la cabecera `Authorization: Bearer` o, si no viene, del parámetro `token`."""
+    for nombre, valor in scope.get('headers', []):
+        if nombre == b'authorization':
+            partes = valor.decode('latin-1').split()
+            if len(partes) == 2 and partes[0] == 'Bearer':
+                return partes[1]
+    valores = parametros.get('token')
+    return valores[-1] if valores else None
+
+
+def rechazo(token):
+    """Status con que se rechaza la conexión (401 o 403), o None si el usuario puede suscribirse."""
+    if not token:
+        return 401
+    # Fuera del handler de Django nadie cierra la conexión a la base por nosotros
+    close_old_connections()
+    try:
+        autenticacion = JWTAuthentication()
+        usuario = autenticacion.get_user(autenticacion.get_validated_token(token))
+    except AuthenticationFailed:
+        return 401
+    finally:
+        close_old_connections()
+    if not EsAdministradorOTrabajador().has_permission(SimpleNamespace(user=usuario), None):
+        return 403
+    return None
+
+
+def cabeceras(scope, tipo):
+    lista = [(b'content-type', tipo), (b'cache-control', b'no-cache'), (b'vary', b'Origin')]
+    origen = dict(scope.get('headers', [])).get(b'origin')
+    if origen and origen.decode('latin-1') in getattr(settings, 'CORS_ALLOWED_ORIGINS', []):
+        lista.append((b'access-control-allow-origin', origen))
+    return lista
+
+
+async def responder_error(scope, send, estado, mensaje):
+    cuerpo = json.dumps({'error': mensaje}).encode()
+    lista = cabeceras(scope, b'application/json')
+    if estado == 401:
+        lista.append((b'www-authenticate', b'Bearer realm="api"'))
+    await send({'type': 'http.response.start', 'status': estado, 'headers': lista})
+    await send({'type': 'http.response.body', 'body': cuerpo})
+
+
+def evento(deltas):
+    if deltas is None:
+        return b'event: resync\ndata: {}\n\n'
+    # Un Lote compartido por varias conexiones se codifica una sola vez
+    codificado = getattr(deltas, 'codificado', None)
+    if codificado is None:
+        codificado = b'event: stock\ndata: ' + json.dumps(deltas, separators=(',', ':')).encode() + b'\n\n'
+        if isinstance(deltas, Lote):
+            deltas.codificado = codificado
+    return codificado
+
+
+async def aplicacion_stream(scope, receive, send):
+    parametros = parse_qs(scope.get('query_string', b'').decode())
+    try:
+        productos = ids_de(parametros, 'productos')
+        tiendas = ids_de(parametros, 'tiendas')
+    except ValueError as error:
+        await responder_error(
+            scope, send, 400, f"'{error}' debe ser una lista de hasta {MAX_FILTRO_STREAM} ids separados por coma"
+        )
+        return
+    estado = await sync_to_async(rechazo)(token_de(scope, parametros))
+    if estado is not None:
+        mensaje = 'Se requiere un token de acceso válido' if estado == 401 else 'Solo administradores y trabajadores'
+        await responder_error(scope, send, estado, mensaje)
+        return
+
+    # Al desconectarse el cliente se cancela esta corrutina, que puede estar
+    # esperando la suscripción; `desconectado` distingue eso de una cancelación del servidor
+    tarea = asyncio.current_task()
+    desconectado = False
+
+    async def vigilar():
+        nonlocal desconectado
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+        desconectado = True
+        tarea.cancel()
+
+    suscripcion = broker().suscribir(productos, tiendas)
+    vigilante = asyncio.ensure_future(vigilar())
+    try:
+        await send({
+            'type': 'http.response.start', 'status': 200,
+            'headers': cabeceras(scope, b'text/event-stream') + [(b'x-accel-buffering', b'no')],
+        })
+        await send({'type': 'http.response.body', 'body': b'retry: 3000\n\n', 'more_body': True})
+        while True:
+            try:
+                cuerpo = evento(await suscripcion.siguiente(LATIDO_STREAM))
+            except asyncio.TimeoutError:
+                cuerpo = b': latido\n\n'
+            await send({'type': 'http.response.body', 'body': cuerpo, 'more_body': True})
+    except asyncio.CancelledError:
+        if not desconectado:
+            raise
+    finally:
+        vigilante.cancel()
+        broker().cancelar(suscripcion)
+
+
+def con_stream(aplicacion):
+    """Envuelve la aplicación ASGI de Django para atender la ruta del stream."""
+
+    async def despachar(scope, receive, send):
+        if scope['type'] == 'http' and scope['path'] == RUTA_STREAM and scope['method'] == 'GET':
+            await aplicacion_stream(scope, receive, send)
+        else:
+            await aplicacion(scope, receive, send)
+
+    return despachar
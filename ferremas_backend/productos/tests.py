@@ -1,4 +1,5 @@
-from django.test import TestCase
+from django.db import transaction
+from django.test import TestCase, TransactionTestCase, override_settings
 from django.contrib.auth import get_user_model
 from rest_framework.test import APITestCase, APIClient
 from rest_framework import status
@@ -365,3 +366,1562 @@ class StockTiendaAPITest(APITestCase):
         response = self.client.post(url, data)
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
         self.assertEqual(StockTienda.objects.count(), 2)
+
+    def test_editar_cantidad_queda_en_libro(self):
+        """Un PATCH de la cantidad se registra como ajuste; uno del mínimo no mueve el libro"""
+        from .models import StockMovimiento
+        url = reverse('stocktienda-detail', args=[self.stock.id])
+        self.assertEqual(self.client.patch(url, {'cantidad': 7}).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.patch(url, {'stock_minimo': 2}).status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            list(StockMovimiento.objects.values_list('tipo', 'cantidad', 'usuario')),
+            [(StockMovimiento.AJUSTE, -3, self.admin_user.id)],
+        )
+
+class ProductoListadoPaginadoTest(APITestCase):
+    """Pruebas del listado paginado por cursor y su número de consultas"""
+
+    def setUp(self):
+        self.tiendas = [
+            Tienda.objects.create(nombre=f'Tienda {i}', direccion='Dirección', telefono='123456789')
+            for i in range(4)
+        ]
+        for i in range(30):
+            producto = Producto.objects.create(
+                sku=f'PAG{i:03d}',
+                nombre=f'Producto {i}',
+                precio=Decimal('10.00'),
+                categoria='Herramientas'
+            )
+            for j, tienda in enumerate(self.tiendas):
+                StockTienda.objects.create(producto=producto, tienda=tienda, cantidad=i + j)
+        self.url = reverse('producto-list')
+
+    def test_consultas_constantes_por_pagina(self):
+        """Cada página usa el mismo número de consultas sin importar su tamaño"""
+        for page_size in (5, 25):
+            with self.assertNumQueries(2):
+                response = self.client.get(self.url, {'page_size': page_size})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(len(response.data['results']), page_size)
+
+    def test_recorrer_todas_las_paginas(self):
+        """El cursor recorre todo el catálogo sin repetir productos"""
+        vistos = []
+        response = self.client.get(self.url, {'page_size': 7})
+        while True:
+            vistos.extend(p['id'] for p in response.data['results'])
+            if not response.data['next']:
+                break
+            with self.assertNumQueries(2):
+                response = self.client.get(response.data['next'])
+        self.assertEqual(vistos, sorted(Producto.objects.values_list('id', flat=True)))
+
+    def test_stock_total_calculado_en_sql(self):
+        """El stock total del listado coincide con la suma por tienda"""
+        response = self.client.get(self.url, {'page_size': 30})
+        for producto in response.data['results']:
+            self.assertEqual(
+                producto['stock_total'],
+                sum(stock['cantidad'] for stock in producto['stock_por_tienda'])
+            )
+            self.assertEqual(len(producto['stock_por_tienda']), len(self.tiendas))
+
+    def test_listado_sin_paginar_tambien_acotado(self):
+        """Sin parámetros de paginación se devuelve la lista completa con consultas fijas"""
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url)
+        self.assertEqual(len(response.data), 30)
+
+    def test_filtros_invalidos_responden_400(self):
+        """Un precio o una tienda mal escritos no se ignoran en silencio"""
+        for params in ({'precio_min': 'abc'}, {'precio_max': 'NaN'}, {'precio_min': '5', 'tienda': 'centro'}):
+            with self.subTest(params=params):
+                response = self.client.get(self.url, params)
+                self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+                self.assertIn('error', response.data)
+        response = self.client.get(self.url, {'precio_min': '10', 'precio_max': '10.01', 'tienda': self.tiendas[0].id})
+        self.assertEqual(len(response.data), 29)  # El producto 0 no tiene stock en la tienda 0
+
+class StockTotalDesnormalizadoTest(APITestCase):
+    """Pruebas de los totales de stock guardados en Producto"""
+
+    def setUp(self):
+        self.admin_user = CustomerUser.objects.create_user(
+            username='admin_test',
+            email='admin@test.com',
+            password='testpass123'
+        )
+        self.admin_user.role = 'admin'
+        self.admin_user.save()
+        self.producto = Producto.objects.create(
+            sku='TOT001',
+            nombre='Taladro',
+            precio=Decimal('59.99'),
+            categoria='Herramientas'
+        )
+        self.tienda_a = Tienda.objects.create(nombre='Tienda A', direccion='Dirección A', telefono='1')
+        self.tienda_b = Tienda.objects.create(nombre='Tienda B', direccion='Dirección B', telefono='2')
+        self.stock_a = StockTienda.objects.create(producto=self.producto, tienda=self.tienda_a, cantidad=10)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.admin_user)
+
+    def assertTotales(self, stock_total, tiendas_con_stock):
+        self.producto.refresh_from_db()
+        self.assertEqual(self.producto.stock_total, stock_total)
+        self.assertEqual(self.producto.tiendas_con_stock, tiendas_con_stock)
+
+    def test_totales_al_crear_y_eliminar_stock(self):
+        """Crear y eliminar filas de stock actualiza los totales"""
+        self.assertTotales(10, 1)
+        stock_b = StockTienda.objects.create(producto=self.producto, tienda=self.tienda_b, cantidad=5)
+        self.assertTotales(15, 2)
+        stock_b.delete()
+        self.assertTotales(10, 1)
+
+    def test_totales_al_ajustar_stock(self):
+        """ajustar_stock deja los totales consistentes"""
+        url = reverse('stocktienda-ajustar-stock', args=[self.stock_a.id])
+        self.client.post(url, {'cantidad': -10})
+        self.assertTotales(0, 0)
+
+    def test_totales_al_transferir_stock(self):
+        """transferir_stock mueve cantidad sin cambiar el total"""
+        url = reverse('stocktienda-transferir-stock')
+        self.client.post(url, {
+            'producto': self.producto.id,
+            'tienda_origen': self.tienda_a.id,
+            'tienda_destino': self.tienda_b.id,
+            'cantidad': 4
+        })
+        self.assertTotales(10, 2)
+
+    def test_save_de_producto_no_pisa_totales(self):
+        """Guardar una instancia antigua del producto conserva los totales vigentes"""
+        producto_antiguo = Producto.objects.get(pk=self.producto.pk)
+        StockTienda.objects.create(producto=self.producto, tienda=self.tienda_b, cantidad=5)
+        producto_antiguo.nombre = 'Taladro Percutor'
+        producto_antiguo.save()
+        self.assertTotales(15, 2)
+
+    def test_filtrar_y_ordenar_por_disponibilidad(self):
+        """Se puede filtrar y ordenar el listado por stock_total"""
+        Producto.objects.create(sku='TOT002', nombre='Sin stock', precio=Decimal('1.00'), categoria='Herramientas')
+        url = reverse('producto-list')
+        response = self.client.get(url, {'disponible': 'true'})
+        self.assertEqual([p['sku'] for p in response.data], ['TOT001'])
+        response = self.client.get(url, {'ordering': 'stock_total', 'page_size': 10})
+        self.assertEqual([p['sku'] for p in response.data['results']], ['TOT002', 'TOT001'])
+
+    def test_comando_recalcular_stock(self):
+        """El comando detecta y corrige totales descuadrados"""
+        from io import StringIO
+        from django.core.management import call_command
+
+        Producto.objects.filter(pk=self.producto.pk).update(stock_total=99, tiendas_con_stock=7)
+        salida = StringIO()
+        call_command('recalcular_stock', '--verificar', stdout=salida)
+        self.assertIn('Productos descuadrados: 1', salida.getvalue())
+        self.assertTotales(99, 7)
+
+        call_command('recalcular_stock', stdout=StringIO())
+        self.assertTotales(10, 1)
+
+class BusquedaProductosTest(APITestCase):
+    """Pruebas del endpoint de búsqueda por texto libre"""
+
+    def setUp(self):
+        from .search import reiniciar_indice
+        reiniciar_indice()
+        self.addCleanup(reiniciar_indice)
+        self.bosch = Producto.objects.create(
+            sku='TAL-18V', nombre='Taladro Percutor Inalámbrico 18V', marca='Bosch',
+            descripcion='Incluye batería y cargador', precio=Decimal('89990'), categoria='Herramientas Eléctricas'
+        )
+        self.makita = Producto.objects.create(
+            sku='TAL-220', nombre='Taladro de Banco', marca='Makita',
+            descripcion='Motor de inducción', precio=Decimal('159990'), categoria='Herramientas Eléctricas'
+        )
+        self.brocas = Producto.objects.create(
+            sku='BRO-010', nombre='Set de Brocas', marca='Bosch',
+            descripcion='Compatible con cualquier taladro', precio=Decimal('9990'), categoria='Accesorios'
+        )
+        self.martillo = Producto.objects.create(
+            sku='MAR-001', nombre='Martillo Carpintero', marca='Stanley',
+            descripcion='Mango de fibra', precio=Decimal('12990'), categoria='Herramientas Manuales'
+        )
+        self.url = reverse('producto-search')
+
+    def buscar(self, consulta, **params):
+        response = self.client.get(self.url, {'q': consulta, **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [producto['id'] for producto in response.data['results']]
+
+    def test_ranking_con_varios_terminos(self):
+        """El producto que coincide con todos los términos aparece primero"""
+        ids = self.buscar('taladro bosch 18v')
+        self.assertEqual(ids[0], self.bosch.id)
+        self.assertIn(self.makita.id, ids)
+
+    def test_nombre_pesa_mas_que_descripcion(self):
+        """Una coincidencia en el nombre rankea sobre una en la descripción"""
+        ids = self.buscar('taladro')
+        self.assertEqual(set(ids[:2]), {self.bosch.id, self.makita.id})
+        self.assertEqual(ids[2], self.brocas.id)
+
+    def test_acentos_plurales_y_prefijos(self):
+        """La búsqueda ignora tildes, aplica stemming y coincide por prefijo"""
+        self.assertEqual(self.buscar('martíllos'), [self.martillo.id])
+        self.assertEqual(self.buscar('MARTI'), [self.martillo.id])
+        self.assertEqual(self.buscar('inalambrico')[0], self.bosch.id)
+
+    def test_busqueda_por_sku(self):
+        """Se puede buscar por sku con o sin separadores"""
+        self.assertEqual(self.buscar('MAR-001'), [self.martillo.id])
+        self.assertEqual(self.buscar('bro010'), [self.brocas.id])
+
+    def test_filtro_por_categoria(self):
+        """Los filtros del listado se aplican a los resultados"""
+        ids = self.buscar('bosch', categoria='Accesorios')
+        self.assertEqual(ids, [self.brocas.id])
+
+    def test_indice_se_actualiza_con_cambios(self):
+        """Crear, modificar o eliminar productos se refleja en la búsqueda"""
+        self.buscar('martillo')
+        self.martillo.nombre = 'Combo Carpintero'
+        self.martillo.save()
+        self.assertEqual(self.buscar('martillo'), [])
+        self.makita.delete()
+        self.assertEqual(self.buscar('banco'), [])
+        nuevo = Producto.objects.create(sku='SIE-001', nombre='Sierra Circular', precio=Decimal('1'), categoria='X')
+        self.assertEqual(self.buscar('sierra'), [nuevo.id])
+
+    def test_consulta_vacia_y_paginacion(self):
+        """Sin consulta no hay resultados y limit/offset paginan"""
+        self.assertEqual(self.buscar(''), [])
+        todos = self.buscar('taladro')
+        self.assertEqual(self.buscar('taladro', limit=1, offset=1), todos[1:2])
+
+class FacetasProductosTest(APITestCase):
+    """Pruebas de los conteos por faceta del catálogo"""
+
+    def setUp(self):
+        from .search import reiniciar_indice
+        reiniciar_indice()
+        self.addCleanup(reiniciar_indice)
+        self.centro = Tienda.objects.create(nombre='Centro', direccion='Dirección', telefono='1')
+        self.norte = Tienda.objects.create(nombre='Norte', direccion='Dirección', telefono='2')
+        datos = [
+            ('FAC001', 'Taladro Percutor', 'Herramientas', 'Bosch', '89990'),
+            ('FAC002', 'Taladro Inalámbrico', 'Herramientas', 'Makita', '129990'),
+            ('FAC003', 'Martillo', 'Herramientas', 'Stanley', '12990'),
+            ('FAC004', 'Pintura Látex', 'Pinturas', '', '4990'),
+        ]
+        self.productos = [
+            Producto.objects.create(sku=sku, nombre=nombre, categoria=categoria, marca=marca, precio=Decimal(precio))
+            for sku, nombre, categoria, marca, precio in datos
+        ]
+        StockTienda.objects.create(producto=self.productos[0], tienda=self.centro, cantidad=3)
+        StockTienda.objects.create(producto=self.productos[0], tienda=self.norte, cantidad=1)
+        StockTienda.objects.create(producto=self.productos[2], tienda=self.centro, cantidad=0)
+        StockTienda.objects.create(producto=self.productos[3], tienda=self.norte, cantidad=8)
+
+    def test_facetas_de_todo_el_catalogo(self):
+        """El listado con facets=true incluye todos los conteos"""
+        response = self.client.get(reverse('producto-list'), {'facets': 'true'})
+        facetas = response.data['facets']
+        self.assertEqual(len(response.data['results']), 4)
+        self.assertEqual(facetas['categoria'], [
+            {'valor': 'Herramientas', 'total': 3},
+            {'valor': 'Pinturas', 'total': 1},
+        ])
+        self.assertEqual({f['valor'] for f in facetas['marca']}, {'Bosch', 'Makita', 'Stanley'})
+        precios = {(f['desde'], f['hasta']): f['total'] for f in facetas['precio']}
+        self.assertEqual(precios[(0, 5000)], 1)
+        self.assertEqual(precios[(10000, 25000)], 1)
+        self.assertEqual(precios[(50000, 100000)], 1)
+        self.assertEqual(precios[(100000, None)], 1)
+        self.assertEqual(facetas['tienda'], [
+            {'id': self.norte.id, 'nombre': 'Norte', 'total': 2},
+            {'id': self.centro.id, 'nombre': 'Centro', 'total': 1},
+        ])
+
+    def test_facetas_respetan_filtros(self):
+        """Los conteos corresponden a los productos filtrados"""
+        response = self.client.get(reverse('producto-facets'), {'categoria': 'Herramientas', 'tienda': self.centro.id})
+        self.assertEqual(response.data['categoria'], [{'valor': 'Herramientas', 'total': 1}])
+        self.assertEqual(response.data['marca'], [{'valor': 'Bosch', 'total': 1}])
+
+    def test_facetas_paginadas_y_en_busqueda(self):
+        """Las facetas acompañan a la página y a la búsqueda"""
+        response = self.client.get(reverse('producto-list'), {'facets': '1', 'page_size': 1})
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(response.data['facets']['categoria'][0]['total'], 3)
+
+        response = self.client.get(reverse('producto-search'), {'q': 'taladro', 'facets': 'true', 'limit': 1})
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(response.data['facets']['categoria'], [{'valor': 'Herramientas', 'total': 2}])
+        self.assertEqual(len(response.data['facets']['marca']), 2)
+
+    @override_settings(CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'},
+        'catalogo': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'facetas-test'},
+    })
+    def test_resumen_cacheado_se_invalida(self):
+        """El resumen se sirve de caché y se invalida al cambiar los datos"""
+        url = reverse('producto-categories')
+        self.assertEqual(self.client.get(url).data, ['Herramientas', 'Pinturas'])
+        with self.assertNumQueries(0):
+            self.client.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            Producto.objects.create(sku='FAC005', nombre='Cable', categoria='Electricidad', precio=Decimal('1990'))
+        self.assertIn('Electricidad', self.client.get(url).data)
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'},
+    'catalogo': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'catalogo-test'},
+})
+class CacheCatalogoTest(APITestCase):
+    """Pruebas de la caché versionada del catálogo público"""
+
+    def setUp(self):
+        from .cache import cache_catalogo
+        cache_catalogo().clear()
+        self.tienda = Tienda.objects.create(nombre='Centro', direccion='Dirección', telefono='1')
+        self.producto = Producto.objects.create(
+            sku='CAC001', nombre='Alicate', precio=Decimal('4990'), categoria='Herramientas'
+        )
+        self.stock = StockTienda.objects.create(producto=self.producto, tienda=self.tienda, cantidad=5)
+
+    def test_segunda_lectura_sin_consultas(self):
+        """Las acciones públicas se sirven de caché tras la primera lectura"""
+        urls = [
+            reverse('producto-list'),
+            reverse('producto-detail', args=[self.producto.id]),
+            reverse('producto-categories'),
+            reverse('producto-stock-por-tienda', args=[self.producto.id]),
+            reverse('tienda-list'),
+        ]
+        for url in urls:
+            primera = self.client.get(url)
+            with self.assertNumQueries(0):
+                segunda = self.client.get(url)
+            self.assertEqual(primera.data, segunda.data)
+
+    def test_query_string_distingue_entradas(self):
+        """Cada combinación de parámetros tiene su propia entrada"""
+        url = reverse('producto-list')
+        self.client.get(url, {'categoria': 'Herramientas'})
+        self.assertEqual(len(self.client.get(url, {'categoria': 'Otra'}).data), 0)
+
+    def test_invalidacion_por_escrituras(self):
+        """Cambios en Producto, StockTienda y Tienda invalidan lo cacheado"""
+        url = reverse('producto-detail', args=[self.producto.id])
+        self.client.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.stock.cantidad = 9
+            self.stock.save()
+        self.assertEqual(self.client.get(url).data['stock_total'], 9)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tienda.nombre = 'Centro Renovado'
+            self.tienda.save()
+        self.assertEqual(self.client.get(url).data['stock_por_tienda'][0]['tienda_nombre'], 'Centro Renovado')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.producto.delete()
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_invalidacion_al_confirmar(self):
+        """Dentro de una transacción la versión no cambia; la respuesta se renueva tras el commit"""
+        url = reverse('producto-detail', args=[self.producto.id])
+        self.assertEqual(self.client.get(url).data['stock_total'], 5)
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                self.stock.cantidad = 9
+                self.stock.save()
+                # Un GET antes del commit sigue leyendo la entrada de la versión anterior
+                with self.assertNumQueries(0):
+                    self.assertEqual(self.client.get(url).data['stock_total'], 5)
+        self.assertEqual(self.client.get(url).data['stock_total'], 9)
+
+    def test_ajuste_revertido_no_invalida(self):
+        """Un ajuste de stock que se revierte no cambia la versión del catálogo"""
+        from .cache import version_catalogo
+        from .stock_service import ajustar_cantidad
+        version = version_catalogo()
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                ajustar_cantidad(self.stock.id, 3)
+                raise RuntimeError
+        self.assertEqual(version_catalogo(), version)
+        with self.captureOnCommitCallbacks(execute=True):
+            ajustar_cantidad(self.stock.id, 3)
+        self.assertNotEqual(version_catalogo(), version)
+
+    def test_get_condicional_con_etag(self):
+        """Con If-None-Match vigente se responde 304 sin consultas; tras una escritura, 200"""
+        url = reverse('producto-list')
+        primera = self.client.get(url)
+        self.assertIn('ETag', primera)
+        self.assertIn('Last-Modified', primera)
+        self.assertEqual(primera['Cache-Control'], 'no-cache')
+
+        with self.assertNumQueries(0):
+            respuesta = self.client.get(url, HTTP_IF_NONE_MATCH=primera['ETag'])
+        self.assertEqual(respuesta.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(respuesta['ETag'], primera['ETag'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.stock.cantidad = 7
+            self.stock.save()
+        respuesta = self.client.get(url, HTTP_IF_NONE_MATCH=primera['ETag'])
+        self.assertEqual(respuesta.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(respuesta['ETag'], primera['ETag'])
+
+    def test_get_condicional_con_last_modified(self):
+        """If-Modified-Since posterior al último cambio responde 304"""
+        url = reverse('tienda-list')
+        primera = self.client.get(url)
+        respuesta = self.client.get(url, HTTP_IF_MODIFIED_SINCE=primera['Last-Modified'])
+        self.assertEqual(respuesta.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_respuestas_sin_etag_siguen_sin_cache(self):
+        """Los GET sin validador mantienen los encabezados no-store"""
+        respuesta = self.client.get(reverse('producto-search'), {'q': 'alicate'})
+        self.assertNotIn('ETag', respuesta)
+        self.assertIn('no-store', respuesta['Cache-Control'])
+
+    def test_version_de_imagen_estable(self):
+        """La versión de la imagen depende de la URL y no de la hora de la petición"""
+        self.producto.imagen_url = 'https://example.com/productos/1700000000_abcd1234.jpg'
+        self.producto.save()
+        url = reverse('producto-detail', args=[self.producto.id])
+        primera = self.client.get(url).data['imagen_url']
+        from .cache import invalidar_catalogo
+        invalidar_catalogo()
+        self.assertEqual(self.client.get(url).data['imagen_url'], primera)
+        self.assertTrue(primera.startswith(self.producto.imagen_url + '?v='))
+
+    def test_contadores_de_aciertos(self):
+        """Las estadísticas cuentan aciertos y fallos y solo las ve un admin"""
+        url = reverse('producto-list')
+        for _ in range(3):
+            self.client.get(url)
+        stats_url = reverse('producto-cache-stats')
+        self.assertEqual(self.client.get(stats_url).status_code, status.HTTP_401_UNAUTHORIZED)
+
+        admin = CustomerUser.objects.create_user(username='admin_cache', email='admin_cache@test.com', password='x')
+        admin.role = 'admin'
+        admin.save()
+        self.client.force_authenticate(user=admin)
+        stats = self.client.get(stats_url).data
+        self.assertEqual(stats['acciones']['productos_list'], {'hits': 2, 'misses': 1, 'hit_ratio': 0.6667})
+
+
+class ChequeoCacheCatalogoTest(TestCase):
+    """Sin DEBUG la caché del catálogo no puede ser local al proceso"""
+
+    def test_locmem_sin_debug_es_error(self):
+        from .checks import cache_catalogo_compartida
+        locmem = {'catalogo': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+        compartida = {'catalogo': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': '/tmp/c'}}
+        with override_settings(DEBUG=False, CACHES=locmem):
+            self.assertEqual([error.id for error in cache_catalogo_compartida(None)], ['productos.E001'])
+        with override_settings(DEBUG=True, CACHES=locmem):
+            self.assertEqual(cache_catalogo_compartida(None), [])
+        with override_settings(DEBUG=False, CACHES=compartida):
+            self.assertEqual(cache_catalogo_compartida(None), [])
+
+
+class CargaMasivaTest(APITestCase):
+    """Pruebas de la importación y exportación masiva de productos y stock"""
+
+    def setUp(self):
+        self.trabajador = CustomerUser.objects.create_user(
+            username='trabajador_carga', email='trabajador_carga@test.com', password='x'
+        )
+        self.trabajador.role = 'trabajador'
+        self.trabajador.save()
+        self.client.force_authenticate(user=self.trabajador)
+        self.tienda = Tienda.objects.create(nombre='Centro', direccion='Dirección', telefono='1')
+        self.existente = Producto.objects.create(
+            sku='MAS001', nombre='Nombre viejo', precio=Decimal('100'), categoria='Herramientas'
+        )
+
+    def subir(self, url, nombre, contenido):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        archivo = SimpleUploadedFile(nombre, contenido.encode())
+        return self.client.post(url, {'archivo': archivo}, format='multipart')
+
+    def test_importar_productos_csv_con_upsert_y_errores(self):
+        """Crea, actualiza por sku y reporta las filas inválidas con su número"""
+        contenido = (
+            'sku,nombre,precio,categoria,marca\n'
+            'MAS001,Nombre nuevo,150,Herramientas,Bosch\n'
+            'MAS002,Taladro,59990,Herramientas,\n'
+            'MAS003,Sin precio,,Herramientas,\n'
+            'MAS004,Precio malo,abc,Herramientas,\n'
+        )
+        respuesta = self.subir(reverse('producto-importar'), 'lista.csv', contenido)
+        self.assertEqual(respuesta.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual(respuesta.data['procesadas'], 4)
+        self.assertEqual(respuesta.data['creados'], 1)
+        self.assertEqual(respuesta.data['actualizados'], 1)
+        self.assertEqual([e['fila'] for e in respuesta.data['errores']], [3, 4])
+        self.assertIn('precio', respuesta.data['errores'][0]['errores'])
+
+        self.existente.refresh_from_db()
+        self.assertEqual((self.existente.nombre, self.existente.precio, self.existente.marca), ('Nombre nuevo', Decimal('150'), 'Bosch'))
+        self.assertTrue(Producto.objects.filter(sku='MAS002', precio=Decimal('59990')).exists())
+
+    def test_importar_stock_ndjson_actualiza_totales(self):
+        """El stock se crea o actualiza por (producto, tienda) y recalcula los totales"""
+        StockTienda.objects.create(producto=self.existente, tienda=self.tienda, cantidad=1, stock_minimo=3)
+        contenido = '\n'.join([
+            '{"sku": "MAS001", "tienda": %d, "cantidad": 12}' % self.tienda.id,
+            '{"sku": "NOEXISTE", "tienda": %d, "cantidad": 1}' % self.tienda.id,
+            'no es json',
+        ])
+        respuesta = self.subir(reverse('stocktienda-importar'), 'stock.ndjson', contenido)
+        self.assertEqual(respuesta.data['actualizados'], 1)
+        self.assertEqual(respuesta.data['con_error'], 2)
+
+        stock = StockTienda.objects.get(producto=self.existente, tienda=self.tienda)
+        self.assertEqual((stock.cantidad, stock.stock_minimo), (12, 3))
+        self.existente.refresh_from_db()
+        self.assertEqual(self.existente.stock_total, 12)
+
+    def test_importar_stock_queda_en_libro(self):
+        """Cada cambio de cantidad importado es un ajuste, así el stock esperado sigue cuadrando"""
+        from .conciliacion_service import conciliar
+        from .models import StockMovimiento
+        StockTienda.objects.create(producto=self.existente, tienda=self.tienda, cantidad=1)
+        StockMovimiento.objects.create(
+            producto=self.existente, tienda=self.tienda, tipo=StockMovimiento.AJUSTE, cantidad=1
+        )
+        otra = Tienda.objects.create(nombre='Otra', direccion='D', telefono='1')
+        contenido = '\n'.join([
+            '{"sku": "MAS001", "tienda": %d, "cantidad": 12}' % self.tienda.id,
+            '{"sku": "MAS001", "tienda": %d, "cantidad": 5}' % otra.id,
+        ])
+        self.subir(reverse('stocktienda-importar'), 'stock.ndjson', contenido)
+        self.assertEqual(
+            sorted(StockMovimiento.objects.values_list('tienda_id', 'cantidad', 'usuario')),
+            sorted([(self.tienda.id, 1, None), (self.tienda.id, 11, self.trabajador.id), (otra.id, 5, self.trabajador.id)]),
+        )
+        self.assertEqual(conciliar(esperado=True)['diferencias_esperado'], 0)
+        # Reimportar lo mismo no agrega movimientos
+        self.subir(reverse('stocktienda-importar'), 'stock.ndjson', contenido)
+        self.assertEqual(StockMovimiento.objects.count(), 3)
+
+    def test_exportar_e_importar_ida_y_vuelta(self):
+        """Lo exportado se puede volver a importar sin cambios ni errores"""
+        StockTienda.objects.create(producto=self.existente, tienda=self.tienda, cantidad=4)
+        for formato in ['csv', 'ndjson']:
+            respuesta = self.client.get(reverse('producto-exportar'), {'formato': formato})
+            self.assertEqual(respuesta.status_code, status.HTTP_200_OK)
+            contenido = b''.join(respuesta.streaming_content).decode()
+            resultado = self.subir(reverse('producto-importar'), f'p.{formato}', contenido).data
+            self.assertEqual((resultado['actualizados'], resultado['con_error']), (1, 0))
+
+            respuesta = self.client.get(reverse('stocktienda-exportar'), {'formato': formato})
+            contenido = b''.join(respuesta.streaming_content).decode()
+            self.assertIn('MAS001', contenido)
+            resultado = self.subir(reverse('stocktienda-importar'), f's.{formato}', contenido).data
+            self.assertEqual((resultado['actualizados'], resultado['con_error']), (1, 0))
+
+    def test_requiere_trabajador_o_admin(self):
+        """Los clientes no pueden importar ni exportar"""
+        cliente = CustomerUser.objects.create_user(username='cliente_carga', email='cliente_carga@test.com', password='x')
+        self.client.force_authenticate(user=cliente)
+        self.assertEqual(self.client.get(reverse('producto-exportar')).status_code, status.HTTP_403_FORBIDDEN)
+        respuesta = self.subir(reverse('stocktienda-importar'), 's.csv', 'sku,tienda,cantidad\n')
+        self.assertEqual(respuesta.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_comandos(self):
+        """Los comandos de gestión exportan e importan archivos"""
+        import os
+        import tempfile
+        from io import StringIO
+        from django.core.management import call_command
+        with tempfile.TemporaryDirectory() as carpeta:
+            ruta = os.path.join(carpeta, 'productos.ndjson')
+            call_command('exportar_catalogo', 'productos', ruta, stderr=StringIO())
+            Producto.objects.filter(sku='MAS001').update(nombre='Cambiado')
+            salida = StringIO()
+            call_command('importar_catalogo', 'productos', ruta, stdout=salida)
+        self.assertIn('actualizadas: 1', salida.getvalue())
+        self.assertEqual(Producto.objects.get(sku='MAS001').nombre, 'Nombre viejo')
+
+
+class CamposDinamicosTest(APITestCase):
+    """Pruebas de ?fields= y ?expand= en productos y tiendas"""
+
+    def setUp(self):
+        self.tienda = Tienda.objects.create(nombre='Centro', direccion='Dirección', telefono='1')
+        for i in range(3):
+            producto = Producto.objects.create(
+                sku=f'CAM00{i}', nombre=f'Producto {i}', descripcion='x' * 500,
+                precio=Decimal('1000') * (i + 1), categoria='Herramientas'
+            )
+            StockTienda.objects.create(producto=producto, tienda=self.tienda, cantidad=i)
+
+    def test_salida_por_defecto_sin_cambios(self):
+        """Sin parámetros el producto trae todos los campos, incluido el stock por tienda"""
+        producto = self.client.get(reverse('producto-list')).data[0]
+        self.assertEqual(set(producto), set(ProductoSerializer.Meta.fields) - {'imagen'})
+        self.assertNotIn('stock', self.client.get(reverse('tienda-list')).data[0])
+
+    def test_fields_limita_campos_y_consultas(self):
+        """Solo se serializan los campos pedidos y no se consulta el stock"""
+        url = reverse('producto-list')
+        with self.assertNumQueries(1):
+            respuesta = self.client.get(url, {'fields': 'id,sku,nombre,precio,imagen_url'})
+        self.assertEqual(list(respuesta.data[0]), ['id', 'sku', 'nombre', 'precio', 'imagen_url'])
+
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        with CaptureQueriesContext(connection) as consultas:
+            self.client.get(url, {'fields': 'id,sku'})
+        self.assertNotIn('descripcion', consultas.captured_queries[0]['sql'])
+
+    def test_expand_stock(self):
+        """?expand=stock agrega el stock por tienda a los campos pedidos"""
+        respuesta = self.client.get(reverse('producto-list'), {'fields': 'id,sku', 'expand': 'stock', 'ordering': '-precio', 'page_size': 2})
+        self.assertEqual(list(respuesta.data['results'][0]), ['id', 'sku', 'stock_por_tienda'])
+        self.assertEqual(respuesta.data['results'][0]['stock_por_tienda'][0]['cantidad'], 2)
+
+        tienda = self.client.get(reverse('tienda-detail', args=[self.tienda.id]), {'fields': 'id,nombre', 'expand': 'stock'}).data
+        self.assertEqual(list(tienda), ['id', 'nombre', 'stock'])
+        self.assertEqual(len(tienda['stock']), 3)
+
+    def test_campos_desconocidos(self):
+        """Un campo o expansión desconocidos responden 400"""
+        self.assertEqual(self.client.get(reverse('producto-list'), {'fields': 'id,clave'}).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(reverse('tienda-list'), {'expand': 'ventas'}).status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class SerializacionRapidaProductosTest(APITestCase):
+    """El camino rápido del listado produce exactamente los mismos bytes que ProductoSerializer"""
+
+    def setUp(self):
+        tiendas = [Tienda.objects.create(nombre=f'Tienda {i}', direccion='D', telefono='1') for i in range(2)]
+        datos = [
+            ('RAP001', 'Martillo “Pro” ', Decimal('29.99'), 'FerreMax', 'https://example.com/a.jpg'),
+            ('RAP002', 'Llave ñandú', Decimal('1000.00'), '', None),
+            ('RAP003', 'Taladro', Decimal('0.10'), 'Bosch', None),
+        ]
+        for indice, (sku, nombre, precio, marca, imagen) in enumerate(datos):
+            producto = Producto.objects.create(
+                sku=sku, nombre=nombre, descripcion='Descripción', precio=precio,
+                categoria='Herramientas', marca=marca, imagen_url=imagen
+            )
+            for tienda in tiendas[:indice]:
+                StockTienda.objects.create(producto=producto, tienda=tienda, cantidad=indice, stock_minimo=1)
+
+    def comparar(self, params):
+        from rest_framework.renderers import JSONRenderer
+        url = reverse('producto-list')
+        with self.settings(SERIALIZACION_RAPIDA=False):
+            lenta = self.client.get(url, params)
+        with self.settings(SERIALIZACION_RAPIDA=True):
+            rapida = self.client.get(url, params)
+        self.assertEqual(lenta.status_code, status.HTTP_200_OK)
+        self.assertEqual(rapida.content, lenta.content)
+        self.assertEqual(lenta.content, JSONRenderer().render(lenta.data))
+
+    def test_mismos_bytes(self):
+        """Listado completo, filtrado, ordenado, paginado y con ?fields="""
+        for params in [
+            {},
+            {'marca': 'Bosch'},
+            {'ordering': '-precio'},
+            {'page_size': 2},
+            {'page_size': 2, 'ordering': 'stock_total'},
+            {'fields': 'id,sku,imagen_url', 'expand': 'stock'},
+            {'fields': 'nombre,precio'},
+            {'facets': 'true'},
+        ]:
+            with self.subTest(params=params):
+                self.comparar(params)
+
+    def test_consultas_constantes(self):
+        """Dos consultas (productos y stock) sin importar cuántos productos haya"""
+        with self.settings(SERIALIZACION_RAPIDA=True), self.assertNumQueries(2):
+            self.client.get(reverse('producto-list'))
+
+
+class StockConcurrenteTest(TransactionTestCase):
+    """Los cambios de stock son atómicos aunque lleguen a la vez desde varios hilos"""
+
+    HILOS = 8
+
+    def setUp(self):
+        self.producto = Producto.objects.create(sku='HOT001', nombre='Cemento', precio=Decimal('5990'), categoria='Construcción')
+        self.tienda_a = Tienda.objects.create(nombre='A', direccion='D', telefono='1')
+        self.tienda_b = Tienda.objects.create(nombre='B', direccion='D', telefono='1')
+        self.stock_a = StockTienda.objects.create(producto=self.producto, tienda=self.tienda_a, cantidad=50)
+        self.stock_b = StockTienda.objects.create(producto=self.producto, tienda=self.tienda_b, cantidad=50)
+
+    def en_hilos(self, operacion, veces):
+        """Ejecuta `operacion` `veces` veces en cada hilo y devuelve cuántas tuvieron éxito."""
+        import threading
+        import time
+        from django.db import OperationalError, connection
+        from .stock_service import StockInsuficiente
+        exitos, barrera, candado = [], threading.Barrier(self.HILOS), threading.Lock()
+
+        def trabajar():
+            try:
+                barrera.wait()
+                for _ in range(veces):
+                    while True:
+                        try:
+                            operacion()
+                        except StockInsuficiente:
+                            break
+                        except OperationalError:
+                            # SQLite serializa las escrituras: se reintenta si la base está ocupada
+                            time.sleep(0.001)
+                            continue
+                        with candado:
+                            exitos.append(1)
+                        break
+            finally:
+                connection.close()
+
+        hilos = [threading.Thread(target=trabajar) for _ in range(self.HILOS)]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+        return len(exitos)
+
+    def test_descuentos_concurrentes_sin_perdidas(self):
+        """8 hilos x 10 descuentos sobre 50 unidades: se venden exactamente 50"""
+        from .stock_service import ajustar_cantidad
+        exitos = self.en_hilos(lambda: ajustar_cantidad(self.stock_a.id, -1), 10)
+        self.stock_a.refresh_from_db()
+        self.producto.refresh_from_db()
+        self.assertEqual(exitos, 50)
+        self.assertEqual(self.stock_a.cantidad, 0)
+        self.assertEqual(self.producto.stock_total, 50)
+
+    def test_transferencias_cruzadas_conservan_total(self):
+        """Transferencias A->B y B->A a la vez no crean ni pierden unidades"""
+        from .stock_service import transferir
+        sentidos = iter([(self.tienda_a.id, self.tienda_b.id), (self.tienda_b.id, self.tienda_a.id)] * self.HILOS)
+        import threading
+        local = threading.local()
+
+        def operar():
+            if not hasattr(local, 'sentido'):
+                local.sentido = next(sentidos)
+            transferir(self.producto.id, *local.sentido, 3)
+
+        self.en_hilos(operar, 5)
+        cantidades = StockTienda.objects.filter(producto=self.producto).values_list('cantidad', flat=True)
+        self.assertEqual(sum(cantidades), 100)
+        self.assertTrue(all(cantidad >= 0 for cantidad in cantidades))
+
+    def test_restriccion_no_negativa(self):
+        """La base rechaza una cantidad negativa aunque se escriba sin pasar por el servicio"""
+        from django.db import IntegrityError
+        from django.db.models import F
+        with self.assertRaises(IntegrityError):
+            StockTienda.objects.filter(pk=self.stock_a.pk).update(cantidad=F('cantidad') - 51)
+
+
+class LibroMovimientosTest(APITestCase):
+    """Cada cambio de stock queda en el libro y el stock histórico sale de snapshot + cola"""
+
+    def setUp(self):
+        self.admin = CustomerUser.objects.create_user(username='admin_libro', email='admin_libro@test.com', password='x', role='admin')
+        self.producto = Producto.objects.create(sku='LIB001', nombre='Taladro', precio=Decimal('49990'), categoria='Herramientas')
+        self.tienda_a = Tienda.objects.create(nombre='A', direccion='D', telefono='1')
+        self.tienda_b = Tienda.objects.create(nombre='B', direccion='D', telefono='1')
+        self.stock_a = StockTienda.objects.create(producto=self.producto, tienda=self.tienda_a, cantidad=10)
+        self.client.force_authenticate(user=self.admin)
+
+    def movimientos(self):
+        from .models import StockMovimiento
+        return list(StockMovimiento.objects.order_by('id').values_list('tienda_id', 'tipo', 'cantidad', 'tienda_contraparte_id'))
+
+    def test_ajuste_y_transferencia_registran_movimientos(self):
+        """Un ajuste deja un movimiento y una transferencia uno por tienda, con el usuario"""
+        from .models import StockMovimiento
+        self.client.post(reverse('stocktienda-ajustar-stock', args=[self.stock_a.id]), {'cantidad': -3})
+        self.client.post(reverse('stocktienda-transferir-stock'), {
+            'producto': self.producto.id, 'tienda_origen': self.tienda_a.id, 'tienda_destino': self.tienda_b.id, 'cantidad': 2,
+        })
+        self.client.post(reverse('stocktienda-ajustar-stock', args=[self.stock_a.id]), {'cantidad': -50})
+        self.assertEqual(self.movimientos(), [
+            (self.tienda_a.id, 'ajuste', -3, None),
+            (self.tienda_a.id, 'transferencia', -2, self.tienda_b.id),
+            (self.tienda_b.id, 'transferencia', 2, self.tienda_a.id),
+        ])
+        self.assertFalse(StockMovimiento.objects.exclude(usuario=self.admin).exists())
+
+    def test_devolucion_referencia_item_de_orden(self):
+        """Un ajuste con item_orden se registra como devolución de esa orden"""
+        from carrito.models import ItemOrden, Orden
+        from .models import StockMovimiento
+        orden = Orden.objects.create(
+            total=Decimal('99980'), nombre='C', email='c@test.com', telefono='1',
+            direccion='D', ciudad='S', codigo_postal='1', metodo_pago='pago_simulado'
+        )
+        item = ItemOrden.objects.create(orden=orden, producto=self.producto, cantidad=2, precio_unitario=self.producto.precio)
+        url = reverse('stocktienda-ajustar-stock', args=[self.stock_a.id])
+        self.assertEqual(self.client.post(url, {'cantidad': 3, 'item_orden': item.id}).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.post(url, {'cantidad': 1, 'item_orden': 'x'}).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.post(url, {'cantidad': 2, 'item_orden': item.id}).status_code, status.HTTP_200_OK)
+        movimiento = StockMovimiento.objects.get()
+        self.assertEqual((movimiento.tipo, movimiento.cantidad, movimiento.orden_id, movimiento.item_orden_id),
+                         ('devolucion', 2, orden.id, item.id))
+
+    def test_stock_en_fecha_con_y_sin_snapshot(self):
+        """El stock en una fecha pasada es el mismo antes y después de compactar y purgar"""
+        from datetime import timedelta
+        from django.utils import timezone
+        from .models import StockMovimiento, StockSnapshot
+        from .movimientos_service import compactar, purgar, stock_en
+        from .stock_service import ajustar_cantidad
+
+        ahora = timezone.now()
+        # 10 unidades iniciales (sin libro), luego -4 hace 3 días, +6 hace 2 días y -1 hace 1 día
+        for dias, delta in [(3, -4), (2, 6), (1, -1)]:
+            ajustar_cantidad(self.stock_a.id, delta)
+            StockMovimiento.objects.filter(fecha__gt=ahora).update(fecha=ahora - timedelta(days=dias))
+        clave = (self.producto.id, self.tienda_a.id)
+        esperado = {4: 10, 3: 6, 2: 12, 1: 11, 0: 11}
+        fechas = {dias: ahora - timedelta(days=dias, hours=-1) for dias in esperado}
+        fechas[4] = ahora - timedelta(days=4)
+
+        self.assertEqual({dias: stock_en(fecha)[clave] for dias, fecha in fechas.items()}, esperado)
+        self.assertEqual(compactar(ahora - timedelta(days=2, hours=-2)), 1)
+        self.assertEqual(compactar(ahora - timedelta(days=2, hours=-2)), 0)
+        self.assertEqual(StockSnapshot.objects.get().cantidad, 12)
+        self.assertEqual({dias: stock_en(fecha)[clave] for dias, fecha in fechas.items()}, esperado)
+
+        self.assertEqual(purgar(ahora), 2)
+        self.assertEqual({dias: stock_en(fechas[dias])[clave] for dias in [1, 0]}, {1: 11, 0: 11})
+
+    def test_consulta_anterior_a_la_purga(self):
+        """Tras purgar, una fecha anterior al límite se rechaza y desde él el stock sigue exacto en todas las filas"""
+        from datetime import timedelta
+        from django.utils import timezone
+        from .models import StockMovimiento, StockSnapshot
+        from .movimientos_service import HistoriaPurgada, compactar, inicio_historia, purgar, stock_en
+        from .stock_service import ajustar_cantidad
+
+        ahora = timezone.now()
+        stock_b = StockTienda.objects.create(producto=self.producto, tienda=self.tienda_b, cantidad=0)
+
+        def ajustar(stock, delta, dias):
+            ajustar_cantidad(stock.id, delta)
+            StockMovimiento.objects.filter(fecha__gt=ahora).update(fecha=ahora - timedelta(days=dias))
+
+        ajustar(self.stock_a, -4, 3)
+        ajustar(stock_b, 2, 3)
+        self.assertEqual(compactar(ahora - timedelta(days=2.5)), 2)
+        ajustar(self.stock_a, 1, 2.2)
+        limite = ahora - timedelta(days=2)
+        # Solo la fila A tiene snapshot en el límite; el de B es anterior
+        self.assertEqual(compactar(limite), 1)
+        ajustar(self.stock_a, 5, 1)
+        antes = stock_en(limite)
+        self.assertIsNone(inicio_historia())
+
+        self.assertEqual(purgar(limite), 3)
+        self.assertEqual(inicio_historia(), limite)
+        self.assertFalse(StockSnapshot.objects.filter(fecha__lt=limite).exists())
+        with self.assertRaises(HistoriaPurgada):
+            stock_en(limite - timedelta(hours=1))
+        self.assertEqual(stock_en(limite), antes)
+        self.assertEqual(antes, {(self.producto.id, self.tienda_a.id): 7, (self.producto.id, self.tienda_b.id): 2})
+        self.assertEqual(stock_en(ahora)[(self.producto.id, self.tienda_a.id)], 12)
+
+        url = reverse('tienda-movimientos', args=[self.tienda_a.id])
+        response = self.client.get(url, {'desde': (limite - timedelta(days=1)).isoformat()})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(url, {'desde': limite.isoformat()})
+        self.assertEqual((response.data['productos'][0]['stock_inicial'], response.data['productos'][0]['ajuste']), (7, 5))
+
+    def test_reporte_de_tienda(self):
+        """El reporte entrega stock inicial, neto por tipo y stock final de cada producto"""
+        from .stock_service import ajustar_cantidad, transferir
+        ajustar_cantidad(self.stock_a.id, 5)
+        transferir(self.producto.id, self.tienda_a.id, self.tienda_b.id, 4)
+        url = reverse('tienda-movimientos', args=[self.tienda_a.id])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['productos'], [{
+            'producto': self.producto.id, 'sku': 'LIB001', 'nombre': 'Taladro', 'stock_inicial': 10,
+            'ajuste': 5, 'transferencia': -4, 'venta': 0, 'devolucion': 0, 'stock_final': 11,
+        }])
+        self.assertEqual(self.client.get(url, {'desde': 'ayer'}).status_code, status.HTTP_400_BAD_REQUEST)
+        self.client.force_authenticate(user=None)
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class AjusteMasivoTest(APITestCase):
+    """Ajuste masivo de stock en una transacción con resultado por entrada"""
+
+    def setUp(self):
+        self.trabajador = CustomerUser.objects.create_user(username='bodega', email='bodega@test.com', password='x', role='trabajador')
+        self.tienda = Tienda.objects.create(nombre='A', direccion='D', telefono='1')
+        self.productos = [
+            Producto.objects.create(sku=f'AM{i:03d}', nombre=f'Producto {i}', precio=Decimal('1000'), categoria='C')
+            for i in range(60)
+        ]
+        for producto in self.productos[:50]:
+            StockTienda.objects.create(producto=producto, tienda=self.tienda, cantidad=10)
+        self.url = reverse('stocktienda-ajuste-masivo')
+        self.client.force_authenticate(user=self.trabajador)
+
+    def cantidad(self, producto):
+        return StockTienda.objects.get(producto=producto, tienda=self.tienda).cantidad
+
+    def test_aplica_en_orden_y_rechaza_por_entrada(self):
+        """Deltas y conteos se aplican en orden; los negativos e inválidos se rechazan solos"""
+        from .models import StockMovimiento
+        p = self.productos
+        response = self.client.post(self.url, {'ajustes': [
+            {'producto': p[0].id, 'tienda': self.tienda.id, 'delta': -4},
+            {'producto': p[0].id, 'tienda': self.tienda.id, 'delta': -7},
+            {'producto': p[1].id, 'tienda': self.tienda.id, 'cantidad': 3},
+            {'producto': p[1].id, 'tienda': self.tienda.id, 'delta': 2},
+            {'producto': p[55].id, 'tienda': self.tienda.id, 'cantidad': 8},
+            {'producto': p[56].id, 'tienda': self.tienda.id, 'delta': -1},
+            {'producto': p[2].id, 'tienda': self.tienda.id, 'delta': 1, 'cantidad': 1},
+            {'producto': 'x', 'tienda': self.tienda.id, 'delta': 1},
+            {'producto': 999999, 'tienda': self.tienda.id, 'delta': 1},
+        ]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual((response.data['aplicados'], response.data['rechazados']), (4, 5))
+        self.assertEqual(
+            [resultado['estado'] for resultado in response.data['resultados']],
+            ['aplicado', 'rechazado', 'aplicado', 'aplicado', 'aplicado', 'rechazado', 'rechazado', 'rechazado', 'rechazado'],
+        )
+        self.assertEqual(response.data['resultados'][1]['cantidad'], 6)
+        self.assertEqual([self.cantidad(p[0]), self.cantidad(p[1]), self.cantidad(p[55])], [6, 5, 8])
+        self.assertFalse(StockTienda.objects.filter(producto=p[56]).exists())
+        self.assertEqual(
+            list(StockMovimiento.objects.order_by('id').values_list('producto_id', 'cantidad')),
+            [(p[0].id, -4), (p[1].id, -7), (p[1].id, 2), (p[55].id, 8)],
+        )
+        p[1].refresh_from_db()
+        self.assertEqual(p[1].stock_total, 5)
+
+    def test_consultas_constantes(self):
+        """La cantidad de consultas no crece con el número de ajustes"""
+        def consultas(productos, nuevos):
+            from django.db import connection
+            from django.test.utils import CaptureQueriesContext
+            with CaptureQueriesContext(connection) as capturadas:
+                response = self.client.post(self.url, {'ajustes': [
+                    {'producto': producto.id, 'tienda': self.tienda.id, 'delta': 1} for producto in productos
+                ] + [{'producto': producto.id, 'tienda': self.tienda.id, 'cantidad': 1} for producto in nuevos]}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return len(capturadas.captured_queries)
+        self.assertEqual(consultas(self.productos[:3], self.productos[50:51]), consultas(self.productos[:50], self.productos[51:60]))
+
+    def test_mas_de_mil_pares(self):
+        """Un lote con más de mil pares (producto, tienda) distintos se bloquea por partes y se aplica completo"""
+        from .models import StockMovimiento
+        tiendas = [self.tienda] + Tienda.objects.bulk_create([
+            Tienda(nombre=f'T{i}', direccion='D', telefono='1') for i in range(19)
+        ])
+        ajustes = [
+            {'producto': producto.id, 'tienda': tienda.id, 'cantidad': 7}
+            for producto in self.productos for tienda in tiendas
+        ]
+        self.assertGreater(len(ajustes), 1000)
+        response = self.client.post(self.url, {'ajustes': ajustes}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['aplicados'], len(ajustes))
+        self.assertEqual(set(StockTienda.objects.values_list('cantidad', flat=True)), {7})
+        self.assertEqual(StockTienda.objects.count(), len(ajustes))
+        # Las 50 filas que tenían 10 bajan 3; las demás se crean con 7
+        self.assertEqual(StockMovimiento.objects.filter(cantidad=-3).count(), 50)
+
+    def test_validaciones(self):
+        """Lista vacía, demasiados ajustes o usuario sin rol se rechazan completos"""
+        self.assertEqual(self.client.post(self.url, {'ajustes': []}, format='json').status_code, status.HTTP_400_BAD_REQUEST)
+        demasiados = [{'producto': 1, 'tienda': 1, 'delta': 1}] * 10001
+        self.assertEqual(self.client.post(self.url, {'ajustes': demasiados}, format='json').status_code, status.HTTP_400_BAD_REQUEST)
+        self.client.force_authenticate(user=CustomerUser.objects.create_user(username='c', email='c@test.com', password='x'))
+        self.assertEqual(self.client.post(self.url, {'ajustes': [{}]}, format='json').status_code, status.HTTP_403_FORBIDDEN)
+
+
+class StockTiendaPaginadoTest(APITestCase):
+    """Stock de una tienda paginado por cursor, con filtros, orden y búsqueda en un número fijo de consultas"""
+
+    def setUp(self):
+        from .search import reiniciar_indice
+        reiniciar_indice()
+        self.addCleanup(reiniciar_indice)
+        self.client.force_authenticate(user=CustomerUser.objects.create_superuser(username='bodega', email='b@test.com', password='x'))
+        self.tienda = Tienda.objects.create(nombre='Bodega', direccion='D', telefono='1')
+        otra = Tienda.objects.create(nombre='Otra', direccion='D', telefono='1')
+        filas = [
+            ('SP1', 'Taladro Percutor', 'Herramientas', 'Bosch', 7, 2),
+            ('SP2', 'Martillo Carpintero', 'Herramientas', 'Stanley', 0, 3),
+            ('SP3', 'Clavos 2 pulgadas', 'Fijaciones', 'Stanley', 50, 100),
+            ('SP4', 'Taladro de Banco', 'Herramientas', 'Makita', 3, 0),
+            ('SP5', 'Tornillos', 'Fijaciones', 'Bosch', 0, 0),
+        ]
+        for sku, nombre, categoria, marca, cantidad, minimo in filas:
+            producto = Producto.objects.create(sku=sku, nombre=nombre, precio=Decimal('1000'), categoria=categoria, marca=marca)
+            StockTienda.objects.create(producto=producto, tienda=self.tienda, cantidad=cantidad, stock_minimo=minimo)
+            StockTienda.objects.create(producto=producto, tienda=otra, cantidad=1)
+        self.url = reverse('tienda-stock', args=[self.tienda.id])
+
+    def skus(self, consultas=2, **params):
+        with self.assertNumQueries(consultas):
+            response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [fila['producto_nombre'].split()[0] for fila in response.data['results']], response.data
+
+    def test_paginas_por_cursor(self):
+        nombres, data = self.skus(page_size=2)
+        self.assertEqual(nombres, ['Taladro', 'Martillo'])
+        vistos = nombres
+        while data['next']:
+            with self.assertNumQueries(2):
+                data = self.client.get(data['next']).data
+            vistos += [fila['producto_nombre'].split()[0] for fila in data['results']]
+        self.assertEqual(vistos, ['Taladro', 'Martillo', 'Clavos', 'Taladro', 'Tornillos'])
+
+    def test_filtros(self):
+        self.assertEqual(self.skus(categoria='Fijaciones')[0], ['Clavos', 'Tornillos'])
+        self.assertEqual(self.skus(marca='Stanley', categoria='Herramientas')[0], ['Martillo'])
+        self.assertEqual(self.skus(bajo_minimo='true')[0], ['Martillo', 'Clavos'])
+        self.assertEqual(self.skus(sin_stock='1')[0], ['Martillo', 'Tornillos'])
+        self.assertEqual(self.skus(sin_stock='1', bajo_minimo='1')[0], ['Martillo'])
+
+    def test_orden_y_busqueda(self):
+        self.assertEqual(self.skus(ordering='-cantidad')[0], ['Clavos', 'Taladro', 'Taladro', 'Tornillos', 'Martillo'])
+        self.assertEqual(self.skus(ordering='cantidad', page_size=3)[0], ['Martillo', 'Tornillos', 'Taladro'])
+        # La primera búsqueda construye el índice en memoria (SQLite): una consulta más
+        self.assertEqual(self.skus(consultas=3, q='taladro')[0], ['Taladro', 'Taladro'])
+        self.assertEqual(self.skus(q='taladro', ordering='cantidad')[0], ['Taladro', 'Taladro'])
+        self.assertEqual(
+            [fila['cantidad'] for fila in self.skus(q='taladro', ordering='cantidad')[1]['results']], [3, 7]
+        )
+
+
+class StockBajoMinimoTest(APITestCase):
+    """Reposición: stock bajo mínimo por tienda y global, y el resumen por tienda"""
+
+    def setUp(self):
+        from django.core.cache import caches
+        caches['catalogo'].clear()
+        self.trabajador = CustomerUser.objects.create_user(username='repo', email='repo@test.com', password='x', role='trabajador')
+        self.norte = Tienda.objects.create(nombre='Norte', direccion='D', telefono='1')
+        self.sur = Tienda.objects.create(nombre='Sur', direccion='D', telefono='1')
+        self.martillo = Producto.objects.create(sku='BM001', nombre='Martillo', precio=Decimal('5000'), categoria='Herramientas', marca='Stanley')
+        self.taladro = Producto.objects.create(sku='BM002', nombre='Taladro', precio=Decimal('50000'), categoria='Herramientas', marca='Bosch')
+        self.clavos = Producto.objects.create(sku='BM003', nombre='Clavos', precio=Decimal('990'), categoria='Fijaciones', marca='Stanley')
+        self.bajo_norte = StockTienda.objects.create(producto=self.martillo, tienda=self.norte, cantidad=2, stock_minimo=5)
+        StockTienda.objects.create(producto=self.taladro, tienda=self.norte, cantidad=5, stock_minimo=5)
+        StockTienda.objects.create(producto=self.clavos, tienda=self.norte, cantidad=0, stock_minimo=10)
+        self.sur_ok = StockTienda.objects.create(producto=self.taladro, tienda=self.sur, cantidad=9, stock_minimo=3)
+        self.client.force_authenticate(user=self.trabajador)
+
+    def listar(self, url, **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_listado_global_y_filtros(self):
+        url = reverse('stocktienda-bajo-minimo')
+        data = self.listar(url)
+        self.assertEqual([fila['producto_sku'] for fila in data['results']], ['BM001', 'BM003'])
+        self.assertEqual([fila['reponer'] for fila in data['results']], [3, 10])
+        self.assertEqual([fila['producto_sku'] for fila in self.listar(url, marca='Stanley', categoria='Fijaciones')['results']], ['BM003'])
+        self.assertEqual(self.listar(url, tienda=self.sur.id)['results'], [])
+        self.assertEqual(self.client.get(url, {'tienda': 'x'}).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_por_tienda_paginado_por_cursor(self):
+        url = reverse('tienda-bajo-minimo', args=[self.norte.id])
+        primera = self.listar(url, page_size=1)
+        self.assertEqual([fila['producto_sku'] for fila in primera['results']], ['BM001'])
+        segunda = self.client.get(primera['next']).data
+        self.assertEqual([fila['producto_sku'] for fila in segunda['results']], ['BM003'])
+        self.assertIsNone(segunda['next'])
+
+    def test_se_actualiza_con_cada_escritura_y_resumen(self):
+        resumen_url = reverse('stocktienda-resumen-bajo-minimo')
+        self.assertEqual(
+            [(t['nombre'], t['bajo_minimo'], t['agotados']) for t in self.listar(resumen_url)['tiendas']],
+            [('Norte', 2, 1), ('Sur', 0, 0)],
+        )
+        self.client.post(reverse('stocktienda-ajustar-stock', args=[self.bajo_norte.id]), {'cantidad': 5}, format='json')
+        self.client.post(reverse('stocktienda-ajuste-masivo'), {'ajustes': [
+            {'producto': self.taladro.id, 'tienda': self.sur.id, 'cantidad': 0},
+        ]}, format='json')
+        self.assertEqual(
+            [(t['nombre'], t['bajo_minimo'], t['agotados']) for t in self.listar(resumen_url)['tiendas']],
+            [('Norte', 1, 1), ('Sur', 1, 1)],
+        )
+        self.assertEqual(
+            [fila['producto_sku'] for fila in self.listar(reverse('stocktienda-bajo-minimo'))['results']], ['BM003', 'BM002']
+        )
+
+    def test_solo_personal(self):
+        self.client.force_authenticate(user=CustomerUser.objects.create_user(username='c', email='c@test.com', password='x'))
+        self.assertEqual(self.client.get(reverse('stocktienda-bajo-minimo')).status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(self.client.get(reverse('tienda-bajo-minimo', args=[self.norte.id])).status_code, status.HTTP_403_FORBIDDEN)
+
+
+class MatrizStockTest(APITestCase):
+    """Matriz columnar productos x tiendas con ejes paginados y modo delta"""
+
+    def setUp(self):
+        self.trabajador = CustomerUser.objects.create_user(username='grilla', email='grilla@test.com', password='x', role='trabajador')
+        self.tiendas = [Tienda.objects.create(nombre=f'T{i}', direccion='D', telefono='1') for i in range(3)]
+        self.productos = [
+            Producto.objects.create(sku=f'MX{i:03d}', nombre=f'Producto {i}', precio=Decimal('1000'), categoria='C')
+            for i in range(4)
+        ]
+        # Producto i con stock 10*i+j en las tiendas j <= i (la última tienda solo la tiene el último)
+        for i, producto in enumerate(self.productos):
+            for j, tienda in enumerate(self.tiendas[:i + 1]):
+                StockTienda.objects.create(producto=producto, tienda=tienda, cantidad=10 * i + j)
+        self.url = reverse('stocktienda-matriz')
+        self.client.force_authenticate(user=self.trabajador)
+
+    def test_densa_y_coordenadas(self):
+        data = self.client.get(self.url).data
+        self.assertEqual(data['productos'], [p.id for p in self.productos])
+        self.assertEqual(data['tiendas'], [t.id for t in self.tiendas])
+        self.assertEqual(data['cantidades'], [[0, None, None], [10, 11, None], [20, 21, 22], [30, 31, 32]])
+        celdas = self.client.get(self.url, {'formato': 'coordenadas'}).data['celdas']
+        self.assertEqual(
+            sorted(zip(celdas['filas'], celdas['columnas'], celdas['cantidades'])),
+            [(i, j, 10 * i + j) for i in range(4) for j in range(min(i + 1, 3))],
+        )
+
+    def test_rango_y_paginas_en_ambos_ejes(self):
+        p, t = self.productos, self.tiendas
+        data = self.client.get(self.url, {'producto_desde': p[1].id, 'productos': 2, 'tiendas': 2}).data
+        self.assertEqual((data['productos'], data['tiendas']), ([p[1].id, p[2].id], [t[0].id, t[1].id]))
+        self.assertEqual((data['siguiente_producto'], data['siguiente_tienda']), (p[3].id, t[2].id))
+        self.assertEqual(data['cantidades'], [[10, 11], [20, 21]])
+        data = self.client.get(self.url, {
+            'producto_desde': data['siguiente_producto'], 'tienda_desde': data['siguiente_tienda'], 'tienda_hasta': t[2].id,
+        }).data
+        self.assertEqual((data['cantidades'], data['siguiente_producto'], data['siguiente_tienda']), ([[32]], None, None))
+
+    def test_since_trae_solo_lo_cambiado(self):
+        generado = self.client.get(self.url).data['generado']
+        stock = StockTienda.objects.get(producto=self.productos[2], tienda=self.tiendas[1])
+        self.client.post(reverse('stocktienda-ajustar-stock', args=[stock.id]), {'cantidad': -1}, format='json')
+        data = self.client.get(self.url, {'since': generado}).data
+        self.assertEqual(data['formato'], 'coordenadas')
+        self.assertEqual(data['celdas'], {'filas': [2], 'columnas': [1], 'cantidades': [20]})
+
+    def test_validaciones(self):
+        for params in [{'productos': 0}, {'tienda_desde': 'x'}, {'formato': 'xml'}, {'since': 'ayer'}]:
+            self.assertEqual(self.client.get(self.url, params).status_code, status.HTTP_400_BAD_REQUEST)
+        self.client.force_authenticate(user=CustomerUser.objects.create_user(username='c', email='c@test.com', password='x'))
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_403_FORBIDDEN)
+
+
+class TiendasCercanasTest(APITestCase):
+    """Tiendas más cercanas con stock para un pedido, sobre el índice espacial en memoria"""
+
+    def setUp(self):
+        from .cercania import reiniciar_indice
+        reiniciar_indice()
+        self.addCleanup(reiniciar_indice)
+        self.santiago = Tienda.objects.create(nombre='Santiago', direccion='D', telefono='1', latitud=-33.45, longitud=-70.66)
+        self.valparaiso = Tienda.objects.create(nombre='Valparaíso', direccion='D', telefono='1', latitud=-33.05, longitud=-71.62)
+        self.concepcion = Tienda.objects.create(nombre='Concepción', direccion='D', telefono='1', latitud=-36.83, longitud=-73.05)
+        Tienda.objects.create(nombre='Sin coordenadas', direccion='D', telefono='1')
+        self.taladro = Producto.objects.create(sku='GEO-1', nombre='Taladro', precio=Decimal('1000'), categoria='C')
+        self.broca = Producto.objects.create(sku='GEO-2', nombre='Broca', precio=Decimal('100'), categoria='C')
+        StockTienda.objects.create(producto=self.taladro, tienda=self.santiago, cantidad=1)
+        StockTienda.objects.create(producto=self.taladro, tienda=self.valparaiso, cantidad=5)
+        StockTienda.objects.create(producto=self.broca, tienda=self.valparaiso, cantidad=1)
+        StockTienda.objects.create(producto=self.taladro, tienda=self.concepcion, cantidad=5)
+        StockTienda.objects.create(producto=self.broca, tienda=self.concepcion, cantidad=10)
+        self.url = reverse('tienda-cercanas')
+        # Plaza de Armas de Santiago
+        self.punto = {'lat': -33.4378, 'lon': -70.6504}
+
+    def nombres(self, **params):
+        respuesta = self.client.get(self.url, {**self.punto, **params})
+        self.assertEqual(respuesta.status_code, status.HTTP_200_OK)
+        return [tienda['nombre'] for tienda in respuesta.data]
+
+    def test_por_distancia_y_stock(self):
+        self.assertEqual(self.nombres(), ['Santiago', 'Valparaíso', 'Concepción'])
+        self.assertEqual(self.nombres(productos=f'{self.taladro.id}'), ['Santiago', 'Valparaíso', 'Concepción'])
+        self.assertEqual(self.nombres(productos=f'{self.taladro.id}:2'), ['Valparaíso', 'Concepción'])
+        self.assertEqual(self.nombres(productos=f'{self.taladro.id}:2,{self.broca.id}:2', limite=1), ['Concepción'])
+        self.assertEqual(self.nombres(productos=f'{self.taladro.id}:6'), [])
+        primera = self.client.get(self.url, self.punto).data[0]
+        self.assertAlmostEqual(primera['distancia_km'], 1.62, delta=0.01)
+
+    def test_el_indice_sigue_los_cambios_de_tiendas(self):
+        self.assertEqual(self.nombres(limite=1), ['Santiago'])
+        self.santiago.activa = False
+        self.santiago.save()
+        self.assertEqual(self.nombres(limite=1), ['Valparaíso'])
+        nueva = Tienda.objects.create(nombre='Providencia', direccion='D', telefono='1', latitud=-33.43, longitud=-70.61)
+        self.assertEqual(self.nombres(limite=1), ['Providencia'])
+        nueva.latitud, nueva.longitud = -41.47, -72.94
+        nueva.save()
+        self.assertEqual(self.nombres(), ['Valparaíso', 'Concepción', 'Providencia'])
+        self.valparaiso.delete()
+        self.assertEqual(self.nombres(), ['Concepción', 'Providencia'])
+
+    def test_igual_a_fuerza_bruta(self):
+        import random
+        from .cercania import MAX_PENDIENTES_INDICE, IndiceTiendas, distancia_km, vector
+        rnd = random.Random(7)
+        puntos = {i: (rnd.uniform(-90, 90), rnd.uniform(-180, 180)) for i in range(300)}
+        indice = IndiceTiendas((i, lat, lon) for i, (lat, lon) in puntos.items())
+        # Cambios incrementales, menos y más de los que fuerzan a rehacer el árbol
+        for i in range(MAX_PENDIENTES_INDICE * 2):
+            if i % 3 == 0:
+                puntos.pop(i, None)
+                indice.eliminar(i)
+            else:
+                puntos[1000 + i] = (rnd.uniform(-90, 90), rnd.uniform(-180, 180))
+                indice.indexar(1000 + i, *puntos[1000 + i])
+        for consulta in [(0, 179.9), (-89, 10), (rnd.uniform(-90, 90), rnd.uniform(-180, 180))]:
+            for candidatas in [None, set(rnd.sample(sorted(puntos), 150)), set(rnd.sample(sorted(puntos), 5))]:
+                q = vector(*consulta)
+                esperadas = sorted(
+                    (sum((a - b) ** 2 for a, b in zip(q, vector(*punto))), i)
+                    for i, punto in puntos.items() if candidatas is None or i in candidatas
+                )[:7]
+                obtenidas = indice.cercanas(*consulta, 7, candidatas=candidatas)
+                self.assertEqual([i for i, _ in obtenidas], [i for _, i in esperadas])
+                for (_, km), (d2, _) in zip(obtenidas, esperadas):
+                    self.assertAlmostEqual(km, distancia_km(d2))
+
+    def test_validaciones(self):
+        for params in [{}, {'lat': 91, 'lon': 0}, {'lat': 0, 'lon': 'x'}, {**self.punto, 'productos': 'a:1'},
+                       {**self.punto, 'productos': f'{self.taladro.id}:0'}, {**self.punto, 'limite': 0}]:
+            self.assertEqual(self.client.get(self.url, params).status_code, status.HTTP_400_BAD_REQUEST)
+        admin = CustomerUser.objects.create_superuser(username='geo', email='geo@test.com', password='x')
+        self.client.force_authenticate(user=admin)
+        respuesta = self.client.patch(reverse('tienda-detail', args=[self.santiago.id]), {'longitud': None}, format='json')
+        self.assertEqual(respuesta.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class StreamStockTest(APITestCase):
+    """Cambios de stock en vivo: broker del proceso y stream SSE"""
+
+    def setUp(self):
+        self.trabajador = CustomerUser.objects.create_user(username='vivo', email='vivo@test.com', password='x', role='trabajador')
+        self.norte = Tienda.objects.create(nombre='Norte', direccion='D', telefono='1')
+        self.sur = Tienda.objects.create(nombre='Sur', direccion='D', telefono='1')
+        self.producto = Producto.objects.create(sku='EV001', nombre='Martillo', precio=Decimal('5000'), categoria='C')
+        self.stock_norte = StockTienda.objects.create(producto=self.producto, tienda=self.norte, cantidad=10)
+        self.stock_sur = StockTienda.objects.create(producto=self.producto, tienda=self.sur, cantidad=4)
+        self.client.force_authenticate(user=self.trabajador)
+
+    def test_escrituras_publican_al_confirmar_filtradas(self):
+        """El suscriptor vive en el event loop de otro hilo, como bajo ASGI"""
+        import asyncio
+        import threading
+        from .eventos_service import broker
+
+        loop = asyncio.new_event_loop()
+        threading.Thread(target=loop.run_forever, daemon=True).start()
+
+        async def suscribir():
+            return broker().suscribir(tiendas={self.norte.id})
+
+        suscripcion = asyncio.run_coroutine_threadsafe(suscribir(), loop).result()
+        try:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post(reverse('stocktienda-ajustar-stock', args=[self.stock_sur.id]), {'cantidad': 1}, format='json')
+                self.client.post(reverse('stocktienda-transferir-stock'), {
+                    'producto': self.producto.id, 'tienda_origen': self.sur.id, 'tienda_destino': self.norte.id, 'cantidad': 2,
+                }, format='json')
+            deltas = asyncio.run_coroutine_threadsafe(suscripcion.siguiente(1), loop).result()
+        finally:
+            broker().cancelar(suscripcion)
+            loop.call_soon_threadsafe(loop.stop)
+        self.assertEqual(deltas, [{'producto': self.producto.id, 'tienda': self.norte.id, 'cantidad': 12}])
+
+    def test_suscriptor_lento_se_desfasa_y_sigue(self):
+        import asyncio
+        from .eventos_service import MAX_PENDIENTES, BrokerLocal
+
+        async def escuchar():
+            local = BrokerLocal()
+            suscripcion = local.suscribir()
+            for cantidad in range(MAX_PENDIENTES + 5):
+                local.publicar([{'producto': 1, 'tienda': 1, 'cantidad': cantidad}])
+            await asyncio.sleep(0)
+            perdido = await suscripcion.siguiente(1)
+            local.publicar([{'producto': 1, 'tienda': 1, 'cantidad': 0}])
+            return perdido, await suscripcion.siguiente(1)
+
+        self.assertEqual(asyncio.run(escuchar()), (None, [{'producto': 1, 'tienda': 1, 'cantidad': 0}]))
+
+
+class StreamSseTest(TransactionTestCase):
+    """
+    La aplicación ASGI del stream. El usuario del token se busca desde otro
+    hilo (sync_to_async), así que los datos tienen que estar confirmados.
+    """
+
+    def setUp(self):
+        from rest_framework_simplejwt.tokens import AccessToken
+        self.norte = Tienda.objects.create(nombre='Norte', direccion='D', telefono='1')
+        self.sur = Tienda.objects.create(nombre='Sur', direccion='D', telefono='1')
+        trabajador = CustomerUser.objects.create_user(username='vivo', email='vivo@test.com', password='x', role='trabajador')
+        cliente = CustomerUser.objects.create_user(username='miron', email='miron@test.com', password='x', role='cliente')
+        self.token = str(AccessToken.for_user(trabajador))
+        self.token_cliente = str(AccessToken.for_user(cliente))
+
+    def conectar(self, consulta, cabeceras=()):
+        import asyncio
+        from config.asgi import application
+        enviados, entrantes = asyncio.Queue(), asyncio.Queue()
+        entrantes.put_nowait({'type': 'http.request', 'body': b'', 'more_body': False})
+        scope = {
+            'type': 'http', 'method': 'GET', 'path': '/api/stock-tienda/stream/', 'query_string': consulta,
+            'headers': list(cabeceras), 'asgi': {'version': '3.0'},
+        }
+        tarea = asyncio.ensure_future(application(scope, entrantes.get, enviados.put))
+        return tarea, entrantes, enviados
+
+    def test_stream_sse(self):
+        """El stream filtra, manda los eventos y suelta la suscripción al desconectarse"""
+        import asyncio
+        from .eventos_service import broker
+
+        async def probar():
+            tarea, _, enviados = self.conectar(f'tiendas=x&token={self.token}'.encode())
+            await tarea
+            respuesta_invalida = (await enviados.get())['status']
+
+            tarea, entrantes, enviados = self.conectar(f'tiendas={self.sur.id}&token={self.token}'.encode())
+            inicio = await asyncio.wait_for(enviados.get(), 5)
+            primero = (await enviados.get())['body']
+            suscriptores = broker().suscriptores
+            broker().publicar([
+                {'producto': 1, 'tienda': self.norte.id, 'cantidad': 3},
+                {'producto': 1, 'tienda': self.sur.id, 'cantidad': None},
+            ])
+            cambio = (await asyncio.wait_for(enviados.get(), 1))['body']
+            entrantes.put_nowait({'type': 'http.disconnect'})
+            await asyncio.wait_for(tarea, 1)
+            return respuesta_invalida, inicio, primero, cambio, suscriptores - broker().suscriptores
+
+        respuesta_invalida, inicio, primero, cambio, liberadas = asyncio.run(probar())
+        self.assertEqual(respuesta_invalida, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual((inicio['status'], dict(inicio['headers'])[b'content-type']), (200, b'text/event-stream'))
+        self.assertEqual(primero, b'retry: 3000\n\n')
+        self.assertEqual(cambio, f'event: stock\ndata: [{{"producto":1,"tienda":{self.sur.id},"cantidad":null}}]\n\n'.encode())
+        self.assertEqual(liberadas, 1)
+
+    def test_stream_exige_token_y_rol(self):
+        """Sin token válido 401, sin rol de administrador o trabajador 403, y nunca CORS con *"""
+        import asyncio
+
+        async def estado(consulta, cabeceras=()):
+            tarea, entrantes, enviados = self.conectar(consulta, cabeceras)
+            inicio = await asyncio.wait_for(enviados.get(), 5)
+            entrantes.put_nowait({'type': 'http.disconnect'})
+            await asyncio.wait_for(tarea, 1)
+            return inicio['status'], dict(inicio['headers'])
+
+        async def probar():
+            return [
+                await estado(b''),
+                await estado(b'token=basura'),
+                await estado(f'token={self.token_cliente}'.encode()),
+                await estado(b'', [(b'authorization', f'Bearer {self.token}'.encode()), (b'origin', b'https://otro.example')]),
+            ]
+
+        respuestas = asyncio.run(probar())
+        self.assertEqual([codigo for codigo, _ in respuestas], [401, 401, 403, 200])
+        self.assertTrue(all(b'access-control-allow-origin' not in cabeceras for _, cabeceras in respuestas))
+
+
+class ConciliacionTest(TestCase):
+    """Conciliación por merge-join contra un conteo y contra el stock esperado"""
+
+    def setUp(self):
+        self.norte = Tienda.objects.create(nombre='Norte', direccion='D', telefono='1')
+        self.sur = Tienda.objects.create(nombre='Sur', direccion='D', telefono='1')
+        # Creados fuera de orden: el cruce es por sku, no por id
+        self.clavos = Producto.objects.create(sku='C-2', nombre='Clavos', precio=Decimal('990'), categoria='C')
+        self.martillo = Producto.objects.create(sku='A-1', nombre='Martillo', precio=Decimal('5000'), categoria='C')
+        self.taladro = Producto.objects.create(sku='B-9', nombre='Taladro', precio=Decimal('50000'), categoria='C')
+        StockTienda.objects.create(producto=self.martillo, tienda=self.norte, cantidad=10)
+        StockTienda.objects.create(producto=self.martillo, tienda=self.sur, cantidad=4)
+        StockTienda.objects.create(producto=self.clavos, tienda=self.norte, cantidad=100)
+
+    def conteo(self, texto):
+        import io
+        from .carga_masiva_service import leer_filas
+        return leer_filas(io.BytesIO(texto.encode()), 'csv')
+
+    def test_diferencias_con_el_conteo_y_correccion(self):
+        import io
+        from unittest import mock
+        from .models import StockMovimiento
+        from . import conciliacion_service
+        reporte = io.StringIO()
+        archivo = (
+            'sku,tienda,cantidad\n'
+            f'C-2,{self.norte.id},90\n'
+            f'A-1,{self.norte.id},10\n'
+            f'B-9,{self.sur.id},3\n'
+            f'A-1,{self.norte.id},8\n'
+            'A-1,x,1\n'
+        )
+        # Partes de 2 filas: el conteo se ordena por temporales y se mezcla
+        with mock.patch.object(conciliacion_service, 'TAMANO_ORDEN', 2):
+            resultado = conciliacion_service.conciliar(self.conteo(archivo), aplicar=True, reporte=reporte, no_contadas=True)
+        self.assertEqual(
+            reporte.getvalue().splitlines(),
+            [
+                'sku,tienda,sistema,contado,esperado,diferencias',
+                f'A-1,{self.norte.id},10,8,,conteo',
+                f'A-1,{self.sur.id},4,,,no_contada',
+                f'B-9,{self.sur.id},,3,,conteo',
+                f'C-2,{self.norte.id},100,90,,conteo',
+            ],
+        )
+        self.assertEqual(
+            (resultado['diferencias_conteo'], resultado['no_contadas'], resultado['con_error'], resultado['corregidas']),
+            (3, 1, 1, 3),
+        )
+        self.assertEqual(resultado['filas'], 3 + 4)
+        self.assertEqual(
+            sorted(StockTienda.objects.values_list('producto__sku', 'tienda_id', 'cantidad')),
+            [('A-1', self.norte.id, 8), ('A-1', self.sur.id, 4), ('B-9', self.sur.id, 3), ('C-2', self.norte.id, 90)],
+        )
+        self.assertEqual(StockMovimiento.objects.filter(tipo=StockMovimiento.AJUSTE).count(), 3)
+
+    def test_esperado_con_snapshot_libro_y_ventas(self):
+        import io
+        from datetime import timedelta
+        from django.utils import timezone
+        from carrito.models import ItemOrden, Orden
+        from .conciliacion_service import conciliar
+        from .models import StockMovimiento, StockSnapshot
+        antes = timezone.now() - timedelta(days=1)
+        StockSnapshot.objects.create(producto=self.martillo, tienda=self.norte, cantidad=12, fecha=antes)
+        StockSnapshot.objects.create(producto=self.clavos, tienda=self.norte, cantidad=100, fecha=antes)
+        StockSnapshot.objects.create(producto=self.martillo, tienda=self.sur, cantidad=4, fecha=antes)
+        StockMovimiento.objects.create(producto=self.martillo, tienda=self.norte, tipo=StockMovimiento.AJUSTE, cantidad=1)
+        # La venta del libro no cuenta: las ventas salen de ItemOrden
+        StockMovimiento.objects.create(producto=self.martillo, tienda=self.norte, tipo=StockMovimiento.VENTA, cantidad=-50)
+        orden = Orden.objects.create(
+            total=Decimal('15000'), nombre='Cliente', email='c@test.com', telefono='1',
+            direccion='Calle 1', ciudad='Santiago', codigo_postal='1', metodo_pago='mercadopago',
+        )
+        ItemOrden.objects.create(orden=orden, producto=self.martillo, tienda=self.norte, cantidad=3, precio_unitario=Decimal('5000'))
+        ItemOrden.objects.create(orden=orden, producto=self.taladro, cantidad=1, precio_unitario=Decimal('50000'))
+        reporte = io.StringIO()
+        resultado = conciliar(esperado=True, reporte=reporte)
+        # Martillo en Norte: 12 + 1 - 3 = 10, como el sistema; los clavos y el Sur también cuadran
+        self.assertEqual(resultado['diferencias_esperado'], 0)
+        StockTienda.objects.filter(producto=self.clavos).update(cantidad=97)
+        reporte = io.StringIO()
+        conciliar(esperado=True, reporte=reporte)
+        self.assertEqual(reporte.getvalue().splitlines()[1:], [f'C-2,{self.norte.id},97,,100,esperado'])
+
+    def test_aplica_mas_de_mil_correcciones(self):
+        """Un conteo con más de mil filas distintas del sistema se corrige completo"""
+        from .conciliacion_service import LOTE_ESCRITURA, conciliar
+        from .models import StockMovimiento
+        productos = Producto.objects.bulk_create([
+            Producto(sku=f'M-{i:04d}', nombre=f'Producto {i}', precio=Decimal('1000'), categoria='C') for i in range(60)
+        ])
+        tiendas = Tienda.objects.bulk_create([Tienda(nombre=f'T{i}', direccion='D', telefono='1') for i in range(20)])
+        StockTienda.objects.bulk_create([StockTienda(producto=producto, tienda=tiendas[0], cantidad=1) for producto in productos])
+        archivo = 'sku,tienda,cantidad\n' + ''.join(
+            f'{producto.sku},{tienda.id},5\n' for producto in productos for tienda in tiendas
+        )
+        resultado = conciliar(self.conteo(archivo), aplicar=True)
+        self.assertGreater(resultado['corregidas'], LOTE_ESCRITURA)
+        self.assertEqual((resultado['corregidas'], resultado['rechazadas']), (1200, 0))
+        self.assertEqual(StockTienda.objects.filter(producto__in=productos, cantidad=5).count(), 1200)
+        self.assertEqual(StockMovimiento.objects.filter(tipo=StockMovimiento.AJUSTE).count(), 1200)
+
+    def test_comando(self):
+        import os
+        import tempfile
+        from io import StringIO
+        from django.core.management import call_command
+        with tempfile.TemporaryDirectory() as carpeta:
+            conteo = os.path.join(carpeta, 'conteo.csv')
+            with open(conteo, 'w') as archivo:
+                archivo.write(f'sku,tienda,cantidad\nA-1,{self.sur.id},5\n')
+            salida = StringIO()
+            call_command('conciliar_stock', '--conteo', conteo, '--reporte', os.path.join(carpeta, 'r.csv'), stdout=salida)
+            with open(os.path.join(carpeta, 'r.csv')) as archivo:
+                self.assertEqual(archivo.read().splitlines()[1:], [f'A-1,{self.sur.id},4,5,,conteo'])
+        self.assertIn('filas/s', salida.getvalue())
+        self.assertEqual(StockTienda.objects.get(producto=self.martillo, tienda=self.sur).cantidad, 4)
+
+
+class AsignacionTest(TestCase):
+    """Los asignadores reparten el pedido entre tiendas sin vender de más"""
+
+    def test_una_tienda_completa_gana_aunque_no_sea_la_primera(self):
+        from .asignacion import MinimasTiendasAsignador, PrimeraTiendaAsignador
+        pedido = {1: 5, 2: 3}
+        disponibles = {1: {10: 5, 20: 5}, 2: {10: 1, 20: 3}}
+        asignacion = MinimasTiendasAsignador().asignar(pedido, disponibles)
+        self.assertEqual(asignacion.partes, {1: [(20, 5)], 2: [(20, 3)]})
+        self.assertEqual(asignacion.faltantes, {})
+        primera = PrimeraTiendaAsignador().asignar(pedido, disponibles)
+        self.assertEqual(primera.partes, {1: [(10, 5)], 2: [(10, 1), (20, 2)]})
+
+    def test_parte_cantidades_y_reporta_faltantes(self):
+        """Si ninguna tienda alcanza, la cantidad se reparte; lo que no existe queda faltante"""
+        from .asignacion import MinimasTiendasAsignador
+        pedido = {1: 8, 2: 2, 3: 4}
+        disponibles = {1: {10: 5, 20: 2, 30: 4}, 2: {20: 2}, 3: {30: 1}}
+        asignacion = MinimasTiendasAsignador().asignar(pedido, disponibles)
+        self.assertEqual(sum(cantidad for _, cantidad in asignacion.partes[1]), 8)
+        self.assertEqual(asignacion.partes[2], [(20, 2)])
+        self.assertEqual(asignacion.partes[3], [(30, 1)])
+        self.assertEqual(asignacion.faltantes, {3: 3})
+        for producto_id, partes in asignacion.partes.items():
+            for tienda_id, cantidad in partes:
+                self.assertLessEqual(cantidad, disponibles[producto_id][tienda_id])
+
+    def test_linea_partida_se_junta_en_una_tienda_elegida(self):
+        """Si una tienda ya elegida tiene la línea completa, la línea no se parte"""
+        from .asignacion import MinimasTiendasAsignador
+        # La tienda 10 se elige primero (completa 2 líneas) y solo tiene 1 unidad
+        # del producto 3; la 20 se necesita igual para el producto 4 y tiene las 3
+        pedido = {1: 1, 2: 1, 3: 3, 4: 1}
+        disponibles = {1: {10: 1}, 2: {10: 1}, 3: {10: 1, 20: 3}, 4: {20: 1}}
+        asignacion = MinimasTiendasAsignador().asignar(pedido, disponibles)
+        self.assertEqual(asignacion.partes[3], [(20, 3)])
+        self.assertEqual(asignacion.tiendas, {10, 20})
+
+    @override_settings(ASIGNADOR_STOCK='productos.asignacion.PrimeraTiendaAsignador')
+    def test_asignador_configurable(self):
+        from .asignacion import PrimeraTiendaAsignador, asignador_configurado
+        self.assertIsInstance(asignador_configurado(), PrimeraTiendaAsignador)
+
+    def test_descontar_pedido_ignora_tiendas_inactivas(self):
+        from .stock_service import descontar_pedido
+        producto = Producto.objects.create(sku='AS001', nombre='Clavos', precio=Decimal('990'), categoria='Fijaciones')
+        cerrada = Tienda.objects.create(nombre='Cerrada', direccion='D', telefono='1', activa=False)
+        abierta = Tienda.objects.create(nombre='Abierta', direccion='D', telefono='1')
+        StockTienda.objects.create(producto=producto, tienda=cerrada, cantidad=10)
+        StockTienda.objects.create(producto=producto, tienda=abierta, cantidad=3)
+        asignacion = descontar_pedido({producto.id: 5})
+        self.assertEqual((asignacion.partes, asignacion.faltantes), ({producto.id: [(abierta.id, 3)]}, {producto.id: 2}))
+        producto.refresh_from_db()
+        self.assertEqual(producto.stock_total, 10)
@@ -1,12 +1,208 @@
 from rest_framework import viewsets, permissions, status
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
-from .models import Producto, Tienda, StockTienda
-from .serializers import ProductoSerializer, TiendaSerializer, StockTiendaSerializer
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef, Prefetch
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from datetime import timedelta
+from decimal import Decimal, InvalidOperation
+from functools import partial
+from .models import Producto, Tienda, StockMovimiento, StockTienda
+from .serializers import ProductoSerializer, TiendaSerializer, StockTiendaSerializer, StockBajoMinimoSerializer
+from .pagination import ProductoCursorPagination, StockBajoMinimoPagination, StockTiendaPagination
+from .stock_service import (
+    MAX_AJUSTES_LOTE, StockInsuficiente, ajustar_cantidad, ajustar_en_lote, bajo_minimo, resumen_bajo_minimo,
+    sincronizar_totales, transferir,
+)
+from .search import buscar_productos, filtrar_productos
+from .facets import calcular_facetas, resumen_facetas
+from .cache import CatalogoCacheMixin, estadisticas
+from .mappers import filas_productos, serializar_productos
+from .movimientos_service import HistoriaPurgada, movimiento, registrar, reporte_tienda
+from .cercania import tiendas_cercanas
+from .matriz_service import FORMATOS, MAX_PRODUCTOS_MATRIZ, MAX_TIENDAS_MATRIZ, matriz_stock
+from .carga_masiva_service import (
+    FormatoInvalido, exportar_productos, exportar_stock, formato_de,
+    importar_productos, importar_stock, leer_filas,
+)
+from usuarios.permissions import EsAdministrador, EsAdministradorOTrabajador
+from carrito.models import ItemOrden
+from config.serializacion_rapida import JSONRapidoRenderer, serializacion_rapida_activa
+from rest_framework.renderers import BrowsableAPIRenderer
 
-class ProductoViewSet(viewsets.ModelViewSet):
+TIPOS_CONTENIDO = {'csv': 'text/csv; charset=utf-8', 'ndjson': 'application/x-ndjson; charset=utf-8'}
+DIAS_REPORTE_MOVIMIENTOS = 30
+MAX_TIENDAS_CERCANAS = 50
+MAX_PRODUCTOS_CERCANAS = 50
+
+
+def fecha_de(request, nombre, por_defecto):
+    """Fecha ISO 8601 del query param `nombre` (con zona horaria). Lanza ValueError si no es válida."""
+    texto = request.query_params.get(nombre)
+    if not texto:
+        return por_defecto
+    fecha = parse_datetime(texto)
+    if fecha is None:
+        raise ValueError(nombre)
+    return fecha if timezone.is_aware(fecha) else timezone.make_aware(fecha)
+
+
+def entero_de(request, nombre, por_defecto=None, maximo=None):
+    """Entero positivo del query param `nombre`, acotado a `maximo`. Lanza ValueError si no es válido."""
+    texto = request.query_params.get(nombre)
+    if not texto:
+        return por_defecto
+    try:
+        valor = int(texto)
+    except ValueError:
+        raise ValueError(nombre)
+    if valor < 1:
+        raise ValueError(nombre)
+    return min(valor, maximo) if maximo else valor
+
+
+def filtro_de(request, nombre, tipo, mensaje):
+    """
+    Valor del query param opcional `nombre` convertido con `tipo` (None si no
+    viene). Si no es válido lanza ValidationError (400) con `mensaje`.
+    """
+    texto = request.query_params.get(nombre)
+    if not texto:
+        return None
+    try:
+        valor = tipo(texto)
+    except (ValueError, InvalidOperation):
+        raise ValidationError({'error': mensaje})
+    if isinstance(valor, Decimal) and not valor.is_finite():
+        raise ValidationError({'error': mensaje})
+    return valor
+
+
+def coordenada_de(request, nombre, limite):
+    """Grados del query param obligatorio `nombre`, entre -limite y limite. Lanza ValueError si no es válido."""
+    try:
+        valor = float(request.query_params[nombre])
+    except (KeyError, ValueError):
+        raise ValueError(nombre)
+    if not -limite <= valor <= limite:
+        raise ValueError(nombre)
+    return valor
+
+
+def pedido_de(request, nombre):
+    """
+    {producto_id: cantidad} del query param `nombre` ("12:3,15" pide 3 del 12
+    y 1 del 15). Lanza ValueError si no es válido.
+    """
+    pedido = {}
+    for parte in filter(None, request.query_params.get(nombre, '').split(',')):
+        producto, _, cantidad = parte.partition(':')
+        try:
+            producto_id, cantidad = int(producto), int(cantidad or 1)
+        except ValueError:
+            raise ValueError(nombre)
+        if cantidad < 1:
+            raise ValueError(nombre)
+        pedido[producto_id] = pedido.get(producto_id, 0) + cantidad
+    if len(pedido) > MAX_PRODUCTOS_CERCANAS:
+        raise ValueError(nombre)
+    return pedido
+
+
+def usuario_de(request):
+    return request.user if request.user.is_authenticated else None
+
+
+def respuesta_bajo_minimo(view, request, tienda_id=None):
+    """
+    Stock bajo su mínimo, paginado por cursor, con lo que falta para reponer.
+    Filtra por `tienda` (si no viene fija), `categoria` y `marca`.
+    """
+    params = request.query_params
+    queryset = bajo_minimo(StockTienda.objects.select_related('producto', 'tienda')).annotate(
+        reponer=F('stock_minimo') - F('cantidad')
+    )
+    if tienda_id is None and params.get('tienda'):
+        try:
+            tienda_id = int(params['tienda'])
+        except ValueError:
+            return Response({'error': 'tienda debe ser un id numérico'}, status=status.HTTP_400_BAD_REQUEST)
+    if tienda_id is not None:
+        queryset = queryset.filter(tienda_id=tienda_id)
+    if params.get('categoria') is not None:
+        queryset = queryset.filter(producto__categoria=params['categoria'])
+    if params.get('marca') is not None:
+        queryset = queryset.filter(producto__marca=params['marca'])
+    paginator = StockBajoMinimoPagination()
+    pagina = paginator.paginate_queryset(queryset, request, view=view)
+    return paginator.get_paginated_response(StockBajoMinimoSerializer(pagina, many=True).data)
+
+
+def respuesta_importacion(request, importar):
+    """Importa el archivo subido en `archivo` (CSV o NDJSON) y responde el resumen."""
+    archivo = request.FILES.get('archivo')
+    if archivo is None:
+        return Response({'error': 'Debe adjuntar el archivo en el campo "archivo"'}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        formato = formato_de(archivo.name, request.query_params.get('formato') or request.data.get('formato'))
+    except FormatoInvalido as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    resultado = importar(leer_filas(archivo.file, formato))
+    codigo = status.HTTP_200_OK if not resultado['con_error'] else status.HTTP_207_MULTI_STATUS
+    return Response(resultado, status=codigo)
+
+
+def respuesta_exportacion(request, exportar, nombre):
+    """Descarga en streaming, en el formato de `?formato=` (csv por defecto)."""
+    try:
+        formato = formato_de(None, request.query_params.get('formato', 'csv'))
+    except FormatoInvalido as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    response = StreamingHttpResponse(exportar(formato), content_type=TIPOS_CONTENIDO[formato])
+    response['Content-Disposition'] = f'attachment; filename="{nombre}.{formato}"'
+    return response
+
+
+class CamposDinamicosViewMixin:
+    """
+    `?fields=a,b` y `?expand=stock`: eligen los campos del serializer y, con
+    ellos, las columnas que se leen (`only()`) y las relaciones que se precargan.
+    """
+
+    def campos_solicitados(self):
+        if not hasattr(self, '_campos'):
+            params = self.request.query_params
+
+            def lista(nombre):
+                return [valor.strip() for valor in params.get(nombre, '').split(',') if valor.strip()]
+
+            campos = lista('fields') if 'fields' in params else None
+            self._campos = self.get_serializer_class().resolver_campos(campos, lista('expand'))
+        return self._campos
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        if self.request is not None and self.request.method == 'GET':
+            context['campos'] = self.campos_solicitados()
+        return context
+
+    def solo_columnas(self, queryset):
+        """Restringe el SELECT a las columnas de los campos pedidos cuando se usa ?fields=."""
+        if 'fields' not in self.request.query_params:
+            return queryset
+        columnas = {campo.name for campo in queryset.model._meta.concrete_fields}
+        # La columna de orden también se lee: la paginación por cursor la usa
+        pedidas = set(self.campos_solicitados()) | {self.request.query_params.get('ordering', '').lstrip('-')}
+        return queryset.only('id', *(nombre for nombre in pedidas if nombre in columnas))
+
+class ProductoViewSet(CamposDinamicosViewMixin, CatalogoCacheMixin, viewsets.ModelViewSet):
     queryset = Producto.objects.all()
     serializer_class = ProductoSerializer
+    pagination_class = ProductoCursorPagination
+    renderer_classes = [JSONRapidoRenderer, BrowsableAPIRenderer]
 
     def get_serializer_context(self):
         context = super().get_serializer_context()
@@ -19,8 +215,12 @@ class ProductoViewSet(viewsets.ModelViewSet):
         Permitir acceso para listar, ver detalles y categorías sin autenticación.
         Requerir autenticación y rol admin o trabajador para otras acciones.
         """
-        if self.action in ['list', 'retrieve', 'categories', 'stock_por_tienda']:
+        if self.action in ['list', 'retrieve', 'categories', 'stock_por_tienda', 'search', 'facets']:
             permission_classes = [permissions.AllowAny]
+        elif self.action == 'cache_stats':
+            permission_classes = [EsAdministrador]
+        elif self.action in ['importar', 'exportar']:
+            permission_classes = [EsAdministradorOTrabajador]
         else:
             # Para crear, actualizar, eliminar: requiere autenticación y rol admin o trabajador
             permission_classes = [permissions.IsAuthenticated]
@@ -35,45 +235,192 @@ class ProductoViewSet(viewsets.ModelViewSet):
 
     def get_queryset(self):
         """
-        Optionally filters products by category.
+        Optionally filters products by category, brand, price range, store and
+        availability.
+        Para lectura, carga el stock con su tienda en una sola consulta, así el
+        número de consultas no depende del tamaño del catálogo.
         """
         queryset = self.queryset
-        categoria = self.request.query_params.get('categoria', None)
+        params = self.request.query_params
+        categoria = params.get('categoria', None)
         if categoria is not None:
             queryset = queryset.filter(categoria=categoria)
+        marca = params.get('marca', None)
+        if marca is not None:
+            queryset = queryset.filter(marca=marca)
+        precio_min = filtro_de(self.request, 'precio_min', Decimal, 'precio_min debe ser un número')
+        if precio_min is not None:
+            queryset = queryset.filter(precio__gte=precio_min)
+        precio_max = filtro_de(self.request, 'precio_max', Decimal, 'precio_max debe ser un número')
+        if precio_max is not None:
+            queryset = queryset.filter(precio__lt=precio_max)
+        tienda = filtro_de(self.request, 'tienda', int, 'tienda debe ser un id numérico')
+        if tienda is not None:
+            queryset = queryset.filter(Exists(StockTienda.objects.filter(
+                producto=OuterRef('pk'), tienda_id=tienda, cantidad__gt=0
+            )))
+        disponible = params.get('disponible', None)
+        if disponible is not None:
+            if disponible.lower() in ['true', '1']:
+                queryset = queryset.filter(stock_total__gt=0)
+            else:
+                queryset = queryset.filter(stock_total=0)
+        ordering = params.get('ordering', None)
+        if ordering in ProductoCursorPagination.ordenamientos_permitidos:
+            queryset = queryset.order_by(ordering, 'id')
+        if self.action in ['list', 'retrieve', 'search']:
+            queryset = self.solo_columnas(queryset)
+            # El stock solo se consulta si va en la respuesta
+            if 'stock_por_tienda' in self.campos_solicitados():
+                queryset = queryset.prefetch_related(
+                    Prefetch('stocktienda_set', queryset=StockTienda.objects.select_related('tienda').order_by('id'))
+                )
         return queryset
 
+    def quiere_facetas(self):
+        return self.request.query_params.get('facets', '').lower() in ['true', '1']
+
+    def list(self, request, *args, **kwargs):
+        """
+        Listado de productos. Con `?facets=true` agrega los conteos por
+        categoría, marca, rango de precio y tienda de los productos filtrados.
+        """
+        return self.respuesta_cacheada('productos_list', lambda: self.listar(request, *args, **kwargs))
+
+    def listar(self, request, *args, **kwargs):
+        if serializacion_rapida_activa():
+            response = self.listar_rapido()
+        else:
+            response = super().list(request, *args, **kwargs)
+        if self.quiere_facetas():
+            if not isinstance(response.data, dict):
+                response.data = {'results': response.data}
+            response.data['facets'] = self.facetas_de(self.filter_queryset(self.get_queryset()))
+        return response
+
+    def listar_rapido(self):
+        """Mismo resultado que ModelViewSet.list, armado desde values() sin instanciar modelos."""
+        campos = self.campos_solicitados()
+        filas = filas_productos(
+            self.filter_queryset(self.get_queryset()), campos,
+            ordering=self.paginator.get_ordering(self.request, None, self)[0],
+        )
+        page = self.paginate_queryset(filas)
+        if page is not None:
+            return self.get_paginated_response(serializar_productos(page, campos))
+        return Response(serializar_productos(filas, campos))
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.respuesta_cacheada('productos_retrieve', lambda: super(ProductoViewSet, self).retrieve(request, *args, **kwargs))
+
+    def facetas_de(self, queryset):
+        # Sin filtros se usa el resumen cacheado de todo el catálogo
+        if not queryset.query.where:
+            return resumen_facetas()
+        return calcular_facetas(queryset)
+
+    @action(detail=False, methods=['get'])
+    def facets(self, request):
+        """Conteos por faceta de los productos que cumplen los filtros del listado."""
+        return self.respuesta_cacheada('productos_facetas', lambda: Response(self.facetas_de(self.get_queryset())))
+
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        """
+        Búsqueda por texto libre en nombre, descripción, marca y sku, ordenada
+        por relevancia. Admite `q`, `limit` (máx. 100), `offset` y los mismos
+        filtros que el listado.
+        """
+        consulta = request.query_params.get('q', '').strip()
+        try:
+            limite = min(max(int(request.query_params.get('limit', 20)), 1), 100)
+            offset = max(int(request.query_params.get('offset', 0)), 0)
+        except ValueError:
+            return Response(
+                {'error': 'limit y offset deben ser números enteros'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if not consulta:
+            return Response({'query': consulta, 'results': []})
+
+        queryset = self.get_queryset()
+        ids = buscar_productos(queryset.order_by(), consulta, limite=limite, offset=offset)
+        productos = queryset.in_bulk(ids)
+        serializer = self.get_serializer([productos[i] for i in ids if i in productos], many=True)
+        data = {'query': consulta, 'results': serializer.data}
+        if self.quiere_facetas():
+            coincidentes = buscar_productos(queryset.order_by(), consulta, limite=None)
+            data['facets'] = calcular_facetas(self.queryset, ids=coincidentes)
+        return Response(data)
+
     @action(detail=False, methods=['get'])
     def categories(self, request):
         """
         Returns a list of unique product categories.
+        Se toma del resumen de facetas cacheado en vez de recorrer la tabla.
         """
-        categories = Producto.objects.values_list('categoria', flat=True).distinct()
-        return Response(list(categories))
+        return self.respuesta_cacheada('productos_categories', lambda: Response(
+            [faceta['valor'] for faceta in resumen_facetas()['categoria']]
+        ))
 
     @action(detail=True, methods=['get'])
     def stock_por_tienda(self, request, pk=None):
-        producto = self.get_object()
-        stock = StockTienda.objects.filter(producto=producto)
-        serializer = StockTiendaSerializer(stock, many=True)
-        return Response(serializer.data)
+        def construir():
+            producto = self.get_object()
+            stock = StockTienda.objects.filter(producto=producto).select_related('producto', 'tienda')
+            serializer = StockTiendaSerializer(stock, many=True)
+            return Response(serializer.data)
+        return self.respuesta_cacheada('productos_stock_por_tienda', construir)
+
+    @action(detail=False, methods=['get'])
+    def cache_stats(self, request):
+        """Aciertos y fallos de la caché del catálogo por acción. Solo administradores."""
+        return Response(estadisticas())
+
+    @action(detail=False, methods=['post'])
+    def importar(self, request):
+        """
+        Carga masiva de productos desde un archivo CSV o NDJSON (campo `archivo`).
+        Crea o actualiza por sku y devuelve los errores de cada fila rechazada.
+        """
+        return respuesta_importacion(request, importar_productos)
+
+    @action(detail=False, methods=['get'])
+    def exportar(self, request):
+        """Exporta el catálogo completo en CSV o NDJSON (`?formato=`)."""
+        return respuesta_exportacion(request, exportar_productos, 'productos')
 
-class TiendaViewSet(viewsets.ModelViewSet):
+class TiendaViewSet(CamposDinamicosViewMixin, CatalogoCacheMixin, viewsets.ModelViewSet):
     queryset = Tienda.objects.all()
     serializer_class = TiendaSerializer
     permission_classes = [permissions.IsAuthenticated]
 
+    def get_queryset(self):
+        queryset = self.queryset
+        if self.action in ['list', 'retrieve', 'cercanas']:
+            queryset = self.solo_columnas(queryset)
+            if 'stock' in self.campos_solicitados():
+                queryset = queryset.prefetch_related(
+                    Prefetch('stocktienda_set', queryset=StockTienda.objects.select_related('producto', 'tienda').order_by('id'))
+                )
+        return queryset
+
     def get_permissions(self):
         """
         Permite el acceso sin autenticación para listar y ver detalles de tiendas.
         Requiere autenticación y rol de administrador para crear, actualizar o eliminar.
         """
-        if self.action in ['list', 'retrieve']:
+        if self.action in ['list', 'retrieve', 'cercanas']:
             permission_classes = [permissions.AllowAny]
+        elif self.action in ['movimientos', 'bajo_minimo']:
+            permission_classes = [EsAdministradorOTrabajador]
         else:
             permission_classes = [permissions.IsAuthenticated, permissions.IsAdminUser]
         return [permission() for permission in permission_classes]
 
+    def list(self, request, *args, **kwargs):
+        return self.respuesta_cacheada('tiendas_list', lambda: super(TiendaViewSet, self).list(request, *args, **kwargs))
+
     def create(self, request, *args, **kwargs):
         """
         Crea una nueva tienda.
@@ -109,84 +456,320 @@ class TiendaViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['get'])
     def stock(self, request, pk=None):
         """
-        Obtiene el stock de productos para una tienda específica.
-        Accesible sin autenticación.
+        Stock de productos de la tienda, paginado por cursor (`page_size`,
+        hasta 1000). Filtra por `categoria`, `marca`, `bajo_minimo=true`,
+        `sin_stock=true` y texto libre en `q`; `ordering` admite cantidad y
+        fecha_actualizacion (con `-` para descendente).
         """
         tienda = self.get_object()
-        stock = StockTienda.objects.filter(tienda=tienda).select_related('producto')
-        serializer = StockTiendaSerializer(stock, many=True)
-        return Response(serializer.data)
+        params = request.query_params
+        queryset = StockTienda.objects.filter(tienda=tienda).select_related('producto', 'tienda')
+        if params.get('categoria') is not None:
+            queryset = queryset.filter(producto__categoria=params['categoria'])
+        if params.get('marca') is not None:
+            queryset = queryset.filter(producto__marca=params['marca'])
+        if params.get('bajo_minimo', '').lower() in ['true', '1']:
+            queryset = bajo_minimo(queryset)
+        if params.get('sin_stock', '').lower() in ['true', '1']:
+            queryset = queryset.filter(cantidad=0)
+        consulta = params.get('q', '').strip()
+        if consulta:
+            queryset = queryset.filter(producto__in=filtrar_productos(Producto.objects.all(), consulta))
+        paginator = StockTiendaPagination()
+        pagina = paginator.paginate_queryset(queryset, request, view=self)
+        return paginator.get_paginated_response(StockTiendaSerializer(pagina, many=True).data)
+
+    @action(detail=True, methods=['get'])
+    def movimientos(self, request, pk=None):
+        """
+        Reporte de movimientos de stock de la tienda entre `desde` y `hasta`
+        (ISO 8601; por defecto los últimos 30 días): stock inicial, neto por
+        tipo de movimiento y stock final de cada producto.
+        """
+        tienda = self.get_object()
+        try:
+            hasta = fecha_de(request, 'hasta', timezone.now())
+            desde = fecha_de(request, 'desde', hasta - timedelta(days=DIAS_REPORTE_MOVIMIENTOS))
+        except ValueError as error:
+            return Response(
+                {'error': f"'{error}' debe ser una fecha ISO 8601"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if desde > hasta:
+            return Response(
+                {'error': "'desde' debe ser anterior a 'hasta'"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            productos = reporte_tienda(tienda.id, desde, hasta)
+        except HistoriaPurgada as error:
+            return Response(
+                {'error': f"El libro de movimientos empieza el {error.args[0].isoformat()}: 'desde' no puede ser anterior"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response({
+            'tienda': tienda.id,
+            'desde': desde,
+            'hasta': hasta,
+            'productos': productos,
+        })
+
+    @action(detail=True, methods=['get'])
+    def bajo_minimo(self, request, pk=None):
+        """Productos de la tienda bajo su stock mínimo (`?categoria=`, `?marca=`, paginado por cursor)."""
+        tienda = self.get_object()
+        return respuesta_bajo_minimo(self, request, tienda_id=tienda.id)
+
+    @action(detail=False, methods=['get'])
+    def cercanas(self, request):
+        """
+        Las tiendas activas más cercanas a `lat`/`lon` que tienen todo el
+        pedido `productos` ("12:3,15": 3 unidades del 12 y 1 del 15), de la
+        más cercana a la más lejana, con su `distancia_km`. Sin `productos`,
+        las más cercanas. Hasta `limite` tiendas (5 por defecto).
+        """
+        try:
+            latitud = coordenada_de(request, 'lat', 90)
+            longitud = coordenada_de(request, 'lon', 180)
+            pedido = pedido_de(request, 'productos')
+            limite = entero_de(request, 'limite', 5, MAX_TIENDAS_CERCANAS)
+        except ValueError as error:
+            return Response(
+                {'error': f"'{error}' no es válido: se esperan lat y lon en grados, productos como 12:3,15 y limite entero"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        cercanas = tiendas_cercanas(latitud, longitud, pedido, limite)
+        tiendas = self.get_queryset().in_bulk([tienda_id for tienda_id, _ in cercanas])
+        resultado = []
+        for tienda_id, distancia in cercanas:
+            if tienda_id in tiendas:
+                datos = self.get_serializer(tiendas[tienda_id]).data
+                datos['distancia_km'] = round(distancia, 3)
+                resultado.append(datos)
+        return Response(resultado)
 
-class StockTiendaViewSet(viewsets.ModelViewSet):
-    queryset = StockTienda.objects.all()
+class StockTiendaViewSet(CatalogoCacheMixin, viewsets.ModelViewSet):
+    queryset = StockTienda.objects.select_related('producto', 'tienda')
     serializer_class = StockTiendaSerializer
 
+    def get_permissions(self):
+        if self.action in ['importar', 'exportar', 'ajuste_masivo', 'bajo_minimo', 'resumen_bajo_minimo', 'matriz']:
+            return [EsAdministradorOTrabajador()]
+        return super().get_permissions()
+
+    def perform_create(self, serializer):
+        """La cantidad inicial queda en el libro como ajuste."""
+        with transaction.atomic():
+            stock = serializer.save()
+            if stock.cantidad:
+                registrar([movimiento(stock, StockMovimiento.AJUSTE, stock.cantidad, usuario=usuario_de(self.request))])
+
+    def perform_update(self, serializer):
+        """
+        Un cambio de cantidad por PUT/PATCH queda en el libro como ajuste,
+        contra la cantidad de la fila bloqueada. Si la fila cambia de producto
+        o de tienda, sale todo del par anterior y entra todo al nuevo.
+        """
+        usuario = usuario_de(self.request)
+        with transaction.atomic():
+            anterior = StockTienda.objects.select_for_update().get(pk=serializer.instance.pk)
+            stock = serializer.save()
+            if (stock.producto_id, stock.tienda_id) == (anterior.producto_id, anterior.tienda_id):
+                movimientos = [movimiento(stock, StockMovimiento.AJUSTE, stock.cantidad - anterior.cantidad, usuario=usuario)]
+            else:
+                movimientos = [
+                    movimiento(anterior, StockMovimiento.AJUSTE, -anterior.cantidad, usuario=usuario),
+                    movimiento(stock, StockMovimiento.AJUSTE, stock.cantidad, usuario=usuario),
+                ]
+            registrar([mov for mov in movimientos if mov.cantidad])
+            # La señal solo recalcula el producto nuevo si la fila cambió de producto
+            if stock.producto_id != anterior.producto_id:
+                sincronizar_totales([anterior.producto_id])
+
     @action(detail=True, methods=['post'])
     def ajustar_stock(self, request, pk=None):
+        """
+        Suma (o resta, si es negativa) `cantidad` al stock en una sola operación
+        atómica. Con `item_orden` se registra como devolución de ese item.
+        """
         stock = self.get_object()
-        cantidad = request.data.get('cantidad', 0)
-        
         try:
-            cantidad = int(cantidad)
-            stock.cantidad += cantidad
-            if stock.cantidad < 0:
+            cantidad = int(request.data.get('cantidad', 0))
+        except (TypeError, ValueError):
+            return Response(
+                {'error': 'La cantidad debe ser un número entero'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        tipo, referencias = StockMovimiento.AJUSTE, {'usuario': usuario_de(request)}
+        item_orden_id = request.data.get('item_orden')
+        if item_orden_id:
+            try:
+                item_orden = ItemOrden.objects.filter(pk=int(item_orden_id), producto_id=stock.producto_id).first()
+            except (TypeError, ValueError):
+                item_orden = None
+            if item_orden is None or not 0 < cantidad <= item_orden.cantidad:
                 return Response(
-                    {'error': 'No se puede tener stock negativo'},
+                    {'error': 'La devolución debe ser de un item de este producto y de 1 a las unidades vendidas'},
                     status=status.HTTP_400_BAD_REQUEST
                 )
-            stock.save()
-            serializer = self.get_serializer(stock)
-            return Response(serializer.data)
-        except ValueError:
+            tipo = StockMovimiento.DEVOLUCION
+            referencias.update(orden_id=item_orden.orden_id, item_orden=item_orden)
+        try:
+            stock = ajustar_cantidad(stock.pk, cantidad, tipo, **referencias)
+        except StockInsuficiente:
             return Response(
-                {'error': 'La cantidad debe ser un número entero'},
+                {'error': 'No se puede tener stock negativo'},
                 status=status.HTTP_400_BAD_REQUEST
             )
+        serializer = self.get_serializer(stock)
+        return Response(serializer.data)
 
     @action(detail=False, methods=['post'])
     def transferir_stock(self, request):
+        """
+        Mueve `cantidad` unidades de `producto` desde `tienda_origen` a
+        `tienda_destino` en una transacción, sin que otra operación pueda
+        intercalarse entre el descuento y el abono.
+        """
         producto_id = request.data.get('producto')
         tienda_origen_id = request.data.get('tienda_origen')
         tienda_destino_id = request.data.get('tienda_destino')
-        cantidad = request.data.get('cantidad')
 
         try:
-            cantidad = int(cantidad)
-            stock_origen = StockTienda.objects.get(
-                producto_id=producto_id,
-                tienda_id=tienda_origen_id
+            cantidad = int(request.data.get('cantidad'))
+        except (TypeError, ValueError):
+            return Response(
+                {'error': 'La cantidad debe ser un número entero'},
+                status=status.HTTP_400_BAD_REQUEST
             )
-            stock_destino, created = StockTienda.objects.get_or_create(
-                producto_id=producto_id,
-                tienda_id=tienda_destino_id,
-                defaults={'cantidad': 0, 'stock_minimo': 0}
+        if cantidad <= 0:
+            return Response(
+                {'error': 'La cantidad debe ser mayor a cero'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if str(tienda_origen_id) == str(tienda_destino_id):
+            return Response(
+                {'error': 'La tienda de origen y la de destino deben ser distintas'},
+                status=status.HTTP_400_BAD_REQUEST
             )
 
-            if stock_origen.cantidad < cantidad:
-                return Response(
-                    {'error': 'No hay suficiente stock en la tienda de origen'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-
-            stock_origen.cantidad -= cantidad
-            stock_destino.cantidad += cantidad
-            stock_origen.save()
-            stock_destino.save()
-
-            return Response({
-                'origen': StockTiendaSerializer(stock_origen).data,
-                'destino': StockTiendaSerializer(stock_destino).data
-            })
+        try:
+            stock_origen, stock_destino = transferir(
+                producto_id, tienda_origen_id, tienda_destino_id, cantidad, usuario=usuario_de(request)
+            )
+        except (TypeError, ValueError):
+            return Response(
+                {'error': 'La tienda de origen y la de destino deben ser ids válidos'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         except StockTienda.DoesNotExist:
             return Response(
                 {'error': 'Stock no encontrado'},
                 status=status.HTTP_404_NOT_FOUND
             )
+        except StockInsuficiente:
+            return Response(
+                {'error': 'No hay suficiente stock en la tienda de origen'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response({
+            'origen': StockTiendaSerializer(stock_origen).data,
+            'destino': StockTiendaSerializer(stock_destino).data
+        })
+
+    @action(detail=False, methods=['post'])
+    def ajuste_masivo(self, request):
+        """
+        Aplica en una transacción una lista `ajustes` de {producto, tienda,
+        delta} o {producto, tienda, cantidad} (conteo absoluto), hasta 10.000.
+        Responde el resultado de cada ajuste; los rechazados (stock negativo o
+        datos inválidos) no impiden aplicar los demás.
+        """
+        ajustes = request.data.get('ajustes')
+        if not isinstance(ajustes, list) or not ajustes:
+            return Response(
+                {'error': "Debe enviar 'ajustes' como una lista no vacía"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if len(ajustes) > MAX_AJUSTES_LOTE:
+            return Response(
+                {'error': f'No se pueden enviar más de {MAX_AJUSTES_LOTE} ajustes por llamada'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        resultados = ajustar_en_lote(ajustes, usuario=usuario_de(request))
+        rechazados = sum(1 for resultado in resultados if resultado['estado'] == 'rechazado')
+        return Response(
+            {'aplicados': len(resultados) - rechazados, 'rechazados': rechazados, 'resultados': resultados},
+            status=status.HTTP_207_MULTI_STATUS if rechazados else status.HTTP_200_OK
+        )
+
+    @action(detail=False, methods=['get'], renderer_classes=[JSONRapidoRenderer, BrowsableAPIRenderer])
+    def matriz(self, request):
+        """
+        Stock productos x tiendas en formato columnar para la grilla de gestión.
+        Cada eje se acota por id (`producto_desde`/`producto_hasta`,
+        `tienda_desde`/`tienda_hasta`) y se pagina con `productos`/`tiendas`;
+        `siguiente_producto`/`siguiente_tienda` son el `*_desde` de la página
+        siguiente. `formato=densa|coordenadas`; con `since` (ISO 8601) solo
+        vienen las celdas cambiadas desde entonces, como coordenadas.
+        """
+        try:
+            ejes = {
+                'producto_desde': entero_de(request, 'producto_desde'),
+                'producto_hasta': entero_de(request, 'producto_hasta'),
+                'productos': entero_de(request, 'productos', MAX_PRODUCTOS_MATRIZ, MAX_PRODUCTOS_MATRIZ),
+                'tienda_desde': entero_de(request, 'tienda_desde'),
+                'tienda_hasta': entero_de(request, 'tienda_hasta'),
+                'tiendas': entero_de(request, 'tiendas', MAX_TIENDAS_MATRIZ, MAX_TIENDAS_MATRIZ),
+            }
+        except ValueError as error:
+            return Response(
+                {'error': f"'{error}' debe ser un entero positivo"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            desde = fecha_de(request, 'since', None)
         except ValueError:
+            return Response({'error': "'since' debe ser una fecha ISO 8601"}, status=status.HTTP_400_BAD_REQUEST)
+        formato = request.query_params.get('formato', FORMATOS[0])
+        if formato not in FORMATOS:
             return Response(
-                {'error': 'La cantidad debe ser un número entero'},
+                {'error': f"'formato' debe ser uno de: {', '.join(FORMATOS)}"},
                 status=status.HTTP_400_BAD_REQUEST
             )
+        return Response(matriz_stock(formato=formato, desde=desde, **ejes))
+
+    @action(detail=False, methods=['get'])
+    def bajo_minimo(self, request):
+        """
+        Stock bajo su mínimo en todas las tiendas, para reponer. Filtra por
+        `tienda`, `categoria` y `marca`; se pagina con `cursor` y `page_size`.
+        """
+        return respuesta_bajo_minimo(self, request)
+
+    @action(detail=False, methods=['get'])
+    def resumen_bajo_minimo(self, request):
+        """
+        Cantidad de productos bajo su mínimo (y agotados) por tienda. Pensado
+        para consultarse seguido: sale del índice parcial, se cachea hasta el
+        próximo cambio de stock y responde 304 si el cliente ya lo tiene.
+        """
+        return self.respuesta_cacheada(
+            'stock_resumen_bajo_minimo', lambda: Response({'tiendas': resumen_bajo_minimo()})
+        )
+
+    @action(detail=False, methods=['post'])
+    def importar(self, request):
+        """
+        Carga masiva de stock desde CSV o NDJSON con columnas sku, tienda,
+        cantidad y stock_minimo. Crea o actualiza por (producto, tienda).
+        """
+        return respuesta_importacion(request, partial(importar_stock, usuario=usuario_de(request)))
+
+    @action(detail=False, methods=['get'])
+    def exportar(self, request):
+        """Exporta el stock de todas las tiendas en CSV o NDJSON (`?formato=`)."""
+        return respuesta_exportacion(request, exportar_stock, 'stock')
 @action(detail=True, methods=['get'])
 def stock_por_tienda(self, request, pk=None):
     producto = self.get_object()
@@ -2,4 +2,8 @@ from rest_framework import permissions
 
 class EsAdministrador(permissions.BasePermission):
     def has_permission(self, request, view):
-        return request.user.is_authenticated and request.user.role == 'admin' 
\ No newline at end of file
+        return request.user.is_authenticated and request.user.role == 'admin' 
+
+class EsAdministradorOTrabajador(permissions.BasePermission):
+    def has_permission(self, request, view):
+        return request.user.is_authenticated and request.user.role in ['admin', 'trabajador']
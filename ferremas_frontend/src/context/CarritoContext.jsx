@@ -1,5 +1,6 @@
-import React, { createContext, useContext, useState, useEffect } from 'react';
+import React, { createContext, useContext, useState, useEffect, useRef } from 'react';
 import api from '../utils/axiosConfig';
+import { useAuth } from './AuthContext';
 import { v4 as uuidv4 } from 'uuid'; // Importar uuid para generar IDs únicos
 
 const CarritoContext = createContext(null);
@@ -9,6 +10,7 @@ export const CarritoProvider = ({ children }) => {
   const [loadingCarrito, setLoadingCarrito] = useState(true);
   const [errorCarrito, setErrorCarrito] = useState(null);
   const [guestCartId, setGuestCartId] = useState(null); // Estado para el ID del carrito de invitado
+  const { user } = useAuth();
 
   // Cargar el guestCartId de localStorage al montar el componente
   useEffect(() => {
@@ -41,12 +43,39 @@ export const CarritoProvider = ({ children }) => {
     }
   };
 
-  // Cargar el carrito después de obtener el guestCartId
+  // Al iniciar sesión, el carrito de invitado se suma al del usuario y se
+  // empieza un carrito de invitado nuevo para cuando cierre sesión
+  const fusionarCarrito = async () => {
+    setLoadingCarrito(true);
+    setErrorCarrito(null);
+    try {
+      const response = await api.post('/carritos/fusionar/', {
+        guest_cart_id: localStorage.getItem('guest_cart_id')
+      });
+      const nuevoGuestCartId = uuidv4();
+      localStorage.setItem('guest_cart_id', nuevoGuestCartId);
+      setGuestCartId(nuevoGuestCartId);
+      setCarrito(response.data);
+    } catch (err) {
+      console.error('Error fusionando carrito:', err);
+      fetchCarrito();
+    } finally {
+      setLoadingCarrito(false);
+    }
+  };
+
+  // Cargar el carrito después de obtener el guestCartId, y al entrar o salir de la sesión
+  useEffect(() => {
+    if (user) {
+      fusionarCarrito();
+    }
+  }, [user]);
+
   useEffect(() => {
-    if (guestCartId) {
+    if (guestCartId && !user) {
       fetchCarrito();
     }
-  }, [guestCartId]); // Dependencia en guestCartId para cargar el carrito una vez que el ID esté disponible
+  }, [guestCartId, user]); // Dependencia en guestCartId para cargar el carrito una vez que el ID esté disponible
 
   // Función para agregar un item al carrito (llama al backend y recarga el carrito)
   const agregarItem = async (productoId, cantidad = 1) => {
@@ -61,13 +90,24 @@ export const CarritoProvider = ({ children }) => {
       });
 
       if (response.status === 200) {
+        const { carrito: totales, guest_cart_id: nuevoGuestCartId, ...item } = response.data;
         // Si se creó un nuevo carrito de invitado en el backend, actualizar el ID en localStorage
-        if (response.data.guest_cart_id && response.data.guest_cart_id !== currentGuestCartId) {
-            localStorage.setItem('guest_cart_id', response.data.guest_cart_id);
-            setGuestCartId(response.data.guest_cart_id); // Actualizar el estado
+        if (nuevoGuestCartId && nuevoGuestCartId !== currentGuestCartId) {
+            localStorage.setItem('guest_cart_id', nuevoGuestCartId);
+            setGuestCartId(nuevoGuestCartId); // Actualizar el estado
+        }
+        // La respuesta trae la línea actualizada y los totales del carrito:
+        // se aplican al estado local en vez de recargar todo el carrito
+        const items = carrito?.items ?? [];
+        const nuevosItems = items.some(i => i.id === item.id)
+          ? items.map(i => (i.id === item.id ? item : i))
+          : [...items, item];
+        if (!totales || nuevosItems.length !== totales.items) {
+          // El carrito local estaba desactualizado (p. ej. se modificó en otra pestaña)
+          fetchCarrito();
+        } else {
+          setCarrito(prev => ({ ...prev, id: totales.id, items: nuevosItems, total: totales.total }));
         }
-        // Recargar el carrito para actualizar el estado global
-        fetchCarrito();
       } else {
          console.error('Error inesperado al agregar item:', response);
          setErrorCarrito('Error al agregar el producto al carrito.');
@@ -84,72 +124,59 @@ export const CarritoProvider = ({ children }) => {
     }
   };
 
-  // Función para eliminar un item del carrito
-  const eliminarItem = async (itemId) => {
-    try {
-      setLoadingCarrito(true);
-      const currentGuestCartId = guestCartId || localStorage.getItem('guest_cart_id');
-      
-      if (!currentGuestCartId) {
-        throw new Error('No hay un carrito de invitado');
-      }
+  // Cambios de cantidad y eliminaciones seguidos (p. ej. varios clics en +)
+  // se juntan y van al backend en un solo lote, que responde el carrito final
+  const ESPERA_LOTE_MS = 250;
+  const loteRef = useRef({ ops: [], resolvers: [], temporizador: null });
 
-      const response = await api.post('/carritos/remove_item/', {
-        item_id: itemId,
-        guest_cart_id: currentGuestCartId
+  const enviarLote = async () => {
+    const { ops, resolvers } = loteRef.current;
+    loteRef.current = { ops: [], resolvers: [], temporizador: null };
+    try {
+      const response = await api.post('/carritos/batch/', {
+        ops,
+        guest_cart_id: guestCartId || localStorage.getItem('guest_cart_id')
       });
-
-      if (response.status === 200) {
-        await fetchCarrito();
-        return true;
-      } else {
-        throw new Error('Error inesperado al eliminar item');
-      }
+      setCarrito(response.data);
+      resolvers.forEach(resolver => resolver(true));
     } catch (error) {
-      console.error('Error al eliminar item del carrito:', error);
-      let errorMessage = 'Error al eliminar el producto del carrito. Inténtalo de nuevo.';
+      console.error('Error al actualizar el carrito:', error);
+      let errorMessage = 'Error al actualizar el carrito. Inténtalo de nuevo.';
       if (error.response?.status === 401) {
         errorMessage = 'Debes iniciar sesión para modificar el carrito.';
       } else if (error.response?.data?.error) {
         errorMessage = error.response.data.error;
       }
       setErrorCarrito(errorMessage);
-      return false;
-    } finally {
-      setLoadingCarrito(false);
+      // El lote se aplica completo o no se aplica: volver a lo que tiene el backend
+      fetchCarrito();
+      resolvers.forEach(resolver => resolver(false));
     }
   };
 
-  // Función para actualizar la cantidad de un item
-  const actualizarCantidad = async (itemId, cantidad) => {
-    try {
-      const currentGuestCartId = guestCartId || localStorage.getItem('guest_cart_id');
-      
-      const response = await api.post('/carritos/update_quantity/', {
-        item_id: itemId,
-        new_quantity: cantidad,
-        guest_cart_id: currentGuestCartId
-      });
+  // Aplica la operación al estado local de inmediato y la encola para el próximo lote
+  const encolarOperacion = (op) => new Promise((resolve) => {
+    setCarrito(prev => {
+      if (!prev?.items) return prev;
+      const items = op.op === 'remove'
+        ? prev.items.filter(i => i.id !== op.item_id)
+        : prev.items.map(i => (i.id === op.item_id
+          ? { ...i, cantidad: op.cantidad, subtotal: i.producto_precio * op.cantidad }
+          : i));
+      return { ...prev, items, total: items.reduce((suma, i) => suma + i.subtotal, 0) };
+    });
+    const lote = loteRef.current;
+    lote.ops.push(op);
+    lote.resolvers.push(resolve);
+    clearTimeout(lote.temporizador);
+    lote.temporizador = setTimeout(enviarLote, ESPERA_LOTE_MS);
+  });
 
-      if (response.status === 200) {
-        // Recargar el carrito para actualizar el estado global
-        fetchCarrito();
-        return true;
-      } else {
-        console.error('Error inesperado al actualizar cantidad:', response);
-        setErrorCarrito('Error al actualizar la cantidad del producto.');
-        return false;
-      }
-    } catch (error) {
-      console.error('Error al actualizar cantidad:', error);
-      let errorMessage = 'Error al actualizar la cantidad. Inténtalo de nuevo.';
-      if (error.response && error.response.status === 401) {
-        errorMessage = 'Debes iniciar sesión para modificar el carrito.';
-      }
-      setErrorCarrito(errorMessage);
-      return false;
-    }
-  };
+  // Función para eliminar un item del carrito
+  const eliminarItem = (itemId) => encolarOperacion({ op: 'remove', item_id: itemId });
+
+  // Función para actualizar la cantidad de un item
+  const actualizarCantidad = (itemId, cantidad) => encolarOperacion({ op: 'set', item_id: itemId, cantidad });
 
   // Función para iniciar el proceso de checkout
   const iniciarCheckout = async (formData) => {